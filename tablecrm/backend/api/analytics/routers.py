@@ -5,6 +5,7 @@ from database.db import database, users_cboxes_relation, loyality_cards, users
 import api.analytics.schemas as analytics_schemas
 import functions.filter_schemas as filter_schemas
 from functions.helpers import get_filters_analytics
+from functions.token_resolver import token_resolver
 from datetime import date, timedelta, datetime
 from sqlalchemy import and_, func, select, distinct
 from typing import Optional
@@ -24,8 +25,7 @@ async def analytics(
     type: str = f"{PaymentType.incoming}, {PaymentType.outgoing}",
 ):
     """Аналитика платежей"""
-    query_user = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query_user)
+    user = await token_resolver.resolve(token)
     if user:
         if user.status:
             filters = get_filters_analytics(filter_schema)
@@ -106,8 +106,7 @@ async def analytics(
             yield start_date + timedelta(n)
 
     """Аналитика карт лояльности"""
-    query_user = users_cboxes_relation.select(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query_user)
+    user = await token_resolver.resolve(token)
     if user:
         if user.status:
             start_date = datetime.fromtimestamp(date_from)
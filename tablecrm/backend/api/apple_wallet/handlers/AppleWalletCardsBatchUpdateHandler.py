@@ -0,0 +1,16 @@
+from typing import Optional, Mapping, Any
+
+from aio_pika import IncomingMessage
+
+from api.apple_wallet.messages.AppleWalletCardsBatchUpdateMessage import AppleWalletCardsBatchUpdateMessage
+from api.apple_wallet.utils import rebuild_apple_wallet_passes, BATCH_CONCURRENCY
+from common.amqp_messaging.common.core.EventHandler import IEventHandler
+
+
+class AppleWalletCardsBatchUpdateHandler(IEventHandler[AppleWalletCardsBatchUpdateMessage]):
+    def __init__(self, concurrency: int = BATCH_CONCURRENCY):
+        self.__concurrency = concurrency
+
+    async def __call__(self, event: Mapping[str, Any], message: Optional[IncomingMessage] = None):
+        # карты пачки читаются одним запросом, неизменившиеся пассы пропускаются
+        await rebuild_apple_wallet_passes(event['loyality_card_ids'], concurrency=self.__concurrency)
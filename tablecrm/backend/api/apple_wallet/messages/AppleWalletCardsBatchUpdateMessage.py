@@ -0,0 +1,7 @@
+from typing import List
+
+from common.amqp_messaging.models.BaseModelMessage import BaseModelMessage
+
+
+class AppleWalletCardsBatchUpdateMessage(BaseModelMessage):
+    loyality_card_ids: List[int]
@@ -26,10 +26,13 @@ async def create_apple_wallet_card(token: str, card_id: int):
     pass_generator = WalletPassGeneratorService()
     s3_key, filename = await pass_generator.update_pass(card_id)
 
-    # Получаем файл из S3
-    pkpass_bytes = await pass_generator.get_pkpass_from_s3(
-        s3_key.split('/')[-1].replace('.pkpass', '')
-    )
+    # Получаем файл из S3; если его нет при неизменившейся карте — собираем заново
+    card_number = s3_key.split('/')[-1].replace('.pkpass', '')
+    try:
+        pkpass_bytes = await pass_generator.get_pkpass_from_s3(card_number)
+    except Exception:
+        await pass_generator.update_pass(card_id, force=True)
+        pkpass_bytes = await pass_generator.get_pkpass_from_s3(card_number)
 
     return Response(
         content=pkpass_bytes,
@@ -131,8 +134,12 @@ async def get_pass(
     # if not exists:
     await pass_service.update_pass(int(serial_number))
 
-    # Получаем файл из S3
-    pkpass_bytes = await pass_service.get_pkpass_from_s3(serial_number)
+    # Получаем файл из S3; если его нет при неизменившейся карте — собираем заново
+    try:
+        pkpass_bytes = await pass_service.get_pkpass_from_s3(serial_number)
+    except Exception:
+        await pass_service.update_pass(int(serial_number), force=True)
+        pkpass_bytes = await pass_service.get_pkpass_from_s3(serial_number)
     filename = f'{serial_number}.pkpass'
 
     return Response(
@@ -1,9 +1,39 @@
+import logging
+import os
+from typing import List
+
 from common.apple_wallet_service.impl.WalletNotificationService import WalletNotificationService
 from common.apple_wallet_service.impl.WalletPassService import WalletPassGeneratorService
+from producer import publish_apple_wallet_passes_batch_update
 
+logger = logging.getLogger(__name__)
 
-async def update_apple_wallet_pass(loyalty_card_id: int):
-    apple_notification_service = WalletNotificationService()
+BATCH_CONCURRENCY = int(os.getenv("APPLE_WALLET_BATCH_CONCURRENCY", 10))
+
+
+async def rebuild_apple_wallet_passes(card_ids: List[int], concurrency: int = BATCH_CONCURRENCY) -> List[int]:
+    """Пересборка пассов на месте; push уходит только по картам, чей пасс изменился."""
     apple_wallet_service = WalletPassGeneratorService()
-    await apple_wallet_service.update_pass(loyalty_card_id)
-    await apple_notification_service.ask_update_pass(loyalty_card_id)
+    changed = await apple_wallet_service.update_passes(card_ids, concurrency=concurrency)
+    if changed:
+        apple_notification_service = WalletNotificationService()
+        for card_id in changed:
+            await apple_notification_service.ask_update_pass(card_id)
+    return changed
+
+
+async def update_apple_wallet_pass(loyalty_card_id: int):
+    await rebuild_apple_wallet_passes([loyalty_card_id])
+
+
+async def update_apple_wallet_passes(card_ids: List[int]):
+    """Массовое обновление раздаётся воркеру через RabbitMQ; без брокера — обновляем на месте."""
+    if not card_ids:
+        return
+    try:
+        await publish_apple_wallet_passes_batch_update(card_ids)
+        return
+    except Exception as e:
+        logger.warning(f"Apple Wallet fan-out unavailable, updating {len(card_ids)} passes inline: {e}")
+
+    await rebuild_apple_wallet_passes(card_ids)
@@ -7,14 +7,13 @@ from fastapi.responses import JSONResponse
 from sqlalchemy import select
 from starlette.staticfiles import StaticFiles
 
-from api.apple_wallet.utils import update_apple_wallet_pass
+from api.apple_wallet.utils import update_apple_wallet_pass, update_apple_wallet_passes
 from api.apple_wallet_card_settings.schemas import WalletCardSettings, WalletCardSettingsCreate, \
     WalletCardSettingsUpdate
 from api.apple_wallet_card_settings.utils import create_default_apple_wallet_setting
 from database.db import users_cboxes_relation, database, apple_wallet_card_settings, loyality_cards
 from common.s3_service.impl.S3Client import S3Client
 from common.s3_service.models.S3SettingsModel import S3SettingsModel
-from producer import publish_apple_wallet_pass_update
 
 router = APIRouter(prefix='/apple_wallet_card_settings', tags=['apple_wallet_card_settings'])
 router.mount('/backend/static_files', StaticFiles(directory='/backend/static_files'), name='static_files')
@@ -128,8 +127,8 @@ async def update_apple_wallet_card_settings(token: str, settings: WalletCardSett
     )
     cards = [row.id for row in await database.fetch_all(cards_query)]
 
-    # Опубликовать обновление пассов
-    await publish_apple_wallet_pass_update(cards)
+    # Опубликовать обновление пассов пачками
+    await update_apple_wallet_passes(cards)
 
     # Вернуть обновлённые настройки
     return WalletCardSettings(**json.loads(updated_data.data))
\ No newline at end of file
@@ -1,8 +1,11 @@
 from fastapi import APIRouter
 
 from common.geocoders.instance import geocoder
+from database.db import nomenclature, nomenclature_barcodes, contragents, chats, chat_contacts
+from functions.helpers import get_user_by_token
+from functions.search import suggest, phone_or_text_match, normalize_barcode, barcode_code
 
-from api.autosuggestion.schemas import AutosuggestResponse
+from api.autosuggestion.schemas import AutosuggestResponse, EntityAutosuggestResponse
 
 router = APIRouter(prefix="/autosuggestions", tags=["autosuggestions"])
 
@@ -10,3 +13,63 @@ router = APIRouter(prefix="/autosuggestions", tags=["autosuggestions"])
 async def autosuggest_location(query: str, limit: int = 5):
     suggestions = await geocoder.autocomplete(query, limit=limit)
     return AutosuggestResponse(suggestions=suggestions)
+
+
+@router.get("/nomenclature", response_model=EntityAutosuggestResponse)
+async def autosuggest_nomenclature(token: str, query: str, limit: int = 10):
+    """Подсказки по названию номенклатуры; запрос-штрихкод сначала ищется точным совпадением."""
+    user = await get_user_by_token(token)
+    conditions = [
+        nomenclature.c.cashbox == user.cashbox_id,
+        nomenclature.c.is_deleted.is_not(True),
+    ]
+
+    barcode = normalize_barcode(query)
+    if barcode.isdigit():
+        suggestions = await suggest(
+            nomenclature.c.id,
+            nomenclature.c.name,
+            query,
+            conditions,
+            limit=limit,
+            select_from=nomenclature.join(
+                nomenclature_barcodes, nomenclature_barcodes.c.nomenclature_id == nomenclature.c.id
+            ),
+            match_condition=barcode_code(nomenclature_barcodes.c.code) == barcode,
+        )
+        if suggestions:
+            return EntityAutosuggestResponse(suggestions=suggestions)
+
+    suggestions = await suggest(nomenclature.c.id, nomenclature.c.name, query, conditions, limit=limit)
+    return EntityAutosuggestResponse(suggestions=suggestions)
+
+
+@router.get("/contragents", response_model=EntityAutosuggestResponse)
+async def autosuggest_contragents(token: str, query: str, limit: int = 10):
+    """Подсказки по имени или телефону контрагента."""
+    user = await get_user_by_token(token)
+    suggestions = await suggest(
+        contragents.c.id,
+        contragents.c.name,
+        query,
+        [contragents.c.cashbox == user.cashbox_id, contragents.c.is_deleted.is_not(True)],
+        limit=limit,
+        match_condition=phone_or_text_match(contragents.c.name, contragents.c.phone, query.strip()),
+    )
+    return EntityAutosuggestResponse(suggestions=suggestions)
+
+
+@router.get("/chats", response_model=EntityAutosuggestResponse)
+async def autosuggest_chats(token: str, query: str, limit: int = 10):
+    """Подсказки по имени или телефону собеседника; id — идентификатор чата."""
+    user = await get_user_by_token(token)
+    suggestions = await suggest(
+        chats.c.id,
+        chat_contacts.c.name,
+        query,
+        [chats.c.cashbox_id == user.cashbox_id],
+        limit=limit,
+        select_from=chats.join(chat_contacts, chats.c.chat_contact_id == chat_contacts.c.id),
+        match_condition=phone_or_text_match(chat_contacts.c.name, chat_contacts.c.phone, query.strip()),
+    )
+    return EntityAutosuggestResponse(suggestions=suggestions)
@@ -1,5 +1,14 @@
 from pydantic import BaseModel
-from typing import List
+from typing import List, Optional
 
 class AutosuggestResponse(BaseModel):
     suggestions: List[str]
+
+
+class EntitySuggestion(BaseModel):
+    id: int
+    name: Optional[str]
+
+
+class EntityAutosuggestResponse(BaseModel):
+    suggestions: List[EntitySuggestion]
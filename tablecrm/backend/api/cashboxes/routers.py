@@ -11,6 +11,7 @@ import functions.filter_schemas as filter_schemas
 import api.users.schemas as user_schemas
 
 from functions.helpers import get_filters_users, raise_wrong_token
+from functions.token_resolver import token_resolver
 
 from api.cashboxes.schemas import CashboxUpdate
 
@@ -125,6 +126,7 @@ async def edit_cashbox_user(token: str, user_id: int, data: Optional[CashboxUpda
                     .values(**data)
                 )
                 await database.execute(q)
+                token_resolver.invalidate_where(cashbox_id=user.cashbox_id, user_id=user_id)
 
             q = users_cboxes_relation.select().where(
                 users_cboxes_relation.c.cashbox_id == user.cashbox_id,
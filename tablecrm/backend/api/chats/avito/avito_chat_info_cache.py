@@ -0,0 +1,159 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from database.db import database, channel_credentials
+from .avito_client import AvitoClient
+from .avito_factory import create_avito_client, save_token_callback
+
+logger = logging.getLogger(__name__)
+
+
+class AvitoChatInfoCache:
+    """
+    Кэш get_chat_info для обогащения чатов (название объявления, аватар собеседника).
+
+    Свежая запись отдаётся сразу; устаревшая — тоже сразу, а обновляется
+    в фоне. Запросы к Avito ограничены семафором, клиент создаётся один
+    на канал и переиспользуется client_ttl секунд. Вебхук о новом событии
+    в чате помечает запись устаревшей (invalidate). Кэш — в памяти процесса,
+    поэтому в других воркерах запись устареет не позже чем через ttl.
+    """
+
+    def __init__(
+            self,
+            ttl: float = float(os.getenv("AVITO_CHAT_INFO_TTL", 300)),
+            max_size: int = int(os.getenv("AVITO_CHAT_INFO_CACHE_SIZE", 10000)),
+            concurrency: int = int(os.getenv("AVITO_CHAT_INFO_CONCURRENCY", 5)),
+            client_ttl: float = 600,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.client_ttl = client_ttl
+        self._semaphore = asyncio.Semaphore(concurrency)
+        # (cashbox_id, external_chat_id) -> (время загрузки, {"info": ..., "avito_user_id": ...})
+        self._entries: "OrderedDict[Tuple[int, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
+        # (channel_id, cashbox_id) -> (время создания, клиент, avito_user_id)
+        self._clients: Dict[Tuple[int, int], Tuple[float, Optional[AvitoClient], Optional[int]]] = {}
+        self._client_locks: Dict[Tuple[int, int], asyncio.Lock] = {}
+        self._refreshing: Dict[Tuple[int, str], asyncio.Task] = {}
+
+        self.hits = 0
+        self.stale = 0
+        self.misses = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "items": len(self._entries),
+            "clients": len(self._clients),
+            "refreshing": len(self._refreshing),
+            "hits": self.hits,
+            "stale": self.stale,
+            "misses": self.misses,
+            "errors": self.errors,
+        }
+
+    async def _client(self, channel_id: int, cashbox_id: int) -> Tuple[Optional[AvitoClient], Optional[int]]:
+        key = (channel_id, cashbox_id)
+        cached = self._clients.get(key)
+        if cached is not None and time.monotonic() - cached[0] < self.client_ttl:
+            return cached[1], cached[2]
+
+        async with self._client_locks.setdefault(key, asyncio.Lock()):
+            cached = self._clients.get(key)
+            if cached is not None and time.monotonic() - cached[0] < self.client_ttl:
+                return cached[1], cached[2]
+
+            client = None
+            avito_user_id = None
+            creds = await database.fetch_one(
+                channel_credentials.select().where(
+                    (channel_credentials.c.channel_id == channel_id) &
+                    (channel_credentials.c.cashbox_id == cashbox_id) &
+                    (channel_credentials.c.is_active.is_(True))
+                )
+            )
+            if creds:
+                avito_user_id = creds.get('avito_user_id')
+                client = await create_avito_client(
+                    channel_id=channel_id,
+                    cashbox_id=cashbox_id,
+                    on_token_refresh=lambda token_data: save_token_callback(channel_id, cashbox_id, token_data)
+                )
+            # отсутствие credentials тоже запоминается, чтобы не читать их на каждый чат;
+            # неудачное создание клиента при наличии credentials — нет
+            if client is not None or creds is None:
+                self._clients[key] = (time.monotonic(), client, avito_user_id)
+            return client, avito_user_id
+
+    def _remember(self, key: Tuple[int, str], entry: Dict[str, Any]):
+        self._entries[key] = (time.monotonic(), entry)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def _refresh(self, key: Tuple[int, str], channel_id: int):
+        cashbox_id, external_chat_id = key
+        try:
+            async with self._semaphore:
+                client, avito_user_id = await self._client(channel_id, cashbox_id)
+                if client is None:
+                    return
+                info = await client.get_chat_info(external_chat_id)
+            self._remember(key, {"info": info, "avito_user_id": avito_user_id})
+        except Exception as e:
+            self.errors += 1
+            logger.warning(f"Failed to fetch Avito chat info for {external_chat_id}: {e}")
+
+    def _schedule_refresh(self, key: Tuple[int, str], channel_id: int) -> asyncio.Task:
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh(key, channel_id))
+            self._refreshing[key] = task
+            task.add_done_callback(lambda _: self._refreshing.pop(key, None))
+        return task
+
+    async def get(
+            self,
+            channel_id: int,
+            cashbox_id: int,
+            external_chat_id: str,
+            wait: bool = False,
+    ) -> Optional[Dict[str, Any]]:
+        """
+        {"info": ответ get_chat_info, "avito_user_id": ...} или None.
+        При промахе с wait=False загрузка уходит в фон, а вызывающий сразу получает None.
+        """
+        key = (cashbox_id, external_chat_id)
+        cached = self._entries.get(key)
+        if cached is not None:
+            fetched_at, entry = cached
+            self._entries.move_to_end(key)
+            if time.monotonic() - fetched_at >= self.ttl:
+                self.stale += 1
+                self._schedule_refresh(key, channel_id)
+            else:
+                self.hits += 1
+            return entry
+
+        self.misses += 1
+        task = self._schedule_refresh(key, channel_id)
+        if not wait:
+            return None
+        await asyncio.shield(task)
+        cached = self._entries.get(key)
+        return cached[1] if cached is not None else None
+
+    def invalidate(self, cashbox_id: int, external_chat_id: str):
+        """Запись остаётся, но следующее чтение обновит её в фоне."""
+        key = (cashbox_id, external_chat_id)
+        cached = self._entries.get(key)
+        if cached is not None:
+            self._entries[key] = (float("-inf"), cached[1])
+
+
+avito_chat_info_cache = AvitoChatInfoCache()
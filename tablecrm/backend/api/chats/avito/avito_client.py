@@ -3,6 +3,7 @@ import json
 from typing import Optional, List, Dict, Any
 from datetime import datetime, timedelta
 from .avito_types import AvitoCredentials
+from common.http_client.registry import http_clients
 import logging
 
 logger = logging.getLogger(__name__)
@@ -63,7 +64,7 @@ class AvitoClient:
             raise AvitoTokenExpiredError("No refresh token available")
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 data = {
                     "grant_type": "refresh_token",
                     "refresh_token": self.refresh_token,
@@ -106,7 +107,7 @@ class AvitoClient:
     
     async def get_access_token(self) -> Dict[str, Any]:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 data = {
                     "grant_type": "client_credentials",
                     "client_id": self.api_key,
@@ -155,7 +156,7 @@ class AvitoClient:
         redirect_uri: Optional[str] = None
     ) -> Dict[str, Any]:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=client_id) as session:
                 data = {
                     "grant_type": "authorization_code",
                     "code": authorization_code,
@@ -198,7 +199,7 @@ class AvitoClient:
             return self._user_id
         
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 headers = {
                     "Authorization": f"Bearer {self.access_token}",
                     "Content-Type": "application/json",
@@ -240,7 +241,7 @@ class AvitoClient:
             "Content-Type": "application/json",
         }
         
-        async with aiohttp.ClientSession() as session:
+        async with http_clients.session("avito", rate_key=self.api_key) as session:
             try:
                 async with session.request(
                     method,
@@ -378,7 +379,7 @@ class AvitoClient:
                 "Authorization": f"Bearer {self.access_token}",
             }
             
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 async with session.post(
                     url,
                     data=form_data,
@@ -524,7 +525,7 @@ class AvitoClient:
     
     async def get_user_profile(self) -> Dict[str, Any]:
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 headers = {
                     "Authorization": f"Bearer {self.access_token}",
                     "Content-Type": "application/json",
@@ -560,7 +561,7 @@ class AvitoClient:
         Возвращает: {'status_code': int, 'connection_status': str, 'success': bool}
         """
         try:
-            async with aiohttp.ClientSession() as session:
+            async with http_clients.session("avito", rate_key=self.api_key) as session:
                 headers = {
                     "Authorization": f"Bearer {self.access_token}",
                     "Content-Type": "application/json",
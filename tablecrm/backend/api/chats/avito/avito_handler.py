@@ -3,6 +3,7 @@ import re
 from typing import Optional, Dict, Any
 from datetime import datetime
 from .avito_types import AvitoWebhook
+from .avito_chat_info_cache import avito_chat_info_cache
 from ..producer import chat_producer
 from .. import crud
 
@@ -893,6 +894,9 @@ class AvitoHandler:
         
         event_type = webhook.payload.type
         
+        if webhook.payload.value.chat_id:
+            avito_chat_info_cache.invalidate(cashbox_id, webhook.payload.value.chat_id)
+        
         if event_type == 'message':
             return await AvitoHandler.handle_message_event(webhook, cashbox_id, channel_id)
         
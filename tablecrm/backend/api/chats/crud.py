@@ -1,10 +1,10 @@
-from sqlalchemy import desc, and_, or_, func, select, cast, String
+from sqlalchemy import desc, and_, or_, func, select, tuple_
 from database.db import database, channels, chats, chat_messages, contragents, channel_credentials, chat_contacts
+from functions.search import TRGM_MIN_LENGTH, normalize_phone, phone_digits
 from fastapi import HTTPException
 from typing import Optional, List, Dict, Any
 from datetime import datetime
 import json
-import asyncio
 
 
 
@@ -336,6 +336,56 @@ async def create_chat(
     return await get_chat(chat_id)
 
 
+def extract_avito_avatar(user: Dict[str, Any]) -> Optional[str]:
+    public_profile = user.get('public_user_profile', {})
+    if not public_profile:
+        return None
+    avatar_data = public_profile.get('avatar', {})
+    if isinstance(avatar_data, dict):
+        return (
+            avatar_data.get('default') or
+            avatar_data.get('images', {}).get('256x256') or
+            avatar_data.get('images', {}).get('128x128') or
+            (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
+        )
+    elif isinstance(avatar_data, str):
+        return avatar_data
+    return None
+
+
+async def _apply_avito_chat_info(chat_dict: Dict[str, Any], entry: Dict[str, Any]):
+    """Название объявления и аватар собеседника из записи кэша get_chat_info."""
+    chat_info = entry.get('info') or {}
+    avito_user_id = entry.get('avito_user_id')
+    
+    if not chat_dict.get('name'):
+        context = chat_info.get('context', {})
+        if isinstance(context, dict):
+            value = context.get('value', {})
+            if isinstance(value, dict) and value.get('title'):
+                chat_dict['name'] = value.get('title')
+    
+    for user in chat_info.get('users', []):
+        user_id_in_chat = user.get('user_id') or user.get('id')
+        if avito_user_id and (not user_id_in_chat or user_id_in_chat == avito_user_id):
+            continue
+        avatar_url = extract_avito_avatar(user)
+        if not avatar_url:
+            continue
+        previous_avatar = chat_dict['contact'].get('avatar') if chat_dict.get('contact') else None
+        if chat_dict.get('contact'):
+            chat_dict['contact']['avatar'] = avatar_url
+        else:
+            chat_dict['contact'] = {'avatar': avatar_url}
+        if chat_dict.get('chat_contact_id') and previous_avatar != avatar_url:
+            await database.execute(
+                chat_contacts.update().where(
+                    chat_contacts.c.id == chat_dict['chat_contact_id']
+                ).values(avatar=avatar_url)
+            )
+        break
+
+
 async def get_chat(chat_id: int):
     """Get chat by ID with additional fields"""
     query = select([
@@ -360,7 +410,10 @@ async def get_chat(chat_id: int):
         chat_contacts.c.phone.label('contact_phone'),
         chat_contacts.c.email.label('contact_email'),
         chat_contacts.c.avatar.label('contact_avatar'),
-        chat_contacts.c.contragent_id.label('contact_contragent_id')
+        chat_contacts.c.contragent_id.label('contact_contragent_id'),
+        chats.c.last_message_id,
+        chats.c.last_message_preview,
+        chats.c.unread_count,
     ]).select_from(
         chats.join(channels, chats.c.channel_id == channels.c.id)
         .outerjoin(chat_contacts, chats.c.chat_contact_id == chat_contacts.c.id)
@@ -420,27 +473,6 @@ async def get_chat(chat_id: int):
     if not chat_dict.get('name'):
         chat_dict['name'] = name
     
-    last_message_query = select([chat_messages.c.content]).where(
-        chat_messages.c.chat_id == chat_id
-    ).order_by(desc(chat_messages.c.created_at)).limit(1)
-    last_message = await database.fetch_one(last_message_query)
-    
-    if last_message and last_message['content']:
-        preview = last_message['content'][:100]
-        chat_dict['last_message_preview'] = preview
-    else:
-        chat_dict['last_message_preview'] = None
-    
-    unread_query = select([func.count(chat_messages.c.id)]).where(
-        and_(
-            chat_messages.c.chat_id == chat_id,
-            chat_messages.c.sender_type == "CLIENT",
-            chat_messages.c.status != "READ"
-        )
-    )
-    unread_count = await database.fetch_val(unread_query) or 0
-    chat_dict['unread_count'] = unread_count
-    
     is_avito_chat = (
         chat_dict.get('channel_type') == 'AVITO' or 
         (chat_dict.get('external_chat_id') and chat_dict.get('external_chat_id', '').startswith('u2'))
@@ -448,8 +480,7 @@ async def get_chat(chat_id: int):
     
     if is_avito_chat:
         try:
-            from database.db import channel_credentials
-            from api.chats.avito.avito_factory import create_avito_client, save_token_callback
+            from api.chats.avito.avito_chat_info_cache import avito_chat_info_cache
             
             if not chat_dict.get('channel_type'):
                 channel = await get_channel(chat_dict['channel_id'])
@@ -459,98 +490,11 @@ async def get_chat(chat_id: int):
                     chat_dict['channel_icon'] = channel.get('svg_icon')
             
             if chat_dict.get('channel_type') == 'AVITO':
-                creds = await database.fetch_one(
-                    channel_credentials.select().where(
-                        (channel_credentials.c.channel_id == chat_dict['channel_id']) &
-                        (channel_credentials.c.cashbox_id == chat_dict['cashbox_id']) &
-                        (channel_credentials.c.is_active.is_(True))
-                    )
+                entry = await avito_chat_info_cache.get(
+                    chat_dict['channel_id'], chat_dict['cashbox_id'], chat_dict['external_chat_id'], wait=True
                 )
-                
-                if creds:
-                    client = await create_avito_client(
-                        channel_id=chat_dict['channel_id'],
-                        cashbox_id=chat_dict['cashbox_id'],
-                        on_token_refresh=lambda token_data: save_token_callback(
-                            chat_dict['channel_id'],
-                            chat_dict['cashbox_id'],
-                            token_data
-                        )
-                    )
-                    
-                    if client:
-                        chat_info = await client.get_chat_info(chat_dict['external_chat_id'])
-                        users = chat_info.get('users', [])
-                        avito_user_id = creds.get('avito_user_id')
-                        
-                        if not chat_dict.get('name'):
-                            context = chat_info.get('context', {})
-                            if isinstance(context, dict):
-                                value = context.get('value', {})
-                                if isinstance(value, dict):
-                                    title = value.get('title')
-                                    if title:
-                                        chat_dict['name'] = title
-                        
-                        if users:
-                            for user in users:
-                                user_id_in_chat = user.get('user_id') or user.get('id')
-                                if avito_user_id:
-                                    if user_id_in_chat and user_id_in_chat != avito_user_id:
-                                        avatar_url = None
-                                        public_profile = user.get('public_user_profile', {})
-                                        if public_profile:
-                                            avatar_data = public_profile.get('avatar', {})
-                                            if isinstance(avatar_data, dict):
-                                                avatar_url = (
-                                                    avatar_data.get('default') or
-                                                    avatar_data.get('images', {}).get('256x256') or
-                                                    avatar_data.get('images', {}).get('128x128') or
-                                                    (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                                )
-                                            elif isinstance(avatar_data, str):
-                                                avatar_url = avatar_data
-                                        
-                                        if avatar_url:
-                                            if chat_dict.get('contact'):
-                                                chat_dict['contact']['avatar'] = avatar_url
-                                            else:
-                                                chat_dict['contact'] = {'avatar': avatar_url}
-                                            
-                                            if chat_dict.get('chat_contact_id'):
-                                                await database.execute(
-                                                    chat_contacts.update().where(
-                                                        chat_contacts.c.id == chat_dict['chat_contact_id']
-                                                    ).values(avatar=avatar_url)
-                                                )
-                                            break
-                                else:
-                                    public_profile = user.get('public_user_profile', {})
-                                    if public_profile:
-                                        avatar_data = public_profile.get('avatar', {})
-                                        if isinstance(avatar_data, dict):
-                                            avatar_url = (
-                                                avatar_data.get('default') or
-                                                avatar_data.get('images', {}).get('256x256') or
-                                                avatar_data.get('images', {}).get('128x128') or
-                                                (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                            )
-                                        elif isinstance(avatar_data, str):
-                                            avatar_url = avatar_data
-                                        
-                                        if avatar_url:
-                                            if chat_dict.get('contact'):
-                                                chat_dict['contact']['avatar'] = avatar_url
-                                            else:
-                                                chat_dict['contact'] = {'avatar': avatar_url}
-                                            
-                                            if chat_dict.get('chat_contact_id'):
-                                                await database.execute(
-                                                    chat_contacts.update().where(
-                                                        chat_contacts.c.id == chat_dict['chat_contact_id']
-                                                    ).values(avatar=avatar_url)
-                                                )
-                                            break
+                if entry:
+                    await _apply_avito_chat_info(chat_dict, entry)
         except Exception as e:
             import logging
             logger = logging.getLogger(__name__)
@@ -586,37 +530,16 @@ async def get_chats(
     sort_order: Optional[str] = "desc",
     skip: int = 0, 
     limit: int = 100,
-    with_avito_info: bool = False 
+    with_avito_info: bool = False,
+    cursor_time: Optional[datetime] = None,
+    cursor_id: Optional[int] = None,
 ) -> List[Dict[str, Any]]:
-    last_msg_correlated = (
-        select([
-            func.left(
-                func.coalesce(cast(chat_messages.c.content, String), ''),
-                100
-            )
-        ])
-        .where(chat_messages.c.chat_id == chats.c.id)
-        .order_by(desc(chat_messages.c.created_at))
-        .limit(1)
-        .correlate(chats)
-        .scalar_subquery()
-    )
-    
-    unread_count_subquery = (
-        select([
-            chat_messages.c.chat_id,
-            func.count(chat_messages.c.id).label('unread_count')
-        ])
-        .where(
-            and_(
-                chat_messages.c.sender_type == "CLIENT",
-                chat_messages.c.status != "READ"
-            )
-        )
-        .group_by(chat_messages.c.chat_id)
-        .subquery('unread')
-    )
-    
+    """
+    Список чатов кассы. Без sort_by — от последних сообщений к старым
+    с keyset-пагинацией: cursor_time/cursor_id — last_message_time и id
+    последнего чата предыдущей страницы. unread_count и превью последнего
+    сообщения берутся из полей чата, их ведёт триггер на chat_messages.
+    """
     query = select([
         chats.c.id,
         chats.c.channel_id,
@@ -640,12 +563,12 @@ async def get_chats(
         chat_contacts.c.email.label('contact_email'),
         chat_contacts.c.avatar.label('contact_avatar'),
         chat_contacts.c.contragent_id.label('contact_contragent_id'),
-        last_msg_correlated.label('last_message_preview'),
-        func.coalesce(unread_count_subquery.c.unread_count, 0).label('unread_count')
+        chats.c.last_message_id,
+        chats.c.last_message_preview,
+        chats.c.unread_count,
     ]).select_from(
         chats.join(channels, chats.c.channel_id == channels.c.id)
         .outerjoin(chat_contacts, chats.c.chat_contact_id == chat_contacts.c.id)
-        .outerjoin(unread_count_subquery, unread_count_subquery.c.chat_id == chats.c.id)
     )
     
     conditions = [chats.c.cashbox_id == cashbox_id] 
@@ -657,11 +580,16 @@ async def get_chats(
     if status:
         conditions.append(chats.c.status == status)
     if search:
-        search_condition = or_(
+        search_conditions = [
             chat_contacts.c.name.ilike(f"%{search}%"),
-            chat_contacts.c.phone.ilike(f"%{search}%"),
-            chats.c.external_chat_id.ilike(f"%{search}%")
-        )
+            chats.c.external_chat_id.ilike(f"%{search}%"),
+        ]
+        search_digits = normalize_phone(search)
+        if len(search_digits) >= TRGM_MIN_LENGTH:
+            search_conditions.append(phone_digits(chat_contacts.c.phone).ilike(f"%{search_digits}%"))
+        else:
+            search_conditions.append(chat_contacts.c.phone.ilike(f"%{search}%"))
+        search_condition = or_(*search_conditions)
         conditions.append(search_condition)
     
     if created_from:
@@ -694,79 +622,27 @@ async def get_chats(
                 query = query.order_by(sort_column.desc().nulls_last())
         else:
             query = query.order_by(desc(chats.c.updated_at).nulls_last())
+        query = query.offset(skip)
     else:
-        query = query.order_by(desc(chats.c.updated_at).nulls_last())
+        # порядок совпадает с индексом idx_chats_cashbox_last_message
+        query = query.order_by(chats.c.last_message_time.desc().nulls_last(), chats.c.id.desc())
+        if cursor_id is not None:
+            if cursor_time is not None:
+                query = query.where(or_(
+                    tuple_(chats.c.last_message_time, chats.c.id) < tuple_(cursor_time, cursor_id),
+                    chats.c.last_message_time.is_(None),
+                ))
+            else:
+                query = query.where(and_(chats.c.last_message_time.is_(None), chats.c.id < cursor_id))
+        else:
+            query = query.offset(skip)
     
-    query = query.offset(skip).limit(limit)
+    query = query.limit(limit)
     
     chats_data = await database.fetch_all(query)
     
-    avito_chats_to_fetch = []
     if with_avito_info:
-        for chat_row in chats_data:
-            chat_dict = dict(chat_row)
-            is_avito_chat = (
-                chat_dict.get('channel_type') == 'AVITO' or 
-                (chat_dict.get('external_chat_id') and chat_dict.get('external_chat_id', '').startswith('u2'))
-            )
-            if is_avito_chat:
-                avito_chats_to_fetch.append(chat_dict)
-    
-    channel_creds_cache = {}
-    if with_avito_info and avito_chats_to_fetch:
-        from database.db import channel_credentials
-        unique_channel_ids = list(set(chat['channel_id'] for chat in avito_chats_to_fetch))
-        if unique_channel_ids:
-            creds_query = channel_credentials.select().where(
-                and_(
-                    channel_credentials.c.channel_id.in_(unique_channel_ids),
-                    channel_credentials.c.cashbox_id == cashbox_id,
-                    channel_credentials.c.is_active.is_(True)
-                )
-            )
-            all_creds = await database.fetch_all(creds_query)
-            channel_creds_cache = {cred['channel_id']: cred for cred in all_creds}
-    
-    avito_info_cache = {}
-    if with_avito_info and avito_chats_to_fetch:
-        async def fetch_avito_chat_info(chat_dict):
-            try:
-                from api.chats.avito.avito_factory import create_avito_client, save_token_callback
-                
-                channel_id = chat_dict['channel_id']
-                creds = channel_creds_cache.get(channel_id)
-                
-                if not creds:
-                    return None
-                
-                client = await create_avito_client(
-                    channel_id=channel_id,
-                    cashbox_id=cashbox_id,
-                    on_token_refresh=lambda token_data: save_token_callback(
-                        channel_id,
-                        cashbox_id,
-                        token_data
-                    )
-                )
-                
-                if not client:
-                    return None
-                
-                chat_info = await client.get_chat_info(chat_dict['external_chat_id'])
-                return (chat_dict['id'], chat_info, creds)
-            except Exception as e:
-                import logging
-                logger = logging.getLogger(__name__)
-                logger.warning(f"Failed to fetch Avito info for chat {chat_dict.get('id')}: {e}")
-                return None
-        
-        avito_tasks = [fetch_avito_chat_info(chat) for chat in avito_chats_to_fetch]
-        avito_results = await asyncio.gather(*avito_tasks, return_exceptions=True)
-        
-        for result in avito_results:
-            if result and not isinstance(result, Exception):
-                chat_id, chat_info, creds = result
-                avito_info_cache[chat_id] = (chat_info, creds)
+        from api.chats.avito.avito_chat_info_cache import avito_chat_info_cache
     
     result = []
     for chat_row in chats_data:
@@ -834,80 +710,10 @@ async def get_chats(
         
         if is_avito_chat and with_avito_info:
             try:
-                avito_data = avito_info_cache.get(chat_id)
-                if avito_data:
-                    chat_info, creds = avito_data
-                    users = chat_info.get('users', [])
-                    avito_user_id = creds.get('avito_user_id')
-                    
-                    if not chat_dict.get('name'):
-                        context = chat_info.get('context', {})
-                        if isinstance(context, dict):
-                            value = context.get('value', {})
-                            if isinstance(value, dict):
-                                title = value.get('title')
-                                if title:
-                                    chat_dict['name'] = title
-                    
-                    if users:
-                        for user in users:
-                            user_id_in_chat = user.get('user_id') or user.get('id')
-                            if avito_user_id:
-                                if user_id_in_chat and user_id_in_chat != avito_user_id:
-                                    avatar_url = None
-                                    public_profile = user.get('public_user_profile', {})
-                                    if public_profile:
-                                        avatar_data = public_profile.get('avatar', {})
-                                        if isinstance(avatar_data, dict):
-                                            avatar_url = (
-                                                avatar_data.get('default') or
-                                                avatar_data.get('images', {}).get('256x256') or
-                                                avatar_data.get('images', {}).get('128x128') or
-                                                (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                            )
-                                        elif isinstance(avatar_data, str):
-                                            avatar_url = avatar_data
-                                    
-                                    if avatar_url:
-                                        if chat_dict.get('contact'):
-                                            chat_dict['contact']['avatar'] = avatar_url
-                                        else:
-                                            chat_dict['contact'] = {'avatar': avatar_url}
-                                        
-                                        if chat_dict.get('chat_contact_id'):
-                                            await database.execute(
-                                                chat_contacts.update().where(
-                                                    chat_contacts.c.id == chat_dict['chat_contact_id']
-                                                ).values(avatar=avatar_url)
-                                            )
-                                        break
-                            else:
-                                public_profile = user.get('public_user_profile', {})
-                                if public_profile:
-                                    avatar_data = public_profile.get('avatar', {})
-                                    if isinstance(avatar_data, dict):
-                                        avatar_url = (
-                                            avatar_data.get('default') or
-                                            avatar_data.get('images', {}).get('256x256') or
-                                            avatar_data.get('images', {}).get('128x128') or
-                                            (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                        )
-                                    elif isinstance(avatar_data, str):
-                                        avatar_url = avatar_data
-                                    
-                                    if avatar_url:
-                                        if chat_dict.get('contact'):
-                                            chat_dict['contact']['avatar'] = avatar_url
-                                        else:
-                                            chat_dict['contact'] = {'avatar': avatar_url}
-                                        
-                                        if chat_dict.get('chat_contact_id'):
-                                            await database.execute(
-                                                chat_contacts.update().where(
-                                                    chat_contacts.c.id == chat_dict['chat_contact_id']
-                                                ).values(avatar=avatar_url)
-                                            )
-                                        break
+                # только из кэша: промахи и устаревшие записи догружаются в фоне
+                entry = await avito_chat_info_cache.get(chat_dict['channel_id'], cashbox_id, chat_dict['external_chat_id'])
+                if entry:
+                    await _apply_avito_chat_info(chat_dict, entry)
             except Exception as e:
                 import logging
                 logger = logging.getLogger(__name__)
@@ -99,6 +99,8 @@ async def get_chats(
     sort_order: Optional[str] = Query("desc", description="Порядок сортировки: asc или desc"),
     skip: int = 0,
     limit: int = 100,
+    cursor_time: Optional[datetime] = Query(None, description="Keyset-пагинация без sort_by: last_message_time последнего чата предыдущей страницы"),
+    cursor_id: Optional[int] = Query(None, description="Keyset-пагинация без sort_by: id последнего чата предыдущей страницы"),
     user = Depends(get_current_user)
 ):
     return await crud.get_chats(
@@ -114,7 +116,9 @@ async def get_chats(
         sort_by=sort_by,
         sort_order=sort_order,
         skip=skip,
-        limit=limit
+        limit=limit,
+        cursor_time=cursor_time,
+        cursor_id=cursor_id,
     )
 
 
@@ -375,64 +379,25 @@ async def get_chat_messages(chat_id: int, token: str, skip: int = 0, limit: int
         
         if channel and channel['type'] == 'AVITO':
             try:
-                from database.db import channel_credentials
-                from api.chats.avito.avito_factory import create_avito_client, save_token_callback
+                from api.chats.avito.avito_chat_info_cache import avito_chat_info_cache
                 
-                creds = await database.fetch_one(
-                    channel_credentials.select().where(
-                        (channel_credentials.c.channel_id == chat['channel_id']) &
-                        (channel_credentials.c.cashbox_id == user.cashbox_id) &
-                        (channel_credentials.c.is_active.is_(True))
-                    )
+                # get_chat выше уже загрузил запись в кэш и сохранил аватар клиента
+                entry = await avito_chat_info_cache.get(
+                    chat['channel_id'], user.cashbox_id, chat['external_chat_id'], wait=True
                 )
-                
-                if creds:
-                    client = await create_avito_client(
-                        channel_id=chat['channel_id'],
-                        cashbox_id=user.cashbox_id,
-                        on_token_refresh=lambda token_data: save_token_callback(
-                            chat['channel_id'],
-                            user.cashbox_id,
-                            token_data
-                        )
-                    )
-                    
-                    if client:
-                        chat_info = await client.get_chat_info(chat['external_chat_id'])
-                        users = chat_info.get('users', [])
-                        avito_user_id = creds.get('avito_user_id')
-                        
-                        if users:
-                            for user_data in users:
-                                user_id_in_chat = user_data.get('user_id') or user_data.get('id')
-                                if user_id_in_chat:
-                                    avatar_url = None
-                                    public_profile = user_data.get('public_user_profile', {})
-                                    if public_profile:
-                                        avatar_data = public_profile.get('avatar', {})
-                                        if isinstance(avatar_data, dict):
-                                            avatar_url = (
-                                                avatar_data.get('default') or
-                                                avatar_data.get('images', {}).get('256x256') or
-                                                avatar_data.get('images', {}).get('128x128') or
-                                                (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                            )
-                                        elif isinstance(avatar_data, str):
-                                            avatar_url = avatar_data
-                                    
-                                    if avatar_url:
-                                        if avito_user_id and user_id_in_chat == avito_user_id:
-                                            operator_avatar = avatar_url
-                                        elif not client_avatar:
-                                            client_avatar = avatar_url
-                                            # Сохраняем аватар в БД
-                                            if chat.get('chat_contact_id'):
-                                                from database.db import chat_contacts
-                                                await database.execute(
-                                                    chat_contacts.update().where(
-                                                        chat_contacts.c.id == chat['chat_contact_id']
-                                                    ).values(avatar=avatar_url)
-                                                )
+                if entry:
+                    avito_user_id = entry.get('avito_user_id')
+                    for user_data in (entry.get('info') or {}).get('users', []):
+                        user_id_in_chat = user_data.get('user_id') or user_data.get('id')
+                        if not user_id_in_chat:
+                            continue
+                        avatar_url = crud.extract_avito_avatar(user_data)
+                        if not avatar_url:
+                            continue
+                        if avito_user_id and user_id_in_chat == avito_user_id:
+                            operator_avatar = avatar_url
+                        elif not client_avatar:
+                            client_avatar = avatar_url
             except Exception:
                 pass
         
@@ -87,6 +87,7 @@ class ChatResponse(BaseModel):
     last_response_time_seconds: Optional[int] = None
     created_at: datetime
     updated_at: datetime
+    last_message_id: Optional[int] = None
     last_message_preview: Optional[str] = None
     unread_count: int = 0
     channel_name: Optional[str] = None
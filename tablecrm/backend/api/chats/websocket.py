@@ -6,6 +6,7 @@ from dataclasses import dataclass
 from api.chats.producer import chat_producer
 from api.chats import crud
 from api.chats.auth import get_current_user
+from ws_manager import WebSocketHub, hub
 
 router = APIRouter(prefix="/chats", tags=["chats-ws"])
 
@@ -19,78 +20,43 @@ class ChatConnectionInfo:
 
 
 class ChatConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[ChatConnectionInfo]] = {}
-    
+    """Сокеты чатов поверх общего хаба: ключ "chat:{chat_id}"."""
+
+    def __init__(self, hub: WebSocketHub):
+        self.hub = hub
+
     async def connect(self, chat_id: int, websocket: WebSocket, user_id: int, user_type: str):
-        if chat_id not in self.active_connections:
-            self.active_connections[chat_id] = []
-        
         connection_info = ChatConnectionInfo(
             websocket=websocket,
             user_id=user_id,
             user_type=user_type,
             connected_at=datetime.utcnow()
         )
-        
-        self.active_connections[chat_id].append(connection_info)
-    
+        self.hub.add(websocket, [f"chat:{chat_id}"], connection_info)
+
     async def disconnect(self, chat_id: int, websocket: WebSocket) -> Optional[ChatConnectionInfo]:
-        if chat_id in self.active_connections:
-            connection_info = None
-            for conn_info in self.active_connections[chat_id]:
-                if conn_info.websocket == websocket:
-                    connection_info = conn_info
-                    self.active_connections[chat_id].remove(conn_info)
-                    break
-            
-            if not self.active_connections[chat_id]:
-                del self.active_connections[chat_id]
-            
-            if connection_info:
-                return connection_info
-            else:
-                return None
-        else:
-            return None
-    
+        subscriber = self.hub.remove(websocket)
+        return subscriber.info if subscriber is not None else None
+
     def get_connection_info(self, chat_id: int, websocket: WebSocket) -> Optional[ChatConnectionInfo]:
-        if chat_id in self.active_connections:
-            for conn_info in self.active_connections[chat_id]:
-                if conn_info.websocket == websocket:
-                    return conn_info
-        return None
-    
+        subscriber = self.hub.get(websocket)
+        return subscriber.info if subscriber is not None else None
+
     def get_connected_users(self, chat_id: int) -> List[Dict]:
-        if chat_id not in self.active_connections:
-            return []
-        
-        users = []
-        for conn_info in self.active_connections[chat_id]:
-            users.append({
-                "user_id": conn_info.user_id,
-                "user_type": conn_info.user_type,
-                "connected_at": conn_info.connected_at.isoformat()
-            })
-        
-        return users
-    
+        """Пользователи, подключённые к чату через этот процесс."""
+        return [
+            {
+                "user_id": subscriber.info.user_id,
+                "user_type": subscriber.info.user_type,
+                "connected_at": subscriber.info.connected_at.isoformat()
+            }
+            for subscriber in self.hub.subscribers(f"chat:{chat_id}")
+        ]
+
     async def broadcast_to_chat(self, chat_id: int, message: dict):
-        if chat_id in self.active_connections:
-            disconnected_clients = []
-            for i, conn_info in enumerate(self.active_connections[chat_id]):
-                try:
-                    await conn_info.websocket.send_json(message)
-                except Exception as e:
-                    disconnected_clients.append(i)
-            
-            for i in reversed(disconnected_clients):
-                try:
-                    self.active_connections[chat_id].pop(i)
-                except Exception:
-                    pass
+        await self.hub.publish(f"chat:{chat_id}", message)
 
-chat_manager = ChatConnectionManager()
+chat_manager = ChatConnectionManager(hub)
 
 
 @dataclass
@@ -102,53 +68,28 @@ class CashboxConnectionInfo:
 
 
 class CashboxConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[int, List[CashboxConnectionInfo]] = {}
-    
+    """Сокеты /chats/ws/all/ поверх общего хаба: ключ "chats_cashbox:{cashbox_id}"."""
+
+    def __init__(self, hub: WebSocketHub):
+        self.hub = hub
+
     async def connect(self, cashbox_id: int, websocket: WebSocket, user_id: int):
-        if cashbox_id not in self.active_connections:
-            self.active_connections[cashbox_id] = []
-        
         connection_info = CashboxConnectionInfo(
             websocket=websocket,
             user_id=user_id,
             cashbox_id=cashbox_id,
             connected_at=datetime.utcnow()
         )
-        
-        self.active_connections[cashbox_id].append(connection_info)
-    
+        self.hub.add(websocket, [f"chats_cashbox:{cashbox_id}"], connection_info)
+
     async def disconnect(self, cashbox_id: int, websocket: WebSocket) -> Optional[CashboxConnectionInfo]:
-        if cashbox_id in self.active_connections:
-            connection_info = None
-            for conn_info in self.active_connections[cashbox_id]:
-                if conn_info.websocket == websocket:
-                    connection_info = conn_info
-                    self.active_connections[cashbox_id].remove(conn_info)
-                    break
-            
-            if not self.active_connections[cashbox_id]:
-                del self.active_connections[cashbox_id]
-            
-            return connection_info
-        return None
-    
+        subscriber = self.hub.remove(websocket)
+        return subscriber.info if subscriber is not None else None
+
     async def broadcast_to_cashbox(self, cashbox_id: int, message: dict):
-        if cashbox_id in self.active_connections:
-            disconnected_clients = []
-            for i, conn_info in enumerate(self.active_connections[cashbox_id]):
-                try:
-                    await conn_info.websocket.send_json(message)
-                except Exception as e:
-                    disconnected_clients.append(i)
-            
-            for i in reversed(disconnected_clients):
-                try:
-                    self.active_connections[cashbox_id].pop(i)
-                except Exception:
-                    pass
+        await self.hub.publish(f"chats_cashbox:{cashbox_id}", message)
 
-cashbox_manager = CashboxConnectionManager()
+cashbox_manager = CashboxConnectionManager(hub)
 
 @router.websocket("/ws/all/")
 async def websocket_all_chats(websocket: WebSocket, token: str = Query(...)):
@@ -188,17 +129,14 @@ async def websocket_all_chats(websocket: WebSocket, token: str = Query(...)):
         cashbox_id = user.cashbox_id
         await cashbox_manager.connect(cashbox_id, websocket, user.user)
         
-        try:
-            await websocket.send_json({
-                "type": "connected",
-                "cashbox_id": cashbox_id,
-                "user_id": user.user,
-                "message": "Successfully connected to all chats",
-                "timestamp": datetime.utcnow().isoformat()
-            })
-        except Exception as e:
-            import traceback
-            traceback.print_exc()
+        # после connect в сокет пишет только задача хаба: ответ — через его очередь
+        hub.send(websocket, {
+            "type": "connected",
+            "cashbox_id": cashbox_id,
+            "user_id": user.user,
+            "message": "Successfully connected to all chats",
+            "timestamp": datetime.utcnow().isoformat()
+        })
             
         while True:
             try:
@@ -280,17 +218,15 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
             import traceback
             traceback.print_exc()
         
-        try:
-            await websocket.send_json({
-                "type": "connected",
-                "chat_id": chat_id,
-                "user_id": user.user,
-                "user_type": user_type,
-                "message": "Successfully connected to chat",
-                "timestamp": datetime.utcnow().isoformat()
-            })
-        except Exception as e:
-            pass
+        # после connect в сокет пишет только задача хаба: ответы — через его очередь
+        hub.send(websocket, {
+            "type": "connected",
+            "chat_id": chat_id,
+            "user_id": user.user,
+            "user_type": user_type,
+            "message": "Successfully connected to chat",
+            "timestamp": datetime.utcnow().isoformat()
+        })
         
         while True:
             try:
@@ -301,7 +237,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
             except WebSocketDisconnect:
                 raise
             except json.JSONDecodeError as e:
-                await websocket.send_json({
+                hub.send(websocket, {
                     "error": "Invalid JSON",
                     "detail": str(e)
                 })
@@ -309,13 +245,10 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
             except Exception as e:
                 import traceback
                 traceback.print_exc()
-                try:
-                    await websocket.send_json({
-                        "error": "Failed to process message",
-                        "detail": str(e)
-                    })
-                except:
-                    pass
+                hub.send(websocket, {
+                    "error": "Failed to process message",
+                    "detail": str(e)
+                })
                 continue
             
             if event_type == "message":
@@ -332,7 +265,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
                         source="web"
                     )
                 except Exception as e:
-                    await websocket.send_json({"error": "Failed to save message", "detail": str(e)})
+                    hub.send(websocket, {"error": "Failed to save message", "detail": str(e)})
                     continue
                 
                 try:
@@ -368,7 +301,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
             
             elif event_type == "get_users":
                 users = chat_manager.get_connected_users(chat_id)
-                await websocket.send_json({
+                hub.send(websocket, {
                     "type": "users_list",
                     "chat_id": chat_id,
                     "users": users,
@@ -376,7 +309,7 @@ async def websocket_chat(chat_id: int, websocket: WebSocket, token: str = Query(
                 })
             
             else:
-                await websocket.send_json({
+                hub.send(websocket, {
                     "error": "Unknown event type",
                     "type": event_type
                 })
@@ -10,6 +10,7 @@ from functions.helpers import (
     get_entity_by_id,
     get_user_by_token,
 )
+from functions.reference_cache import reference_cache
 from sqlalchemy import func, select
 from ws_manager import manager
 
@@ -123,6 +124,7 @@ async def edit_contract(
 
         query = contracts.update().where(contracts.c.id == idx, contracts.c.cashbox == user.cashbox_id).values(contract_values)
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "contracts", [idx])
         contract_db = await get_entity_by_id(contracts, idx, user.id)
 
     contract_db = datetime_to_timestamp(contract_db)
@@ -144,6 +146,7 @@ async def delete_contract(token: str, idx: int):
 
     query = contracts.update().where(contracts.c.id == idx, contracts.c.cashbox == user.cashbox_id).values({"is_deleted": True})
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "contracts", [idx])
 
     query = contracts.select().where(contracts.c.id == idx, contracts.c.cashbox == user.cashbox_id)
     contract_db = await database.fetch_one(query)
@@ -15,6 +15,7 @@ import api.contragents.schemas as ca_schemas
 import functions.filter_schemas as filter_schemas
 
 from functions.helpers import get_filters_ca, clear_phone_number, build_filters
+from functions.reference_cache import reference_cache
 from datetime import datetime
 
 router = APIRouter(tags=["contragents"])
@@ -189,6 +190,7 @@ async def update_contragent_data(token: str, ca_body: ca_schemas.ContragentEdit,
             q = contragents.update().where(contragents.c.id == id, contragents.c.cashbox == user.cashbox_id,
                                            contragents.c.is_deleted == False).values(update_dict)
             await database.execute(q)
+            reference_cache.invalidate(user.cashbox_id, "contragents", [id])
 
             q = contragents.select().where(contragents.c.id == id, contragents.c.cashbox == user.cashbox_id,
                                            contragents.c.is_deleted == False)
@@ -218,6 +220,7 @@ async def delete_contragent(token: str, id: int):
                 q = contragents.update().where(contragents.c.id == id, contragents.c.cashbox == user.cashbox_id).values(
                     {"is_deleted": True})
                 await database.execute(q)
+                reference_cache.invalidate(user.cashbox_id, "contragents", [id])
             except ForeignKeyViolationError:
                 return {"error": "К данному контрагенту привязан платеж, удаление невозможно!"}
 
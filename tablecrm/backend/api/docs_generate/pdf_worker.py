@@ -0,0 +1,30 @@
+import subprocess
+
+import pdfkit
+
+# Модуль выполняется в процессах пула рендеринга (spawn),
+# поэтому импортирует только pdfkit и ничего из приложения
+
+PDF_OPTIONS = {"enable-local-file-access": ""}
+
+
+def html_to_pdf(html: str, timeout: float) -> bytes:
+    """
+    HTML -> PDF через wkhtmltopdf.
+    Та же команда, что собирает pdfkit.from_string, но с таймаутом:
+    зависший wkhtmltopdf убивается, а не держит процесс пула.
+    """
+    kit = pdfkit.PDFKit(html, "string", options=PDF_OPTIONS)
+    result = subprocess.run(
+        kit.command(),
+        input=html.encode("utf-8"),
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        timeout=timeout,
+    )
+    if result.returncode != 0 and not result.stdout:
+        raise IOError(
+            f"wkhtmltopdf exited with code {result.returncode}: "
+            f"{result.stderr.decode('utf-8', errors='replace')[:500]}"
+        )
+    return result.stdout
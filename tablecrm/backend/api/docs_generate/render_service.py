@@ -0,0 +1,239 @@
+import asyncio
+import base64
+import datetime
+import hashlib
+import multiprocessing
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import BytesIO
+from subprocess import TimeoutExpired
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+import aioboto3
+import qrcode
+from fastapi import HTTPException
+from jinja2 import Environment, Template, TemplateError
+from sqlalchemy import desc
+
+from api.docs_generate.pdf_worker import html_to_pdf
+from api.docs_generate.schemas import TypeDoc
+from database.db import database, doc_generated
+
+s3_session = aioboto3.Session()
+
+s3_data = {
+    "service_name": "s3",
+    "endpoint_url": os.environ.get("S3_URL"),
+    "aws_access_key_id": os.environ.get("S3_ACCESS"),
+    "aws_secret_access_key": os.environ.get("S3_SECRET"),
+}
+
+bucket_name = "5075293c-docs_generated"
+
+
+def render_qrcode(value):
+    qr_image = qrcode.make(value, box_size=15)
+    qr_image_pil = qr_image.get_image()
+    stream = BytesIO()
+    qr_image_pil.save(stream, format='PNG')
+    qr_image_data = stream.getvalue()
+    qr_image_base64 = base64.b64encode(qr_image_data).decode('utf-8')
+    return f"data:image/png;base64,{qr_image_base64}"
+
+
+class DocRenderService:
+    """
+    Генерация документов по шаблонам doc_template.
+
+    Скомпилированные шаблоны кэшируются по (id, updated_at) — PATCH шаблона
+    меняет updated_at, и следующий вызов компилирует новую версию.
+    PDF рендерится wkhtmltopdf в пуле процессов: не более pdf_workers
+    одновременно, зависший рендер убивается по pdf_timeout.
+    Готовый файл ищется по хэшу содержимого в doc_generated кассы:
+    повторная генерация того же документа не рендерит PDF и не загружает файл в S3.
+    """
+
+    def __init__(
+            self,
+            pdf_workers: int = int(os.getenv("DOCS_PDF_WORKERS", 2)),
+            pdf_timeout: float = float(os.getenv("DOCS_PDF_TIMEOUT", 60)),
+            template_cache_size: int = int(os.getenv("DOCS_TEMPLATE_CACHE_SIZE", 256)),
+    ):
+        self.pdf_workers = pdf_workers
+        self.pdf_timeout = pdf_timeout
+        self.template_cache_size = template_cache_size
+        self._env = Environment()
+        self._env.filters["render_qrcode"] = render_qrcode
+        self._templates: "OrderedDict[Tuple[int, Any], Tuple[str, Template]]" = OrderedDict()
+        self._pool: Optional[ProcessPoolExecutor] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._inflight: Dict[Tuple[int, str], asyncio.Future] = {}
+
+    def get_template(self, template_row) -> Template:
+        key = (template_row.id, template_row.updated_at)
+        cached = self._templates.get(key)
+        # updated_at в секундах: две правки за секунду отличаем по исходнику
+        if cached is not None and cached[0] == template_row.template_data:
+            self._templates.move_to_end(key)
+            return cached[1]
+
+        try:
+            compiled = self._env.from_string(template_row.template_data or "")
+        except TemplateError as error:
+            raise HTTPException(status_code=400, detail=f"Ошибка в шаблоне: {error}")
+
+        self._templates[key] = (template_row.template_data, compiled)
+        self._templates.move_to_end(key)
+        while len(self._templates) > self.template_cache_size:
+            self._templates.popitem(last=False)
+        return compiled
+
+    def render_html(self, template_row, variables: Dict) -> str:
+        try:
+            return self.get_template(template_row).render(variables)
+        except HTTPException:
+            raise
+        except Exception as error:
+            raise HTTPException(status_code=400, detail=f"Ошибка генерации документа: {error}")
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(
+                max_workers=self.pdf_workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return self._pool
+
+    async def render_pdf(self, html: str) -> bytes:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.pdf_workers)
+
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            try:
+                return await asyncio.wait_for(
+                    loop.run_in_executor(self._get_pool(), html_to_pdf, html, self.pdf_timeout),
+                    timeout=self.pdf_timeout + 5,
+                )
+            except (TimeoutExpired, asyncio.TimeoutError):
+                raise HTTPException(status_code=504, detail="Превышено время генерации PDF")
+            except BrokenProcessPool:
+                # процесс пула упал — следующий вызов поднимет новый пул
+                self._pool = None
+                raise HTTPException(status_code=500, detail="Ошибка генерации PDF")
+            except IOError as error:
+                raise HTTPException(status_code=500, detail=f"Ошибка генерации PDF: {error}")
+
+    @staticmethod
+    def content_hash(html: str, type_doc: TypeDoc) -> str:
+        return hashlib.sha256(f"{type_doc.value}\n{html}".encode("utf-8")).hexdigest()
+
+    async def _find_file(self, cashbox_id: int, content_hash: str, type_doc: TypeDoc) -> Optional[str]:
+        query = (
+            doc_generated.select()
+            .where(
+                doc_generated.c.cashbox_id == cashbox_id,
+                doc_generated.c.content_hash == content_hash,
+                doc_generated.c.type_doc == type_doc.value,
+            )
+            .order_by(desc(doc_generated.c.id))
+            .limit(1)
+        )
+        existing = await database.fetch_one(query)
+        return existing.doc_link if existing else None
+
+    async def _render_and_upload(self, html: str, type_doc: TypeDoc, entity: Optional[str],
+                                 entity_id: Optional[int]) -> str:
+        file_link = f"docsgenerate/{entity}_{entity_id}_{uuid4().hex[:8]}"
+        if type_doc is TypeDoc.pdf:
+            data = await self.render_pdf(html)
+            file_link += ".pdf"
+        else:
+            data = html.encode("utf-8")
+            file_link += ".html"
+
+        async with s3_session.client(**s3_data) as s3:
+            await s3.put_object(Body=data, Bucket=bucket_name, Key=file_link)
+        return file_link
+
+    async def _get_file_link(self, cashbox_id: int, html: str, type_doc: TypeDoc,
+                             entity: Optional[str], entity_id: Optional[int]) -> Tuple[str, str]:
+        content_hash = self.content_hash(html, type_doc)
+
+        file_link = await self._find_file(cashbox_id, content_hash, type_doc)
+        if file_link:
+            return file_link, content_hash
+
+        # одинаковые документы, генерируемые одновременно (например, в одной пачке),
+        # рендерятся и загружаются один раз
+        key = (cashbox_id, content_hash)
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            return await asyncio.shield(inflight), content_hash
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            file_link = await self._render_and_upload(html, type_doc, entity, entity_id)
+            future.set_result(file_link)
+            return file_link, content_hash
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as error:
+            future.set_exception(error)
+            # ошибку получат ожидающие этот же документ; без ожидающих она не должна
+            # попасть в лог как «never retrieved»
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(key, None)
+
+    async def generate(self, cashbox_id: int, template_row, variables: Dict, type_doc: TypeDoc,
+                       entity: str = None, entity_id: int = None, tags: str = None):
+        """Генерация документа с загрузкой в S3 и фиксацией записи генерации."""
+        html = self.render_html(template_row, variables)
+        file_link, content_hash = await self._get_file_link(cashbox_id, html, type_doc, entity, entity_id)
+
+        file_dict = {
+            'cashbox_id': cashbox_id,
+            'doc_link': file_link,
+            'created_at': datetime.datetime.now(),
+            'tags': None if not tags else tags.lower(),
+            'template_id': template_row.id,
+            'entity': entity,
+            'entity_id': entity_id,
+            'type_doc': type_doc,
+            'content_hash': content_hash,
+        }
+        query = doc_generated.insert().values(file_dict)
+        result_file_dict_id = await database.execute(query)
+        query = doc_generated.select().where(doc_generated.c.id == result_file_dict_id,
+                                             doc_generated.c.cashbox_id == cashbox_id)
+        return await database.fetch_one(query)
+
+    async def generate_many(self, cashbox_id: int, templates_by_id: Dict[int, Any], items: List) -> List:
+        """Пачка генераций: шаблоны уже загружены, PDF рендерятся параллельно в пределах пула."""
+        return list(await asyncio.gather(*[
+            self.generate(
+                cashbox_id,
+                templates_by_id[item.template_id],
+                item.variable,
+                item.type_doc,
+                entity=item.entity,
+                entity_id=item.entity_id,
+                tags=item.tags,
+            )
+            for item in items
+        ]))
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+
+doc_render_service = DocRenderService()
@@ -1,64 +1,16 @@
-import datetime
-import pdfkit
-
 from fastapi import APIRouter, HTTPException, status
-from uuid import uuid4
-from fastapi.responses import Response, FileResponse
-from jinja2 import Template
-from jinja2.filters import FILTERS
-from typing import Dict, Any
-from io import BytesIO
-import qrcode
-from PIL import Image
+from fastapi.responses import Response
+from typing import Dict
 
+from api.docs_generate.render_service import doc_render_service, s3_session, s3_data, bucket_name
 from api.docs_generate.schemas import TypeDoc, ReGenerateList
 from database.db import database, doc_generated, doc_templates
 from functions.helpers import get_user_by_token
-import base64
-from sqlalchemy import or_, desc
-from os import environ
-
-import aioboto3
-
-
-def render_qrcode(value):
-    qr_image = qrcode.make(value, box_size=15)
-    qr_image_pil = qr_image.get_image()
-    stream = BytesIO()
-    qr_image_pil.save(stream, format='PNG')
-    qr_image_data = stream.getvalue()
-    qr_image_base64 = base64.b64encode(qr_image_data).decode('utf-8')
-    return f"data:image/png;base64,{qr_image_base64}"
-
-
-FILTERS['render_qrcode'] = render_qrcode
-
-s3_session = aioboto3.Session()
-
-s3_data = {
-    "service_name": "s3",
-    "endpoint_url": environ.get("S3_URL"),
-    "aws_access_key_id": environ.get("S3_ACCESS"),
-    "aws_secret_access_key": environ.get("S3_SECRET"),
-}
-
-bucket_name = "5075293c-docs_generated"
+from sqlalchemy import desc
 
 router = APIRouter(tags=["docgenerated"])
 
 
-def generate_doc(template, *kwargs) -> Any:
-    try:
-        tm = Template(template)
-        return tm.render(*kwargs)
-    except Exception as error:
-        return error
-
-
-def convert_html_to_pdf(doc_render):
-    return pdfkit.from_string(doc_render, options={"enable-local-file-access": ""})
-
-
 @router.post('/docgenerated/')
 async def doc_generate(token: str,
                        template_id: int,
@@ -73,33 +25,12 @@ async def doc_generate(token: str,
     user = await get_user_by_token(token)
     query = doc_templates.select().where(doc_templates.c.id == template_id, doc_templates.c.cashbox == user.cashbox_id)
     template = await database.fetch_one(query)
-    data = generate_doc(template['template_data'], variable)
+    if not template:
+        raise HTTPException(status_code=404, detail="Шаблон не найден")
 
-    file_link = f"docsgenerate/{entity}_{entity_id}_{uuid4().hex[:8]}"
-    if type_doc is TypeDoc.html:
-        file_link += ".html"
-    if type_doc is TypeDoc.pdf:
-        data = convert_html_to_pdf(data)
-        file_link += ".pdf"
-
-    async with s3_session.client(**s3_data) as s3:
-        await s3.put_object(Body=data, Bucket=bucket_name, Key=file_link)
-
-    file_dict = {
-            'cashbox_id': user.cashbox_id,
-            'doc_link': file_link,
-            'created_at': datetime.datetime.now(),
-            'tags': None if not tags else tags.lower(),
-            'template_id': template_id,
-            'entity': entity,
-            'entity_id': entity_id,
-            'type_doc': type_doc
-        }
-    query = doc_generated.insert().values(file_dict)
-    result_file_dict_id = await database.execute(query)
-    query = doc_generated.select().where(doc_generated.c.id == result_file_dict_id, doc_generated.c.cashbox_id == user.cashbox_id)
-    result = await database.fetch_one(query)
-    return result
+    return await doc_render_service.generate(
+        user.cashbox_id, template, variable, type_doc, entity=entity, entity_id=entity_id, tags=tags
+    )
 
 
 @router.get('/docgenerated/{idx}', status_code=status.HTTP_200_OK)
@@ -156,5 +87,20 @@ async def get_doc_generate_list(token: str, tags: str = None, limit: int = 100,
 
 @router.post('/regenerated/', status_code=status.HTTP_200_OK)
 async def regenerated(token: str, generateList: ReGenerateList):
-    pass
+    """ Пакетная генерация документов: шаблоны загружаются одним запросом, PDF рендерятся параллельно """
+    user = await get_user_by_token(token)
+    items = generateList.__root__ or []
+    if not items:
+        return {'results': []}
+
+    template_ids = {item.template_id for item in items}
+    query = doc_templates.select().where(doc_templates.c.id.in_(template_ids),
+                                         doc_templates.c.cashbox == user.cashbox_id)
+    templates_by_id = {template.id: template for template in await database.fetch_all(query)}
+    missing = template_ids - templates_by_id.keys()
+    if missing:
+        raise HTTPException(status_code=404, detail=f"Шаблоны не найдены: {sorted(missing)}")
+
+    results = await doc_render_service.generate_many(user.cashbox_id, templates_by_id, items)
+    return {'results': results}
 
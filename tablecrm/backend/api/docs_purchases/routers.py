@@ -1,28 +1,22 @@
 from database.db import (
-    contracts,
     database,
     docs_purchases,
     docs_purchases_goods,
     nomenclature,
-    organizations,
-    price_types,
-    users_cboxes_relation,
     warehouse_balances,
-    warehouses,
     units,
     docs_warehouse
 )
 from fastapi import APIRouter, HTTPException
 from fastapi_pagination import Page, paginate
 from functions.helpers import (
-    check_contragent_exists,
-    check_entity_exists,
     check_period_blocked,
-    check_unit_exists,
     datetime_to_timestamp,
     get_user_by_token,
 )
-from sqlalchemy import desc, func, select, asc
+from functions.doc_numbers import DOCS_PURCHASES, doc_numbers
+from functions.reference_cache import reference_cache
+from sqlalchemy import desc, func, select
 from ws_manager import manager
 
 from . import schemas
@@ -32,15 +26,6 @@ from api.docs_warehouses.routers import update as update_warehouse_doc
 
 router = APIRouter(tags=["docs_purchases"])
 
-contragents_cache = set()
-organizations_cache = set()
-contracts_cache = set()
-warehouses_cache = set()
-users_cache = set()
-price_types_cache = set()
-units_cache = set()
-nomenclature_cache = set()
-
 
 @router.get("/docs_purchases/{idx}/", response_model=schemas.View)
 async def get_by_id(token: str, idx: int):
@@ -95,67 +80,21 @@ async def get_list(token: str, limit: int = 100, offset: int = 0, tags: str = No
 
 
 async def check_foreign_keys(instance_values, user, exceptions) -> bool:
-    if instance_values.get("nomenclature") is not None:
-        if instance_values["nomenclature"] not in nomenclature_cache:
+    for key, entity in (
+        ("nomenclature", "nomenclature"),
+        ("client", "contragents"),
+        ("contragent", "contragents"),
+        ("contract", "contracts"),
+        ("organization", "organizations"),
+        ("warehouse", "warehouses"),
+        ("purchased_by", "users"),
+    ):
+        if instance_values.get(key) is not None:
             try:
-                await check_entity_exists(nomenclature, instance_values["nomenclature"], user.id)
-                nomenclature_cache.add(instance_values["nomenclature"])
+                await reference_cache.ensure_exist(user.cashbox_id, entity, [instance_values[key]])
             except HTTPException as e:
                 exceptions.append(str(instance_values) + " " + e.detail)
                 return False
-
-    if instance_values.get("client") is not None:
-        if instance_values["client"] not in contragents_cache:
-            try:
-                await check_contragent_exists(instance_values["client"], user.cashbox_id)
-                contragents_cache.add(instance_values["client"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("contragent") is not None:
-        if instance_values["contragent"] not in contragents_cache:
-            try:
-                await check_contragent_exists(instance_values["contragent"], user.cashbox_id)
-                contragents_cache.add(instance_values["contragent"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("contract") is not None:
-        if instance_values["contract"] not in contracts_cache:
-            try:
-                await check_entity_exists(contracts, instance_values["contract"], user.id)
-                contracts_cache.add(instance_values["contract"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("organization") is not None:
-        if instance_values["organization"] not in organizations_cache:
-            try:
-                await check_entity_exists(organizations, instance_values["organization"], user.id)
-                organizations_cache.add(instance_values["organization"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("warehouse") is not None:
-        if instance_values["warehouse"] not in warehouses_cache:
-            try:
-                await check_entity_exists(warehouses, instance_values["warehouse"], user.id)
-                warehouses_cache.add(instance_values["warehouse"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("purchased_by") is not None:
-        if instance_values["purchased_by"] not in users_cache:
-            query = users_cboxes_relation.select().where(users_cboxes_relation.c.id == instance_values["purchased_by"])
-            if not await database.fetch_one(query):
-                exceptions.append(str(instance_values) + " Пользователь не существует!")
-                return False
-            users_cache.add(instance_values["purchased_by"])
     return True
 
 
@@ -184,29 +123,32 @@ async def create(token: str, docs_purchases_data: schemas.CreateMass):
             del instance_values["goods"]
         except KeyError:
             pass
-        query = docs_purchases.insert().values(instance_values)
-        instance_id = await database.execute(query)
+        # номер и заголовок — в одной транзакции: в режиме без пропусков
+        # откат вставки возвращает номер
+        async with database.connection() as conn, conn.transaction():
+            if not instance_values.get("number"):
+                instance_values["number"] = await doc_numbers.next(
+                    instance_values["organization"], DOCS_PURCHASES, connection=conn
+                )
+            query = docs_purchases.insert().values(instance_values)
+            instance_id = await conn.execute(query)
         inserted_ids.add(instance_id)
         items_sum = 0
         for item in goods:
             item["docs_purchases_id"] = instance_id
 
             if item.get("price_type") is not None:
-                if item["price_type"] not in price_types_cache:
-                    try:
-                        await check_entity_exists(price_types, item["price_type"], user.id)
-                        price_types_cache.add(item["price_type"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             if item.get("unit") is not None:
-                if item["unit"] not in units_cache:
-                    try:
-                        await check_unit_exists(item["unit"])
-                        units_cache.add(item["unit"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             query = docs_purchases_goods.insert().values(item)
             await database.execute(query)
             items_sum += item["price"] * item["quantity"]
@@ -291,19 +233,6 @@ async def create(token: str, docs_purchases_data: schemas.CreateMass):
         body['to_warehouse'] = None
         await create_warehouse_docs(token, body, user.cashbox_id)
 
-    q = docs_purchases.select().where(
-        docs_purchases.c.cashbox == user.cashbox_id,
-        docs_purchases.c.is_deleted == False
-    ).order_by(asc(docs_purchases.c.id))
-
-    docs_db = await database.fetch_all(q)
-
-    for i in range(0, len(docs_db)):
-        if not docs_db[i].number:
-            q = docs_purchases.update().where(docs_purchases.c.id == docs_db[i].id).values({ "number": str(i + 1) })
-            await database.execute(q)
-
-
     query = docs_purchases.select().where(docs_purchases.c.id.in_(inserted_ids))
     docs_purchases_db = await database.fetch_all(query)
     docs_purchases_db = [*map(datetime_to_timestamp, docs_purchases_db)]
@@ -354,21 +283,17 @@ async def update(token: str, docs_purchases_data: schemas.EditMass):
                 item["docs_purchases_id"] = instance_id
 
                 if item.get("price_type") is not None:
-                    if item["price_type"] not in price_types_cache:
-                        try:
-                            await check_entity_exists(price_types, item["price_type"], user.id)
-                            price_types_cache.add(item["price_type"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 if item.get("unit") is not None:
-                    if item["unit"] not in units_cache:
-                        try:
-                            await check_unit_exists(item["unit"])
-                            units_cache.add(item["unit"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 query = docs_purchases_goods.insert().values(item)
                 await database.execute(query)
                 items_sum += item["price"] * item["quantity"]
@@ -25,14 +25,6 @@ from sqlalchemy import select, func
 
 router = APIRouter(tags=["docs_reconciliation"])
 
-contragents_cache = set()
-organizations_cache = set()
-contracts_cache = set()
-warehouses_cache = set()
-users_cache = set()
-price_types_cache = set()
-units_cache = set()
-
 
 @router.get("/docs_reconciliation/{idx}/", response_model=schemas.View)
 async def get_by_id(token: str, idx: int):
@@ -8,7 +8,6 @@ from typing import Any, Dict, Optional, Union, List
 from api.docs_warehouses.routers import update as update_warehouse_doc
 from api.docs_warehouses.schemas import EditMass as WarehouseUpdate
 from api.docs_warehouses.utils import create_warehouse_docs
-from api.loyality_transactions.routers import raschet_bonuses
 from apps.yookassa.functions.impl.GetOauthCredentialFunction import (
     GetOauthCredentialFunction,
 )
@@ -46,7 +45,6 @@ from database.db import (
     NomenclatureCashbackType,
     OrderStatus,
     articles,
-    contracts,
     contragents,
     database,
     docs_sales,
@@ -60,10 +58,8 @@ from database.db import (
     loyality_cards,
     loyality_transactions,
     nomenclature,
-    organizations,
     payments,
     pboxes,
-    price_types,
     users,
     users_cboxes_relation,
     warehouse_balances,
@@ -77,15 +73,14 @@ from functions.helpers import (
     add_delivery_info_to_doc,
     add_docs_sales_settings,
     add_nomenclature_name_to_goods,
-    check_contragent_exists,
-    check_entity_exists,
     check_period_blocked,
-    check_unit_exists,
     datetime_to_timestamp,
     get_user_by_token,
     raschet_oplat,
     build_filters
 )
+from functions.doc_numbers import DOCS_SALES, doc_numbers
+from functions.reference_cache import reference_cache
 from functions.users import raschet
 from producer import queue_notification
 from sqlalchemy import and_, desc, func, select, exists, or_, String, cast
@@ -102,16 +97,10 @@ from api.employee_shifts.service import (
 
 from api.docs_sales.application.queries import (GetDocsSalesListByDeliveryDateQuery,
     GetDocsSalesListQuery, GetDocsSalesListByCreatedDateQuery, GetDocSaleByIdQuery)
+from api.docs_sales.application.commands import BulkCreateDocsSalesCommand
 
 router = APIRouter(tags=["docs_sales"])
 
-contragents_cache = set()
-organizations_cache = set()
-contracts_cache = set()
-warehouses_cache = set()
-users_cache = set()
-price_types_cache = set()
-units_cache = set()
 
 # Секретный ключ для генерации MD5-хешей (в реальном приложении лучше хранить в переменных окружения)
 SECRET_KEY = os.environ.get(
@@ -283,79 +272,42 @@ async def get_list_by_delivery_date(
     return await query.execute(cashbox_id=user.cashbox_id, date=date, filters=filters)
 
 async def check_foreign_keys(instance_values, user, exceptions) -> bool:
-    if instance_values.get("client") is not None:
-        if instance_values["client"] not in contragents_cache:
-            try:
-                await check_contragent_exists(
-                    instance_values["client"], user.cashbox_id
-                )
-                contragents_cache.add(instance_values["client"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("contragent") is not None:
-        if instance_values["contragent"] not in contragents_cache:
-            try:
-                await check_contragent_exists(
-                    instance_values["contragent"], user.cashbox_id
-                )
-                contragents_cache.add(instance_values["contragent"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("contract") is not None:
-        if instance_values["contract"] not in contracts_cache:
-            try:
-                await check_entity_exists(
-                    contracts, instance_values["contract"], user.id
-                )
-                contracts_cache.add(instance_values["contract"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("organization") is not None:
-        if instance_values["organization"] not in organizations_cache:
-            try:
-                await check_entity_exists(
-                    organizations, instance_values["organization"], user.id
-                )
-                organizations_cache.add(instance_values["organization"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("warehouse") is not None:
-        if instance_values["warehouse"] not in warehouses_cache:
+    for key, entity in (
+        ("client", "contragents"),
+        ("contragent", "contragents"),
+        ("contract", "contracts"),
+        ("organization", "organizations"),
+        ("warehouse", "warehouses"),
+        ("sales_manager", "users"),
+    ):
+        if instance_values.get(key) is not None:
             try:
-                await check_entity_exists(
-                    warehouses, instance_values["warehouse"], user.id
-                )
-                warehouses_cache.add(instance_values["warehouse"])
+                await reference_cache.ensure_exist(user.cashbox_id, entity, [instance_values[key]])
             except HTTPException as e:
                 exceptions.append(str(instance_values) + " " + e.detail)
                 return False
-
-    if instance_values.get("sales_manager") is not None:
-        if instance_values["sales_manager"] not in users_cache:
-            query = users_cboxes_relation.select().where(
-                users_cboxes_relation.c.id == instance_values["sales_manager"]
-            )
-            if not await database.fetch_one(query):
-                exceptions.append(str(instance_values) + " Пользователь не существует!")
-                return False
-            users_cache.add(instance_values["sales_manager"])
     return True
 
 
 async def create(
-    token: str, docs_sales_data: schemas.CreateMass, generate_out: bool = True
+    token: str,
+    docs_sales_data: schemas.CreateMass,
+    generate_out: bool = True,
+    bulk: bool = False,
 ):
-    """Создание документов"""
+    """
+    Создание документов.
+    bulk=True — пакетная загрузка одной транзакцией (BulkCreateDocsSalesCommand):
+    при ошибке в любом документе не создаётся ни один. Менеджер продажи,
+    как и при поштучном создании, — пользователь токена.
+    """
     user = await get_user_by_token(token)
 
+    if bulk:
+        return await BulkCreateDocsSalesCommand().execute(
+            user, token, docs_sales_data.__root__, generate_out, own_sales_manager=True
+        )
+
     inserted_ids = set()
     exceptions = []
 
@@ -411,35 +363,20 @@ async def create(
 
         del instance_values["client"]
 
-        if not instance_values.get("number"):
-            query = (
-                select(docs_sales.c.number)
-                .where(
-                    docs_sales.c.is_deleted == False,
-                    docs_sales.c.organization == instance_values["organization"],
-                )
-                .order_by(desc(docs_sales.c.created_at))
-            )
-            prev_number_docs_sales = await database.fetch_one(query)
-            if prev_number_docs_sales:
-                if prev_number_docs_sales.number:
-                    try:
-                        number_int = int(prev_number_docs_sales.number)
-                    except:
-                        number_int = 0
-                    instance_values["number"] = str(number_int + 1)
-                else:
-                    instance_values["number"] = "1"
-            else:
-                instance_values["number"] = "1"
-
         paybox = instance_values.pop("paybox", None)
         if paybox is None:
             if paybox_id is not None:
                 paybox = paybox_id
 
-        query = docs_sales.insert().values(instance_values)
-        instance_id = await database.execute(query)
+        # номер и заголовок — в одной транзакции: в режиме без пропусков
+        # откат вставки возвращает номер
+        async with database.connection() as conn, conn.transaction():
+            if not instance_values.get("number"):
+                instance_values["number"] = await doc_numbers.next(
+                    instance_values["organization"], DOCS_SALES, connection=conn
+                )
+            query = docs_sales.insert().values(instance_values)
+            instance_id = await conn.execute(query)
 
         # Генерация ссылок для заказа
         try:
@@ -478,23 +415,17 @@ async def create(
             del item["unit_name"]
 
             if item.get("price_type") is not None:
-                if item["price_type"] not in price_types_cache:
-                    try:
-                        await check_entity_exists(
-                            price_types, item["price_type"], user.id
-                        )
-                        price_types_cache.add(item["price_type"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             if item.get("unit") is not None:
-                if item["unit"] not in units_cache:
-                    try:
-                        await check_unit_exists(item["unit"])
-                        units_cache.add(item["unit"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             item["nomenclature"] = int(item["nomenclature"])
             query = docs_sales_goods.insert().values(item)
             await database.execute(query)
@@ -631,11 +562,6 @@ async def create(
                     }
                 )
             )
-            await database.execute(
-                pboxes.update()
-                .where(pboxes.c.id == paybox)
-                .values({"balance": pboxes.c.balance - paid_rubles})
-            )
 
             # Юкасса
 
@@ -730,8 +656,6 @@ async def create(
                             loyality_transactions.insert().values(rubles_body)
                         )
 
-                        await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
-
             await asyncio.gather(asyncio.create_task(raschet(user, token)))
         if lt:
             if paid_lt > 0:
@@ -758,13 +682,6 @@ async def create(
                 lt_id = await database.execute(
                     loyality_transactions.insert().values(rubles_body)
                 )
-                print("loyality_transactions insert")
-                await database.execute(
-                    loyality_cards.update()
-                    .where(loyality_cards.c.card_number == payboxes.card_number)
-                    .values({"balance": loyality_cards.c.balance - paid_lt})
-                )
-                print("loyality_transactions update")
                 await database.execute(
                     entity_to_entity.insert().values(
                         {
@@ -780,8 +697,6 @@ async def create(
                     )
                 )
 
-                await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
-
         query = (
             docs_sales.update()
             .where(docs_sales.c.id == instance_id)
@@ -830,7 +745,7 @@ async def create(
     docs_sales_db = await database.fetch_all(query)
     docs_sales_db = [*map(datetime_to_timestamp, docs_sales_db)]
 
-    await manager.send_message(
+    await manager.send_update(
         token,
         {
             "action": "create",
@@ -1006,7 +921,6 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                     lt_id = await database.execute(
                         loyality_transactions.insert().values(rubles_body)
                     )
-                    await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
 
                 await asyncio.gather(asyncio.create_task(raschet(user, token)))
 
@@ -1052,8 +966,6 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                         )
                     )
 
-                    await asyncio.gather(asyncio.create_task(raschet_bonuses(lt)))
-
         if instance_values.get("paid_rubles"):
             del instance_values["paid_rubles"]
 
@@ -1075,23 +987,17 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
                 item["docs_sales_id"] = instance_id
 
                 if item.get("price_type") is not None:
-                    if item["price_type"] not in price_types_cache:
-                        try:
-                            await check_entity_exists(
-                                price_types, item["price_type"], user.id
-                            )
-                            price_types_cache.add(item["price_type"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 if item.get("unit") is not None:
-                    if item["unit"] not in units_cache:
-                        try:
-                            await check_unit_exists(item["unit"])
-                            units_cache.add(item["unit"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 item["nomenclature"] = int(item["nomenclature"])
                 query = docs_sales_goods.insert().values(item)
                 await database.execute(query)
@@ -1183,7 +1089,7 @@ async def update(token: str, docs_sales_data: schemas.EditMass):
     docs_sales_db = await database.fetch_all(query)
     docs_sales_db = [*map(datetime_to_timestamp, docs_sales_db)]
 
-    await manager.send_message(
+    await manager.send_update(
         token,
         {
             "action": "edit",
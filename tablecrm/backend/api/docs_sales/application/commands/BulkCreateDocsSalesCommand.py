@@ -0,0 +1,647 @@
+import asyncio
+import datetime
+import logging
+import os
+from collections import defaultdict
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Table, and_, func, or_, select
+
+from api.docs_sales import schemas
+from api.docs_warehouses.utils import create_warehouse_docs
+from apps.yookassa.functions.impl.GetOauthCredentialFunction import GetOauthCredentialFunction
+from apps.yookassa.models.PaymentModel import (
+    AmountModel,
+    ConfirmationRedirect,
+    CustomerModel,
+    ItemModel,
+    PaymentCreateModel,
+    ReceiptModel,
+)
+from apps.yookassa.repositories.impl.YookassaCrmPaymentsRepository import YookassaCrmPaymentsRepository
+from apps.yookassa.repositories.impl.YookassaOauthRepository import YookassaOauthRepository
+from apps.yookassa.repositories.impl.YookassaPaymentsRepository import YookassaPaymentsRepository
+from apps.yookassa.repositories.impl.YookassaRequestRepository import YookassaRequestRepository
+from apps.yookassa.repositories.impl.YookassaTableNomenclature import YookassaTableNomenclature
+from apps.yookassa.repositories.impl.YookasssaAmoTableCrmRepository import YookasssaAmoTableCrmRepository
+from apps.yookassa.services.impl.OauthService import OauthService
+from apps.yookassa.services.impl.YookassaApiService import YookassaApiService
+from database.db import (
+    NomenclatureCashbackType,
+    articles,
+    database,
+    docs_sales,
+    docs_sales_goods,
+    docs_sales_links,
+    docs_sales_settings,
+    docs_sales_tags,
+    entity_to_entity,
+    fifo_settings,
+    loyality_cards,
+    loyality_transactions,
+    nomenclature,
+    payments,
+    pboxes,
+    warehouse_balances,
+)
+from functions.doc_numbers import DOCS_SALES, doc_numbers
+from functions.helpers import datetime_to_timestamp
+from functions.reference_cache import reference_cache
+from functions.users import raschet
+from ws_manager import manager
+
+logger = logging.getLogger(__name__)
+
+# asyncpg принимает не больше 32767 параметров в одном запросе
+MAX_QUERY_PARAMS = 30000
+
+LINK_ROLES = ("general", "picker", "courier")
+
+
+class BulkCreateDocsSalesCommand:
+    """
+    Пакетное создание документов продажи (офлайн-выгрузка касс, POST /docs_sales/).
+
+    Внешние ключи всей пачки проверяются несколькими запросами IN (...),
+    заголовки, товары, теги, ссылки, платежи, операции по картам лояльности
+    и остатки пишутся многострочными INSERT на одном явно взятом соединении
+    в его транзакции: пачка создаётся целиком или не создаётся вовсе.
+    Рассылка балансов — одна на пачку, складские документы создаются в фоне
+    после фиксации.
+
+    own_sales_manager=True — менеджером продажи всегда становится
+    пользователь токена (как в поштучном create, которым пользуется Эвотор).
+    """
+
+    async def execute(
+        self,
+        user,
+        token: str,
+        docs: List[schemas.Create],
+        generate_out: bool = True,
+        yookassa_payments: bool = True,
+        own_sales_manager: bool = False,
+    ) -> List[Dict[str, Any]]:
+        if not docs:
+            return []
+
+        for doc in docs:
+            if doc.priority is not None and (doc.priority < 0 or doc.priority > 10):
+                raise HTTPException(400, "Приоритет должен быть от 0 до 10")
+
+        nomenclature_map = await self._validate_foreign_keys(user, docs)
+        await self._check_periods(docs)
+        cards = await self._get_cards(docs)
+
+        now = datetime.datetime.now()
+        now_ts = int(now.timestamp())
+        need_payments = any(doc.paid_rubles for doc in docs)
+        default_paybox = None
+        if need_payments:
+            default_paybox = await database.fetch_val(
+                select(pboxes.c.id).where(pboxes.c.cashbox == user.cashbox_id).limit(1)
+            )
+            if default_paybox is None and any(doc.paid_rubles and not doc.paybox for doc in docs):
+                raise HTTPException(404, "Paybox Not Found")
+
+        async with database.connection() as conn, conn.transaction():
+            article_id = await self._get_sales_article(conn, user.cashbox_id, now_ts) if need_payments else None
+            numbers = await self._allocate_numbers(conn, docs)
+            settings_ids = await self._insert_settings(conn, docs)
+
+            docs_rows = []
+            for doc, number, settings_id in zip(docs, numbers, settings_ids):
+                docs_rows.append({
+                    "number": number,
+                    "dated": doc.dated,
+                    "operation": doc.operation,
+                    "tags": doc.tags,
+                    "parent_docs_sales": doc.parent_docs_sales,
+                    "comment": doc.comment,
+                    "contragent": doc.contragent,
+                    "contract": doc.contract,
+                    "organization": doc.organization,
+                    "warehouse": doc.warehouse,
+                    "settings": settings_id,
+                    "status": doc.status,
+                    "tax_included": doc.tax_included,
+                    "tax_active": doc.tax_active,
+                    "sum": round(sum(g.price * g.quantity for g in doc.goods or []), 2),
+                    "created_by": user.id,
+                    "sales_manager": user.id if own_sales_manager else doc.sales_manager or user.id,
+                    "cashbox": user.cashbox_id,
+                    "is_deleted": False,
+                    "priority": doc.priority,
+                    "is_marketplace_order": doc.is_marketplace_order,
+                })
+            doc_ids = [
+                row.id for row in await self._insert_rows(conn, docs_sales, docs_rows, docs_sales.c.id)
+            ]
+
+            goods_rows, tags_rows, links_rows = [], [], []
+            payments_rows, payments_docs = [], []
+            lt_rows, lt_docs = [], []
+            for doc, doc_id, number in zip(docs, doc_ids, numbers):
+                tags = doc.tags or ""
+                tags_rows.extend(
+                    {"docs_sales_id": doc_id, "name": tag.strip()}
+                    for tag in tags.split(",") if tag.strip()
+                )
+                links_rows.extend(self._links_rows(doc_id, now))
+
+                paid_rubles = doc.paid_rubles or 0
+                paid_lt = doc.paid_lt or 0
+                card = cards.get(doc.loyality_card_id) if doc.loyality_card_id else None
+                share_rubles = paid_rubles / (paid_rubles + paid_lt) if paid_rubles + paid_lt else 0
+                cashback_sum = 0
+                for good in doc.goods or []:
+                    goods_rows.append({
+                        "docs_sales_id": doc_id,
+                        "nomenclature": int(good.nomenclature),
+                        "price_type": good.price_type,
+                        "price": good.price,
+                        "quantity": good.quantity,
+                        "unit": good.unit,
+                        "tax": good.tax,
+                        "discount": good.discount,
+                        "sum_discounted": good.sum_discounted,
+                        "status": good.status,
+                    })
+                    if card:
+                        cashback_sum += self._cashback(
+                            good, nomenclature_map.get(int(good.nomenclature)), card, share_rubles
+                        )
+
+                if paid_rubles > 0:
+                    payments_rows.append({
+                        "contragent": doc.contragent,
+                        "type": "incoming",
+                        "name": f"Оплата по документу {number}",
+                        "amount_without_tax": round(paid_rubles, 2),
+                        "tags": tags,
+                        "amount": round(paid_rubles, 2),
+                        "tax": 0,
+                        "tax_type": "internal",
+                        "article_id": article_id,
+                        "article": "Продажи",
+                        "paybox": doc.paybox or default_paybox,
+                        "date": now_ts,
+                        "account": user.user,
+                        "cashbox": user.cashbox_id,
+                        "is_deleted": False,
+                        "created_at": now_ts,
+                        "updated_at": now_ts,
+                        "status": doc.status,
+                        "stopped": True,
+                        "docs_sales_id": doc_id,
+                    })
+                    payments_docs.append(doc_id)
+
+                    cashback_sum = round(cashback_sum, 2)
+                    if card and cashback_sum > 0:
+                        lt_rows.append(self._lt_row(
+                            user, card, "accrual", f"Кешбек по документу {number}", cashback_sum, tags, now
+                        ))
+                        lt_docs.append(doc_id)
+
+                if card and paid_lt > 0:
+                    lt_rows.append(self._lt_row(
+                        user, card, "withdraw", f"Оплата по документу {number}", paid_lt, tags, now
+                    ))
+                    lt_docs.append(doc_id)
+
+            await self._insert_rows(conn, docs_sales_goods, goods_rows)
+            await self._insert_rows(conn, docs_sales_tags, tags_rows)
+            await self._insert_rows(conn, docs_sales_links, links_rows)
+
+            e2e_rows = []
+            payment_ids = [
+                row.id for row in await self._insert_rows(conn, payments, payments_rows, payments.c.id)
+            ]
+            for doc_id, payment_id in zip(payments_docs, payment_ids):
+                e2e_rows.append(self._e2e_row(user, 5, "docs_sales_payments", doc_id, payment_id))
+            lt_ids = [
+                row.id for row in await self._insert_rows(conn, loyality_transactions, lt_rows, loyality_transactions.c.id)
+            ]
+            for doc_id, lt_id in zip(lt_docs, lt_ids):
+                e2e_rows.append(self._e2e_row(user, 6, "docs_sales_loyality_transactions", doc_id, lt_id))
+            await self._insert_rows(conn, entity_to_entity, e2e_rows)
+
+            await self._insert_rows(
+                conn,
+                warehouse_balances,
+                await self._warehouse_balances_rows(conn, user, docs, doc_ids, nomenclature_map),
+            )
+
+        if payment_ids:
+            if yookassa_payments:
+                await self._create_yookassa_payments(
+                    user, token, docs, doc_ids, numbers, dict(zip(payments_docs, payment_ids))
+                )
+            await raschet(user, token)
+
+        if generate_out:
+            out_docs = self._warehouse_docs(docs, doc_ids, nomenclature_map)
+            if out_docs:
+                asyncio.create_task(self._create_warehouse_docs(token, user.cashbox_id, out_docs))
+
+        rows = await database.fetch_all(docs_sales.select().where(docs_sales.c.id.in_(doc_ids)))
+        result = [datetime_to_timestamp(row) for row in rows]
+
+        await manager.send_update(
+            token,
+            {
+                "action": "create",
+                "target": "docs_sales",
+                "result": result,
+            },
+        )
+        return result
+
+    @staticmethod
+    async def _insert_rows(conn, table: Table, rows: List[Dict[str, Any]], *returning) -> list:
+        """Многострочный INSERT, разбитый на части по лимиту параметров запроса."""
+        if not rows:
+            return []
+        width = max(len(row) for row in rows)
+        chunk = max(1, MAX_QUERY_PARAMS // width)
+        result = []
+        for start in range(0, len(rows), chunk):
+            query = table.insert().values(rows[start:start + chunk])
+            if returning:
+                result.extend(await conn.fetch_all(query.returning(*returning)))
+            else:
+                await conn.execute(query)
+        return result
+
+    async def _validate_foreign_keys(self, user, docs: List[schemas.Create]) -> Dict[int, Any]:
+        fks = defaultdict(set)
+        for doc in docs:
+            for key in ("contragent", "client"):
+                if getattr(doc, key) is not None:
+                    fks["contragents"].add(getattr(doc, key))
+            if doc.contract is not None:
+                fks["contracts"].add(doc.contract)
+            fks["organizations"].add(doc.organization)
+            if doc.warehouse is not None:
+                fks["warehouses"].add(doc.warehouse)
+            if doc.sales_manager is not None:
+                fks["users"].add(doc.sales_manager)
+            if doc.loyality_card_id is not None:
+                fks["loyality_cards"].add(doc.loyality_card_id)
+            for good in doc.goods or []:
+                fks["nomenclature"].add(int(good.nomenclature))
+                if good.price_type is not None:
+                    fks["price_types"].add(good.price_type)
+                if good.unit is not None:
+                    fks["units"].add(good.unit)
+
+        for entity in (
+            "contragents", "contracts", "organizations", "warehouses",
+            "users", "loyality_cards", "price_types", "units",
+        ):
+            self._raise_missing(entity, await reference_cache.missing(user.cashbox_id, entity, fks[entity]))
+
+        if not fks["nomenclature"]:
+            return {}
+        rows = await database.fetch_all(
+            select(
+                nomenclature.c.id,
+                nomenclature.c.type,
+                nomenclature.c.cashback_type,
+                nomenclature.c.cashback_value,
+            ).where(
+                nomenclature.c.id.in_(fks["nomenclature"]),
+                or_(nomenclature.c.cashbox == user.cashbox_id, nomenclature.c.cashbox.is_(None)),
+            )
+        )
+        nomenclature_map = {row.id: row for row in rows}
+        self._raise_missing("nomenclature", fks["nomenclature"] - set(nomenclature_map))
+        return nomenclature_map
+
+    @staticmethod
+    def _raise_missing(name: str, missing: Set[int]):
+        if missing:
+            raise HTTPException(
+                400,
+                detail=f"{name}.id: {', '.join(map(str, sorted(missing)))} не найден(ы)",
+            )
+
+    @staticmethod
+    async def _check_periods(docs: List[schemas.Create]):
+        conditions = [
+            and_(fifo_settings.c.organization_id == doc.organization, fifo_settings.c.blocked_date >= doc.dated)
+            for doc in docs if doc.dated
+        ]
+        if not conditions:
+            return
+        blocked = await database.fetch_all(select(fifo_settings.c.organization_id).where(or_(*conditions)))
+        if blocked:
+            organizations_ids = sorted({row.organization_id for row in blocked})
+            raise HTTPException(
+                400, f"Период закрыт для организаций: {', '.join(map(str, organizations_ids))}"
+            )
+
+    @staticmethod
+    async def _get_cards(docs: List[schemas.Create]) -> Dict[int, Any]:
+        cards_ids = {doc.loyality_card_id for doc in docs if doc.loyality_card_id}
+        if not cards_ids:
+            return {}
+        rows = await database.fetch_all(
+            select(
+                loyality_cards.c.id,
+                loyality_cards.c.card_number,
+                loyality_cards.c.balance,
+                loyality_cards.c.cashback_percent,
+            ).where(loyality_cards.c.id.in_(cards_ids))
+        )
+        return {row.id: row for row in rows}
+
+    @staticmethod
+    async def _get_sales_article(conn, cashbox_id: int, now_ts: int) -> int:
+        article_id = await conn.fetch_val(
+            select(articles.c.id)
+            .where(articles.c.cashbox == cashbox_id, articles.c.name == "Продажи")
+            .limit(1)
+        )
+        if article_id is None:
+            article_id = await conn.execute(
+                articles.insert().values(
+                    name="Продажи",
+                    emoji="🛍️",
+                    cashbox=cashbox_id,
+                    created_at=now_ts,
+                    updated_at=now_ts,
+                )
+            )
+        return article_id
+
+    @staticmethod
+    async def _allocate_numbers(conn, docs: List[schemas.Create]) -> List[str]:
+        """Номера документов без номера: по одному выделению на организацию пачки."""
+        counts: Dict[int, int] = defaultdict(int)
+        for doc in docs:
+            if not doc.number:
+                counts[doc.organization] += 1
+        # счётчики блокируются в порядке id организаций: параллельные пачки
+        # с одними и теми же организациями не захватят их крест-накрест
+        allocated = {
+            organization_id: iter(await doc_numbers.allocate(organization_id, DOCS_SALES, count, connection=conn))
+            for organization_id, count in sorted(counts.items())
+        }
+        return [doc.number or next(allocated[doc.organization]) for doc in docs]
+
+    async def _insert_settings(self, conn, docs: List[schemas.Create]) -> List[Optional[int]]:
+        payload = [doc.settings.dict() if doc.settings else None for doc in docs]
+        inserted = iter(
+            row.id for row in await self._insert_rows(
+                conn,
+                docs_sales_settings, [settings for settings in payload if settings], docs_sales_settings.c.id
+            )
+        )
+        return [next(inserted) if settings else None for settings in payload]
+
+    @staticmethod
+    def _links_rows(doc_id: int, now: datetime.datetime) -> List[Dict[str, Any]]:
+        from api.docs_sales.api.routers import generate_notification_hash
+
+        base_url = os.environ.get("APP_URL")
+        if not base_url:
+            return []
+        rows = []
+        for role in LINK_ROLES:
+            hash_value = generate_notification_hash(doc_id, role)
+            if role == "general":
+                url = f"{base_url}/orders/{doc_id}?hash={hash_value}"
+            else:
+                url = f"{base_url}/orders/{doc_id}/{role}?hash={hash_value}"
+            rows.append({
+                "docs_sales_id": doc_id,
+                "role": role,
+                "hash": hash_value,
+                "url": url,
+                "created_at": now,
+                "updated_at": now,
+            })
+        return rows
+
+    @staticmethod
+    def _cashback(good: schemas.Item, nomenclature_db, card, share_rubles: float) -> float:
+        card_percent = (card.cashback_percent or 0) / 100
+        if nomenclature_db is None:
+            return share_rubles * good.price * good.quantity * card_percent
+        if nomenclature_db.cashback_type == NomenclatureCashbackType.no_cashback:
+            return 0
+        if nomenclature_db.cashback_type == NomenclatureCashbackType.percent:
+            return share_rubles * good.price * good.quantity * (nomenclature_db.cashback_value / 100)
+        if nomenclature_db.cashback_type == NomenclatureCashbackType.const:
+            return good.quantity * nomenclature_db.cashback_value
+        return share_rubles * good.price * good.quantity * card_percent
+
+    @staticmethod
+    def _lt_row(user, card, type_: str, name: str, amount: float, tags: str, now: datetime.datetime) -> dict:
+        return {
+            "loyality_card_id": card.id,
+            "loyality_card_number": card.card_number,
+            "type": type_,
+            "name": name,
+            "amount": amount,
+            "created_by_id": user.id,
+            "tags": tags,
+            "card_balance": card.balance,
+            "dated": now,
+            "cashbox": user.cashbox_id,
+            "is_deleted": False,
+            "created_at": now,
+            "updated_at": now,
+            "status": True,
+        }
+
+    @staticmethod
+    def _e2e_row(user, to_entity: int, type_: str, doc_id: int, to_id: int) -> dict:
+        return {
+            "from_entity": 7,
+            "to_entity": to_entity,
+            "cashbox_id": user.cashbox_id,
+            "type": type_,
+            "from_id": doc_id,
+            "to_id": to_id,
+            "status": True,
+            "delinked": False,
+        }
+
+    @staticmethod
+    async def _warehouse_balances_rows(
+        conn,
+        user,
+        docs: List[schemas.Create],
+        doc_ids: List[int],
+        nomenclature_map: Dict[int, Any],
+    ) -> List[Dict[str, Any]]:
+        """Движения остатков по каждому товару: последний остаток читается одним запросом на пачку."""
+        outgoing: List[Tuple[schemas.Create, int, int, float]] = []
+        for doc, doc_id in zip(docs, doc_ids):
+            if doc.warehouse is None:
+                continue
+            for good in doc.goods or []:
+                nomenclature_db = nomenclature_map.get(int(good.nomenclature))
+                if nomenclature_db and nomenclature_db.type in ("product", "property"):
+                    outgoing.append((doc, doc_id, int(good.nomenclature), good.quantity))
+        if not outgoing:
+            return []
+
+        keys = {(doc.warehouse, nomenclature_id) for doc, _, nomenclature_id, _ in outgoing}
+        subq = (
+            select(
+                warehouse_balances.c.warehouse_id,
+                warehouse_balances.c.nomenclature_id,
+                warehouse_balances.c.current_amount,
+                func.row_number().over(
+                    partition_by=(warehouse_balances.c.warehouse_id, warehouse_balances.c.nomenclature_id),
+                    order_by=warehouse_balances.c.created_at.desc(),
+                ).label("rn"),
+            )
+            .where(
+                or_(*[
+                    and_(
+                        warehouse_balances.c.warehouse_id == warehouse_id,
+                        warehouse_balances.c.nomenclature_id == nomenclature_id,
+                    )
+                    for warehouse_id, nomenclature_id in keys
+                ])
+            )
+        ).subquery()
+        rows = await conn.fetch_all(select(subq).where(subq.c.rn == 1))
+        current = {(row.warehouse_id, row.nomenclature_id): row.current_amount for row in rows}
+
+        balances_rows = []
+        for doc, doc_id, nomenclature_id, quantity in outgoing:
+            key = (doc.warehouse, nomenclature_id)
+            current[key] = current.get(key, 0) - quantity
+            balances_rows.append({
+                "organization_id": doc.organization,
+                "warehouse_id": doc.warehouse,
+                "nomenclature_id": nomenclature_id,
+                "document_sale_id": doc_id,
+                "outgoing_amount": quantity,
+                "current_amount": current[key],
+                "cashbox_id": user.cashbox_id,
+            })
+        return balances_rows
+
+    @staticmethod
+    async def _create_yookassa_payments(
+        user,
+        token: str,
+        docs: List[schemas.Create],
+        doc_ids: List[int],
+        numbers: List[str],
+        payment_by_doc: Dict[int, int],
+    ):
+        yookassa_oauth_service = OauthService(
+            oauth_repository=YookassaOauthRepository(),
+            request_repository=YookassaRequestRepository(),
+            get_oauth_credential_function=GetOauthCredentialFunction(),
+        )
+        yookassa_api_service = YookassaApiService(
+            request_repository=YookassaRequestRepository(),
+            oauth_repository=YookassaOauthRepository(),
+            payments_repository=YookassaPaymentsRepository(),
+            crm_payments_repository=YookassaCrmPaymentsRepository(),
+            table_nomenclature_repository=YookassaTableNomenclature(),
+            amo_table_crm_repository=YookasssaAmoTableCrmRepository(),
+        )
+
+        # подключение ЮKassa проверяется один раз на склад, а не на каждый документ
+        oauth_by_warehouse: Dict[Optional[int], bool] = {}
+        for doc, doc_id, number in zip(docs, doc_ids, numbers):
+            payment_id = payment_by_doc.get(doc_id)
+            if payment_id is None:
+                continue
+            try:
+                if doc.warehouse not in oauth_by_warehouse:
+                    oauth_by_warehouse[doc.warehouse] = bool(
+                        await yookassa_oauth_service.validation_oauth(user.cashbox_id, doc.warehouse)
+                    )
+                if not oauth_by_warehouse[doc.warehouse]:
+                    continue
+                await yookassa_api_service.api_create_payment(
+                    user.cashbox_id,
+                    doc.warehouse,
+                    doc_id,
+                    payment_id,
+                    PaymentCreateModel(
+                        amount=AmountModel(value=str(round(doc.paid_rubles, 2)), currency="RUB"),
+                        description=f"Оплата по документу {number}",
+                        capture=True,
+                        receipt=ReceiptModel(
+                            customer=CustomerModel(),
+                            items=[
+                                ItemModel(
+                                    description=good.nomenclature_name or "",
+                                    amount=AmountModel(value=good.price, currency="RUB"),
+                                    quantity=good.quantity,
+                                    vat_code="1",
+                                )
+                                for good in doc.goods or []
+                            ],
+                        ),
+                        confirmation=ConfirmationRedirect(
+                            type="redirect",
+                            return_url=f"https://${os.getenv('APP_URL')}/?token=${token}",
+                        ),
+                    ),
+                )
+            except Exception as e:
+                logger.warning(f"Не удалось создать платёж ЮKassa для документа {doc_id}: {e}")
+
+    @staticmethod
+    def _warehouse_docs(
+        docs: List[schemas.Create],
+        doc_ids: List[int],
+        nomenclature_map: Dict[int, Any],
+    ) -> List[Dict[str, Any]]:
+        out_docs = []
+        for doc, doc_id in zip(docs, doc_ids):
+            if doc.warehouse is None:
+                continue
+            goods = [
+                {
+                    "price_type": 1,
+                    "price": 0,
+                    "quantity": good.quantity,
+                    "unit": good.unit,
+                    "nomenclature": int(good.nomenclature),
+                }
+                for good in doc.goods or []
+                if getattr(nomenclature_map.get(int(good.nomenclature)), "type", None) == "product"
+            ]
+            if not goods:
+                continue
+            out_docs.append({
+                "number": None,
+                "dated": doc.dated,
+                "docs_purchases": None,
+                "to_warehouse": None,
+                "status": True,
+                "contragent": doc.contragent,
+                "organization": doc.organization,
+                "operation": "outgoing",
+                "comment": doc.comment,
+                "warehouse": doc.warehouse,
+                "docs_sales_id": doc_id,
+                "goods": goods,
+            })
+        return out_docs
+
+    @staticmethod
+    async def _create_warehouse_docs(token: str, cashbox_id: int, out_docs: List[Dict[str, Any]]):
+        # по очереди, чтобы фоновая задача не занимала пул соединений
+        for body in out_docs:
+            try:
+                await create_warehouse_docs(token, body, cashbox_id)
+            except Exception as e:
+                logger.warning(
+                    f"Не удалось создать складской документ для продажи {body['docs_sales_id']}: {e}"
+                )
@@ -0,0 +1 @@
+from api.docs_sales.application.commands.BulkCreateDocsSalesCommand import BulkCreateDocsSalesCommand
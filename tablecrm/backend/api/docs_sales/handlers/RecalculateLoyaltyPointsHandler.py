@@ -3,7 +3,7 @@ from typing import Mapping, Any, Optional
 from aio_pika import IncomingMessage
 
 from api.docs_sales.messages.RecalculateLoyaltyPointsMessageModel import RecalculateLoyaltyPointsMessageModel
-from api.loyality_transactions.routers import raschet_bonuses
+from api.loyality_transactions.routers import recalculate_cards
 from common.amqp_messaging.common.core.EventHandler import IEventHandler
 
 
@@ -11,8 +11,5 @@ class RecalculateLoyaltyPointsHandler(IEventHandler[RecalculateLoyaltyPointsMess
 
     async def __call__(self, event: Mapping[str, Any], message: Optional[IncomingMessage] = None):
         recalculate_loyalty_points_message_model = RecalculateLoyaltyPointsMessageModel(**event)
-        
-        for loyalty_card_id in recalculate_loyalty_points_message_model.loyalty_card_ids:
-            await raschet_bonuses(
-                card_id=loyalty_card_id
-            )
\ No newline at end of file
+
+        await recalculate_cards(recalculate_loyalty_points_message_model.loyalty_card_ids)
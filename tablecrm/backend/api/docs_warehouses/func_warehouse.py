@@ -6,7 +6,6 @@ from database.db import (
     docs_warehouse,
     docs_warehouse_goods,
     OperationType,
-    users_cboxes_relation,
     organizations,
     contracts,
     docs_purchases,
@@ -16,6 +15,7 @@ from database.db import (
     nomenclature,
     pictures)
 from sqlalchemy.sql import select, func, case, and_
+from functions.doc_numbers import DOCS_WAREHOUSE, doc_numbers
 from functions.helpers import get_user_by_token
 from api.docs_warehouses.schemas import WarehouseOperations
 
@@ -58,11 +58,7 @@ async def check_relationship(entity):
 
 
 async def set_data_doc_warehouse(**kwargs):
-    await get_user_by_token(kwargs.get('token'))
-
-    users_cboxes = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == kwargs.get('token'))
-    )
+    users_cboxes = await get_user_by_token(kwargs.get('token'))
     # check = await check_relationship(kwargs.get('entity_values'))
 
     entity = kwargs.get('entity_values')
@@ -80,8 +76,11 @@ async def set_data_doc_warehouse(**kwargs):
 async def insert_docs_warehouse(entity):
     try:
         del entity["goods"]
-        query = docs_warehouse.insert().values(entity)
-        doc_id = await database.execute(query)
+        async with database.connection() as conn, conn.transaction():
+            if not entity.get("number"):
+                entity["number"] = await doc_numbers.next(entity["organization"], DOCS_WAREHOUSE, connection=conn)
+            query = docs_warehouse.insert().values(entity)
+            doc_id = await conn.execute(query)
     except Exception as err:
         raise Exception(f"error insert record in docs_warehouse: {str(err)}")
     return doc_id
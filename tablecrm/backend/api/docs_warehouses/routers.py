@@ -3,12 +3,9 @@ from database.db import (
     database,
     docs_warehouse,
     docs_warehouse_goods,
-    organizations,
     nomenclature,
-    price_types,
     warehouse_balances,
     warehouse_register_movement,
-    warehouses,
     units,
     OperationType,
     docs_warehouse_goods,
@@ -20,13 +17,13 @@ from fastapi.encoders import jsonable_encoder
 from fastapi_pagination import add_pagination, paginate
 from api.pagination.pagination import Page
 from functions.helpers import (
-    check_entity_exists ,
     check_period_blocked ,
-    check_unit_exists ,
     datetime_to_timestamp ,
     get_user_by_token , add_nomenclature_name_to_goods ,
 )
-from sqlalchemy import desc, asc, select, func
+from functions.doc_numbers import DOCS_WAREHOUSE, doc_numbers
+from functions.reference_cache import reference_cache
+from sqlalchemy import desc, select, func
 from ws_manager import manager
 
 from typing import List
@@ -36,13 +33,6 @@ from api.docs_warehouses.schemas import WarehouseOperations
 
 router = APIRouter(tags=["docs_warehouse"])
 
-contragents_cache = set()
-organizations_cache = set()
-contracts_cache = set()
-warehouses_cache = set()
-users_cache = set()
-price_types_cache = set()
-units_cache = set()
 
 Page = Page.with_custom_options(
     size=Query(10, ge=1, le=100),
@@ -130,20 +120,13 @@ async def get_list(token: str, warehouse_id: int = None, operation: str = '', sh
 
 
 async def check_foreign_keys(instance_values, user, exceptions) -> bool:
-    if instance_values.get("organization") is not None:
-        if instance_values["organization"] not in organizations_cache:
+    for key, entity in (
+        ("organization", "organizations"),
+        ("warehouse", "warehouses"),
+    ):
+        if instance_values.get(key) is not None:
             try:
-                await check_entity_exists(organizations, instance_values["organization"], user.id)
-                organizations_cache.add(instance_values["organization"])
-            except HTTPException as e:
-                exceptions.append(str(instance_values) + " " + e.detail)
-                return False
-
-    if instance_values.get("warehouse") is not None:
-        if instance_values["warehouse"] not in warehouses_cache:
-            try:
-                await check_entity_exists(warehouses, instance_values["warehouse"], user.id)
-                warehouses_cache.add(instance_values["warehouse"])
+                await reference_cache.ensure_exist(user.cashbox_id, entity, [instance_values[key]])
             except HTTPException as e:
                 exceptions.append(str(instance_values) + " " + e.detail)
                 return False
@@ -179,29 +162,32 @@ async def create(token: str, docs_warehouse_data: schemas.CreateMass):
             del instance_values["goods"]
         except KeyError:
             pass
-        query = docs_warehouse.insert().values(instance_values)
-        instance_id = await database.execute(query)
+        # номер и заголовок — в одной транзакции: в режиме без пропусков
+        # откат вставки возвращает номер
+        async with database.connection() as conn, conn.transaction():
+            if not instance_values.get("number"):
+                instance_values["number"] = await doc_numbers.next(
+                    instance_values["organization"], DOCS_WAREHOUSE, connection=conn
+                )
+            query = docs_warehouse.insert().values(instance_values)
+            instance_id = await conn.execute(query)
         inserted_ids.add(instance_id)
         items_sum = 0
         for item in goods:
             item["docs_warehouse_id"] = instance_id
 
             if item.get("price_type") is not None:
-                if item["price_type"] not in price_types_cache:
-                    try:
-                        await check_entity_exists(price_types, item["price_type"], user.id)
-                        price_types_cache.add(item["price_type"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             if item.get("unit") is not None:
-                if item["unit"] not in units_cache:
-                    try:
-                        await check_unit_exists(item["unit"])
-                        units_cache.add(item["unit"])
-                    except HTTPException as e:
-                        exceptions.append(str(item) + " " + e.detail)
-                        continue
+                try:
+                    await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                except HTTPException as e:
+                    exceptions.append(str(item) + " " + e.detail)
+                    continue
             else:
                 q = nomenclature.select().where(nomenclature.c.id == item['nomenclature'])
                 nom_db = await database.fetch_one(q)
@@ -315,21 +301,17 @@ async def update(token: str, docs_warehouse_data: schemas.EditMass):
                 item["docs_warehouse_id"] = instance_id
                 print(item)
                 if item.get("price_type") is not None:
-                    if item["price_type"] not in price_types_cache:
-                        try:
-                            await check_entity_exists(price_types, item["price_type"], user.id)
-                            price_types_cache.add(item["price_type"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "price_types", [item["price_type"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 if item.get("unit") is not None:
-                    if item["unit"] not in units_cache:
-                        try:
-                            await check_unit_exists(item["unit"])
-                            units_cache.add(item["unit"])
-                        except HTTPException as e:
-                            exceptions.append(str(item) + " " + e.detail)
-                            continue
+                    try:
+                        await reference_cache.ensure_exist(user.cashbox_id, "units", [item["unit"]])
+                    except HTTPException as e:
+                        exceptions.append(str(item) + " " + e.detail)
+                        continue
                 else:
                     q = nomenclature.select().where(nomenclature.c.id == item['nomenclature'])
                     nom_db = await database.fetch_one(q)
@@ -486,18 +468,6 @@ async def create(
     docs_warehouse_db = await database.fetch_all(query)
     docs_warehouse_db = [*map(datetime_to_timestamp, docs_warehouse_db)]
 
-    q = docs_warehouse.select().where(
-        docs_warehouse.c.cashbox == user.cashbox_id,
-        docs_warehouse.c.is_deleted == False
-    ).order_by(asc(docs_warehouse.c.id))
-
-    docs_db = await database.fetch_all(q)
-
-    for i in range(0, len(docs_db)):
-        if not docs_db[i].number:
-            q = docs_warehouse.update().where(docs_warehouse.c.id == docs_db[i].id).values({ "number": str(i + 1) })
-            await database.execute(q)
-
     if holding:
         await update(token, schemas.EditMass(__root__=[{"id": doc["id"], "status": True} for doc in docs_warehouse_db]))
         query = docs_warehouse.select().where(docs_warehouse.c.id.in_(response))
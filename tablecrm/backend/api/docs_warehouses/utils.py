@@ -17,8 +17,6 @@ from functions.helpers import (
     datetime_to_timestamp,
     get_user_by_token,
 )
-from sqlalchemy import asc
-
 from ws_manager import manager
 
 async def create_warehouse_docs(token: str, doc: list, cashbox_id: int):
@@ -29,18 +27,6 @@ async def create_warehouse_docs(token: str, doc: list, cashbox_id: int):
     docs_warehouse_db = await database.fetch_all(query)
     docs_warehouse_db = [*map(datetime_to_timestamp, docs_warehouse_db)]
 
-    q = docs_warehouse.select().where(
-            docs_warehouse.c.cashbox == cashbox_id,
-            docs_warehouse.c.is_deleted == False
-        ).order_by(asc(docs_warehouse.c.id))
-
-    docs_db = await database.fetch_all(q)
-
-    for i in range(0, len(docs_db)):
-        if not docs_db[i].number:
-            q = docs_warehouse.update().where(docs_warehouse.c.id == docs_db[i].id).values({ "number": str(i + 1) })
-            await database.execute(q)
-
     await manager.send_message(
         token,
         {
@@ -72,8 +72,9 @@ async def send_shift_time_updates():
             }
             
             # Отправляем обновление пользователю
+            # раз в минуту меняется только длительность: остальные поля уходят при изменении
             if shift.token:
-                await manager.send_message(shift.token, update_data)
+                await manager.send_update(shift.token, update_data, id_field="user_id", patch=True)
         
         print(f"Sent time updates for {len(active_shifts)} active shifts")
         
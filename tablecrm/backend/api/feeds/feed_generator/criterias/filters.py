@@ -1,9 +1,9 @@
 from collections import defaultdict
 
-from sqlalchemy import case, select, func, and_
+from sqlalchemy import select, and_
 
 from database.db import (
-    warehouse_register_movement, price_types, nomenclature, database, prices,
+    warehouse_balance_ledger, price_types, nomenclature, database, prices,
     categories, pictures, nomenclature_attributes_value, nomenclature_attributes
 )
 
@@ -14,13 +14,13 @@ class FeedCriteriaFilter:
         self.criteria_data = criteria_data
         self.cashbox_id = cashbox_id
 
-    def add_filters(self, query, q):
+    def add_filters(self, query):
         """Добавляем фильтры к запросу"""
         criteria = self.criteria_data
 
         if criteria.get("warehouse_id"):
             query = query.where(
-                warehouse_register_movement.c.warehouse_id.in_(criteria["warehouse_id"])
+                warehouse_balance_ledger.c.warehouse_id.in_(criteria["warehouse_id"])
             )
 
         if criteria.get("category_id"):
@@ -35,7 +35,7 @@ class FeedCriteriaFilter:
                 query = query.where(prices.c.price <= criteria["prices"]["to"])
 
         if criteria.get("only_on_stock"):
-            query = query.having(func.sum(q) > 0)
+            query = query.where(warehouse_balance_ledger.c.current_amount > 0)
 
         return query
 
@@ -52,13 +52,7 @@ class FeedCriteriaFilter:
         if not price_type_id:
             return None
 
-        # считаем остаток (учёт минус/плюс)
-        q = case(
-            (warehouse_register_movement.c.type_amount == "minus", warehouse_register_movement.c.amount * -1),
-            else_=warehouse_register_movement.c.amount,
-        )
-
-        # базовый запрос
+        # остатки берём из леджера, который поддерживается триггером на warehouse_register_movement
         query = (
             select(
                 nomenclature.c.id.label("id"),
@@ -66,12 +60,15 @@ class FeedCriteriaFilter:
                 categories.c.name.label("category"),
                 nomenclature.c.description_short.label("description"),
                 prices.c.price.label("price"),
-                warehouse_register_movement.c.warehouse_id.label("warehouse_id"),
-                func.sum(q).label("current_amount"),
+                warehouse_balance_ledger.c.organization_id.label("organization_id"),
+                warehouse_balance_ledger.c.warehouse_id.label("warehouse_id"),
+                warehouse_balance_ledger.c.current_amount.label("current_amount"),
             )
+            .distinct()
+            .select_from(warehouse_balance_ledger)
             .join(
                 nomenclature,
-                warehouse_register_movement.c.nomenclature_id == nomenclature.c.id,
+                warehouse_balance_ledger.c.nomenclature_id == nomenclature.c.id,
             )
             .join(
                 prices,
@@ -84,18 +81,11 @@ class FeedCriteriaFilter:
                 categories,
                 categories.c.id == nomenclature.c.category,
             )
-            .where(warehouse_register_movement.c.cashbox_id == self.cashbox_id)
-            .group_by(
-                nomenclature.c.id,
-                warehouse_register_movement.c.organization_id,
-                warehouse_register_movement.c.warehouse_id,
-                categories.c.name,
-                prices.c.price
-            )
+            .where(warehouse_balance_ledger.c.cashbox_id == self.cashbox_id)
         )
 
         # применяем фильтры
-        query = self.add_filters(query, q)
+        query = self.add_filters(query)
 
         # выполняем запрос
         rows = await database.fetch_all(query)
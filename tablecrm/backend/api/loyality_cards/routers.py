@@ -11,8 +11,7 @@ from sqlalchemy import func, select
 from sqlalchemy import or_
 
 import api.loyality_cards.schemas as schemas
-from api.apple_wallet.utils import update_apple_wallet_pass
-from common.apple_wallet_service.impl.WalletPassService import WalletPassGeneratorService
+from api.apple_wallet.utils import update_apple_wallet_pass, update_apple_wallet_passes
 from database.db import (
     database,
     loyality_cards,
@@ -34,6 +33,7 @@ from functions.helpers import (
     build_filters,
 )
 from functions.helpers import get_user_by_token
+from functions.reference_cache import reference_cache
 from ws_manager import manager
 
 router = APIRouter(tags=["loyality_cards"])
@@ -485,13 +485,7 @@ async def new_loyality_card(
         },
     )
 
-    apple_wallet_service = WalletPassGeneratorService()
-
-    for card in loyality_cards_db:
-        try:
-            await apple_wallet_service.update_pass(card['id'])
-        except Exception as e:
-            print(e)
+    await update_apple_wallet_passes([card['id'] for card in loyality_cards_db])
 
     return loyality_cards_db
 
@@ -534,6 +528,7 @@ async def edit_loyality_transaction(
             .values(loyality_card_values)
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "loyality_cards", [idx])
         loyality_card_db = await get_entity_by_id_and_created_by(
             loyality_cards, idx, user.id
         )
@@ -563,6 +558,7 @@ async def delete_loyality_transaction(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "loyality_cards", [idx])
 
     query = loyality_cards.select().where(
         loyality_cards.c.id == idx, loyality_cards.c.created_by_id == user.id
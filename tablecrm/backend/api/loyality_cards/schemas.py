@@ -91,8 +91,8 @@ class LoyalityCardGet(BaseModel):
     card_number: int
     tags: Optional[str]
     balance: float
-    income: int
-    outcome: int
+    income: float
+    outcome: float
     contragent_id: int
     organization_id: int
     contragent: str
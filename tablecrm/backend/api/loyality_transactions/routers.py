@@ -1,84 +1,85 @@
 from fastapi import APIRouter, Depends, HTTPException
-from database.db import database, loyality_transactions, loyality_cards, async_session_maker
+from database.db import database, loyality_transactions, loyality_cards
 import api.loyality_transactions.schemas as schemas
-from sqlalchemy import desc, func, select, case, update
+from sqlalchemy import desc, func, select, case, update, and_, or_
 from functions.helpers import datetime_to_timestamp, get_filters_transactions, \
     get_entity_by_id_cashbox, clear_phone_number, get_entity_by_id_and_created_by
 from ws_manager import manager
 from functions.helpers import get_user_by_token
 from datetime import datetime
-import asyncio
 
 router = APIRouter(tags=["loyality_transactions"])
 
-# Асинхронная функция подсчёта баланса бонусов по ID карты
-async def raschet_bonuses(card_id: int) -> None:
-    # Открываем асинхронную сессию SQLAlchemy
-    async with async_session_maker() as session:
-        # -----------------------------------------------
-        # Шаг 1. Формируем подзапрос для доходов (accrual)
-        # select SUM(amount) where type='accrual'
-        a_q = func.coalesce(
-            func.sum(
-                case((loyality_transactions.c.type == "accrual", loyality_transactions.c.amount))
-            ),
-            0
-        ).label("income")
-
-        # -----------------------------------------------
-        # Шаг 2. Формируем подзапрос для расходов (withdraw)
-        # select SUM(amount) where type='withdraw'
-        w_q = func.coalesce(
-            func.sum(
-                case((loyality_transactions.c.type == "withdraw", loyality_transactions.c.amount))
-            ),
-            0
-        ).label("outcome")
-
-        # -----------------------------------------------
-        # Шаг 3. Основной запрос для вычисления баланса
-        # CASE WHEN income > outcome THEN income - outcome ELSE 0 END
-        balance_q = case(
-            (a_q > w_q, a_q - w_q),
-            else_=0
-        ).label("balance")
-
-        # -----------------------------------------------
-        # Шаг 4. Объединяем всё в SELECT и фильтруем по условиям
-        query = (
-            select(a_q, w_q, balance_q)
-            .where(
-                loyality_transactions.c.loyality_card_id == card_id,
-                loyality_transactions.c.status.is_(True),
-                loyality_transactions.c.is_deleted.is_(False)
-            )
+async def recalculate_cards(card_ids) -> int:
+    """
+    Сверка income/outcome/balance карт с транзакциями.
+
+    В обычной работе счётчики карты ведёт триггер на loyality_transactions,
+    здесь — полный пересчёт пачками по 10000 id одним UPDATE ... FROM.
+    Перезаписываются только разошедшиеся карты, возвращается их количество.
+
+    Карты пачки сначала блокируются отдельным запросом: иначе UPDATE считал бы
+    суммы по снимку до транзакции, которую ждёт на блокировке строки, и
+    затирал бы изменение, внесённое триггером.
+    """
+    card_ids = sorted(set(card_ids))
+    fixed = 0
+    for i in range(0, len(card_ids), 10000):
+        chunk = card_ids[i:i + 10000]
+        income = func.coalesce(
+            func.sum(case((loyality_transactions.c.type == "accrual", loyality_transactions.c.amount))), 0
         )
-
-        # Выполняем запрос и получаем объект результата
-        result = await session.execute(query)
-        res = result.first()
-        if not res:
-            # Если нет транзакций — выходим
-            return
-
-        # Преобразуем результат в словарь
-        edit_dict = dict(res._mapping)
-
-        # -----------------------------------------------
-        # Шаг 5. Обновляем таблицу loyality_cards на основании расчёта
-        update_stmt = (
-            update(loyality_cards)
-            .where(loyality_cards.c.id == card_id)
-            .values(
-                income=edit_dict["income"],
-                outcome=edit_dict["outcome"],
-                balance=edit_dict["balance"]
+        outcome = func.coalesce(
+            func.sum(case((loyality_transactions.c.type == "withdraw", loyality_transactions.c.amount))), 0
+        )
+        # карты без действующих транзакций тоже попадают в выборку и обнуляются
+        totals = (
+            select(
+                loyality_cards.c.id.label("card_id"),
+                income.label("income"),
+                outcome.label("outcome"),
             )
+            .select_from(
+                loyality_cards.outerjoin(
+                    loyality_transactions,
+                    and_(
+                        loyality_transactions.c.loyality_card_id == loyality_cards.c.id,
+                        loyality_transactions.c.status.is_(True),
+                        loyality_transactions.c.is_deleted.is_(False),
+                    )
+                )
+            )
+            .where(loyality_cards.c.id.in_(chunk))
+            .group_by(loyality_cards.c.id)
+            .subquery("totals")
         )
-
-        # Выполняем UPDATE и фиксируем изменения
-        await session.execute(update_stmt)
-        await session.commit()
+        async with database.connection() as conn, conn.transaction():
+            await conn.fetch_all(
+                select(loyality_cards.c.id)
+                .where(loyality_cards.c.id.in_(chunk))
+                .order_by(loyality_cards.c.id)
+                .with_for_update()
+            )
+            rows = await conn.fetch_all(
+                update(loyality_cards)
+                .where(
+                    loyality_cards.c.id == totals.c.card_id,
+                    or_(
+                        loyality_cards.c.income.is_(None),
+                        loyality_cards.c.outcome.is_(None),
+                        func.abs(loyality_cards.c.income - totals.c.income) > 0.001,
+                        func.abs(loyality_cards.c.outcome - totals.c.outcome) > 0.001,
+                    )
+                )
+                .values(
+                    income=totals.c.income,
+                    outcome=totals.c.outcome,
+                    balance=case((totals.c.income > totals.c.outcome, totals.c.income - totals.c.outcome), else_=0),
+                )
+                .returning(loyality_cards.c.id)
+            )
+        fixed += len(rows)
+    return fixed
 
 
 @router.get("/loyality_transactions/{idx}/", response_model=schemas.LoyalityTransaction)
@@ -164,15 +165,6 @@ async def edit_loyality_transaction(
         {"action": "edit", "target": "loyality_transactions", "result": loyality_transaction_db},
     )
 
-    card_idx = (
-        select(loyality_transactions.c.loyality_card_id)
-        .where(loyality_transactions.c.id == idx)
-        .limit(1)
-    )
-    card_idx = await database.fetch_val(card_idx, column=0)
-
-    await asyncio.gather(asyncio.create_task(raschet_bonuses(card_idx)))
-
     return {**loyality_transaction_db, **{"data": {"status": "success"}}}
 
 
@@ -195,12 +187,8 @@ async def delete_loyality_transaction(token: str, idx: int):
     )
     loyality_transaction_db = await database.fetch_one(query)
 
-    loyality_card_id = loyality_transaction_db.loyality_card_id
-
     loyality_transaction_db = datetime_to_timestamp(loyality_transaction_db)
 
-
-
     await manager.send_message(
         token,
         {
@@ -210,6 +198,4 @@ async def delete_loyality_transaction(token: str, idx: int):
         },
     )
 
-    await asyncio.gather(asyncio.create_task(raschet_bonuses(loyality_card_id)))
-
     return {**loyality_transaction_db, **{"data": {"status": "success"}}}
@@ -1,4 +1,3 @@
-import asyncio
 from datetime import datetime
 from typing import List, Union
 
@@ -6,7 +5,6 @@ from fastapi import HTTPException
 from sqlalchemy import select, and_
 
 from api.loyality_transactions import schemas
-from api.loyality_transactions.routers import raschet_bonuses
 from database.db import database, loyality_cards, loyality_transactions
 from functions.helpers import get_user_by_token, clear_phone_number, datetime_to_timestamp
 from ws_manager import manager
@@ -57,8 +55,6 @@ class CreateLoyalityTransactionsView:
             raise HTTPException(400, "; ".join(errors))
 
         insert_values = []
-        balance_delta = {}
-
         for p in prepared:
             payload = p["raw"].dict()
             card = cards_map[p["number"]]
@@ -85,29 +81,15 @@ class CreateLoyalityTransactionsView:
 
             insert_values.append(payload)
 
-            amt = float(payload["amount"])
-            delta = amt if payload["type"] == "accrual" else -amt
-            balance_delta[card.id] = balance_delta.get(card.id, 0.0) + delta
-
         query = (
             loyality_transactions.insert()
             .values(insert_values)
             .returning(loyality_transactions.c.id)
         )
 
+        # income/outcome/balance карт обновляет триггер на loyality_transactions
         ids = await database.fetch_all(query=query)
 
-        if balance_delta:
-            update_query = """
-                    UPDATE loyality_cards
-                    SET balance = balance + :delta
-                    WHERE id = :id
-                """
-            await database.execute_many(
-                query=update_query,
-                values=[{"id": cid, "delta": round(d, 2)} for cid, d in balance_delta.items()],
-            )
-
         lt_rows = await database.fetch_all(
             select(loyality_transactions).where(loyality_transactions.c.id.in_([k.id for k in ids]))
         )
@@ -117,8 +99,6 @@ class CreateLoyalityTransactionsView:
             await manager.send_message(
                 token, {"action": "create", "target": "loyality_transactions", "result": row}
             )
-        for card_id in balance_delta:
-            asyncio.create_task(raschet_bonuses(card_id))
 
         def with_success(payload: dict) -> dict:
             return {**payload, "data": {"status": "success"}}
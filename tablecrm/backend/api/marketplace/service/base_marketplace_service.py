@@ -2,7 +2,7 @@ import math
 from typing import Optional
 
 from fastapi import HTTPException
-from sqlalchemy import select
+from sqlalchemy import select, func, and_
 
 from api.marketplace.schemas import BaseMarketplaceUtm
 from common.amqp_messaging.common.core.IRabbitMessaging import IRabbitMessaging
@@ -66,5 +66,35 @@ class BaseMarketplaceService:
         distance = R * c
         return distance  # в километрах
 
+    @staticmethod
+    def _distance_to_client_expression(client_lat: float, client_long: float, warehouse_lat, warehouse_long):
+        """SQL-версия _count_distance_to_client (гаверсинус, км), чтобы сортировать до LIMIT/OFFSET"""
+        R = 6371.0
+
+        dlat = func.radians(warehouse_lat - client_lat)
+        dlon = func.radians(warehouse_long - client_long)
+        a = (
+            func.power(func.sin(dlat / 2), 2)
+            + func.cos(func.radians(client_lat)) * func.cos(func.radians(warehouse_lat))
+            * func.power(func.sin(dlon / 2), 2)
+        )
+        return 2 * R * func.asin(func.sqrt(func.least(a, 1.0)))
+
+    @classmethod
+    def _within_radius_condition(cls, client_lat: float, client_long: float, radius_km: float, warehouse_lat, warehouse_long):
+        """
+        Фильтр складов в радиусе от клиента.
+        earth_box отбирает кандидатов по GiST-индексу ix_warehouses_public_ll_to_earth,
+        точная проверка — тем же гаверсинусом, что и сортировка.
+        """
+        # Радиус модели earthdistance чуть больше 6371 км, запас в 1% покрывает расхождение
+        box = func.earth_box(func.ll_to_earth(client_lat, client_long), radius_km * 1000 * 1.01)
+        return and_(
+            warehouse_lat.is_not(None),
+            warehouse_long.is_not(None),
+            box.op("@>")(func.ll_to_earth(warehouse_lat, warehouse_long)),
+            cls._distance_to_client_expression(client_lat, client_long, warehouse_lat, warehouse_long) <= radius_km,
+        )
+
     # @staticmethod
     # async def _hash_order(contragent_id: ):
\ No newline at end of file
@@ -101,6 +101,7 @@ class MarketplaceProductsRequest(BaseModel):
     phone: Optional[str] = None
     lat: Optional[float] = None
     lon: Optional[float] = None
+    radius_km: Optional[float] = Field(default=None, gt=0)
     page: int = 1
     size: int = Field(default=20, le=100)
     sort_by: Optional[MarketplaceSort] = None
@@ -1,6 +1,5 @@
 import json
 import os
-from datetime import datetime
 from typing import Optional, List
 from fastapi import HTTPException
 
@@ -10,9 +9,10 @@ from sqlalchemy.dialects.postgresql import JSONB
 from api.marketplace.service.base_marketplace_service import BaseMarketplaceService
 from api.marketplace.service.products_list_service.schemas import MarketplaceProduct, MarketplaceProductDetail, \
     MarketplaceProductAttribute, MarketplaceProductList, AvailableWarehouse, MarketplaceProductsRequest, MarketplaceSort
-from database.db import nomenclature, prices, price_types, database, warehouses, warehouse_balances, units, categories, \
-    manufacturers, cboxes, marketplace_rating_aggregates, pictures, nomenclature_barcodes, users, docs_sales_goods, \
-    docs_sales, nomenclature_attributes, nomenclature_attributes_value, nomenclature_groups_value, nomenclature_groups
+from database.db import nomenclature, price_types, database, warehouses, units, categories, \
+    manufacturers, cboxes, marketplace_rating_aggregates, pictures, nomenclature_barcodes, users, \
+    nomenclature_attributes, nomenclature_attributes_value, nomenclature_groups_value, nomenclature_groups, \
+    nomenclature_active_prices, warehouse_balances_latest, nomenclature_marketplace_stats
 
 
 class MarketplaceProductsListService(BaseMarketplaceService):
@@ -28,46 +28,9 @@ class MarketplaceProductsListService(BaseMarketplaceService):
 
     async def get_product(self, product_id: int) -> MarketplaceProductDetail:
 
-        current_timestamp = int(datetime.now().timestamp())
-
-        ranked_prices_subquery = (
-            select(
-                prices.c.nomenclature.label('nomenclature_id'),
-                prices.c.id.label('price_id'),
-                prices.c.price,
-                prices.c.price_type,
-                prices.c.created_at,
-                prices.c.date_from,
-                prices.c.date_to,
-                prices.c.is_deleted,
-                func.row_number().over(
-                    partition_by=prices.c.nomenclature,
-                    order_by=[
-                        desc(func.coalesce(prices.c.date_from <= current_timestamp, True)
-                             & func.coalesce(current_timestamp < prices.c.date_to, True)),
-                        desc(prices.c.created_at),
-                        desc(prices.c.id)
-                    ]
-                ).label('rn')
-            )
-            .where(prices.c.is_deleted.is_not(True))
-            .subquery()
-        )
-
-        active_prices_subquery = (
-            select(ranked_prices_subquery)
-            .where(ranked_prices_subquery.c.rn == 1)
-            .subquery()
-        )
-
-        total_sold_subquery = (
-            select(
-                docs_sales_goods.c.nomenclature,
-                func.count(docs_sales_goods.c.id).label("total_sold")
-            )
-            .group_by(docs_sales_goods.c.nomenclature)
-            .subquery()
-        )
+        # Актуальная цена и счётчик продаж поддерживаются триггерами (см. nomenclature_active_prices)
+        active_prices_subquery = nomenclature_active_prices
+        stats = nomenclature_marketplace_stats
 
         # Основной запрос для получения базовой информации о товаре
         query = (
@@ -115,7 +78,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 func.array_agg(func.distinct(nomenclature_barcodes.c.code))
                 .filter(nomenclature_barcodes.c.code.is_not(None)).label("barcodes"),
 
-                func.coalesce(total_sold_subquery.c.total_sold, 0).label("total_sold"),
+                func.coalesce(stats.c.total_sold, 0).label("total_sold"),
             )
             .select_from(nomenclature)
             .join(units, units.c.id == nomenclature.c.unit, isouter=True)
@@ -139,7 +102,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 ),
                 isouter=True
             )
-            .join(total_sold_subquery, total_sold_subquery.c.nomenclature == nomenclature.c.id, isouter=True)
+            .join(stats, stats.c.nomenclature_id == nomenclature.c.id, isouter=True)
             .where(
                 and_(
                     nomenclature.c.id == product_id,
@@ -161,7 +124,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 cboxes.c.seller_description,
                 marketplace_rating_aggregates.c.avg_rating,
                 marketplace_rating_aggregates.c.reviews_count,
-                total_sold_subquery.c.total_sold
+                stats.c.total_sold
             )
         )
 
@@ -179,18 +142,18 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 warehouses.c.address.label("warehouse_address"),
                 warehouses.c.latitude,
                 warehouses.c.longitude,
-                warehouse_balances.c.current_amount,
-                warehouse_balances.c.organization_id
+                warehouse_balances_latest.c.current_amount,
+                warehouse_balances_latest.c.organization_id
             )
-            .select_from(warehouse_balances)
+            .select_from(warehouse_balances_latest)
             .join(warehouses, and_(
-                warehouses.c.id == warehouse_balances.c.warehouse_id,
+                warehouses.c.id == warehouse_balances_latest.c.warehouse_id,
                 # warehouses.c.status.is_(True),
                 warehouses.c.is_deleted.is_not(True)
             ))
             .where(and_(
-                warehouse_balances.c.nomenclature_id == product_id,
-                warehouse_balances.c.current_amount > 0  # Только склады с остатками
+                warehouse_balances_latest.c.nomenclature_id == product_id,
+                warehouse_balances_latest.c.current_amount > 0  # Только склады с остатками
             ))
         )
 
@@ -328,117 +291,12 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             self,
             request: MarketplaceProductsRequest,
     ) -> MarketplaceProductList:
-        # --- НАЧАЛО: Подзапрос для выбора актуальной цены ---
-        # Получаем текущий timestamp (в PostgreSQL это NOW())
-        current_timestamp = int(datetime.now().timestamp())
-
-        # Подзапрос для получения актуальной цены
-        # Используем ROW_NUMBER для ранжирования цен по приоритету
-        ranked_prices_subquery = (
-            select(
-                prices.c.nomenclature.label('nomenclature_id'),
-                prices.c.id.label('price_id'),
-                prices.c.price,
-                prices.c.price_type,
-                prices.c.created_at,
-                prices.c.date_from,
-                prices.c.date_to,
-                prices.c.is_deleted,
-                # Ранжируем: 1. по времени (текущее в интервале), 2. по дате создания (новые первые), 3. по id (стабильность)
-                func.row_number().over(
-                    partition_by=prices.c.nomenclature,
-                    order_by=[
-                        # Если дата не указана (None), считаем, что она подходит (предполагаем, что None означает "без ограничений")
-                        # Сначала идут записи с датами, которые соответствуют условию
-                        # func.coalesce(prices.c.date_from <= current_timestamp, True) & func.coalesce(current_timestamp < prices.c.date_to, True), # Не подходит напрямую для ORDER BY
-                        # Правильный способ - использовать CASE/WHEN для приоритета
-                        # Приоритет 1: цена с указанными датами и попадающая в интервал
-                        # Приоритет 2: цена с указанными датами, но НЕ попадающая в интервал (меньше приоритет)
-                        # Приоритет 3: цена с хотя бы одной датой None (предполагаем, что это "постоянно действительна", но может быть иначе)
-                        # Пример: сначала (1, ...), потом (0, 1, ...), потом (0, 0, ...)
-                        # (CASE WHEN (prices.c.date_from IS NOT NULL AND prices.c.date_to IS NOT NULL AND prices.c.date_from <= current_timestamp AND current_timestamp < prices.c.date_to) THEN 1 ELSE 0 END),
-                        # desc(CASE WHEN (prices.c.date_from IS NOT NULL AND prices.c.date_to IS NOT NULL AND prices.c.date_from <= current_timestamp AND current_timestamp < prices.c.date_to) THEN 1 ELSE 0 END),
-                        # desc((prices.c.date_from <= current_timestamp) & (current_timestamp < prices.c.date_to)),
-                        # Сортировка: сначала те, у кого даты указаны и они подходят, потом без дат (или частично), потом по created_at DESC
-                        # Чтобы сначала шли подходящие по времени:
-                        desc(func.coalesce(prices.c.date_from <= current_timestamp, True) & func.coalesce(current_timestamp < prices.c.date_to, True)),
-                        # Потом по дате создания (новые первые)
-                        desc(prices.c.created_at),
-                        # Потом по ID (стабильность)
-                        desc(prices.c.id)
-                    ]
-                ).label('rn')
-            )
-            .where(
-                # Учитываем только неудаленные цены
-                prices.c.is_deleted.is_not(True)
-            )
-            .subquery()
-        )
-
-        total_sold_subquery = (
-            select(
-                docs_sales_goods.c.nomenclature,
-                func.count(docs_sales_goods.c.id).label("total_sold")
-            )
-            .select_from(docs_sales_goods)
-            .group_by(docs_sales_goods.c.nomenclature)
-            .subquery()
-        )
-
-        # Фильтруем подзапрос, чтобы оставить только первую (самую приоритетную) цену для каждой номенклатуры
-        # Это будет "актуальная" цена
-        active_prices_subquery = select(ranked_prices_subquery).where(ranked_prices_subquery.c.rn == 1).subquery()
-
-        # --- КОНЕЦ: Подзапрос для выбора актуальной цены ---
-
-        # --- Балансы по складам ---
-
-        # 1) Берём последнюю запись по каждой паре (организация, склад, номенклатура)
-        wb_ranked = (
-            select(
-                warehouse_balances.c.organization_id.label("organization_id"),
-                warehouse_balances.c.warehouse_id.label("warehouse_id"),
-                warehouse_balances.c.nomenclature_id.label("nomenclature_id"),
-                warehouse_balances.c.current_amount.label("current_amount"),
-                func.row_number().over(
-                    partition_by=[
-                        warehouse_balances.c.organization_id,
-                        warehouse_balances.c.warehouse_id,
-                        warehouse_balances.c.nomenclature_id,
-                    ],
-                    order_by=[
-                        desc(warehouse_balances.c.created_at),
-                        desc(warehouse_balances.c.id),
-                    ],
-                ).label("rn"),
-            )
-            .subquery()
-        )
-
-        wb_latest = (
-            select(
-                wb_ranked.c.organization_id,
-                wb_ranked.c.warehouse_id,
-                wb_ranked.c.nomenclature_id,
-                wb_ranked.c.current_amount,
-            )
-            .where(wb_ranked.c.rn == 1)
-            .subquery()
-        )
-
-        # 2) Подсчёт суммарного остатка по товару (только положительные остатки)
-        stock_subquery = (
-            select(
-                wb_latest.c.nomenclature_id.label("nomenclature_id"),
-                func.sum(
-                    func.greatest(wb_latest.c.current_amount, 0)
-                ).label("current_amount"),
-            )
-            .select_from(wb_latest)
-            .group_by(wb_latest.c.nomenclature_id)
-            .subquery()
-        )
+        # Актуальная цена, последние остатки по складам, суммарный остаток и счётчик продаж
+        # читаются из проекций, которые поддерживаются триггерами на prices,
+        # warehouse_balances и docs_sales_goods, поэтому здесь нет оконных функций и GROUP BY по всей базе.
+        active_prices_subquery = nomenclature_active_prices
+        wb_latest = warehouse_balances_latest
+        stats = nomenclature_marketplace_stats
 
         # 3) Агрегация доступных складов (для available_warehouses)
         wh_bal = warehouses.alias("wh_bal")
@@ -464,6 +322,26 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             .label("available_warehouses")
         )
 
+        # Расстояние до ближайшего склада с остатком считаем в SQL,
+        # чтобы сортировка и фильтр по радиусу выполнялись до LIMIT/OFFSET
+        has_client_location = request.lat is not None and request.lon is not None
+        distance_column = None
+        if has_client_location:
+            distance_column = (
+                func.min(
+                    self._distance_to_client_expression(
+                        request.lat, request.lon, wh_bal.c.latitude, wh_bal.c.longitude
+                    )
+                )
+                .filter(
+                    and_(
+                        wh_bal.c.id.is_not(None),
+                        wb_latest.c.current_amount > 0,
+                    )
+                )
+                .label("distance")
+            )
+
         # --- Основной запрос по товарам ---
         query = (
             select(
@@ -501,8 +379,8 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                     func.distinct(nomenclature_barcodes.c.code)
                 ).filter(nomenclature_barcodes.c.code.is_not(None)).label("barcodes"),
                 # суммарный остаток по всем складам (минимум 0)
-                func.coalesce(stock_subquery.c.current_amount, 0).label("current_amount"),
-                func.coalesce(total_sold_subquery.c.total_sold, 0).label("total_sold"),
+                func.coalesce(stats.c.current_amount, 0).label("current_amount"),
+                func.coalesce(stats.c.total_sold, 0).label("total_sold"),
                 available_warehouses_agg,
             )
             .select_from(nomenclature)
@@ -542,8 +420,8 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 isouter=True,
             )
             .join(
-                stock_subquery,
-                stock_subquery.c.nomenclature_id == nomenclature.c.id,
+                stats,
+                stats.c.nomenclature_id == nomenclature.c.id,
                 isouter=True,
             )
             .join(
@@ -561,11 +439,6 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 ),
                 isouter=True,
             )
-            .join(
-                total_sold_subquery,
-                total_sold_subquery.c.nomenclature == nomenclature.c.id,
-                isouter=True,
-            )
         )
 
         # --- Условия фильтрации ---
@@ -584,13 +457,34 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             conditions.append(active_prices_subquery.c.price <= request.max_price)
         if request.in_stock:
             # фильтруем по суммарному остатку
-            conditions.append(stock_subquery.c.current_amount > 0)
+            conditions.append(stats.c.current_amount > 0)
         if request.rating_from:
             conditions.append(marketplace_rating_aggregates.c.avg_rating >= request.rating_from)
         if request.rating_to:
             conditions.append(marketplace_rating_aggregates.c.avg_rating <= request.rating_to)
+        if has_client_location and request.radius_km:
+            radius_wh = warehouses.alias("radius_wh")
+            conditions.append(
+                select(wb_latest.c.nomenclature_id)
+                .select_from(wb_latest)
+                .join(radius_wh, radius_wh.c.id == wb_latest.c.warehouse_id)
+                .where(
+                    wb_latest.c.nomenclature_id == nomenclature.c.id,
+                    wb_latest.c.current_amount > 0,
+                    radius_wh.c.is_public.is_(True),
+                    radius_wh.c.status.is_(True),
+                    radius_wh.c.is_deleted.is_not(True),
+                    self._within_radius_condition(
+                        request.lat, request.lon, request.radius_km,
+                        radius_wh.c.latitude, radius_wh.c.longitude,
+                    ),
+                )
+                .exists()
+            )
 
         query = query.where(and_(*conditions))
+        if distance_column is not None:
+            query = query.add_columns(distance_column)
 
         # --- GROUP BY — только по неизменяемым полям, без current_amount из balances ---
         group_by_fields = [
@@ -607,8 +501,8 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             cboxes.c.seller_description,
             marketplace_rating_aggregates.c.avg_rating,
             marketplace_rating_aggregates.c.reviews_count,
-            stock_subquery.c.current_amount,
-            total_sold_subquery.c.total_sold,
+            stats.c.current_amount,
+            stats.c.total_sold,
         ]
         query = query.group_by(*group_by_fields)
 
@@ -622,14 +516,19 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         elif request.sort_by == MarketplaceSort.rating:
             query = query.order_by(order(marketplace_rating_aggregates.c.avg_rating))
         elif request.sort_by == MarketplaceSort.total_sold:
-            query = query.order_by(order(total_sold_subquery.c.total_sold))
+            query = query.order_by(order(stats.c.total_sold))
         elif request.sort_by == MarketplaceSort.created_at:
             query = query.order_by(order(nomenclature.c.created_at))
         elif request.sort_by == MarketplaceSort.updated_at:
             query = query.order_by(order(nomenclature.c.updated_at))
+        elif request.sort_by == MarketplaceSort.distance and distance_column is not None:
+            # товары без складов с координатами — в конце при любом направлении
+            query = query.order_by(order(distance_column).nulls_last())
         else:
             # по умолчанию — по продажам
-            query = query.order_by(order(total_sold_subquery.c.total_sold))
+            query = query.order_by(order(stats.c.total_sold))
+        # стабильная пагинация при равных значениях сортировки
+        query = query.order_by(nomenclature.c.id)
 
         # Пагинация
         offset = (request.page - 1) * request.size
@@ -637,12 +536,11 @@ class MarketplaceProductsListService(BaseMarketplaceService):
 
         products_db = await database.fetch_all(query)
 
-        # --- Подсчёт общего количества (без дублей по складам / картинкам) ---
-        count_query = (
-            select(func.count(func.distinct(nomenclature.c.id)))
-            .select_from(nomenclature)
-            .join(categories, categories.c.id == nomenclature.c.category, isouter=True)
-            .join(manufacturers, manufacturers.c.id == nomenclature.c.manufacturer, isouter=True)
+        # --- Подсчёт общего количества ---
+        # Все присоединяемые таблицы один-к-одному с номенклатурой, поэтому DISTINCT не нужен,
+        # а справочники присоединяем только когда по ним есть фильтр
+        count_from = (
+            nomenclature
             .join(
                 active_prices_subquery,
                 active_prices_subquery.c.nomenclature_id == nomenclature.c.id,
@@ -651,7 +549,13 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 price_types,
                 price_types.c.id == active_prices_subquery.c.price_type,
             )
-            .join(
+        )
+        if request.category:
+            count_from = count_from.join(categories, categories.c.id == nomenclature.c.category, isouter=True)
+        if request.manufacturer:
+            count_from = count_from.join(manufacturers, manufacturers.c.id == nomenclature.c.manufacturer, isouter=True)
+        if request.rating_from or request.rating_to:
+            count_from = count_from.join(
                 marketplace_rating_aggregates,
                 and_(
                     marketplace_rating_aggregates.c.entity_id == nomenclature.c.id,
@@ -659,11 +563,11 @@ class MarketplaceProductsListService(BaseMarketplaceService):
                 ),
                 isouter=True,
             )
-            .join(
-                stock_subquery,
-                stock_subquery.c.nomenclature_id == nomenclature.c.id,
-                isouter=True,
-            )
+        if request.in_stock:
+            count_from = count_from.join(stats, stats.c.nomenclature_id == nomenclature.c.id, isouter=True)
+        count_query = (
+            select(func.count(nomenclature.c.id))
+            .select_from(count_from)
             .where(and_(*conditions))
         )
         count_result = await database.fetch_one(count_query)
@@ -726,14 +630,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             # Остальные поля
             product_dict["is_ad_pos"] = False
             product_dict["variations"] = []
-            product_dict["distance"] = (
-                min(
-                    product_dict["available_warehouses"],
-                    key=lambda x: x.distance_to_client,
-                ).distance_to_client
-                if product_dict["available_warehouses"]
-                else None
-            )
+            product_dict["distance"] = product_dict.get("distance")
             product_dict["cashbox_id"] = product_dict["cashbox"]
             product_dict["seller_photo"] = self.__transform_photo_route(
                 product_dict["seller_photo"]
@@ -741,14 +638,6 @@ class MarketplaceProductsListService(BaseMarketplaceService):
 
             products.append(MarketplaceProduct(**product_dict))
 
-        # Отдельная сортировка по distance (после расчёта distance_to_client)
-        if request.sort_by == MarketplaceSort.distance:
-            reverse = request.sort_order == "desc"
-            products.sort(
-                key=lambda x: x.distance if x.distance is not None else float("inf"),
-                reverse=reverse,
-            )
-
         return MarketplaceProductList(
             result=products,
             count=total_count,
@@ -772,7 +661,7 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         # Формируем JSON-объект для каждого склада
         json_obj = func.jsonb_build_object(
             literal_column("'warehouse_id'"), warehouses.c.id,
-            literal_column("'organization_id'"), warehouse_balances.c.organization_id,
+            literal_column("'organization_id'"), warehouse_balances_latest.c.organization_id,
             literal_column("'warehouse_name'"), warehouses.c.name,
             literal_column("'warehouse_address'"), warehouses.c.address,
             literal_column("'latitude'"), warehouses.c.latitude,
@@ -782,11 +671,11 @@ class MarketplaceProductsListService(BaseMarketplaceService):
         # Запрос: склады с остатками по указанной номенклатуре
         query = (
             select(json_obj)
-            .select_from(warehouse_balances)
+            .select_from(warehouse_balances_latest)
             .join(
                 warehouses,
                 and_(
-                    warehouses.c.id == warehouse_balances.c.warehouse_id,
+                    warehouses.c.id == warehouse_balances_latest.c.warehouse_id,
                     warehouses.c.is_public.is_(True),
                     warehouses.c.status.is_(True),
                     warehouses.c.is_deleted.is_not(True)
@@ -794,9 +683,9 @@ class MarketplaceProductsListService(BaseMarketplaceService):
             )
             .where(
                 and_(
-                    warehouse_balances.c.nomenclature_id == nomenclature_id,
+                    warehouse_balances_latest.c.nomenclature_id == nomenclature_id,
                     # Можно добавить условие на наличие остатка, если нужно:
-                    # warehouse_balances.c.current_amount > 0
+                    # warehouse_balances_latest.c.current_amount > 0
                 )
             )
         )
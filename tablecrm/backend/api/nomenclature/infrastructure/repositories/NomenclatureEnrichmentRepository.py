@@ -0,0 +1,152 @@
+import asyncio
+from collections import defaultdict
+
+from sqlalchemy import select, func, case
+
+from database.db import database, prices, price_types, warehouse_register_movement, warehouses, \
+    nomenclature_attributes, nomenclature_attributes_value, pictures
+from functions.db_connections import in_own_connection
+from functions.helpers import datetime_to_timestamp
+
+
+class NomenclatureEnrichmentRepository:
+    """
+    Догрузка цен, остатков, атрибутов и фото для страницы номенклатуры:
+    по одному запросу IN (...) на вид данных вместо запросов на каждую строку.
+    Запросы разных видов идут параллельно, каждый на своём соединении пула:
+    на общем соединении запроса databases выполнил бы их по очереди.
+    """
+
+    @staticmethod
+    async def fetch_prices_by_ids(ids: list[int]) -> dict[int, list[dict]]:
+        if not ids:
+            return {}
+
+        query = (
+            select(prices.c.nomenclature, prices.c.price, price_types.c.name.label("price_type"))
+            .select_from(prices)
+            .join(price_types, price_types.c.id == prices.c.price_type)
+            .where(prices.c.nomenclature.in_(ids))
+        )
+        prices_map: dict[int, list[dict]] = defaultdict(list)
+        for row in await database.fetch_all(query):
+            prices_map[row["nomenclature"]].append({"price": row["price"], "price_type": row["price_type"]})
+        return prices_map
+
+    @staticmethod
+    async def fetch_balances_by_ids(ids: list[int], cashbox_id: int) -> dict[int, list[dict]]:
+        if not ids:
+            return {}
+
+        amount = case(
+            [(warehouse_register_movement.c.type_amount == "minus", warehouse_register_movement.c.amount * (-1))],
+            else_=warehouse_register_movement.c.amount
+        )
+        query = (
+            select(
+                warehouse_register_movement.c.nomenclature_id,
+                warehouses.c.name.label("warehouse_name"),
+                func.sum(amount).label("current_amount"),
+            )
+            .select_from(
+                warehouse_register_movement
+                .join(warehouses, warehouse_register_movement.c.warehouse_id == warehouses.c.id)
+            )
+            .where(
+                warehouse_register_movement.c.nomenclature_id.in_(ids),
+                warehouse_register_movement.c.cashbox_id == cashbox_id
+            )
+            .group_by(warehouse_register_movement.c.nomenclature_id, warehouses.c.name)
+        )
+        balances_map: dict[int, list[dict]] = defaultdict(list)
+        for row in await database.fetch_all(query):
+            balances_map[row["nomenclature_id"]].append({
+                "warehouse_name": row["warehouse_name"],
+                "id": row["nomenclature_id"],
+                "nomenclature_id": row["nomenclature_id"],
+                "current_amount": row["current_amount"],
+            })
+        return balances_map
+
+    @staticmethod
+    async def fetch_attributes_by_ids(ids: list[int]) -> dict[int, list[dict]]:
+        if not ids:
+            return {}
+
+        query = (
+            select(
+                nomenclature_attributes_value.c.nomenclature_id,
+                nomenclature_attributes_value.c.id,
+                nomenclature_attributes_value.c.attribute_id,
+                nomenclature_attributes.c.name,
+                nomenclature_attributes.c.alias,
+                nomenclature_attributes_value.c.value
+            )
+            .select_from(nomenclature_attributes_value)
+            .join(nomenclature_attributes, nomenclature_attributes_value.c.attribute_id == nomenclature_attributes.c.id)
+            .where(nomenclature_attributes_value.c.nomenclature_id.in_(ids))
+        )
+        attributes_map: dict[int, list[dict]] = defaultdict(list)
+        for row in await database.fetch_all(query):
+            attribute = dict(row)
+            attributes_map[attribute.pop("nomenclature_id")].append(attribute)
+        return attributes_map
+
+    @staticmethod
+    async def fetch_photos_by_ids(ids: list[int]) -> dict[int, list[dict]]:
+        if not ids:
+            return {}
+
+        query = (
+            select(
+                pictures.c.entity_id,
+                pictures.c.id,
+                pictures.c.url,
+                pictures.c.is_main,
+                pictures.c.created_at,
+                pictures.c.updated_at
+            )
+            .select_from(pictures)
+            .where(
+                pictures.c.entity == "nomenclature",
+                pictures.c.entity_id.in_(ids),
+                pictures.c.is_deleted.is_not(True)
+            )
+            .order_by(pictures.c.entity_id, pictures.c.is_main.desc(), pictures.c.id.asc())
+        )
+        photos_map: dict[int, list[dict]] = defaultdict(list)
+        for row in await database.fetch_all(query):
+            photo = datetime_to_timestamp(row)
+            photos_map[photo.pop("entity_id")].append(photo)
+        return photos_map
+
+    async def enrich(
+            self,
+            items: list[dict],
+            cashbox_id: int,
+            with_prices: bool = False,
+            with_balance: bool = False,
+            with_attributes: bool = False,
+            with_photos: bool = False,
+    ) -> list[dict]:
+        ids = [item["id"] for item in items]
+
+        tasks = {}
+        if with_prices:
+            tasks["prices"] = self.fetch_prices_by_ids(ids)
+        if with_balance:
+            tasks["balances"] = self.fetch_balances_by_ids(ids, cashbox_id)
+        if with_attributes:
+            tasks["attributes"] = self.fetch_attributes_by_ids(ids)
+        if with_photos:
+            tasks["photos"] = self.fetch_photos_by_ids(ids)
+        if not ids or not tasks:
+            return items
+
+        results = await asyncio.gather(*(in_own_connection(task) for task in tasks.values()))
+        results_map = dict(zip(tasks.keys(), results))
+
+        for item in items:
+            for key, values_map in results_map.items():
+                item[key] = values_map.get(item["id"], [])
+        return items
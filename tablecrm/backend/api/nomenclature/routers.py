@@ -5,6 +5,8 @@ from typing import List, Optional
 from starlette import status
 
 import api.nomenclature.schemas as schemas
+from api.nomenclature.infrastructure.repositories.NomenclatureEnrichmentRepository import \
+    NomenclatureEnrichmentRepository
 from api.nomenclature.web.pagination.NomenclatureFilter import NomenclatureFilter, SortOrder
 from database.db import categories, database, manufacturers, nomenclature, nomenclature_barcodes, prices, price_types, \
     warehouse_register_movement, warehouses, units, warehouse_balances, nomenclature_groups_value, nomenclature_groups, \
@@ -22,6 +24,8 @@ from functions.helpers import (
     create_entity_hash, update_entity_hash, build_filters
 )
 from functions.filter_schemas import CUIntegerFilters
+from functions.reference_cache import reference_cache
+from functions import search
 from sqlalchemy import func, select, and_, desc, asc, case, cast, ARRAY, null, or_, Float, between
 from sqlalchemy.sql.functions import coalesce
 from sqlalchemy.dialects.postgresql import insert as pg_insert
@@ -182,47 +186,9 @@ async def get_nomenclature_by_ids(token: str, ids: List[int] = Body(..., example
     nomenclature_db = await database.fetch_all(query)
     nomenclature_db = [*map(datetime_to_timestamp, nomenclature_db)]
 
-    for nomenclature_info in nomenclature_db:
-        if with_prices:
-            price = await database.fetch_all(
-                select(prices.c.price, price_types.c.name.label('price_type')).
-                where(prices.c.nomenclature == nomenclature_info['id']).
-                select_from(prices).
-                join(price_types, price_types.c.id == prices.c.price_type)
-            )
-            nomenclature_info["prices"] = price
-
-        if with_balance:
-            q = case(
-                [
-                    (
-                        warehouse_register_movement.c.type_amount == 'minus',
-                        warehouse_register_movement.c.amount * (-1)
-                    )
-                ],
-                else_=warehouse_register_movement.c.amount
-
-            )
-            query = (
-                select(
-                    warehouses.c.name.label("warehouse_name"),
-                    nomenclature.c.id,
-                    warehouse_register_movement.c.nomenclature_id,
-                    func.sum(q).label("current_amount"))
-                .where(
-                    nomenclature.c.id == nomenclature_info['id'],
-                    warehouse_register_movement.c.cashbox_id == user.cashbox_id
-                )
-            ).group_by(
-                warehouses.c.name,
-                nomenclature.c.id,
-                warehouse_register_movement.c.nomenclature_id,
-            ) \
-                .select_from(warehouse_register_movement
-                             .join(warehouses, warehouse_register_movement.c.warehouse_id == warehouses.c.id))
-
-            balances_list = await database.fetch_all(query)
-            nomenclature_info["balances"] = balances_list
+    await NomenclatureEnrichmentRepository().enrich(
+        nomenclature_db, user.cashbox_id, with_prices=with_prices, with_balance=with_balance
+    )
 
     query = select(func.count(nomenclature.c.id)).where(
         nomenclature.c.cashbox == user.cashbox_id,
@@ -239,6 +205,7 @@ async def get_nomenclature(
         token: str,
         name: Optional[str] = None,
         barcode: Optional[str] = None,
+        barcode_exact: bool = Query(False, description="Точное совпадение штрихкода (поиск на кассе)"),
         category: Optional[int] = None,
         limit: int = 100,
         offset: int = 0,
@@ -319,10 +286,14 @@ async def get_nomenclature(
         conditions.append(nomenclature.c.category == category)
 
     if name:
-        conditions.append(nomenclature.c.name.ilike(f'%{name}%'))
+        conditions.append(search.contains(nomenclature.c.name, name))
 
     if barcode:
-        join_barcode = select(nomenclature_barcodes.c.nomenclature_id).where(nomenclature_barcodes.c.code.ilike(f'%{barcode}%'))
+        if barcode_exact:
+            barcode_condition = search.barcode_code(nomenclature_barcodes.c.code) == search.normalize_barcode(barcode)
+        else:
+            barcode_condition = search.contains(nomenclature_barcodes.c.code, barcode)
+        join_barcode = select(nomenclature_barcodes.c.nomenclature_id).where(barcode_condition)
         conditions.append(nomenclature.c.id.in_(join_barcode))
 
     if min_price is not None:
@@ -333,7 +304,7 @@ async def get_nomenclature(
     query = query.where(and_(*conditions)).filter(*filters)
 
     if sort:
-        order_fields = {"created_at", "updated_at", "name"}
+        order_fields = {"created_at", "updated_at", "name", "relevance"}
         directions = {"asc", "desc"}
 
         if (
@@ -346,10 +317,17 @@ async def get_nomenclature(
                 detail="Вы ввели некорректный параметр сортировки!")
         order_by, direction = sort.split(":")
 
-        column = nomenclature.c[order_by]
-        if direction.lower() == "desc":
-            column = column.desc()
-        query = query.order_by(column)
+        if order_by.lower() == "relevance":
+            if not name:
+                raise HTTPException(
+                    status_code=400,
+                    detail="Сортировка по релевантности доступна только вместе с фильтром name")
+            query = query.order_by(*search.rank(nomenclature.c.name, name))
+        else:
+            column = nomenclature.c[order_by]
+            if direction.lower() == "desc":
+                column = column.desc()
+            query = query.order_by(column)
 
     query = query.group_by(nomenclature.c.id, units.c.convent_national_view)
 
@@ -391,89 +369,14 @@ async def get_nomenclature(
 
     nomenclature_db_count = await database.fetch_val(count_query)
 
-    for nomenclature_info in nomenclature_db:
-        if with_prices:
-            price = await database.fetch_all(
-                select(prices.c.price, price_types.c.name.label('price_type')).
-                where(prices.c.nomenclature == nomenclature_info['id']).
-                select_from(prices).
-                join(price_types, price_types.c.id == prices.c.price_type)
-            )
-            nomenclature_info["prices"] = price
-
-        if with_balance:
-            q = case(
-                [
-                    (
-                        warehouse_register_movement.c.type_amount == 'minus',
-                        warehouse_register_movement.c.amount * (-1)
-                    )
-                ],
-                else_=warehouse_register_movement.c.amount
-
-            )
-            query = (
-                select(
-                    warehouses.c.name.label("warehouse_name"),
-                    nomenclature.c.id,
-                    warehouse_register_movement.c.nomenclature_id,
-                    func.sum(q).label("current_amount"))
-                .where(
-                    nomenclature.c.id == nomenclature_info['id'],
-                    warehouse_register_movement.c.cashbox_id == user.cashbox_id
-                )
-            ).group_by(
-                warehouses.c.name,
-                nomenclature.c.id,
-                warehouse_register_movement.c.nomenclature_id,
-            ) \
-                .select_from(warehouse_register_movement
-                             .join(warehouses, warehouse_register_movement.c.warehouse_id == warehouses.c.id))
-
-            balances_list = await database.fetch_all(query)
-            nomenclature_info["balances"] = balances_list
-
-        if with_attributes:
-            attributes_query = (
-                select(
-                    nomenclature_attributes_value.c.id,
-                    nomenclature_attributes_value.c.attribute_id,
-                    nomenclature_attributes.c.name,
-                    nomenclature_attributes.c.alias,
-                    nomenclature_attributes_value.c.value
-                )
-                .select_from(nomenclature_attributes_value)
-                .join(
-                    nomenclature_attributes,
-                    nomenclature_attributes_value.c.attribute_id == nomenclature_attributes.c.id
-                )
-                .where(
-                    nomenclature_attributes_value.c.nomenclature_id == nomenclature_info['id']
-                )
-            )
-            attributes_list = await database.fetch_all(attributes_query)
-            nomenclature_info["attributes"] = attributes_list
-
-        if with_photos:
-            photos_query = (
-                select(
-                    pictures.c.id,
-                    pictures.c.url,
-                    pictures.c.is_main,
-                    pictures.c.created_at,
-                    pictures.c.updated_at
-                )
-                .select_from(pictures)
-                .where(
-                    pictures.c.entity == 'nomenclature',
-                    pictures.c.entity_id == nomenclature_info['id'],
-                    pictures.c.is_deleted.is_not(True)
-                )
-                .order_by(pictures.c.is_main.desc(), pictures.c.id.asc())
-            )
-            photos_list = await database.fetch_all(photos_query)
-            photos_list = [*map(datetime_to_timestamp, photos_list)]
-            nomenclature_info["photos"] = photos_list
+    await NomenclatureEnrichmentRepository().enrich(
+        nomenclature_db,
+        user.cashbox_id,
+        with_prices=with_prices,
+        with_balance=with_balance,
+        with_attributes=with_attributes,
+        with_photos=with_photos,
+    )
 
     return {"result": nomenclature_db, "count": nomenclature_db_count}
 
@@ -569,6 +472,7 @@ async def edit_nomenclature(
             .values(nomenclature_values)
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "nomenclature", [idx])
         nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
         await update_entity_hash(table=nomenclature, table_hash=nomenclature_hash, entity=nomenclature_db)
 
@@ -611,6 +515,7 @@ async def edit_nomenclature_mass(
                 .values(nomenclature_values)
             )
             await database.execute(query)
+            reference_cache.invalidate(user.cashbox_id, "nomenclature", [idx])
             nomenclature_db = await get_entity_by_id(nomenclature, idx, user.cashbox_id)
             await update_entity_hash(table=nomenclature, table_hash=nomenclature_hash, entity=nomenclature_db)
 
@@ -639,6 +544,7 @@ async def delete_nomenclature(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "nomenclature", [idx])
 
     query = nomenclature.select().where(nomenclature.c.id == idx, nomenclature.c.cashbox == user.cashbox_id)
     nomenclature_db = await database.fetch_one(query)
@@ -672,6 +578,7 @@ async def delete_nomenclature_mass(token: str, nomenclature_data: List[int]):
             .values({"is_deleted": True})
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "nomenclature", [idx])
 
         query = nomenclature.select().where(nomenclature.c.id == idx, nomenclature.c.cashbox == user.cashbox_id)
         nomenclature_db = await database.fetch_one(query)
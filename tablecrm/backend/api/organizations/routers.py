@@ -2,6 +2,7 @@ import api.organizations.schemas as schemas
 from database.db import database, organizations
 from fastapi import APIRouter
 from functions.helpers import datetime_to_timestamp, get_entity_by_id, get_user_by_token
+from functions.reference_cache import reference_cache
 from sqlalchemy import func, select
 from ws_manager import manager
 
@@ -92,6 +93,7 @@ async def edit_organization(
             .values(organization_values)
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "organizations", [idx])
         organization_db = await get_entity_by_id(organizations, idx, user.cashbox_id)
 
     organization_db = datetime_to_timestamp(organization_db)
@@ -117,6 +119,7 @@ async def delete_organization(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "organizations", [idx])
 
     query = organizations.select().where(organizations.c.id == idx, organizations.c.cashbox == user.cashbox_id)
     organization_db = await database.fetch_one(query)
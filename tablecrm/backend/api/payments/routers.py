@@ -314,8 +314,6 @@ async def create_payment(token: str, payment: pay_schemas.PaymentCreate):
             status_code=403,
             detail="Введенный счет не принадлежит вам или не существует!",
         )
-    paybox_dict = dict(paybox)
-    project_dict = None
 
     if payment.project_id:
         project_q = projects.select().where(
@@ -323,7 +321,12 @@ async def create_payment(token: str, payment: pay_schemas.PaymentCreate):
             projects.c.cashbox == user.cashbox_id,
         )
         project = await database.fetch_one(project_q)
-        project_dict = dict(project)
+
+        if not project:
+            raise HTTPException(
+                status_code=403,
+                detail="Введенный проект не принадлежит вам или не существует!",
+            )
         payment_dict["project_id"] = project.id
     else:
         payment_dict["project_id"] = None
@@ -368,132 +371,40 @@ async def create_payment(token: str, payment: pay_schemas.PaymentCreate):
     payment_dict["created_at"] = int(datetime.utcnow().timestamp())
     payment_dict["updated_at"] = int(datetime.utcnow().timestamp())
 
-    paybox_to_id = None
-
-    if payment.type == PaymentType.transfer:
-        if payment.status:
-            paybox_to_id = payment.paybox_to
-            paybox_dict["balance"] = round(
-                float(paybox_dict["balance"]) - float(payment_dict['amount']), 2
-            )
-            query = pboxes.select().where(
-                pboxes.c.id == paybox_to_id, pboxes.c.cashbox == user.cashbox_id
-            )
-            pbox_to = await database.fetch_one(query)
-
-            if not pbox_to:
-                raise HTTPException(
-                    status_code=403,
-                    detail="Введенный счет не принадлежит вам или не существует!",
-                )
-
-            pbox_to_dict = dict(pbox_to)
-            pbox_to_dict["balance"] = round(
-                float(pbox_to_dict["balance"]) + float(payment_dict['amount']), 2
-            )
-            paybox_q = (
-                pboxes.update()
-                .where(
-                    pboxes.c.id == paybox_to_id,
-                    pboxes.c.cashbox == user.cashbox_id,
-                )
-                .values(pbox_to_dict)
-            )
-            await database.execute(paybox_q)
-
-
-
-
-    query = payments.insert(values=payment_dict)
-    pay_id = await database.execute(query)
-
-    if payment.project_id:
-        if payment.type == PaymentType.incoming:
-            if payment.status:
-                project_dict["incoming"] += payment_dict['amount_without_tax']
-        if payment.type == PaymentType.outgoing:
-            if payment.status:
-                project_dict["outgoing"] += payment_dict['amount_without_tax']
-        project_q = (
-            projects.update()
-            .where(
-                projects.c.id == payment.project_id,
-                projects.c.cashbox == user.cashbox_id,
-            )
-            .values(project_dict)
+    if payment.type == PaymentType.transfer and payment.status:
+        query = pboxes.select().where(
+            pboxes.c.id == payment.paybox_to, pboxes.c.cashbox == user.cashbox_id
         )
-        await database.execute(project_q)
+        pbox_to = await database.fetch_one(query)
 
-        query = projects.select().where(
-            projects.c.id == payment.project_id,
-            projects.c.cashbox == user.cashbox_id,
-        )
-        project = await database.fetch_one(query)
-
-        if not project:
+        if not pbox_to:
             raise HTTPException(
                 status_code=403,
-                detail="Введенный проект не принадлежит вам или не существует!",
+                detail="Введенный счет не принадлежит вам или не существует!",
             )
 
-        in_sum = float(project.incoming)
-        out_sum = float(project.outgoing)
-
-        if out_sum == 0 and in_sum != 0:
-            project_dict["profitability"] = 100
-        elif out_sum == 0 and in_sum == 0:
-            project_dict["profitability"] = 0
-        else:
-            project_dict["profitability"] = round(
-                ((in_sum - out_sum) / out_sum) * 100, 2
-            )
+    # балансы счетов и проекта обновляет триггер на payments в той же транзакции
+    query = payments.insert(values=payment_dict)
+    pay_id = await database.execute(query)
 
-        project_dict["updated_at"] = int(datetime.utcnow().timestamp())
+    payment_dict["id"] = pay_id
 
-        query = (
-            projects.update()
-            .where(
-                projects.c.id == payment.project_id,
-                projects.c.cashbox == user.cashbox_id,
-            )
-            .values(project_dict)
+    paybox_ids = [payment.paybox]
+    if payment.type == PaymentType.transfer and payment.status:
+        paybox_ids.append(payment.paybox_to)
+    for paybox_db in await database.fetch_all(pboxes.select().where(pboxes.c.id.in_(paybox_ids))):
+        await manager.send_update(
+            token, {"action": "edit", "target": "payboxes", "result": dict(paybox_db)}
         )
-        await database.execute(query)
 
-        await manager.send_message(
-            token,
-            {"action": "edit", "target": "projects", "result": project_dict},
+    if payment.project_id:
+        project = await database.fetch_one(
+            projects.select().where(projects.c.id == payment.project_id)
         )
-
-    payment_dict["id"] = pay_id
-
-    # date_ts = int(datetime.timestamp(datetime.combine(payment.date, datetime.min.time())))
-
-    if paybox_dict["balance_date"] <= payment_dict['date']:
-        if payment.status:
-            if payment.type == PaymentType.incoming:
-                paybox_dict["balance"] = round(
-                    float(paybox_dict["balance"]) + float(payment_dict['amount']), 2
-                )
-            elif payment.type == PaymentType.outgoing:
-                paybox_dict["balance"] = round(
-                    float(paybox_dict["balance"]) - float(payment_dict['amount']), 2
-                )
-
-    await manager.send_message(
-        token, {"action": "edit", "target": "payboxes", "result": paybox_dict}
-    )
-
-    del paybox_dict["id"]
-
-    paybox_q = (
-        pboxes.update()
-        .where(
-            pboxes.c.id == payment.paybox, pboxes.c.cashbox == user.cashbox_id
+        await manager.send_update(
+            token,
+            {"action": "edit", "target": "projects", "result": dict(project)},
         )
-        .values(paybox_dict)
-    )
-    await database.execute(paybox_q)
 
     query = f"""
     SELECT payments.id, payments.type, payments.name, payments.external_id, payments.article,
@@ -776,64 +687,7 @@ async def delete_payment(token: str, payment_id: int):
 
             if payment.cashbox == user.cashbox_id and payment.account == user.user:
 
-                paybox_q = pboxes.select().where(pboxes.c.id == payment.paybox)
-                paybox = await database.fetch_one(paybox_q)
-
-                paybox_dict = dict(paybox)
-
-                if payment.status:
-                    if payment.type == PaymentType.incoming:
-                        paybox_dict["balance"] = float(paybox_dict["balance"]) - float(
-                            payment.amount
-                        )
-                    elif payment.type == PaymentType.outgoing:
-                        paybox_dict["balance"] = float(paybox_dict["balance"]) + float(
-                            payment.amount
-                        )
-                    elif payment.type == PaymentType.transfer:
-                        paybox_dict["balance"] = float(paybox_dict["balance"]) + float(
-                            payment.amount
-                        )
-
-                        paybox_to_q = pboxes.select().where(
-                            pboxes.c.id == payment.paybox_to
-                        )
-                        paybox_to_rec = await database.fetch_one(paybox_to_q)
-
-                        paybox_to = dict(paybox_to_rec)
-
-                        paybox_to["balance"] = float(paybox_to["balance"]) - float(
-                            payment.amount
-                        )
-
-                        await manager.send_message(
-                            token,
-                            {
-                                "action": "edit",
-                                "target": "payboxes",
-                                "result": paybox_to,
-                            },
-                        )
-
-                        paybox_q = (
-                            pboxes.update()
-                            .where(pboxes.c.id == payment.paybox_to)
-                            .values(paybox_to)
-                        )
-                        await database.execute(paybox_q)
-
-                    paybox_q = (
-                        pboxes.update()
-                        .where(pboxes.c.id == payment.paybox)
-                        .values(paybox_dict)
-                    )
-                    await database.execute(paybox_q)
-
-                    await manager.send_message(
-                        token,
-                        {"action": "edit", "target": "payboxes", "result": paybox_dict},
-                    )
-
+                # балансы счетов и проекта откатывает триггер на payments
                 q = (
                     payments.update()
                     .where(payments.c.id == payment_id)
@@ -842,62 +696,26 @@ async def delete_payment(token: str, payment_id: int):
                     )
                 )
                 await database.execute(q)
-                
-                if payment.project_id:
-                    if payment.status:
-                        query = projects.select().where(
-                            projects.c.id == payment.project_id
-                        )
-                        project = await database.fetch_one(query)
-                        project_dict = dict(project)
-
-                        if payment.type == PaymentType.incoming:
-                            project_dict["incoming"] -= payment.amount_without_tax
-                        elif payment.type == PaymentType.outgoing:
-                            project_dict["outgoing"] -= payment.amount_without_tax
-
-                        q = payments.select().where(
-                            payments.c.project_id == payment.project_id,
-                            payments.c.status == True,
-                            payments.c.is_deleted == False,
-                        )
-                        payments_db = await database.fetch_all(q)
-
-                        in_sum = 0
-                        out_sum = 0
-
-                        for payment in payments_db:
-                            if payment.type == PaymentType.incoming:
-                                in_sum += payment.amount_without_tax
-                            else:
-                                out_sum += payment.amount_without_tax
-
-                        if out_sum == 0 and in_sum != 0:
-                            project_dict["profitability"] = 100
-                        elif out_sum == 0 and in_sum == 0:
-                            project_dict["profitability"] = 0
-                        else:
-                            project_dict["profitability"] = round(
-                                ((in_sum - out_sum) / out_sum) * 100, 2
-                            )
-
-                        project_dict["updated_at"] = int(datetime.utcnow().timestamp())
 
-                        await manager.send_message(
+                if payment.status:
+                    paybox_ids = [payment.paybox]
+                    if payment.type == PaymentType.transfer and payment.paybox_to:
+                        paybox_ids.append(payment.paybox_to)
+                    for paybox_db in await database.fetch_all(pboxes.select().where(pboxes.c.id.in_(paybox_ids))):
+                        await manager.send_update(
                             token,
-                            {
-                                "action": "edit",
-                                "target": "projects",
-                                "result": project_dict,
-                            },
+                            {"action": "edit", "target": "payboxes", "result": dict(paybox_db)},
                         )
 
-                        query = (
-                            projects.update()
-                            .where(projects.c.id == payment.project_id)
-                            .values(project_dict)
+                    if payment.project_id:
+                        project = await database.fetch_one(
+                            projects.select().where(projects.c.id == payment.project_id)
                         )
-                        await database.execute(query)
+                        if project:
+                            await manager.send_update(
+                                token,
+                                {"action": "edit", "target": "projects", "result": dict(project)},
+                            )
 
                 await manager.send_message(
                     token,
@@ -1,10 +1,9 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy import desc, asc, func, select, or_, and_
 
-from const import PaymentType
 from ws_manager import manager
 
-from database.db import database, pboxes, users_cboxes_relation, payments, user_permissions
+from database.db import database, pboxes, users_cboxes_relation, user_permissions
 
 import functions.filter_schemas as filter_schemas
 import api.pboxes.schemas as pboxes_schemas
@@ -162,85 +161,21 @@ async def update_paybox_data(token: str, pbox_data: pboxes_schemas.PayboxesEdit)
     pbox_data_dict = pbox_data.dict()
     del pbox_data_dict['id']
 
-    new_pbox = {}
-
-    q = pboxes.select().where(pboxes.c.id == pbox_data.id)
-    pbox = await database.fetch_one(q)
-
-    query = payments.select().where(or_(payments.c.paybox == pbox_data.id, payments.c.paybox_to ==
-                                        pbox_data.id), payments.c.is_deleted == False,
-                                    payments.c.cashbox == user.cashbox_id)
-    pbox_payments = await database.fetch_all(query)
-
-    for i, j in pbox_data_dict.items():
-        if j is not None:
-            if i == "start_balance":
-                all_payments_amount = 0
-                for payment in pbox_payments:
-                    today_ts = int(
-                        datetime.timestamp(datetime.today()))
-                    date_ts = int(payment.date)
-                    if pbox['balance_date'] <= date_ts <= today_ts:
-                        if payment.status:
-                            if payment.type == PaymentType.incoming:
-                                all_payments_amount += float(
-                                    payment.amount)
-                            elif payment.type == PaymentType.transfer:
-                                all_payments_amount += float(
-                                    payment.amount)
-                            else:
-                                all_payments_amount -= float(
-                                    payment.amount)
-
-                new_pbox['balance'] = round(all_payments_amount + j, 2)
-                new_pbox['update_start_balance'] = int(
-                    datetime.utcnow().timestamp())
-
-            if i == "balance_date":
-                all_payments_amount = 0
-                for payment in pbox_payments:
-                    today_ts = int(
-                        datetime.timestamp(datetime.today()))
-                    date_ts = int(payment.date)
-                    if j <= date_ts <= today_ts:
-                        if payment.status:
-                            if payment.type == PaymentType.incoming:
-                                all_payments_amount += float(
-                                    payment.amount)
-                            elif payment.type == PaymentType.transfer:
-                                all_payments_amount += float(
-                                    payment.amount)
-                            else:
-                                all_payments_amount -= float(
-                                    payment.amount)
-                                if payment.paybox_to:
-                                    pbox_to = await database.fetch_one(
-                                        pboxes.select(
-                                            pboxes.c.id == payment.paybox_to)
-                                    )
-                                    await database.execute(
-                                        pboxes.update(pboxes.c.id == pbox_to.id).values({
-                                            "balance": round(float(pbox_to['balance']) + payment.amount, 2),
-                                            "update_start_balance_date": int(datetime.utcnow().timestamp())
-                                        })
-                                    )
-
-                # print(f"j:{j} - date_ts:{date_ts} - today_ts:{today_ts}")
-                # print(all_payments_amount)
-                new_pbox['balance'] = round(
-                    float(pbox['start_balance']) + all_payments_amount, 2)
-                new_pbox['update_start_balance_date'] = int(
-                    datetime.utcnow().timestamp())
-
-            new_pbox[i] = j
+    new_pbox = {i: j for i, j in pbox_data_dict.items() if j is not None}
 
     if new_pbox:
         new_pbox['updated_at'] = int(datetime.utcnow().timestamp())
+        if new_pbox.keys() & {"start_balance", "balance_date"}:
+            new_pbox['update_start_balance_date'] = int(datetime.utcnow().timestamp())
 
         q = pboxes.update().where(pboxes.c.id == pbox_data.id, pboxes.c.cashbox == user.cashbox_id).values(
             new_pbox)
         await database.execute(q)
 
+        # баланс = start_balance + платежи с balance_date, пересчёт по тем же правилам, что и триггер
+        if new_pbox.keys() & {"start_balance", "balance_date"}:
+            await database.fetch_all("SELECT * FROM payboxes_recalculate(:ids)", {"ids": [pbox_data.id]})
+
         q = pboxes.select().where(pboxes.c.id == pbox_data.id,
                                   pboxes.c.cashbox == user.cashbox_id)
         pbox = await database.fetch_one(q)
@@ -6,6 +6,7 @@ import api.price_types.schemas as schemas
 
 from functions.helpers import datetime_to_timestamp, get_entity_by_id
 from functions.helpers import get_user_by_token, raise_bad_request
+from functions.reference_cache import reference_cache
 
 from ws_manager import manager
 from sqlalchemy import select, func
@@ -127,6 +128,7 @@ async def edit_price_type(
             .values(price_type_values)
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "price_types", [idx])
         price_type_db = await get_entity_by_id(price_types, idx, user.id)
 
     price_type_db = datetime_to_timestamp(price_type_db)
@@ -155,6 +157,7 @@ async def delete_price_type(token: str, idx: int):
         .values({"is_deleted": True})
     )
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "price_types", [idx])
 
     query = price_types.select().where(
         price_types.c.id == idx, price_types.c.cashbox == user.cashbox_id
@@ -549,7 +549,7 @@ async def edit_price(
 
         websocket_body = parse_obj_as(schemas.PriceInList, response_body).dict()
 
-        await manager.send_message(
+        await manager.send_update(
             token,
             {"action": "edit", "target": "prices", "result": websocket_body},
         )
@@ -655,7 +655,7 @@ async def edit_price(
     websocket_body = parse_obj_as(Optional[List[schemas.PriceInList]], response_body_list)
     websocket_body = [body.dict() for body in websocket_body]
 
-    await manager.send_message(
+    await manager.send_update(
         token,
         {"action": "edit", "target": "prices", "result": websocket_body},
     )
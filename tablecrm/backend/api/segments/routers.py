@@ -1,4 +1,3 @@
-import asyncio
 import json
 from datetime import datetime, timezone, timedelta
 from typing import List, Optional
@@ -8,7 +7,8 @@ from fastapi import APIRouter, HTTPException, Response
 from api.segments import schemas
 from database.db import segments, database, SegmentStatus
 from functions.helpers import get_user_by_token, sanitize_float, deep_sanitize
-from segments.main import Segments, update_segment_task
+from segments.main import Segments
+from segments.scheduler import segment_scheduler
 from sqlalchemy import func
 
 router = APIRouter(tags=["segments"])
@@ -33,7 +33,7 @@ async def create_segments(token: str, segment_data: schemas.SegmentCreate):
 
     new_segment_id = await database.execute(query)
 
-    asyncio.create_task(update_segment_task(new_segment_id))
+    await segment_scheduler.refresh(new_segment_id)
     segment = await database.fetch_one(
         segments.select()
         .where(segments.c.id == new_segment_id)
@@ -64,11 +64,17 @@ async def refresh_segments(idx: int, token: str):
     # if segment.updated_at and datetime.now(timezone.utc) - segment.updated_at < timedelta(minutes=5):
     #     raise HTTPException(status_code=403, detail="Сегмент обновлен менее 5 минут назад!")
 
-    await database.execute(
-        segments.update().where(segments.c.id == segment.id)
-        .values(status=SegmentStatus.in_process.value)
-    )
-    asyncio.create_task(update_segment_task(segment.id))
+    if not await segment_scheduler.acquire(segment.id, due=False):
+        raise HTTPException(status_code=409, detail="Сегмент уже пересчитывается")
+    try:
+        await database.execute(
+            segments.update().where(segments.c.id == segment.id)
+            .values(status=SegmentStatus.in_process.value)
+        )
+    except Exception:
+        await segment_scheduler.release(segment.id)
+        raise
+    segment_scheduler.start(segment.id)
     segment = await database.fetch_one(
         segments.select()
         .where(segments.c.id == idx)
@@ -136,9 +142,16 @@ async def update_segments(idx: int, token: str, segment_data: schemas.SegmentCre
         is_archived=data.get("is_archived")
     )
 
-    await database.execute(query)
-
-    asyncio.create_task(update_segment_task(idx))
+    # пересчёт с новыми критериями — под арендой планировщика: пока сегмент
+    # считается по старым, изменение отклоняется
+    if not await segment_scheduler.acquire(idx, due=False):
+        raise HTTPException(status_code=409, detail="Сегмент пересчитывается, повторите изменение позже")
+    try:
+        await database.execute(query)
+    except Exception:
+        await segment_scheduler.release(idx)
+        raise
+    segment_scheduler.start(idx)
     segment = await database.fetch_one(
         segments.select()
         .where(segments.c.id == idx)
@@ -105,6 +105,8 @@ class WaNotification(BaseModel):
     wappi_token: str
     wappi_profile_id: str
     sleep: int = 5
+    # Лимит запросов в секунду на профиль; если не задан, интервал задаёт sleep
+    rate_per_second: Optional[float] = Field(default=None, gt=0)
 
 
 class HttpRequest(BaseModel):
@@ -115,6 +117,8 @@ class HttpRequest(BaseModel):
     params: Optional[dict]
     body: Optional[dict]
     sleep: int = 5
+    # Лимит запросов в секунду на хост; если не задан, интервал задаёт sleep
+    rate_per_second: Optional[float] = Field(default=None, gt=0)
 
 
 class TransformLoyalityCard(BaseModel):
@@ -6,6 +6,7 @@ from sqlalchemy import select, func as fsql, or_, and_
 from datetime import datetime
 
 from functions.helpers import raise_wrong_token
+from functions.token_resolver import token_resolver
 
 router = APIRouter(prefix="/users", tags=["users"])
 
@@ -426,6 +427,7 @@ async def update_user_shift_settings(user_id: int, settings: schemas.UserShiftSe
             users_cboxes_relation.c.user == user_id
         ).values(shift_work_enabled=settings.shift_work_enabled)
     )
+    token_resolver.invalidate_where(user_id=user_id)
     
     # Если отключаем смены - завершаем активную смену
     if not settings.shift_work_enabled:
@@ -3,9 +3,10 @@ from fastapi_pagination import paginate, add_pagination
 from api.pagination.pagination import Page
 from fastapi import APIRouter, status, HTTPException
 from fastapi.responses import JSONResponse
-from sqlalchemy import select, func, desc, case, delete
+from sqlalchemy import select, func, desc, case, delete, literal, true
 from fastapi.encoders import jsonable_encoder
-from database.db import database, warehouse_balances, warehouses, warehouse_register_movement, nomenclature, OperationType, organizations, categories
+from database.db import database, warehouse_balances, warehouses, warehouse_register_movement, nomenclature, OperationType, organizations, categories, \
+    warehouse_balance_ledger, warehouse_balance_daily
 from . import schemas
 from datetime import datetime
 
@@ -181,146 +182,108 @@ async def alt_get_warehouse_balances(
     offset: int = 0,
 ):
     """Получение списка остатков склада"""
-
-    dates_arr = []
-
-    if date_to and not date_from:
-        dates_arr.append(warehouse_register_movement.c.created_at <= datetime.fromtimestamp(date_to))
-    if date_to and date_from:
-        dates_arr.append(warehouse_register_movement.c.created_at <= datetime.fromtimestamp(date_to))
-        dates_arr.append(warehouse_register_movement.c.created_at >= datetime.fromtimestamp(date_from))
-    if not date_to and date_from:
-        dates_arr.append(warehouse_register_movement.c.created_at >= datetime.fromtimestamp(date_from))
-
-
-    selection_conditions = [warehouse_register_movement.c.warehouse_id == warehouse_id, *dates_arr]
-    if nomenclature_id is not None:
-        selection_conditions.append(warehouse_register_movement.c.nomenclature_id == nomenclature_id)
-    if organization_id is not None:
-        selection_conditions.append(warehouse_register_movement.c.organization_id == organization_id)
     await get_user_by_token(token)
-    q = case(
-        [
-            (
-                warehouse_register_movement.c.type_amount == 'minus',
-                warehouse_register_movement.c.amount * (-1)
-            )
-        ],
-        else_=warehouse_register_movement.c.amount
-
-    )
-    query = (
-        select(
-            nomenclature.c.id,
-            nomenclature.c.name,
-            nomenclature.c.category,
-            warehouse_register_movement.c.organization_id,
-            warehouse_register_movement.c.warehouse_id,
-            func.sum(q).label("current_amount"))
-        .where(*selection_conditions)
-        .limit(limit)
-        .offset(offset)
-    ).group_by(
-               nomenclature.c.name,
-               nomenclature.c.id,
-               warehouse_register_movement.c.organization_id,
-               warehouse_register_movement.c.warehouse_id
-               )\
-        .select_from(warehouse_register_movement
-                     .join(nomenclature,
-                           warehouse_register_movement.c.nomenclature_id == nomenclature.c.id
-                           ))
 
-    warehouse_balances_db = await database.fetch_all(query)
-
-
-
-    selection_conditions = [warehouse_register_movement.c.warehouse_id == warehouse_id]
+    ledger = warehouse_balance_ledger
+    selection_conditions = [ledger.c.warehouse_id == warehouse_id]
     if nomenclature_id is not None:
-        selection_conditions.append(warehouse_register_movement.c.nomenclature_id == nomenclature_id)
+        selection_conditions.append(ledger.c.nomenclature_id == nomenclature_id)
     if organization_id is not None:
-        selection_conditions.append(warehouse_register_movement.c.organization_id == organization_id)
-    await get_user_by_token(token)
-    q = case(
-        [
-            (
-                warehouse_register_movement.c.type_amount == 'minus',
-                warehouse_register_movement.c.amount * (-1)
+        selection_conditions.append(ledger.c.organization_id == organization_id)
+
+    def daily_totals_on(day_condition, name):
+        # Накопительные итоги на конец последнего дня с движением, удовлетворяющего условию
+        return (
+            select(
+                warehouse_balance_daily.c.incoming_total,
+                warehouse_balance_daily.c.outgoing_total,
             )
-        ],
-        else_=warehouse_register_movement.c.amount
+            .where(
+                warehouse_balance_daily.c.organization_id == ledger.c.organization_id,
+                warehouse_balance_daily.c.warehouse_id == ledger.c.warehouse_id,
+                warehouse_balance_daily.c.nomenclature_id == ledger.c.nomenclature_id,
+                day_condition,
+            )
+            .order_by(desc(warehouse_balance_daily.c.day))
+            .limit(1)
+            .lateral(name)
+        )
 
+    columns = [
+        nomenclature.c.id,
+        nomenclature.c.name,
+        nomenclature.c.category,
+        ledger.c.organization_id,
+        ledger.c.warehouse_id,
+        organizations.c.short_name.label("organization_name"),
+        warehouses.c.name.label("warehouse_name"),
+        ledger.c.incoming_amount.label("end_incoming"),
+        ledger.c.outgoing_amount.label("end_outgoing"),
+        ledger.c.current_amount.label("now_ost"),
+        literal(0.0).label("start_incoming"),
+        literal(0.0).label("start_outgoing"),
+    ]
+    from_clause = (
+        ledger
+        .join(nomenclature, nomenclature.c.id == ledger.c.nomenclature_id)
+        .join(warehouses, warehouses.c.id == ledger.c.warehouse_id)
+        .outerjoin(organizations, organizations.c.id == ledger.c.organization_id)
     )
+    # дни снимков считаются в UTC, как в триггере на warehouse_register_movement
+    if date_from:
+        start = daily_totals_on(
+            warehouse_balance_daily.c.day < datetime.utcfromtimestamp(date_from).date(), "start_totals"
+        )
+        from_clause = from_clause.outerjoin(start, true())
+        columns[-2:] = [
+            func.coalesce(start.c.incoming_total, 0).label("start_incoming"),
+            func.coalesce(start.c.outgoing_total, 0).label("start_outgoing"),
+        ]
+    if date_to:
+        end = daily_totals_on(
+            warehouse_balance_daily.c.day <= datetime.utcfromtimestamp(date_to).date(), "end_totals"
+        )
+        from_clause = from_clause.outerjoin(end, true())
+        columns[7:9] = [
+            func.coalesce(end.c.incoming_total, 0).label("end_incoming"),
+            func.coalesce(end.c.outgoing_total, 0).label("end_outgoing"),
+        ]
+
     query = (
-        select(
-            nomenclature.c.id,
-            nomenclature.c.name,
-            nomenclature.c.category,
-            warehouse_register_movement.c.organization_id,
-            warehouse_register_movement.c.warehouse_id,
-            func.sum(q).label("current_amount"))
+        select(*columns)
+        .select_from(from_clause)
         .where(*selection_conditions)
+        .order_by(nomenclature.c.id, ledger.c.organization_id)
         .limit(limit)
         .offset(offset)
-    ).group_by(
-               nomenclature.c.name,
-               nomenclature.c.id,
-               warehouse_register_movement.c.organization_id,
-               warehouse_register_movement.c.warehouse_id
-               )\
-        .select_from(warehouse_register_movement
-                     .join(nomenclature,
-                           warehouse_register_movement.c.nomenclature_id == nomenclature.c.id
-                           ))
-
-    warehouse_balances_db_curr = await database.fetch_all(query)
-
+    )
+    warehouse_balances_db = await database.fetch_all(query)
 
-    # warehouse_balances_db = [*map(datetime_to_timestamp, warehouse_balances_db)]
     res = []
-
-    categories_db = await database.fetch_all(categories.select())
-
-    res_with_cats = []
-
     for warehouse_balance in warehouse_balances_db:
+        plus_amount = warehouse_balance.end_incoming - warehouse_balance.start_incoming
+        minus_amount = warehouse_balance.end_outgoing - warehouse_balance.start_outgoing
+        res.append({
+            "id": warehouse_balance.id,
+            "name": warehouse_balance.name,
+            "category": warehouse_balance.category,
+            "organization_id": warehouse_balance.organization_id or None,
+            "organization_name": warehouse_balance.organization_name,
+            "warehouse_id": warehouse_balance.warehouse_id,
+            "warehouse_name": warehouse_balance.warehouse_name,
+            "current_amount": plus_amount - minus_amount,
+            "plus_amount": plus_amount,
+            "minus_amount": minus_amount,
+            "start_ost": warehouse_balance.start_incoming - warehouse_balance.start_outgoing,
+            "now_ost": warehouse_balance.now_ost,
+        })
+
+    category_ids = {item["category"] for item in res if item["category"] is not None}
+    categories_db = []
+    if category_ids:
+        categories_db = await database.fetch_all(categories.select().where(categories.c.id.in_(category_ids)))
 
-        current = [item for item in warehouse_balances_db_curr if item.id == warehouse_balance.id]
-
-        balance_dict = dict(warehouse_balance)
-
-        organization_db = await database.fetch_one(organizations.select().where(organizations.c.id == warehouse_balance.organization_id))
-        warehouse_db = await database.fetch_one(warehouses.select().where(warehouses.c.id == warehouse_balance.warehouse_id))
-
-        plus_amount = 0
-        minus_amount = 0
-
-        register_q = warehouse_register_movement.select().where(
-            warehouse_register_movement.c.warehouse_id == warehouse_id, 
-            warehouse_register_movement.c.nomenclature_id == warehouse_balance.id,
-            *dates_arr
-        )\
-        .order_by(warehouse_register_movement.c.id)
-
-
-        register_events = await database.fetch_all(register_q)
-
-        for reg_event in register_events:
-            if reg_event.type_amount == "plus":
-                plus_amount += reg_event.amount
-            else:
-                minus_amount += reg_event.amount
-
-        print(current)
-        balance_dict['now_ost'] = current[0].current_amount
-        balance_dict['start_ost'] = balance_dict['current_amount'] - plus_amount + minus_amount
-        balance_dict['plus_amount'] = plus_amount
-        balance_dict['minus_amount'] = minus_amount
-        balance_dict['organization_name'] = organization_db.short_name
-        balance_dict['warehouse_name'] = warehouse_db.name
-
-        res.append(balance_dict)
-
+    res_with_cats = []
     for category in categories_db:
         cat_childrens = [item for item in res if item['category'] == category.id]
 
@@ -332,7 +295,7 @@ async def alt_get_warehouse_balances(
                     "children": cat_childrens
                 }
             )
-        
+
     none_childrens = [item for item in res if item['category'] == None]
     res_with_cats.append(
                 {
@@ -342,7 +305,7 @@ async def alt_get_warehouse_balances(
                 }
             )
 
-
     return {"result": res_with_cats}
 
-add_pagination(router)
\ No newline at end of file
+
+add_pagination(router)
@@ -6,6 +6,7 @@ from common.geocoders.instance import geocoder
 from database.db import database, warehouses, warehouse_hash
 from fastapi import APIRouter, HTTPException
 from functions.helpers import check_entity_exists, datetime_to_timestamp, get_entity_by_id, get_user_by_token, create_entity_hash, update_entity_hash
+from functions.reference_cache import reference_cache
 from sqlalchemy import func, select
 from ws_manager import manager
 
@@ -136,6 +137,7 @@ async def edit_warehouse(
             warehouses.update().where(warehouses.c.id == idx, warehouses.c.cashbox == user.cashbox_id).values(warehouse_values)
         )
         await database.execute(query)
+        reference_cache.invalidate(user.cashbox_id, "warehouses", [idx])
         warehouse_db = await get_entity_by_id(warehouses, idx,user.cashbox_id)
         await update_entity_hash(table=warehouses, table_hash=warehouse_hash, entity=warehouse_db)
 
@@ -160,6 +162,7 @@ async def delete_warehouse(token: str, idx: int):
         warehouses.update().where(warehouses.c.id == idx, warehouses.c.cashbox == user.cashbox_id).values({"is_deleted": True})
     )
     await database.execute(query)
+    reference_cache.invalidate(user.cashbox_id, "warehouses", [idx])
 
     query = warehouses.select().where(warehouses.c.id == idx, warehouses.c.cashbox == user.cashbox_id)
     warehouse_db = await database.fetch_one(query)
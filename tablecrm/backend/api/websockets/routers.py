@@ -3,7 +3,7 @@ from fastapi import APIRouter, WebSocket, WebSocketDisconnect, status
 from ws_manager import manager
 
 from database.db import database
-from database.db import users, users_cboxes_relation
+from database.db import users_cboxes_relation
 
 import json
 
@@ -13,10 +13,10 @@ router = APIRouter(tags=["ws"])
 @router.websocket("/ws/{ws_token}/")
 async def websocket(ws_token: str, websocket: WebSocket):
     """Вебсокет"""
-    query = users.select().where(users_cboxes_relation.c.token == ws_token)
+    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == ws_token)
     user = await database.fetch_one(query=query)
     if user:
-        await manager.connect(ws_token, websocket)
+        await manager.connect(ws_token, websocket, user.cashbox_id)
         try:
             while True:
                 data = await websocket.receive_text()
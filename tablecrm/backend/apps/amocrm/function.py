@@ -1,7 +1,7 @@
 import asyncio
 from datetime import datetime
 
-import aiohttp
+from common.http_client.registry import http_clients
 
 from database.db import amo_install, database, amo_install_table_cashboxes, cboxes, amo_settings
 from functions.helpers import gen_token
@@ -10,7 +10,7 @@ from ws_manager import manager
 
 async def update_amo_install(amo_post_json, ref, install, code):
     amo_db_data = dict(install)
-    async with aiohttp.ClientSession() as session1:
+    async with http_clients.session("amocrm") as session1:
         async with session1.post(f'https://{ref}/oauth2/access_token', json=amo_post_json) as resp:
             amo_resp_json1 = await resp.json()
 
@@ -19,7 +19,7 @@ async def update_amo_install(amo_post_json, ref, install, code):
     if amo_token:
         if not install.field_id:
             headers = {'Authorization': f'Bearer {amo_token}'}
-            async with aiohttp.ClientSession(headers=headers) as session:
+            async with http_clients.session("amocrm", headers=headers) as session:
                 field_id = None
                 async with session.get(f'https://{ref}/api/v4/contacts/custom_fields') as resp3:
                     amo_resp_json3 = await resp3.json()
@@ -65,7 +65,7 @@ async def update_amo_install(amo_post_json, ref, install, code):
 
 
 async def add_amo_install(amo_post_json, ref, platform, setting_info_id):
-    async with aiohttp.ClientSession() as session:
+    async with http_clients.session("amocrm") as session:
         async with session.post(f'https://{ref}/oauth2/access_token', json=amo_post_json) as resp:
             amo_resp_json1 = await resp.json()
 
@@ -75,7 +75,7 @@ async def add_amo_install(amo_post_json, ref, platform, setting_info_id):
 
     if amo_token:
         headers = {'Authorization': f'Bearer {amo_token}'}
-        async with aiohttp.ClientSession(headers=headers) as session:
+        async with http_clients.session("amocrm", headers=headers) as session:
             async with session.get(f'https://{ref}/api/v4/account') as resp:
                 amo_resp_json2 = await resp.json()
             async with session.get(f'https://{ref}/api/v4/contacts/custom_fields') as resp3:
@@ -139,7 +139,7 @@ async def refresh_token(referer):
             # q = cboxes.select().where(cboxes.c.id == amo_tablecrm_rel.cashbox_id)
             # cashbox = await database.fetch_one(query)
 
-            async with aiohttp.ClientSession() as session1:
+            async with http_clients.session("amocrm") as session1:
                 async with session1.post(f'https://{referer}/oauth2/access_token', json=amo_post_json) as resp:
                     amo_resp_json = await resp.json()
                     # event_body = {
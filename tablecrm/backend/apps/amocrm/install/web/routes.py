@@ -1,6 +1,6 @@
 from datetime import datetime
 
-import aiohttp
+from common.http_client.registry import http_clients
 from fastapi import HTTPException, APIRouter
 from sqlalchemy import and_, select
 from starlette import status
@@ -50,7 +50,7 @@ async def sc_l(code: str, referer: str, platform: int, client_id: str, from_widg
         if install_group_info:
             install_group = install_group_info.id
 
-    async with aiohttp.ClientSession() as session:
+    async with http_clients.session("amocrm") as session:
 
         amocrm_auth = AmoCRMAuthenticator(session, client_id, setting_info.client_secret,
                                           setting_info.redirect_uri, referer)
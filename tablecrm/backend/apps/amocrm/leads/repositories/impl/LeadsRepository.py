@@ -1,4 +1,4 @@
-import aiohttp
+from common.http_client.registry import http_clients
 
 from apps.amocrm.leads.repositories.core.ILeadsRepository import ILeadsRepository
 from apps.amocrm.leads.repositories.models.CreateLeadModel import CreateLeadModel
@@ -10,7 +10,7 @@ class LeadsRepository(ILeadsRepository):
         self.__base_url = "https://{}/api/v4/leads/complex"
 
     async def create_lead(self, access_token: str, amo_lead_model: CreateLeadModel, referrer: str):
-        async with aiohttp.ClientSession(trust_env=True) as http_session:
+        async with http_clients.session("amocrm") as http_session:
             async with http_session.post(
                 self.__base_url.format(referrer),
                 json=[amo_lead_model.dict(exclude_defaults=True, exclude_none=True, by_alias=True)],
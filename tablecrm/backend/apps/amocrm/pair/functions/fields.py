@@ -1,6 +1,6 @@
 import json
 
-import aiohttp
+from common.http_client.registry import http_clients
 from sqlalchemy import or_
 
 from database.db import amo_custom_fields, amo_install_custom_fields, TypeCustomField, database
@@ -38,7 +38,7 @@ async def create_amo_group_contacts(referer: str, access_token: str):
     headers = {'Authorization': f'Bearer {access_token}'}
     group_id = None
 
-    async with aiohttp.ClientSession(headers=headers) as http_session:
+    async with http_clients.session("amocrm", headers=headers) as http_session:
         url = f"https://{referer}/api/v4/contacts/custom_fields/groups"
         async with http_session.get(url) as groups_resp:
             groups_resp.raise_for_status()
@@ -71,7 +71,7 @@ async def create_amo_group_leads(referer: str, access_token: str):
     headers = {'Authorization': f'Bearer {access_token}'}
     group_id = None
 
-    async with aiohttp.ClientSession(headers=headers) as http_session:
+    async with http_clients.session("amocrm", headers=headers) as http_session:
         url = f"https://{referer}/api/v4/leads/custom_fields/groups"
 
         async with http_session.get(url) as groups_resp:
@@ -104,7 +104,7 @@ async def create_amo_group_leads(referer: str, access_token: str):
 async def post_custom_fields_leads(fields_predata, referer: str, access_token: str):
     field_ids = []
     headers = {'Authorization': f'Bearer {access_token}'}
-    async with aiohttp.ClientSession(headers=headers) as http_session:
+    async with http_clients.session("amocrm", headers=headers) as http_session:
         url = f"https://{referer}/api/v4/leads/custom_fields"
         request_json = json.dumps(fields_predata)
         async with http_session.post(url, data=request_json) as groups_resp:
@@ -120,7 +120,7 @@ async def post_custom_fields_leads(fields_predata, referer: str, access_token: s
 async def post_custom_fields_contacts(fields_predata, referer: str, access_token: str):
     field_ids = []
     headers = {'Authorization': f'Bearer {access_token}'}
-    async with aiohttp.ClientSession(headers=headers) as http_session:
+    async with http_clients.session("amocrm", headers=headers) as http_session:
         url = f"https://{referer}/api/v4/contacts/custom_fields"
         request_json = json.dumps(fields_predata)
         async with http_session.post(url, data=request_json) as groups_resp:
@@ -213,7 +213,7 @@ async def get_custom_fields_codes_leads(referer: str, access_token: str):
     codes = []
     custom_fields_url = f'https://{referer}/api/v4/leads/custom_fields'
     headers = {'Authorization': f'Bearer {access_token}'}
-    async with aiohttp.ClientSession(headers=headers) as session:
+    async with http_clients.session("amocrm", headers=headers) as session:
         async with session.get(custom_fields_url) as response:
             response.raise_for_status()
             data = await response.json()
@@ -227,7 +227,7 @@ async def get_custom_fields_codes_contacts(referer: str, access_token: str):
     codes = []
     custom_fields_url = f'https://{referer}/api/v4/contacts/custom_fields'
     headers = {'Authorization': f'Bearer {access_token}'}
-    async with aiohttp.ClientSession(headers=headers) as session:
+    async with http_clients.session("amocrm", headers=headers) as session:
         async with session.get(custom_fields_url) as response:
             response.raise_for_status()
             data = await response.json()
@@ -9,6 +9,7 @@ from database.db import database, booking, users, booking_nomenclature, nomencla
     amo_leads, booking_tags, contragents, booking_events, booking_events_photo, pictures
 from sqlalchemy import or_, and_, select, func, desc, update
 from functions.helpers import get_user_by_token
+from functions.reference_cache import reference_cache
 from apps.booking.schemas import ResponseCreate, BookingList, Booking, BookingCreateList, BookingEdit, \
     BookingEditList, NomenclatureBookingEdit, NomenclatureBookingCreate, BookingFiltersList, BookingCreate
 from ws_manager import manager
@@ -202,7 +203,14 @@ async def create_booking(token: str, bookings: BookingCreateList):
     request_id = 0
 
     try:
-        for bookingItem in bookings.dict()["__root__"]:
+        bookings_data = bookings.dict()["__root__"]
+        missing_nomenclature = await reference_cache.missing(
+            user.get("cashbox_id"),
+            "nomenclature",
+            [good_info["nomenclature_id"] for bookingItem in bookings_data for good_info in bookingItem["goods"]],
+        )
+
+        for bookingItem in bookings_data:
             request_id += 1
 
             skip_iteration_outer = False
@@ -212,18 +220,7 @@ async def create_booking(token: str, bookings: BookingCreateList):
             exception = {}
 
             for good_info in bookingItem.pop("goods"):
-                query = (
-                    select(
-                        nomenclature.c.id
-                    )
-                    .where(and_(
-                        nomenclature.c.id == good_info["nomenclature_id"],
-                        nomenclature.c.cashbox == user.get("cashbox_id")
-                    ))
-                )
-                nomenclature_info = await database.fetch_one(query)
-
-                if not nomenclature_info:
+                if good_info["nomenclature_id"] in missing_nomenclature:
                     skip_iteration_outer = True
                     exception["request_id"] = request_id
                     exception["error"] = "Nomenclature not found"
@@ -7,13 +7,13 @@ from api.nomenclature.schemas import NomenclatureCreateMass
 from .schemas import EvotorInstallEvent, EvotorUserToken, ListEvotorNomenclature
 from fastapi.security import HTTPAuthorizationCredentials, HTTPBearer
 from database.db import database, integrations, integrations_to_cashbox, evotor_credentials, warehouses, users_cboxes_relation, nomenclature, prices
+from common.http_client.registry import http_clients
 from functions.helpers import get_user_by_token
 from ws_manager import manager
 from sqlalchemy import or_, and_, select
 from api.loyality_cards.schemas import LoyalityCardFilters
 from api.docs_sales.schemas import CreateMass as CreateMassDocSales, Create
 from api.loyality_settings.routers import get_loyality_settings
-import aiohttp
 
 
 security = HTTPBearer()
@@ -157,6 +157,22 @@ async def create_doc_sales(
         warehouse_id: int = Depends(has_store),
         ):
     try:
+        # номенклатура всех чеков пачки одним запросом по external_id
+        external_ids = {
+            str(good.nomenclature)
+            for item in docs_sales_data.__getattribute__("__root__")
+            for good in item.goods or []
+            if good.nomenclature
+        }
+        nomenclature_by_external_id = {}
+        if external_ids:
+            nomenclature_rows = await database.fetch_all(
+                select(nomenclature.c.id, nomenclature.c.external_id).where(
+                    nomenclature.c.external_id.in_(external_ids)
+                )
+            )
+            nomenclature_by_external_id = {row.external_id: row.id for row in nomenclature_rows}
+
         docs_data = []
         for item in docs_sales_data.__getattribute__("__root__"):
             item = dict(item)
@@ -165,14 +181,14 @@ async def create_doc_sales(
             
             for good in item.get("goods"):
                 if good.nomenclature:
-                    good_db = await database.fetch_one(nomenclature.select().where(nomenclature.c.external_id == good.nomenclature))
-                    if good_db:
-                        good.nomenclature = good_db.get("id")
+                    good_id = nomenclature_by_external_id.get(str(good.nomenclature))
+                    if good_id:
+                        good.nomenclature = good_id
                         doc_goods_data.append(good)
                     else:
                         user = await get_user_by_token(token)
                         token_evotor = await get_token_evotor(cashbox_id = user.get("id"), integration_id = 2)
-                        async with aiohttp.ClientSession(trust_env = True) as session:
+                        async with http_clients.session("evotor") as session:
                             async with session.get(
                                     f'https://api.evotor.ru/stores/'
                                     f'{req.headers.get("x-evotor-store-uuid")}'
@@ -195,6 +211,7 @@ async def create_doc_sales(
                                     "cashback_type": "lcard_cashback"
                                 }
                             ]))
+                        nomenclature_by_external_id[str(good.nomenclature)] = good_id[0].get("id")
                         good.nomenclature = good_id[0].get("id")
                         
                         doc_goods_data.append(good)
@@ -220,7 +237,8 @@ async def create_doc_sales(
         return await createDocSales(
             token=token,
             docs_sales_data=CreateMassDocSales(__root__=docs_data),
-            generate_out=generate_out
+            generate_out=generate_out,
+            bulk=True
         )
     except Exception as e:
         print(e)
@@ -329,7 +347,7 @@ async def stores(token: str, id_integration: int):
     try:
         user = await get_user_by_token(token)
         token = await get_token_evotor(cashbox_id = user.get("id"), integration_id=id_integration)
-        async with aiohttp.ClientSession(trust_env=True) as session:
+        async with http_clients.session("evotor") as session:
             async with session.get(
                     f'https://api.evotor.ru/stores',
                     headers={
@@ -1,10 +1,10 @@
-import aiohttp
 from fastapi import APIRouter, HTTPException
 from sqlalchemy import and_, select
 from starlette.responses import RedirectResponse
 
 from apps.tochka_bank.routes import integration_info
 from database.db import database, pboxes, module_bank_credentials, module_bank_accounts, integrations_to_cashbox
+from common.http_client.registry import http_clients
 from functions.helpers import get_user_by_token
 from ws_manager import manager
 
@@ -19,7 +19,7 @@ async def moduloauth(code: str, state: int):
     if not user_integration:
         raise HTTPException(status_code=432, detail=f"user not found with integration")
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
+    async with http_clients.session("module_bank") as session:
         async with session.post(
                 f'https://api.modulbank.ru/v1/oauth/token',
                 json={
@@ -1,8 +1,8 @@
-import aiohttp
 # from jobs.jobs import scheduler
 from fastapi import APIRouter, HTTPException
 from fastapi.responses import RedirectResponse
 from database.db import integrations, integrations_to_cashbox, users_cboxes_relation, database, tochka_bank_credentials, pboxes, tochka_bank_accounts
+from common.http_client.registry import http_clients
 from datetime import datetime
 from sqlalchemy import or_, and_, select
 from functions.helpers import get_user_by_token
@@ -35,7 +35,7 @@ async def refresh_token(integration_cashboxes: int):
         integrations.select().where(integrations.c.id == integration_cbox.get('integration_id')))
     credentials = await database.fetch_one(
         tochka_bank_credentials.select().where(tochka_bank_credentials.c.integration_cashboxes == integration_cashboxes))
-    async with aiohttp.ClientSession(trust_env = True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(f'https://enter.tochka.com/connect/token', data = {
             'client_id': integration.get('client_app_id'),
             'client_secret': integration.get('client_secret'),
@@ -63,7 +63,7 @@ async def tochkaoauth(code: str, state: int):
     if not user_integration:
         raise HTTPException( status_code = 432, detail = f"user not found with integration")
 
-    async with aiohttp.ClientSession(trust_env=True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(
                 'https://enter.tochka.com/connect/token',
                 data={
@@ -94,7 +94,7 @@ async def tochkaoauth(code: str, state: int):
     except Exception as error:
         raise HTTPException(status_code=433, detail=str(error))
 
-    async with aiohttp.ClientSession(trust_env = True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.get(f'https://enter.tochka.com/uapi/open-banking/v1.0/accounts',
                                headers={
                                        'Authorization': f'Bearer {token_json.get("access_token")}',
@@ -104,7 +104,7 @@ async def tochkaoauth(code: str, state: int):
         await session.close()
     if len(accounts_json.get("Data").get("Account")) > 0:
         for account in accounts_json.get("Data").get("Account"):
-            async with aiohttp.ClientSession(trust_env = True) as session:
+            async with http_clients.session("tochka") as session:
                 async with session.get(
                             f'https://enter.tochka.com/uapi/open-banking/v1.0/accounts/{account.get("accountId")}/balances',
                             headers={
@@ -184,7 +184,7 @@ async def get_token_for_scope(token: str, id_integration: int):
     user = await get_user_by_token(token)
     user_integration = await integration_info(user.get('cashbox_id'), id_integration)
 
-    async with aiohttp.ClientSession(trust_env = True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(f'https://enter.tochka.com/connect/token', data = {
             'client_id': user_integration.get('client_app_id'),
             'client_secret': user_integration.get('client_secret'),
@@ -194,7 +194,7 @@ async def get_token_for_scope(token: str, id_integration: int):
             token_scope_json = await resp.json()
         await session.close()
 
-    async with aiohttp.ClientSession(trust_env = True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(f'https://enter.tochka.com/uapi/v1.0/consents', json = {
             "Data": {
                 "permissions": [
@@ -367,7 +367,7 @@ async def update_account(token: str, idx: int, account: AccountUpdate):
                         values(updated_account.dict()))
         account_result = await database.fetch_one(tochka_bank_accounts.select().where(tochka_bank_accounts.c.id == idx))
         if account_result.get('is_active'):
-            await tochka_update_transaction()
+            await tochka_update_transaction(account_id=idx)
         return {'result': account_result}
     except Exception as error:
         raise HTTPException(status_code=432, detail=str(error))
@@ -35,6 +35,7 @@ from database.db import database, cboxes, users, users_cboxes_relation, accounts
     articles, cheques, contragents, messages
 from functions.cboxes import create_cbox, join_cbox
 from functions.helpers import gen_token
+from functions.token_resolver import token_resolver
 from common.s3_service.impl.S3ServiceFactory import S3ServiceFactory
 from common.s3_service.models.S3SettingsModel import S3SettingsModel
 from producer import produce_message
@@ -230,6 +231,7 @@ async def generate_new_user_access_token_for_cashbox(user_id: int, cashbox_id: i
         {"token": token}
     )
     await database.execute(query)
+    token_resolver.invalidate_where(cashbox_id=cashbox_id, user_id=user_id)
     return token
 
 
@@ -632,6 +634,7 @@ async def cmd_id_groups(message: types.Message, state: FSMContext):
                         {"token": new_token})
 
                     await database.execute(query)
+                    token_resolver.invalidate_where(cashbox_id=cbox.id, user_id=user_and_chat.id)
                     answer = texts.change_token.format(token=new_token, url=app_url)
                     await message.answer(text=answer, reply_markup=await get_open_app_link(new_token))
                     await store_bot_message(message.message_id + 1, message.chat.id, bot.id, answer)
@@ -1,4 +1,5 @@
 import aiohttp
+from common.http_client.registry import http_clients
 from sqlalchemy import select
 
 from database.db import tochka_bank_credentials, tochka_bank_accounts, database
@@ -70,7 +71,7 @@ async def send_payment_to_tochka(
         }
     }
     
-    async with aiohttp.ClientSession() as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(url, json=payload, headers=headers) as response:
             response_data = await response.json()
             
@@ -1,4 +1,5 @@
 from abc import ABC, abstractmethod
+from typing import List
 
 from common.apple_wallet_service.impl.models import PassParamsModel
 
@@ -13,5 +14,9 @@ class IWalletPassGeneratorService(ABC):
         ...
 
     @abstractmethod
-    async def update_pass(self, card_id: int) -> tuple[str, str]:
+    async def update_pass(self, card_id: int, force: bool = False) -> tuple[str, str]:
+        ...
+
+    @abstractmethod
+    async def update_passes(self, card_ids: List[int], concurrency: int, force: bool = False) -> List[int]:
         ...
@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from common.s3_service.core.IS3Client import IS3Client
+
+
+class WalletAssetCache:
+    """
+    Кэш изображений пассов (icon/logo/strip) из настроек карт.
+
+    Память — LRU с ограничением по суммарному размеру, за ней — файлы на диске
+    с ETag в имени. ETag объекта в S3 перепроверяется HEAD-запросом не чаще
+    раза в ttl секунд, поэтому пачка пассов одной кассы скачивает каждую
+    картинку один раз. Локальные файлы (путь с '/') версионируются по mtime.
+    """
+
+    def __init__(
+            self,
+            s3_client: IS3Client,
+            bucket_name: str,
+            max_memory_bytes: int = int(os.getenv("APPLE_WALLET_ASSET_CACHE_BYTES", 64 * 1024 * 1024)),
+            ttl: float = float(os.getenv("APPLE_WALLET_ASSET_TTL", 300)),
+            cache_dir: str = os.getenv(
+                "APPLE_WALLET_ASSET_CACHE_DIR", os.path.join(tempfile.gettempdir(), "apple_wallet_assets")
+            ),
+    ):
+        self.__s3_client = s3_client
+        self.__bucket_name = bucket_name
+        self.max_memory_bytes = max_memory_bytes
+        self.ttl = ttl
+        self.cache_dir = cache_dir
+        # path -> (etag, data, время проверки etag)
+        self.__memory: "OrderedDict[str, Tuple[str, bytes, float]]" = OrderedDict()
+        self.__memory_bytes = 0
+        self.__locks: Dict[str, asyncio.Lock] = {}
+
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "items": len(self.__memory),
+            "bytes": self.__memory_bytes,
+        }
+
+    def __remember(self, path: str, etag: str, data: bytes):
+        previous = self.__memory.pop(path, None)
+        if previous is not None:
+            self.__memory_bytes -= len(previous[1])
+        self.__memory[path] = (etag, data, time.monotonic())
+        self.__memory_bytes += len(data)
+        while self.__memory_bytes > self.max_memory_bytes and len(self.__memory) > 1:
+            _, (_, evicted, _) = self.__memory.popitem(last=False)
+            self.__memory_bytes -= len(evicted)
+
+    def __disk_path(self, path: str, etag: str) -> str:
+        name = hashlib.sha1(f"{path}:{etag}".encode("utf-8")).hexdigest()
+        return os.path.join(self.cache_dir, name)
+
+    def __read_disk(self, path: str, etag: str) -> Optional[bytes]:
+        try:
+            with open(self.__disk_path(path, etag), "rb") as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def __write_disk(self, path: str, etag: str, data: bytes):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            target = self.__disk_path(path, etag)
+            with tempfile.NamedTemporaryFile(dir=self.cache_dir, delete=False) as tmp:
+                tmp.write(data)
+            os.replace(tmp.name, target)
+        except OSError:
+            # диск — только второй уровень кэша, без него просто чаще ходим в S3
+            pass
+
+    async def __current_etag(self, path: str) -> str:
+        if path.startswith('/'):
+            return str(os.stat(path).st_mtime_ns)
+        head = await self.__s3_client.head_object(self.__bucket_name, path)
+        return head["ETag"]
+
+    async def get(self, path: str) -> bytes:
+        cached = self.__memory.get(path)
+        if cached is not None and time.monotonic() - cached[2] < self.ttl:
+            self.__memory.move_to_end(path)
+            self.hits += 1
+            return cached[1]
+
+        lock = self.__locks.setdefault(path, asyncio.Lock())
+        async with lock:
+            cached = self.__memory.get(path)
+            if cached is not None and time.monotonic() - cached[2] < self.ttl:
+                self.hits += 1
+                return cached[1]
+
+            etag = await self.__current_etag(path)
+            if cached is not None and cached[0] == etag:
+                self.__remember(path, etag, cached[1])
+                self.hits += 1
+                return cached[1]
+
+            data = self.__read_disk(path, etag)
+            if data is not None:
+                self.__remember(path, etag, data)
+                self.hits += 1
+                return data
+
+            self.misses += 1
+            if path.startswith('/'):
+                with open(path, 'rb') as f:
+                    data = f.read()
+            else:
+                data, etag = await self.__s3_client.get_object_with_etag(self.__bucket_name, path)
+                self.__write_disk(path, etag, data)
+            self.__remember(path, etag, data)
+            return data
@@ -1,30 +1,74 @@
+import asyncio
+import hashlib
 import json
+import logging
+import multiprocessing
 import os
-import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Dict, List, Optional
 
-from py_pkpass.models import StoreCard, Pass, BarcodeFormat, Barcode, Field
-from sqlalchemy import select
+from sqlalchemy import select, func
+from sqlalchemy.dialects.postgresql import insert
 
 from api.apple_wallet_card_settings.schemas import WalletCardSettings
 from api.apple_wallet_card_settings.utils import create_default_apple_wallet_setting
 from common.apple_wallet_service.IWalletPassGeneratorService import IWalletPassGeneratorService
+from common.apple_wallet_service.impl.WalletAssetCache import WalletAssetCache
 from common.apple_wallet_service.impl.models import PassParamsModel
-from database.db import loyality_cards, contragents, organizations, database, apple_wallet_card_settings
+from common.apple_wallet_service.impl.pass_signer import build_pkpass
+from database.db import loyality_cards, contragents, organizations, database, apple_wallet_card_settings, \
+    apple_wallet_pass_fingerprints
 from common.s3_service.impl.S3Client import S3Client
 from common.s3_service.models.S3SettingsModel import S3SettingsModel
 
 
 # load_dotenv()
 
+logger = logging.getLogger(__name__)
+
+BUCKET_NAME = "5075293c-docs_generated"
+SIGN_WORKERS = int(os.getenv("APPLE_WALLET_SIGN_WORKERS", 2))
+
+# Общие для всех экземпляров сервиса: клиент S3, кэш картинок и пул подписи
+_s3_client = S3Client(S3SettingsModel(
+    aws_access_key_id=os.getenv("S3_ACCESS"),
+    aws_secret_access_key=os.getenv("S3_SECRET"),
+    endpoint_url=os.getenv("S3_URL")
+))
+_asset_cache = WalletAssetCache(_s3_client, BUCKET_NAME)
+_sign_pool: Optional[ProcessPoolExecutor] = None
+
+
+def _get_sign_pool() -> ProcessPoolExecutor:
+    global _sign_pool
+    if _sign_pool is None:
+        _sign_pool = ProcessPoolExecutor(max_workers=SIGN_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _sign_pool
+
+
+def pass_fingerprint(card, card_settings: WalletCardSettings) -> str:
+    """Отпечаток всего, что попадает в пасс: если он не изменился, пасс не пересобирается."""
+    content = {
+        "balance": card.balance,
+        "cashback_percent": card.cashback_percent,
+        "advertisement": card.apple_wallet_advertisement,
+        "contragent_name": card.contragent_name,
+        "organization_name": card.organization_name,
+        "card_number": card.card_number,
+        "settings": card_settings.dict(),
+        "pass_type_id": os.getenv('APPLE_PASS_TYPE_ID'),
+        "app_url": os.getenv("APP_URL"),
+    }
+    return hashlib.sha256(json.dumps(content, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
 class WalletPassGeneratorService(IWalletPassGeneratorService):
     def __init__(self):
         self.__wallet_pass_folder = 'apple_wallet_passes'
-        self.__bucket_name = "5075293c-docs_generated"
-        self.__s3_client = S3Client(S3SettingsModel(
-            aws_access_key_id=os.getenv("S3_ACCESS"),
-            aws_secret_access_key=os.getenv("S3_SECRET"),
-            endpoint_url=os.getenv("S3_URL")
-        ))
+        self.__bucket_name = BUCKET_NAME
+        self.__s3_client = _s3_client
+        self.__asset_cache = _asset_cache
 
     async def _get_image_from_s3_or_local(self, path: str) -> bytes:
         """
@@ -32,118 +76,33 @@ class WalletPassGeneratorService(IWalletPassGeneratorService):
         Если путь начинается с '/', то это локальный файл.
         Иначе это ключ в S3.
         """
-        if path.startswith('/'):
-            # Локальный файл
-            with open(path, 'rb') as f:
-                return f.read()
-        else:
-            # Файл в S3
-            return await self.__s3_client.get_object(self.__bucket_name, path)
+        return await self.__asset_cache.get(path)
+
+    async def _sign(self, params: dict, assets: Dict[str, bytes]) -> bytes:
+        global _sign_pool
+        loop = asyncio.get_running_loop()
+        try:
+            return await loop.run_in_executor(_get_sign_pool(), build_pkpass, params, assets)
+        except BrokenProcessPool:
+            # процесс пула упал — следующая подпись поднимет новый пул
+            _sign_pool = None
+            raise
 
     async def _generate_pkpass(self, pass_params: PassParamsModel) -> tuple[str, str]:
-        # Create a store card pass type
-        card_info = StoreCard()
-        balance_field = Field('H1', str(pass_params.balance), 'Баланс')
-        balance_field.changeMessage = 'Ваш баланс %@'
-        cashback_field = Field('H2', str(pass_params.cashback_persent) + '%', 'Бонусы')
-        cashback_field.changeMessage = 'Ваш кешбек теперь %@'
-
-        ad_field = Field('B1', pass_params.advertisement, 'Акции')
-        ad_field.changeMessage = "%@"
-
-        card_info.headerFields.append(balance_field)
-        card_info.headerFields.append(cashback_field)
-        card_info.backFields.append(ad_field)
-
-        card_info.addSecondaryField('S1', pass_params.contragent_name, 'ВЛАДЕЛЕЦ КАРТЫ')
-        card_info.addSecondaryField('S2', pass_params.card_number, 'НОМЕР КАРТЫ')
-
-        # Create the Pass object with the required identifiers
-        passfile = Pass(
-            card_info,
-            passTypeIdentifier=os.getenv('APPLE_PASS_TYPE_ID'),
-            organizationName=pass_params.organization_name,
-            teamIdentifier=os.getenv('APPLE_TEAM_ID')
+        # Картинки из кэша настроек карт, подпись — в пуле процессов
+        icon_data, logo_data, strip_data = await asyncio.gather(
+            self._get_image_from_s3_or_local(pass_params.icon_path),
+            self._get_image_from_s3_or_local(pass_params.logo_path),
+            self._get_image_from_s3_or_local(pass_params.strip_path),
         )
-
-        # Set required pass information
-        passfile.serialNumber = str(pass_params.serial_number)
-        passfile.description = pass_params.description
-
-        # Add a barcode - all supported formats: PDF417, QR, AZTEC, CODE128
-        passfile.barcode = Barcode(
-            message=pass_params.card_number,
-            altText=pass_params.barcode_message,
-            format=BarcodeFormat.QR,
+        pkpass_bytes = await self._sign(
+            pass_params.dict(),
+            {"icon": icon_data, "logo": logo_data, "strip": strip_data},
         )
 
-        passfile.webServiceURL = f'https://{os.getenv("APP_URL")}/api/v1'
-        passfile.authenticationToken = pass_params.auth_token
-
-        # Optional: Set colors
-        passfile.backgroundColor = pass_params.colors.backgroundColor
-        passfile.foregroundColor = pass_params.colors.foregroundColor
-        passfile.labelColor = pass_params.colors.labelColor
-
-        passfile.logoText = pass_params.logo_text
-
-        passfile.locations = [i.dict() for i in pass_params.locations]
-
-        # Получаем изображения из S3 и создаем временные файлы
-        icon_data = await self._get_image_from_s3_or_local(pass_params.icon_path)
-        logo_data = await self._get_image_from_s3_or_local(pass_params.logo_path)
-        strip_data = await self._get_image_from_s3_or_local(pass_params.strip_path)
-
-        # Создаем временные файлы для изображений
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.png') as icon_tmp, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.png') as logo_tmp, \
-             tempfile.NamedTemporaryFile(delete=False, suffix='.png') as strip_tmp:
-
-            icon_tmp.write(icon_data)
-            logo_tmp.write(logo_data)
-            strip_tmp.write(strip_data)
-
-            icon_tmp_path = icon_tmp.name
-            logo_tmp_path = logo_tmp.name
-            strip_tmp_path = strip_tmp.name
-
-        # Создаем временный файл для pkpass
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.pkpass') as pkpass_tmp:
-            pkpass_tmp_path = pkpass_tmp.name
-
-        try:
-            # Including the icon and logo is necessary for the passbook to be valid
-            passfile.addFile('icon.png', open(icon_tmp_path, 'rb'))
-            passfile.addFile('icon@2x.png', open(icon_tmp_path, 'rb'))
-            passfile.addFile('icon@3x.png', open(icon_tmp_path, 'rb'))
-            passfile.addFile('logo.png', open(logo_tmp_path, 'rb'))
-            passfile.addFile('strip@2x.png', open(strip_tmp_path, 'rb'))
-
-            # passfile.expirationDate = pass_params.exp_date.isoformat() if pass_params.exp_date else None
-
-            # Create and output the Passbook file (.pkpass) во временный файл
-            password = os.getenv('PKPASS_PASSWORD')
-            passfile.create(
-                os.getenv('APPLE_CERTIFICATE_PATH'),
-                os.getenv('APPLE_KEY_PATH'),
-                os.getenv('APPLE_WWDR_PATH'),
-                password,
-                pkpass_tmp_path
-            )
-
-            # Загружаем pkpass файл в S3
-            with open(pkpass_tmp_path, 'rb') as f:
-                pkpass_bytes = f.read()
-
-            s3_key = f'{self.__wallet_pass_folder}/{pass_params.serial_number}.pkpass'
-            await self.__s3_client.upload_file_object(self.__bucket_name, s3_key, pkpass_bytes)
-
-        finally:
-            # Удаляем временные файлы
-            os.unlink(icon_tmp_path)
-            os.unlink(logo_tmp_path)
-            os.unlink(strip_tmp_path)
-            os.unlink(pkpass_tmp_path)
+        # Загружаем pkpass файл в S3
+        s3_key = self.get_card_s3_key(pass_params.serial_number)
+        await self.__s3_client.upload_file_object(self.__bucket_name, s3_key, pkpass_bytes)
 
         return self.get_card_path_and_name(pass_params.serial_number)
 
@@ -172,8 +131,9 @@ class WalletPassGeneratorService(IWalletPassGeneratorService):
         except Exception:
             return False
 
-    async def update_pass(self, card_id: int) -> tuple[str, str]:
-        query = (
+    @staticmethod
+    def _cards_query():
+        return (
             select(
                 loyality_cards.c.id,
                 loyality_cards.c.card_number,
@@ -183,7 +143,8 @@ class WalletPassGeneratorService(IWalletPassGeneratorService):
                 loyality_cards.c.balance,
                 loyality_cards.c.end_period,
                 loyality_cards.c.cashbox_id,
-                loyality_cards.c.apple_wallet_advertisement
+                loyality_cards.c.apple_wallet_advertisement,
+                apple_wallet_pass_fingerprints.c.fingerprint,
             )
             .select_from(
                 loyality_cards
@@ -195,36 +156,89 @@ class WalletPassGeneratorService(IWalletPassGeneratorService):
                     organizations,
                     organizations.c.id == loyality_cards.c.organization_id
                 )
-            ).where(loyality_cards.c.id == int(card_id))
+                .outerjoin(
+                    apple_wallet_pass_fingerprints,
+                    apple_wallet_pass_fingerprints.c.card_id == loyality_cards.c.id
+                )
+            )
         )
-        loyality_card_db = await database.fetch_one(query)
-
-        card_settings_query = select(apple_wallet_card_settings.c.data).where(
-            apple_wallet_card_settings.c.cashbox_id == loyality_card_db.cashbox_id)
-        card_settings_db = await database.fetch_one(card_settings_query)
-
-        if card_settings_db is None:
-            card_settings = await create_default_apple_wallet_setting(loyality_card_db.cashbox_id)
-        else:
-            card_settings = WalletCardSettings(**json.loads(card_settings_db.data))
-
-        path, filename = await self._generate_pkpass(PassParamsModel(
-            serial_number=loyality_card_db.id,
-            card_number=loyality_card_db.card_number,
-            contragent_name=loyality_card_db.contragent_name,
-            organization_name=loyality_card_db.organization_name,
+
+    @staticmethod
+    async def _get_card_settings(cashbox_ids: List[int]) -> Dict[int, WalletCardSettings]:
+        query = select(apple_wallet_card_settings.c.cashbox_id, apple_wallet_card_settings.c.data).where(
+            apple_wallet_card_settings.c.cashbox_id.in_(cashbox_ids))
+        settings = {
+            row.cashbox_id: WalletCardSettings(**json.loads(row.data))
+            for row in await database.fetch_all(query)
+        }
+        for cashbox_id in cashbox_ids:
+            if cashbox_id not in settings:
+                settings[cashbox_id] = await create_default_apple_wallet_setting(cashbox_id)
+        return settings
+
+    async def _build_pass(self, card, card_settings: WalletCardSettings, force: bool = False) -> bool:
+        """Собирает и загружает пасс карты, если изменилось его содержимое. Возвращает True, если пасс обновлён."""
+        fingerprint = pass_fingerprint(card, card_settings)
+        if not force and card.fingerprint == fingerprint:
+            return False
+
+        await self._generate_pkpass(PassParamsModel(
+            serial_number=card.id,
+            card_number=card.card_number,
+            contragent_name=card.contragent_name,
+            organization_name=card.organization_name,
             description=card_settings.description,
             barcode_message=card_settings.barcode_message,
             colors=card_settings.colors,
             icon_path=card_settings.icon_path,
             logo_path=card_settings.logo_path,
             strip_path=card_settings.strip_path,
-            cashback_persent=loyality_card_db.cashback_percent,
+            cashback_persent=card.cashback_percent,
             locations=card_settings.locations,
             logo_text=card_settings.logo_text,
-            balance=loyality_card_db.balance,
-            exp_date=loyality_card_db.end_period,
-            advertisement=loyality_card_db.apple_wallet_advertisement
+            balance=card.balance,
+            exp_date=card.end_period,
+            advertisement=card.apple_wallet_advertisement
         ))
 
-        return path, filename
+        query = insert(apple_wallet_pass_fingerprints).values(card_id=card.id, fingerprint=fingerprint)
+        query = query.on_conflict_do_update(
+            index_elements=[apple_wallet_pass_fingerprints.c.card_id],
+            set_={"fingerprint": query.excluded.fingerprint, "updated_at": func.now()},
+        )
+        await database.execute(query)
+        return True
+
+    async def update_passes(self, card_ids: List[int], concurrency: int = SIGN_WORKERS,
+                            force: bool = False) -> List[int]:
+        """
+        Пересборка пассов пачки карт: карты и настройки касс читаются
+        двумя запросами, одновременно собирается не больше concurrency пассов.
+        Возвращает id карт, чьи пассы действительно изменились.
+        """
+        if not card_ids:
+            return []
+
+        cards = await database.fetch_all(self._cards_query().where(loyality_cards.c.id.in_(card_ids)))
+        if not cards:
+            return []
+        settings = await self._get_card_settings(list({card.cashbox_id for card in cards}))
+
+        semaphore = asyncio.Semaphore(max(1, concurrency))
+
+        async def build(card) -> Optional[int]:
+            async with semaphore:
+                try:
+                    if await self._build_pass(card, settings[card.cashbox_id], force=force):
+                        return card.id
+                except Exception as e:
+                    logger.error(f"Apple Wallet pass update failed for card {card.id}: {e}")
+                return None
+
+        return [card_id for card_id in await asyncio.gather(*(build(card) for card in cards)) if card_id]
+
+    async def update_pass(self, card_id: int, force: bool = False) -> tuple[str, str]:
+        card = await database.fetch_one(self._cards_query().where(loyality_cards.c.id == int(card_id)))
+        settings = await self._get_card_settings([card.cashbox_id])
+        await self._build_pass(card, settings[card.cashbox_id], force=force)
+        return self.get_card_path_and_name(str(card.id))
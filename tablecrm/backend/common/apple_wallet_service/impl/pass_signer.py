@@ -0,0 +1,74 @@
+import os
+from io import BytesIO
+
+from py_pkpass.models import StoreCard, Pass, BarcodeFormat, Barcode, Field
+
+# Выполняется в процессах пула подписи (spawn): на вход только простые данные —
+# PassParamsModel.dict() и байты картинок, на выходе готовый .pkpass
+
+
+def build_pkpass(params: dict, assets: dict) -> bytes:
+    # Create a store card pass type
+    card_info = StoreCard()
+    balance_field = Field('H1', str(params['balance']), 'Баланс')
+    balance_field.changeMessage = 'Ваш баланс %@'
+    cashback_field = Field('H2', str(params['cashback_persent']) + '%', 'Бонусы')
+    cashback_field.changeMessage = 'Ваш кешбек теперь %@'
+
+    ad_field = Field('B1', params['advertisement'], 'Акции')
+    ad_field.changeMessage = "%@"
+
+    card_info.headerFields.append(balance_field)
+    card_info.headerFields.append(cashback_field)
+    card_info.backFields.append(ad_field)
+
+    card_info.addSecondaryField('S1', params['contragent_name'], 'ВЛАДЕЛЕЦ КАРТЫ')
+    card_info.addSecondaryField('S2', params['card_number'], 'НОМЕР КАРТЫ')
+
+    # Create the Pass object with the required identifiers
+    passfile = Pass(
+        card_info,
+        passTypeIdentifier=os.getenv('APPLE_PASS_TYPE_ID'),
+        organizationName=params['organization_name'],
+        teamIdentifier=os.getenv('APPLE_TEAM_ID')
+    )
+
+    # Set required pass information
+    passfile.serialNumber = str(params['serial_number'])
+    passfile.description = params['description']
+
+    # Add a barcode - all supported formats: PDF417, QR, AZTEC, CODE128
+    passfile.barcode = Barcode(
+        message=params['card_number'],
+        altText=params['barcode_message'],
+        format=BarcodeFormat.QR,
+    )
+
+    passfile.webServiceURL = f'https://{os.getenv("APP_URL")}/api/v1'
+    passfile.authenticationToken = params['auth_token']
+
+    # Optional: Set colors
+    passfile.backgroundColor = params['colors']['backgroundColor']
+    passfile.foregroundColor = params['colors']['foregroundColor']
+    passfile.labelColor = params['colors']['labelColor']
+
+    passfile.logoText = params['logo_text']
+
+    passfile.locations = params['locations']
+
+    # Including the icon and logo is necessary for the passbook to be valid
+    passfile.addFile('icon.png', BytesIO(assets['icon']))
+    passfile.addFile('icon@2x.png', BytesIO(assets['icon']))
+    passfile.addFile('icon@3x.png', BytesIO(assets['icon']))
+    passfile.addFile('logo.png', BytesIO(assets['logo']))
+    passfile.addFile('strip@2x.png', BytesIO(assets['strip']))
+
+    # Create and output the Passbook file (.pkpass) в память, без временных файлов
+    pkpass = passfile.create(
+        os.getenv('APPLE_CERTIFICATE_PATH'),
+        os.getenv('APPLE_KEY_PATH'),
+        os.getenv('APPLE_WWDR_PATH'),
+        os.getenv('PKPASS_PASSWORD'),
+        BytesIO()
+    )
+    return pkpass.getvalue()
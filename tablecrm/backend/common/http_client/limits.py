@@ -0,0 +1,83 @@
+import asyncio
+import time
+
+import aiohttp
+
+
+class TokenBucket:
+    """Ограничитель частоты: не более rate запросов в секунду с пиком до capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class CircuitOpenError(aiohttp.ClientConnectionError):
+    """Интеграция временно отключена автоматом: запрос не отправлялся.
+    Наследует ClientError, поэтому существующие обработчики сетевых ошибок его ловят."""
+
+
+class CircuitBreaker:
+    """
+    Автомат: после failure_threshold ошибок подряд (сеть, таймаут, 5xx)
+    запросы reset_timeout секунд сразу отклоняются, затем пропускается
+    один пробный — при успехе автомат замыкается, при ошибке снова размыкается.
+    failure_threshold <= 0 выключает автомат, ошибки только считаются.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, name: str, failure_threshold: int = 5, reset_timeout: float = 30):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.rejected = 0
+        self._probe_in_flight = False
+
+    def before_request(self):
+        if self.state == self.CLOSED or self.failure_threshold <= 0:
+            return
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN and not self._probe_in_flight:
+            self._probe_in_flight = True
+            return
+        self.rejected += 1
+        raise CircuitOpenError(f"{self.name}: circuit open, request rejected")
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self):
+        self._probe_in_flight = False
+        self.failures += 1
+        if self.failure_threshold <= 0:
+            return
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def cancel_probe(self):
+        self._probe_in_flight = False
+
+    def stats(self) -> dict:
+        return {"state": self.state, "failures": self.failures, "rejected": self.rejected}
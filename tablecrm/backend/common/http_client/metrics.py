@@ -0,0 +1,88 @@
+import bisect
+import re
+from typing import Dict, List, Tuple
+from urllib.parse import urlsplit
+
+# Границы корзин гистограммы, мс
+LATENCY_BUCKETS_MS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+# id в пути (числа, uuid, длинные hex/base64-подобные токены) заменяются на :id,
+# чтобы число эндпоинтов в метриках не росло с числом чатов/счетов
+_ID_SEGMENT = re.compile(
+    r"^(\d+|[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|(?=[A-Za-z0-9_~-]*\d)[A-Za-z0-9_~-]{16,})$"
+)
+
+
+def endpoint_template(method: str, url: str) -> str:
+    parts = urlsplit(str(url))
+    path = "/".join(":id" if _ID_SEGMENT.match(segment) else segment for segment in parts.path.split("/"))
+    return f"{method.upper()} {parts.netloc}{path}"
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.counts: List[int] = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.total = 0
+        self.sum_ms = 0.0
+        self.errors = 0
+        self.statuses: Dict[int, int] = {}
+
+    def observe(self, elapsed_ms: float, status: int = None, error: bool = False):
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)] += 1
+        self.total += 1
+        self.sum_ms += elapsed_ms
+        if error:
+            self.errors += 1
+        if status is not None:
+            self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def quantile(self, q: float) -> float:
+        """Верхняя граница корзины, в которую попадает квантиль q."""
+        if not self.total:
+            return 0.0
+        rank = q * self.total
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return float(LATENCY_BUCKETS_MS[i]) if i < len(LATENCY_BUCKETS_MS) else float("inf")
+        return float("inf")
+
+    def stats(self) -> dict:
+        return {
+            "count": self.total,
+            "errors": self.errors,
+            "avg_ms": round(self.sum_ms / self.total, 2) if self.total else 0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "p99_ms": self.quantile(0.99),
+            "statuses": dict(self.statuses),
+            "buckets_ms": dict(zip([*map(str, LATENCY_BUCKETS_MS), "inf"], self.counts)),
+        }
+
+
+class EndpointMetrics:
+    """Гистограммы задержек по эндпоинтам одной интеграции."""
+
+    MAX_ENDPOINTS = 200
+
+    def __init__(self):
+        self._histograms: Dict[str, LatencyHistogram] = {}
+
+    def observe(self, method: str, url: str, elapsed_ms: float, status: int = None, error: bool = False):
+        key = endpoint_template(method, url)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            if len(self._histograms) >= self.MAX_ENDPOINTS:
+                key = "other"
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+            else:
+                histogram = self._histograms[key] = LatencyHistogram()
+        histogram.observe(elapsed_ms, status=status, error=error)
+
+    def items(self) -> List[Tuple[str, LatencyHistogram]]:
+        return sorted(self._histograms.items())
+
+    def stats(self) -> dict:
+        return {key: histogram.stats() for key, histogram in self.items()}
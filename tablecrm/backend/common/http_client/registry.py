@@ -0,0 +1,259 @@
+import asyncio
+import os
+import time
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from common.http_client.limits import TokenBucket, CircuitBreaker, CircuitOpenError
+from common.http_client.metrics import EndpointMetrics
+
+# Настройки интеграций по умолчанию; любое значение переопределяется
+# переменной окружения HTTP_<ИМЯ>_<ПАРАМЕТР>, например HTTP_AVITO_RATE=5.
+# rate — запросов в секунду на хост и ключ клиента (rate_key): у amoCRM хост
+# свой у каждого аккаунта, у Avito лимит считается по client_id приложения
+INTEGRATIONS: Dict[str, Dict[str, Any]] = {
+    "avito": {"rate": 10, "capacity": 5},
+    "tochka": {"rate": 5, "capacity": 5},
+    "module_bank": {"rate": 5, "capacity": 5},
+    "evotor": {"rate": 10, "capacity": 5},
+    # у amoCRM лимит 7 запросов в секунду на аккаунт (поддомен)
+    "amocrm": {"rate": 7, "capacity": 7},
+    # исходящие запросы сегментов идут на разные хосты (вебхуки, wappi, telegram):
+    # частоту ограничивает OutboundExecutor по хосту, автомат выключен
+    "segments": {"failure_threshold": 0},
+}
+
+DEFAULTS: Dict[str, Any] = {
+    "rate": None,
+    "capacity": 1,
+    "limit": 100,
+    "limit_per_host": 20,
+    "dns_ttl": 300,
+    "keepalive": 30,
+    "timeout": 60,
+    "failure_threshold": 5,
+    "reset_timeout": 30,
+}
+
+
+def _config(name: str) -> Dict[str, Any]:
+    config = {**DEFAULTS, **INTEGRATIONS.get(name, {})}
+    for key, default in DEFAULTS.items():
+        value = os.getenv(f"HTTP_{name.upper()}_{key.upper()}")
+        if value is not None:
+            config[key] = float(value) if key in ("rate", "capacity", "timeout", "reset_timeout") else int(value)
+    return config
+
+
+class _RequestContext:
+    """Запрос через IntegrationClient: поддерживает и `async with`, и `await`, как у aiohttp."""
+
+    def __init__(self, client: "IntegrationClient", method: str, url: str, rate_key: Optional[str], kwargs: dict):
+        self._client = client
+        self._method = method
+        self._url = url
+        self._rate_key = rate_key
+        self._kwargs = kwargs
+        self._response: Optional[aiohttp.ClientResponse] = None
+
+    async def _send(self) -> aiohttp.ClientResponse:
+        client = self._client
+        breaker = client.breaker(self._url)
+        breaker.before_request()
+        try:
+            bucket = client.bucket(self._url, self._rate_key)
+            if bucket is not None:
+                await bucket.acquire()
+            started = time.monotonic()
+            try:
+                response = await client.session.request(self._method, self._url, **self._kwargs)
+            except (aiohttp.ClientError, asyncio.TimeoutError):
+                breaker.record_failure()
+                client.metrics.observe(self._method, self._url, (time.monotonic() - started) * 1000, error=True)
+                raise
+        except CircuitOpenError:
+            raise
+        except BaseException:
+            # отмена до ответа — пробный запрос полуоткрытого автомата не должен «зависнуть»
+            breaker.cancel_probe()
+            raise
+
+        if response.status >= 500:
+            breaker.record_failure()
+        else:
+            breaker.record_success()
+        client.metrics.observe(self._method, self._url, (time.monotonic() - started) * 1000, status=response.status)
+        return response
+
+    def __await__(self):
+        return self._send().__await__()
+
+    async def __aenter__(self) -> aiohttp.ClientResponse:
+        self._response = await self._send()
+        return self._response
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        if self._response is not None:
+            self._response.release()
+
+
+class _SessionMethods:
+    """Интерфейс aiohttp.ClientSession; `async with` и close() общую сессию не закрывают."""
+
+    def request(self, method: str, url: str, rate_key: Optional[str] = None, **kwargs) -> _RequestContext:
+        raise NotImplementedError
+
+    def get(self, url: str, **kwargs) -> _RequestContext:
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url: str, **kwargs) -> _RequestContext:
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url: str, **kwargs) -> _RequestContext:
+        return self.request("PUT", url, **kwargs)
+
+    def patch(self, url: str, **kwargs) -> _RequestContext:
+        return self.request("PATCH", url, **kwargs)
+
+    def delete(self, url: str, **kwargs) -> _RequestContext:
+        return self.request("DELETE", url, **kwargs)
+
+    async def close(self):
+        pass
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class IntegrationClient(_SessionMethods):
+    """
+    HTTP-клиент одной интеграции: общая на процесс aiohttp-сессия с пулом
+    соединений (keep-alive, кэш DNS), ограничитель частоты и автомат
+    размыкания на каждый хост (ограничитель — на хост и rate_key), гистограммы задержек по эндпоинтам.
+    Автомат по хосту: недоступный аккаунт amoCRM или вебхук не отключает
+    интеграцию для остальных.
+
+    Сессия живёт до HttpClientRegistry.close() при остановке приложения;
+    сессия, созданная в другом цикле событий, закрывается при замене.
+    """
+
+    def __init__(self, name: str, config: Dict[str, Any]):
+        self.name = name
+        self.config = config
+        self._buckets: Dict[Tuple[str, Optional[str]], TokenBucket] = {}
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self.metrics = EndpointMetrics()
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            if self._session is not None and not self._session.closed:
+                self._close_stale(self._session, self._loop)
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.config["limit"],
+                    limit_per_host=self.config["limit_per_host"],
+                    ttl_dns_cache=self.config["dns_ttl"],
+                    keepalive_timeout=self.config["keepalive"],
+                ),
+                timeout=aiohttp.ClientTimeout(total=self.config["timeout"]),
+                trust_env=True,
+            )
+            self._loop = loop
+        return self._session
+
+    @staticmethod
+    def _close_stale(session: aiohttp.ClientSession, loop: Optional[asyncio.AbstractEventLoop]):
+        """Сессия прежнего цикла событий: закрывается в нём, если он ещё работает в другом потоке."""
+        if loop is not None and loop.is_running():
+            asyncio.run_coroutine_threadsafe(session.close(), loop)
+        elif session.connector is not None:
+            # остановленный цикл не выполнит await: синхронно закрываем соединения пула
+            # (в закрытом цикле aiohttp только помечает пул закрытым), session.closed становится True
+            session.connector._close()
+
+    def breaker(self, url: str) -> CircuitBreaker:
+        host = urlsplit(str(url)).netloc
+        breaker = self._breakers.get(host)
+        if breaker is None:
+            breaker = self._breakers[host] = CircuitBreaker(
+                f"{self.name} {host}", self.config["failure_threshold"], self.config["reset_timeout"]
+            )
+        return breaker
+
+    def bucket(self, url: str, rate_key: Optional[str] = None) -> Optional[TokenBucket]:
+        """Ограничитель частоты на пару (хост, rate_key): клиенты одного хоста не делят лимит."""
+        if not self.config["rate"]:
+            return None
+        key = (urlsplit(str(url)).netloc, rate_key)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(self.config["rate"], self.config["capacity"])
+        return bucket
+
+    def request(self, method: str, url: str, rate_key: Optional[str] = None, **kwargs) -> _RequestContext:
+        return _RequestContext(self, method, url, rate_key, kwargs)
+
+    def with_headers(self, headers: Optional[dict], rate_key: Optional[str] = None) -> _SessionMethods:
+        """Замена ClientSession(headers=...): заголовки и rate_key добавляются к каждому запросу."""
+        return _HeadersClient(self, headers, rate_key) if headers or rate_key else self
+
+    async def aclose(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def stats(self) -> dict:
+        return {
+            "circuits": {host: breaker.stats() for host, breaker in sorted(self._breakers.items())},
+            "rate_limited_hosts": len({host for host, _ in self._buckets}),
+            "rate_buckets": len(self._buckets),
+            "endpoints": self.metrics.stats(),
+        }
+
+
+class _HeadersClient(_SessionMethods):
+    def __init__(self, client: IntegrationClient, headers: Optional[dict], rate_key: Optional[str]):
+        self._client = client
+        self._headers = dict(headers or {})
+        self._rate_key = rate_key
+
+    def request(self, method: str, url: str, rate_key: Optional[str] = None, **kwargs) -> _RequestContext:
+        if self._headers:
+            kwargs["headers"] = {**self._headers, **(kwargs.get("headers") or {})}
+        return self._client.request(method, url, rate_key=rate_key or self._rate_key, **kwargs)
+
+
+class HttpClientRegistry:
+    """Клиенты интеграций процесса: один IntegrationClient на имя интеграции."""
+
+    def __init__(self):
+        self._clients: Dict[str, IntegrationClient] = {}
+
+    def get(self, name: str) -> IntegrationClient:
+        client = self._clients.get(name)
+        if client is None:
+            client = self._clients[name] = IntegrationClient(name, _config(name))
+        return client
+
+    def session(self, name: str, headers: Optional[dict] = None, rate_key: Optional[str] = None) -> _SessionMethods:
+        """Сессия интеграции для `async with http_clients.session("avito") as session:`."""
+        return self.get(name).with_headers(headers, rate_key)
+
+    def stats(self) -> dict:
+        return {name: client.stats() for name, client in sorted(self._clients.items())}
+
+    async def close(self):
+        for client in self._clients.values():
+            await client.aclose()
+
+
+http_clients = HttpClientRegistry()
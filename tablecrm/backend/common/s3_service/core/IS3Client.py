@@ -1,3 +1,6 @@
+from typing import Tuple
+
+
 class IS3Client:
 
     async def upload_file(self, bucket_name: str, object_name: str, file_path: str):
@@ -12,6 +15,12 @@ class IS3Client:
     async def get_object(self, bucket_name: str, object_name: str) -> bytes:
         raise NotImplementedError()
 
+    async def head_object(self, bucket_name: str, object_name: str) -> dict:
+        raise NotImplementedError()
+
+    async def get_object_with_etag(self, bucket_name: str, object_name: str) -> Tuple[bytes, str]:
+        raise NotImplementedError()
+
     async def get_link_object(self, bucket_name: str, file_key: str):
         raise NotImplementedError()
 
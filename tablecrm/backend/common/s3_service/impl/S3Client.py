@@ -1,4 +1,5 @@
 import io
+from typing import Tuple
 
 import aioboto3
 
@@ -35,6 +36,16 @@ class S3Client(IS3Client):
             data = await response['Body'].read()
             return data
 
+    async def head_object(self, bucket_name: str, object_name: str) -> dict:
+        async with self.session.client('s3', endpoint_url=self.__s3_settings.endpoint_url) as s3_client:
+            return await s3_client.head_object(Bucket=bucket_name, Key=object_name)
+
+    async def get_object_with_etag(self, bucket_name: str, object_name: str) -> Tuple[bytes, str]:
+        async with self.session.client('s3', endpoint_url=self.__s3_settings.endpoint_url) as s3_client:
+            response = await s3_client.get_object(Bucket=bucket_name, Key=object_name)
+            data = await response['Body'].read()
+            return data, response['ETag']
+
     async def get_link_object(self, bucket_name: str, file_key: str):
         async with self.session.client('s3', endpoint_url=self.__s3_settings.endpoint_url) as s3_client:
             url = await s3_client.generate_presigned_url(
@@ -0,0 +1,167 @@
+"""add warehouse balance ledger
+
+Revision ID: 3cd3cfe766f2
+Revises: 8ec34d89b74b
+Create Date: 2026-10-18 11:20:41.318204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3cd3cfe766f2'
+down_revision = '8ec34d89b74b'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('warehouse_balance_ledger',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('cashbox_id', sa.Integer(), nullable=True),
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('nomenclature_id', sa.Integer(), nullable=False),
+        sa.Column('incoming_amount', sa.Float(), server_default='0', nullable=False),
+        sa.Column('outgoing_amount', sa.Float(), server_default='0', nullable=False),
+        sa.Column('current_amount', sa.Float(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('organization_id', 'warehouse_id', 'nomenclature_id', name='uq_warehouse_balance_ledger_key')
+    )
+    op.create_index(op.f('ix_warehouse_balance_ledger_cashbox_id'), 'warehouse_balance_ledger', ['cashbox_id'], unique=False)
+    op.create_index('ix_warehouse_balance_ledger_warehouse_nomenclature', 'warehouse_balance_ledger', ['warehouse_id', 'nomenclature_id'], unique=False)
+
+    op.create_table('warehouse_balance_daily',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('cashbox_id', sa.Integer(), nullable=True),
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('warehouse_id', sa.Integer(), nullable=False),
+        sa.Column('nomenclature_id', sa.Integer(), nullable=False),
+        sa.Column('day', sa.Date(), nullable=False),
+        sa.Column('incoming_total', sa.Float(), server_default='0', nullable=False),
+        sa.Column('outgoing_total', sa.Float(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('organization_id', 'warehouse_id', 'nomenclature_id', 'day', name='uq_warehouse_balance_daily_key')
+    )
+
+    # Применение дельты движения к остатку и к дневным накопительным итогам
+    op.execute("""
+        CREATE OR REPLACE FUNCTION warehouse_ledger_apply(
+            p_cashbox integer, p_org integer, p_wh integer, p_nom integer, p_day date,
+            p_in double precision, p_out double precision
+        ) RETURNS void AS $$
+        BEGIN
+            INSERT INTO warehouse_balance_ledger AS l
+                (cashbox_id, organization_id, warehouse_id, nomenclature_id,
+                 incoming_amount, outgoing_amount, current_amount, updated_at)
+            VALUES (p_cashbox, p_org, p_wh, p_nom, p_in, p_out, p_in - p_out, now())
+            ON CONFLICT (organization_id, warehouse_id, nomenclature_id) DO UPDATE SET
+                incoming_amount = l.incoming_amount + EXCLUDED.incoming_amount,
+                outgoing_amount = l.outgoing_amount + EXCLUDED.outgoing_amount,
+                current_amount = l.current_amount + EXCLUDED.current_amount,
+                updated_at = now();
+
+            INSERT INTO warehouse_balance_daily AS d
+                (cashbox_id, organization_id, warehouse_id, nomenclature_id, day, incoming_total, outgoing_total)
+            SELECT p_cashbox, p_org, p_wh, p_nom, p_day,
+                   COALESCE(prev.incoming_total, 0) + p_in,
+                   COALESCE(prev.outgoing_total, 0) + p_out
+            FROM (SELECT 1) AS one
+            LEFT JOIN LATERAL (
+                SELECT incoming_total, outgoing_total
+                FROM warehouse_balance_daily
+                WHERE organization_id = p_org AND warehouse_id = p_wh
+                  AND nomenclature_id = p_nom AND day < p_day
+                ORDER BY day DESC
+                LIMIT 1
+            ) prev ON true
+            ON CONFLICT (organization_id, warehouse_id, nomenclature_id, day) DO UPDATE SET
+                incoming_total = d.incoming_total + p_in,
+                outgoing_total = d.outgoing_total + p_out;
+
+            -- движение задним числом сдвигает итоги всех последующих дней
+            UPDATE warehouse_balance_daily
+            SET incoming_total = incoming_total + p_in,
+                outgoing_total = outgoing_total + p_out
+            WHERE organization_id = p_org AND warehouse_id = p_wh
+              AND nomenclature_id = p_nom AND day > p_day;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION warehouse_register_movement_ledger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.nomenclature_id IS NOT NULL THEN
+                PERFORM warehouse_ledger_apply(
+                    OLD.cashbox_id, COALESCE(OLD.organization_id, 0), COALESCE(OLD.warehouse_id, 0),
+                    OLD.nomenclature_id, (COALESCE(OLD.created_at, now()) AT TIME ZONE 'UTC')::date,
+                    CASE WHEN OLD.type_amount = 'minus' THEN 0 ELSE -OLD.amount END,
+                    CASE WHEN OLD.type_amount = 'minus' THEN -OLD.amount ELSE 0 END
+                );
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.nomenclature_id IS NOT NULL THEN
+                PERFORM warehouse_ledger_apply(
+                    NEW.cashbox_id, COALESCE(NEW.organization_id, 0), COALESCE(NEW.warehouse_id, 0),
+                    NEW.nomenclature_id, (COALESCE(NEW.created_at, now()) AT TIME ZONE 'UTC')::date,
+                    CASE WHEN NEW.type_amount = 'minus' THEN 0 ELSE NEW.amount END,
+                    CASE WHEN NEW.type_amount = 'minus' THEN NEW.amount ELSE 0 END
+                );
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE TRIGGER trg_warehouse_register_movement_ledger
+        AFTER INSERT OR UPDATE OR DELETE ON warehouse_register_movement
+        FOR EACH ROW
+        EXECUTE FUNCTION warehouse_register_movement_ledger();
+    """)
+
+    # Заполнение проекций по уже существующим движениям
+    op.execute("""
+        INSERT INTO warehouse_balance_ledger
+            (cashbox_id, organization_id, warehouse_id, nomenclature_id,
+             incoming_amount, outgoing_amount, current_amount)
+        SELECT max(cashbox_id),
+               COALESCE(organization_id, 0), COALESCE(warehouse_id, 0), nomenclature_id,
+               sum(CASE WHEN type_amount = 'minus' THEN 0 ELSE amount END),
+               sum(CASE WHEN type_amount = 'minus' THEN amount ELSE 0 END),
+               sum(CASE WHEN type_amount = 'minus' THEN -amount ELSE amount END)
+        FROM warehouse_register_movement
+        WHERE nomenclature_id IS NOT NULL
+        GROUP BY COALESCE(organization_id, 0), COALESCE(warehouse_id, 0), nomenclature_id
+    """)
+    op.execute("""
+        INSERT INTO warehouse_balance_daily
+            (cashbox_id, organization_id, warehouse_id, nomenclature_id, day, incoming_total, outgoing_total)
+        SELECT cashbox_id, organization_id, warehouse_id, nomenclature_id, day,
+               sum(day_in) OVER w, sum(day_out) OVER w
+        FROM (
+            SELECT max(cashbox_id) AS cashbox_id,
+                   COALESCE(organization_id, 0) AS organization_id,
+                   COALESCE(warehouse_id, 0) AS warehouse_id,
+                   nomenclature_id,
+                   (created_at AT TIME ZONE 'UTC')::date AS day,
+                   sum(CASE WHEN type_amount = 'minus' THEN 0 ELSE amount END) AS day_in,
+                   sum(CASE WHEN type_amount = 'minus' THEN amount ELSE 0 END) AS day_out
+            FROM warehouse_register_movement
+            WHERE nomenclature_id IS NOT NULL
+            GROUP BY 2, 3, 4, 5
+        ) per_day
+        WINDOW w AS (PARTITION BY organization_id, warehouse_id, nomenclature_id ORDER BY day)
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_warehouse_register_movement_ledger ON warehouse_register_movement")
+    op.execute("DROP FUNCTION IF EXISTS warehouse_register_movement_ledger()")
+    op.execute("DROP FUNCTION IF EXISTS warehouse_ledger_apply(integer, integer, integer, integer, date, double precision, double precision)")
+    op.drop_table('warehouse_balance_daily')
+    op.drop_index('ix_warehouse_balance_ledger_warehouse_nomenclature', table_name='warehouse_balance_ledger')
+    op.drop_index(op.f('ix_warehouse_balance_ledger_cashbox_id'), table_name='warehouse_balance_ledger')
+    op.drop_table('warehouse_balance_ledger')
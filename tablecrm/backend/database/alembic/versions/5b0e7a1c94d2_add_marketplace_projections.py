@@ -0,0 +1,284 @@
+"""add marketplace projections
+
+Revision ID: 5b0e7a1c94d2
+Revises: 3cd3cfe766f2
+Create Date: 2026-10-18 12:04:12.530911
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5b0e7a1c94d2'
+down_revision = '3cd3cfe766f2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('nomenclature_active_prices',
+        sa.Column('nomenclature_id', sa.Integer(), nullable=False),
+        sa.Column('price_id', sa.Integer(), nullable=False),
+        sa.Column('price_type', sa.Integer(), nullable=True),
+        sa.Column('price', sa.Float(), nullable=False),
+        sa.Column('date_from', sa.Integer(), nullable=True),
+        sa.Column('date_to', sa.Integer(), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('nomenclature_id')
+    )
+    op.create_index(op.f('ix_nomenclature_active_prices_price_type'), 'nomenclature_active_prices', ['price_type'], unique=False)
+
+    op.create_table('warehouse_balances_latest',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('balance_id', sa.Integer(), nullable=False),
+        sa.Column('organization_id', sa.Integer(), nullable=True),
+        sa.Column('warehouse_id', sa.Integer(), nullable=True),
+        sa.Column('nomenclature_id', sa.Integer(), nullable=False),
+        sa.Column('current_amount', sa.Float(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_warehouse_balances_latest_nomenclature_id'), 'warehouse_balances_latest', ['nomenclature_id'], unique=False)
+    op.execute(
+        "CREATE UNIQUE INDEX uq_warehouse_balances_latest_key ON warehouse_balances_latest "
+        "((COALESCE(organization_id, 0)), (COALESCE(warehouse_id, 0)), nomenclature_id)"
+    )
+
+    op.create_table('nomenclature_marketplace_stats',
+        sa.Column('nomenclature_id', sa.Integer(), nullable=False),
+        sa.Column('current_amount', sa.Float(), server_default='0', nullable=False),
+        sa.Column('total_sold', sa.Integer(), server_default='0', nullable=False),
+        sa.PrimaryKeyConstraint('nomenclature_id')
+    )
+
+    # Индексы для точечного пересчёта проекций из триггеров
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_prices_nomenclature_active "
+        "ON prices(nomenclature, created_at DESC, id DESC) "
+        "WHERE is_deleted IS NOT TRUE"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_prices_date_from ON prices(date_from) "
+        "WHERE date_from IS NOT NULL AND is_deleted IS NOT TRUE"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_prices_date_to ON prices(date_to) "
+        "WHERE date_to IS NOT NULL AND is_deleted IS NOT TRUE"
+    )
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS idx_warehouse_balances_key_latest ON warehouse_balances "
+        "((COALESCE(organization_id, 0)), (COALESCE(warehouse_id, 0)), nomenclature_id, created_at DESC, id DESC)"
+    )
+
+    # Актуальная цена номенклатуры: та же логика ранжирования, что была в row_number() листинга
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_nomenclature_active_price(p_nom integer) RETURNS void AS $$
+        DECLARE
+            now_ts bigint := extract(epoch from now())::bigint;
+        BEGIN
+            DELETE FROM nomenclature_active_prices WHERE nomenclature_id = p_nom;
+            INSERT INTO nomenclature_active_prices
+                (nomenclature_id, price_id, price_type, price, date_from, date_to, updated_at)
+            SELECT nomenclature, id, price_type, price, date_from, date_to, now()
+            FROM prices
+            WHERE nomenclature = p_nom AND is_deleted IS NOT TRUE
+            ORDER BY (COALESCE(date_from <= now_ts, true) AND COALESCE(now_ts < date_to, true)) DESC,
+                     created_at DESC, id DESC
+            LIMIT 1;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_active_prices_window(p_from bigint, p_to bigint) RETURNS integer AS $$
+        DECLARE
+            nom_id integer;
+            refreshed integer := 0;
+        BEGIN
+            FOR nom_id IN
+                SELECT nomenclature FROM prices
+                WHERE is_deleted IS NOT TRUE AND date_from > p_from AND date_from <= p_to
+                UNION
+                SELECT nomenclature FROM prices
+                WHERE is_deleted IS NOT TRUE AND date_to > p_from AND date_to <= p_to
+            LOOP
+                PERFORM refresh_nomenclature_active_price(nom_id);
+                refreshed := refreshed + 1;
+            END LOOP;
+            RETURN refreshed;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION prices_active_price_projection() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM refresh_nomenclature_active_price(OLD.nomenclature);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND NEW.nomenclature IS DISTINCT FROM OLD.nomenclature) THEN
+                PERFORM refresh_nomenclature_active_price(NEW.nomenclature);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_prices_active_price_projection
+        AFTER INSERT OR UPDATE OR DELETE ON prices
+        FOR EACH ROW
+        EXECUTE FUNCTION prices_active_price_projection();
+    """)
+
+    # Последняя запись warehouse_balances по (организация, склад, номенклатура) и суммарный остаток
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_warehouse_balance_latest(p_org integer, p_wh integer, p_nom integer) RETURNS void AS $$
+        DECLARE
+            rec record;
+        BEGIN
+            IF p_nom IS NULL THEN
+                RETURN;
+            END IF;
+
+            SELECT id, current_amount INTO rec
+            FROM warehouse_balances
+            WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+              AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+              AND nomenclature_id = p_nom
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1;
+
+            IF NOT FOUND THEN
+                DELETE FROM warehouse_balances_latest
+                WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+                  AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+                  AND nomenclature_id = p_nom;
+            ELSE
+                INSERT INTO warehouse_balances_latest
+                    (balance_id, organization_id, warehouse_id, nomenclature_id, current_amount, updated_at)
+                VALUES (rec.id, p_org, p_wh, p_nom, rec.current_amount, now())
+                ON CONFLICT ((COALESCE(organization_id, 0)), (COALESCE(warehouse_id, 0)), nomenclature_id)
+                DO UPDATE SET balance_id = EXCLUDED.balance_id,
+                              current_amount = EXCLUDED.current_amount,
+                              updated_at = now();
+            END IF;
+
+            INSERT INTO nomenclature_marketplace_stats AS s (nomenclature_id, current_amount)
+            SELECT p_nom, COALESCE(sum(greatest(current_amount, 0)), 0)
+            FROM warehouse_balances_latest
+            WHERE nomenclature_id = p_nom
+            ON CONFLICT (nomenclature_id) DO UPDATE SET current_amount = EXCLUDED.current_amount;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION warehouse_balances_latest_projection() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM refresh_warehouse_balance_latest(OLD.organization_id, OLD.warehouse_id, OLD.nomenclature_id);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND (
+                NEW.organization_id IS DISTINCT FROM OLD.organization_id
+                OR NEW.warehouse_id IS DISTINCT FROM OLD.warehouse_id
+                OR NEW.nomenclature_id IS DISTINCT FROM OLD.nomenclature_id
+            )) THEN
+                PERFORM refresh_warehouse_balance_latest(NEW.organization_id, NEW.warehouse_id, NEW.nomenclature_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_warehouse_balances_latest_projection
+        AFTER INSERT OR UPDATE OR DELETE ON warehouse_balances
+        FOR EACH ROW
+        EXECUTE FUNCTION warehouse_balances_latest_projection();
+    """)
+
+    # Счётчик продаж: число строк docs_sales_goods по номенклатуре
+    op.execute("""
+        CREATE OR REPLACE FUNCTION docs_sales_goods_sold_counter() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                UPDATE nomenclature_marketplace_stats
+                SET total_sold = total_sold - 1
+                WHERE nomenclature_id = OLD.nomenclature;
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                INSERT INTO nomenclature_marketplace_stats AS s (nomenclature_id, total_sold)
+                VALUES (NEW.nomenclature, 1)
+                ON CONFLICT (nomenclature_id) DO UPDATE SET total_sold = s.total_sold + 1;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_docs_sales_goods_sold_counter
+        AFTER INSERT OR DELETE OR UPDATE OF nomenclature ON docs_sales_goods
+        FOR EACH ROW
+        EXECUTE FUNCTION docs_sales_goods_sold_counter();
+    """)
+
+    # Заполнение проекций по текущим данным
+    op.execute("""
+        INSERT INTO nomenclature_active_prices
+            (nomenclature_id, price_id, price_type, price, date_from, date_to)
+        SELECT DISTINCT ON (nomenclature)
+               nomenclature, id, price_type, price, date_from, date_to
+        FROM prices
+        WHERE is_deleted IS NOT TRUE
+        ORDER BY nomenclature,
+                 (COALESCE(date_from <= extract(epoch from now()), true)
+                  AND COALESCE(extract(epoch from now()) < date_to, true)) DESC,
+                 created_at DESC, id DESC
+    """)
+    op.execute("""
+        INSERT INTO warehouse_balances_latest
+            (balance_id, organization_id, warehouse_id, nomenclature_id, current_amount)
+        SELECT DISTINCT ON (COALESCE(organization_id, 0), COALESCE(warehouse_id, 0), nomenclature_id)
+               id, organization_id, warehouse_id, nomenclature_id, current_amount
+        FROM warehouse_balances
+        WHERE nomenclature_id IS NOT NULL
+        ORDER BY COALESCE(organization_id, 0), COALESCE(warehouse_id, 0), nomenclature_id,
+                 created_at DESC, id DESC
+    """)
+    op.execute("""
+        INSERT INTO nomenclature_marketplace_stats (nomenclature_id, current_amount, total_sold)
+        SELECT COALESCE(stock.nomenclature_id, sold.nomenclature_id),
+               COALESCE(stock.current_amount, 0),
+               COALESCE(sold.total_sold, 0)
+        FROM (
+            SELECT nomenclature_id, sum(greatest(current_amount, 0)) AS current_amount
+            FROM warehouse_balances_latest
+            GROUP BY nomenclature_id
+        ) stock
+        FULL OUTER JOIN (
+            SELECT nomenclature AS nomenclature_id, count(id) AS total_sold
+            FROM docs_sales_goods
+            GROUP BY nomenclature
+        ) sold ON sold.nomenclature_id = stock.nomenclature_id
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_docs_sales_goods_sold_counter ON docs_sales_goods")
+    op.execute("DROP TRIGGER IF EXISTS trg_warehouse_balances_latest_projection ON warehouse_balances")
+    op.execute("DROP TRIGGER IF EXISTS trg_prices_active_price_projection ON prices")
+    op.execute("DROP FUNCTION IF EXISTS docs_sales_goods_sold_counter()")
+    op.execute("DROP FUNCTION IF EXISTS warehouse_balances_latest_projection()")
+    op.execute("DROP FUNCTION IF EXISTS refresh_warehouse_balance_latest(integer, integer, integer)")
+    op.execute("DROP FUNCTION IF EXISTS prices_active_price_projection()")
+    op.execute("DROP FUNCTION IF EXISTS refresh_active_prices_window(bigint, bigint)")
+    op.execute("DROP FUNCTION IF EXISTS refresh_nomenclature_active_price(integer)")
+    op.execute("DROP INDEX IF EXISTS idx_warehouse_balances_key_latest")
+    op.execute("DROP INDEX IF EXISTS idx_prices_date_to")
+    op.execute("DROP INDEX IF EXISTS idx_prices_date_from")
+    op.execute("DROP INDEX IF EXISTS idx_prices_nomenclature_active")
+    op.drop_table('nomenclature_marketplace_stats')
+    op.drop_index('uq_warehouse_balances_latest_key', table_name='warehouse_balances_latest')
+    op.drop_index(op.f('ix_warehouse_balances_latest_nomenclature_id'), table_name='warehouse_balances_latest')
+    op.drop_table('warehouse_balances_latest')
+    op.drop_index(op.f('ix_nomenclature_active_prices_price_type'), table_name='nomenclature_active_prices')
+    op.drop_table('nomenclature_active_prices')
@@ -0,0 +1,33 @@
+"""add warehouses geo index
+
+Revision ID: a7d2c5e81f30
+Revises: 5b0e7a1c94d2
+Create Date: 2026-10-18 12:41:55.102377
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a7d2c5e81f30'
+down_revision = '5b0e7a1c94d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # earth_box/ll_to_earth для фильтра по радиусу в листинге маркетплейса
+    op.execute("CREATE EXTENSION IF NOT EXISTS cube")
+    op.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+
+    op.execute(
+        "CREATE INDEX IF NOT EXISTS ix_warehouses_public_ll_to_earth "
+        "ON warehouses USING gist (ll_to_earth(latitude, longitude)) "
+        "WHERE latitude IS NOT NULL AND longitude IS NOT NULL "
+        "AND is_public IS TRUE AND status IS TRUE AND is_deleted IS NOT TRUE"
+    )
+
+
+def downgrade() -> None:
+    op.execute("DROP INDEX IF EXISTS ix_warehouses_public_ll_to_earth")
@@ -0,0 +1,226 @@
+"""payments balance triggers
+
+Revision ID: a91c4e7b2d56
+Revises: d38f6a1c9e27
+Create Date: 2026-10-18 16:22:05.518734
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c4e7b2d56'
+down_revision = 'd38f6a1c9e27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Платёж с датой в будущем попадает в баланс счёта только когда дата наступит
+    # (как в rachet: date <= today); флаг ставит BEFORE-триггер, «созревшие»
+    # платежи переключает джоба apply_matured_payments
+    op.add_column('payments', sa.Column('balance_applied', sa.Boolean(), server_default='false', nullable=False))
+    op.execute("UPDATE payments SET balance_applied = date <= extract(epoch FROM now())::integer")
+    op.execute("""
+        CREATE INDEX idx_payments_balance_pending ON payments (date)
+        WHERE balance_applied IS FALSE
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payments_set_balance_applied() RETURNS trigger AS $$
+        BEGIN
+            NEW.balance_applied := COALESCE(NEW.date <= extract(epoch FROM now())::integer, false);
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Вклад платежа в счета и проект по правилам rachet:
+    # счёт — только родительские платежи не раньше balance_date счёта,
+    # перевод списывается со счёта и зачисляется на paybox_to;
+    # проект — все incoming/outgoing платежи без учёта даты
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payments_apply_balances(p payments, sign integer) RETURNS void AS $$
+        DECLARE
+            amt double precision := sign * COALESCE(p.amount, 0);
+            now_ts integer := extract(epoch FROM now())::integer;
+            new_incoming double precision;
+            new_outgoing double precision;
+        BEGIN
+            IF p.status IS NOT TRUE OR p.is_deleted IS NOT FALSE OR p.paybox IS NULL OR amt = 0 THEN
+                RETURN;
+            END IF;
+
+            IF p.project_id IS NOT NULL AND p.type IN ('incoming', 'outgoing') THEN
+                UPDATE projects
+                SET incoming = round((COALESCE(incoming, 0) + CASE WHEN p.type = 'incoming' THEN amt ELSE 0 END)::numeric, 2),
+                    outgoing = round((COALESCE(outgoing, 0) + CASE WHEN p.type = 'outgoing' THEN amt ELSE 0 END)::numeric, 2),
+                    updated_at = now_ts
+                WHERE id = p.project_id
+                RETURNING incoming, outgoing INTO new_incoming, new_outgoing;
+
+                IF FOUND THEN
+                    UPDATE projects
+                    SET profitability = CASE
+                        WHEN new_outgoing = 0 AND new_incoming <> 0 THEN 100
+                        WHEN new_outgoing = 0 THEN 0
+                        ELSE round(((new_incoming - new_outgoing) / new_outgoing * 100)::numeric, 2)
+                    END
+                    WHERE id = p.project_id;
+                END IF;
+            END IF;
+
+            IF p.balance_applied IS TRUE AND p.parent_id IS NULL THEN
+                -- оба счёта перевода одним UPDATE, чтобы не ловить взаимоблокировки встречных переводов
+                UPDATE payboxes
+                SET balance = round((
+                        COALESCE(balance, 0)
+                        + CASE WHEN id = p.paybox
+                               THEN CASE WHEN p.type IN ('outgoing', 'transfer') THEN -amt ELSE amt END
+                               ELSE 0 END
+                        + CASE WHEN p.type = 'transfer' AND id = p.paybox_to THEN amt ELSE 0 END
+                    )::numeric, 2),
+                    update_start_balance = now_ts
+                WHERE id IN (p.paybox, CASE WHEN p.type = 'transfer' THEN p.paybox_to END)
+                  AND p.date >= balance_date;
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payments_balances_trigger() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM payments_apply_balances(OLD, -1);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM payments_apply_balances(NEW, 1);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE TRIGGER trg_payments_balance_applied
+        BEFORE INSERT OR UPDATE ON payments
+        FOR EACH ROW EXECUTE FUNCTION payments_set_balance_applied();
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_payments_balances
+        AFTER INSERT OR DELETE ON payments
+        FOR EACH ROW EXECUTE FUNCTION payments_balances_trigger();
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_payments_balances_update
+        AFTER UPDATE ON payments
+        FOR EACH ROW
+        WHEN (
+            OLD.type IS DISTINCT FROM NEW.type
+            OR OLD.amount IS DISTINCT FROM NEW.amount
+            OR OLD.status IS DISTINCT FROM NEW.status
+            OR OLD.is_deleted IS DISTINCT FROM NEW.is_deleted
+            OR OLD.paybox IS DISTINCT FROM NEW.paybox
+            OR OLD.paybox_to IS DISTINCT FROM NEW.paybox_to
+            OR OLD.project_id IS DISTINCT FROM NEW.project_id
+            OR OLD.parent_id IS DISTINCT FROM NEW.parent_id
+            OR OLD.date IS DISTINCT FROM NEW.date
+            -- флаг может переключить BEFORE-триггер, поэтому не UPDATE OF
+            OR OLD.balance_applied IS DISTINCT FROM NEW.balance_applied
+        )
+        EXECUTE FUNCTION payments_balances_trigger();
+    """)
+
+    # Полный пересчёт (сверка): возвращает только разошедшиеся записи
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payboxes_recalculate(p_ids integer[])
+        RETURNS TABLE(paybox_id integer, old_balance double precision, new_balance double precision) AS $$
+            WITH moves AS (
+                SELECT p.paybox AS paybox_id, p.date,
+                       CASE WHEN p.type IN ('outgoing', 'transfer') THEN -p.amount ELSE p.amount END AS amount
+                FROM payments p
+                WHERE p.paybox = ANY(p_ids)
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+                UNION ALL
+                SELECT p.paybox_to, p.date, p.amount
+                FROM payments p
+                WHERE p.type = 'transfer' AND p.paybox_to = ANY(p_ids) AND p.paybox IS NOT NULL
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+            ),
+            expected AS (
+                SELECT pb.id, pb.balance AS old_balance,
+                       round((COALESCE(pb.start_balance, 0)
+                           + COALESCE(sum(m.amount) FILTER (WHERE m.date >= pb.balance_date), 0))::numeric, 2
+                       )::double precision AS balance
+                FROM payboxes pb
+                LEFT JOIN moves m ON m.paybox_id = pb.id
+                WHERE pb.id = ANY(p_ids)
+                GROUP BY pb.id
+            )
+            UPDATE payboxes pb
+            SET balance = e.balance,
+                update_start_balance = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pb.id = e.id
+              AND (pb.balance IS NULL OR abs(pb.balance - e.balance) >= 0.01)
+            RETURNING pb.id, e.old_balance, e.balance;
+        $$ LANGUAGE sql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION projects_recalculate(p_ids integer[])
+        RETURNS TABLE(
+            project_id integer,
+            old_incoming double precision, old_outgoing double precision,
+            new_incoming double precision, new_outgoing double precision
+        ) AS $$
+            WITH expected AS (
+                SELECT pr.id, pr.incoming AS old_incoming, pr.outgoing AS old_outgoing,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'incoming'), 0)::numeric, 2)::double precision AS incoming,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'outgoing'), 0)::numeric, 2)::double precision AS outgoing
+                FROM projects pr
+                LEFT JOIN payments p
+                    ON p.project_id = pr.id
+                    AND p.status IS TRUE AND p.is_deleted IS FALSE AND p.paybox IS NOT NULL
+                WHERE pr.id = ANY(p_ids)
+                GROUP BY pr.id
+            )
+            UPDATE projects pr
+            SET incoming = e.incoming,
+                outgoing = e.outgoing,
+                profitability = CASE
+                    WHEN e.outgoing = 0 AND e.incoming <> 0 THEN 100
+                    WHEN e.outgoing = 0 THEN 0
+                    ELSE round(((e.incoming - e.outgoing) / e.outgoing * 100)::numeric, 2)
+                END,
+                updated_at = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pr.id = e.id
+              AND (
+                  pr.incoming IS NULL OR pr.outgoing IS NULL
+                  OR abs(pr.incoming - e.incoming) >= 0.01
+                  OR abs(pr.outgoing - e.outgoing) >= 0.01
+              )
+            RETURNING pr.id, e.old_incoming, e.old_outgoing, e.incoming, e.outgoing;
+        $$ LANGUAGE sql;
+    """)
+
+    # Начальные значения — полный пересчёт всех счетов и проектов
+    op.execute("SELECT count(*) FROM payboxes_recalculate(ARRAY(SELECT id FROM payboxes))")
+    op.execute("SELECT count(*) FROM projects_recalculate(ARRAY(SELECT id FROM projects))")
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_payments_balances_update ON payments;")
+    op.execute("DROP TRIGGER IF EXISTS trg_payments_balances ON payments;")
+    op.execute("DROP TRIGGER IF EXISTS trg_payments_balance_applied ON payments;")
+    op.execute("DROP FUNCTION IF EXISTS projects_recalculate(integer[]);")
+    op.execute("DROP FUNCTION IF EXISTS payboxes_recalculate(integer[]);")
+    op.execute("DROP FUNCTION IF EXISTS payments_balances_trigger();")
+    op.execute("DROP FUNCTION IF EXISTS payments_apply_balances(payments, integer);")
+    op.execute("DROP FUNCTION IF EXISTS payments_set_balance_applied();")
+    op.execute("DROP INDEX IF EXISTS idx_payments_balance_pending;")
+    op.drop_column('payments', 'balance_applied')
@@ -0,0 +1,48 @@
+"""doc number counters
+
+Revision ID: a91c4e7d2b56
+Revises: d7a3e1f05b92
+Create Date: 2026-10-18 21:12:40.518273
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a91c4e7d2b56'
+down_revision = 'd7a3e1f05b92'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('doc_number_counters',
+        sa.Column('organization_id', sa.Integer(), nullable=False),
+        sa.Column('doc_type', sa.String(length=32), nullable=False),
+        sa.Column('last_number', sa.BigInteger(), server_default='0', nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['organization_id'], ['organizations.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('organization_id', 'doc_type')
+    )
+
+    # Счётчик продолжает наибольший числовой номер организации.
+    # Закупки и складские документы раньше нумеровались по кассе, теперь — по организации.
+    for doc_type, table in (
+        ('docs_sales', 'docs_sales'),
+        ('docs_purchases', 'docs_purchases'),
+        ('docs_warehouse', 'docs_warehouse'),
+    ):
+        op.execute(f"""
+            INSERT INTO doc_number_counters (organization_id, doc_type, last_number)
+            SELECT organization, '{doc_type}', max(number::bigint)
+            FROM {table}
+            WHERE organization IS NOT NULL
+              AND is_deleted IS NOT TRUE
+              AND number ~ '^[0-9]{{1,18}}$'
+            GROUP BY organization
+        """)
+
+
+def downgrade() -> None:
+    op.drop_table('doc_number_counters')
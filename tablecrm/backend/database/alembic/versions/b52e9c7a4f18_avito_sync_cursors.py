@@ -0,0 +1,58 @@
+"""avito sync cursors
+
+Revision ID: b52e9c7a4f18
+Revises: f83b5d1e6c24
+Create Date: 2026-10-18 19:05:12.317604
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b52e9c7a4f18'
+down_revision = 'f83b5d1e6c24'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('channel_credentials', sa.Column('sync_cursor_updated', sa.BigInteger(), nullable=True))
+    op.add_column('channel_credentials', sa.Column('synced_at', sa.DateTime(), nullable=True))
+    op.add_column('chats', sa.Column('sync_cursor_message_id', sa.String(length=255), nullable=True))
+    op.add_column('chats', sa.Column('sync_cursor_message_created', sa.BigInteger(), nullable=True))
+
+    # Курсор чата — последнее уже загруженное сообщение: чаты без новой активности
+    # не перечитываются. Время курсора не заполняется (created_at хранится без зоны),
+    # поэтому при новой активности история чата один раз дочитывается целиком.
+    op.execute("""
+        UPDATE chats c
+        SET sync_cursor_message_id = m.external_message_id
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, external_message_id
+            FROM chat_messages
+            WHERE external_message_id IS NOT NULL AND source = 'avito'
+            ORDER BY chat_id, created_at DESC, id DESC
+        ) m
+        WHERE m.chat_id = c.id
+    """)
+
+    # проверка уже загруженных сообщений чата по external_message_id
+    conn = op.get_bind()
+    exists = conn.scalar(sa.text("SELECT to_regclass(:n)"), {"n": "public.idx_chat_messages_chat_external"})
+    if exists is None:
+        with op.get_context().autocommit_block():
+            op.execute("""
+                CREATE INDEX CONCURRENTLY idx_chat_messages_chat_external
+                ON chat_messages (chat_id, external_message_id)
+                WHERE external_message_id IS NOT NULL;
+            """)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chat_messages_chat_external;")
+    op.drop_column('chats', 'sync_cursor_message_created')
+    op.drop_column('chats', 'sync_cursor_message_id')
+    op.drop_column('channel_credentials', 'synced_at')
+    op.drop_column('channel_credentials', 'sync_cursor_updated')
@@ -0,0 +1,101 @@
+"""loyality cards balance counters
+
+Revision ID: b5e0c93d7a41
+Revises: f2a8d41c6e07
+Create Date: 2026-10-18 15:06:41.380127
+
+"""
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e0c93d7a41'
+down_revision = 'f2a8d41c6e07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Суммы транзакций дробные, в integer счётчики накапливали бы ошибку округления
+    op.execute("""
+        ALTER TABLE loyality_cards
+            ALTER COLUMN income TYPE double precision,
+            ALTER COLUMN outcome TYPE double precision;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_cards_apply_delta(
+            p_card_id integer, p_type varchar, p_amount double precision
+        ) RETURNS void AS $$
+        DECLARE
+            d_income double precision := CASE WHEN p_type = 'accrual' THEN p_amount ELSE 0 END;
+            d_outcome double precision := CASE WHEN p_type = 'withdraw' THEN p_amount ELSE 0 END;
+        BEGIN
+            IF p_card_id IS NULL OR (d_income = 0 AND d_outcome = 0) THEN
+                RETURN;
+            END IF;
+            UPDATE loyality_cards
+            SET income = COALESCE(income, 0) + d_income,
+                outcome = COALESCE(outcome, 0) + d_outcome,
+                balance = GREATEST(COALESCE(income, 0) + d_income - COALESCE(outcome, 0) - d_outcome, 0)
+            WHERE id = p_card_id;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_transactions_apply_balance() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.status IS TRUE AND OLD.is_deleted IS FALSE THEN
+                PERFORM loyality_cards_apply_delta(OLD.loyality_card_id, OLD.type, -COALESCE(OLD.amount, 0));
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.status IS TRUE AND NEW.is_deleted IS FALSE THEN
+                PERFORM loyality_cards_apply_delta(NEW.loyality_card_id, NEW.type, COALESCE(NEW.amount, 0));
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE TRIGGER trg_loyality_transactions_balance
+        AFTER INSERT OR DELETE ON loyality_transactions
+        FOR EACH ROW EXECUTE FUNCTION loyality_transactions_apply_balance();
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_loyality_transactions_balance_update
+        AFTER UPDATE OF type, amount, status, is_deleted, loyality_card_id ON loyality_transactions
+        FOR EACH ROW EXECUTE FUNCTION loyality_transactions_apply_balance();
+    """)
+
+    # Начальные значения счётчиков — та же формула, что в recalculate_cards
+    op.execute("""
+        UPDATE loyality_cards c
+        SET income = t.income,
+            outcome = t.outcome,
+            balance = CASE WHEN t.income > t.outcome THEN t.income - t.outcome ELSE 0 END
+        FROM (
+            SELECT lc.id,
+                   COALESCE(SUM(lt.amount) FILTER (WHERE lt.type = 'accrual'), 0) AS income,
+                   COALESCE(SUM(lt.amount) FILTER (WHERE lt.type = 'withdraw'), 0) AS outcome
+            FROM loyality_cards lc
+            LEFT JOIN loyality_transactions lt
+                ON lt.loyality_card_id = lc.id
+                AND lt.status IS TRUE
+                AND lt.is_deleted IS FALSE
+            GROUP BY lc.id
+        ) t
+        WHERE c.id = t.id;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_loyality_transactions_balance_update ON loyality_transactions;")
+    op.execute("DROP TRIGGER IF EXISTS trg_loyality_transactions_balance ON loyality_transactions;")
+    op.execute("DROP FUNCTION IF EXISTS loyality_transactions_apply_balance();")
+    op.execute("DROP FUNCTION IF EXISTS loyality_cards_apply_delta(integer, varchar, double precision);")
+    op.execute("""
+        ALTER TABLE loyality_cards
+            ALTER COLUMN income TYPE integer USING round(income)::integer,
+            ALTER COLUMN outcome TYPE integer USING round(outcome)::integer;
+    """)
@@ -0,0 +1,166 @@
+"""marketplace projection upserts and job cursors
+
+Revision ID: b6d2f8e41a07
+Revises: e4b7c2a9f0d3
+Create Date: 2026-10-19 11:02:37.581204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b6d2f8e41a07'
+down_revision = 'e4b7c2a9f0d3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('job_cursors',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('value', sa.BigInteger(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.PrimaryKeyConstraint('name')
+    )
+
+    # DELETE + INSERT по первичному ключу гонялся с параллельными триггерами
+    # той же номенклатуры (duplicate key). Строка удаляется, только если цены
+    # не осталось, иначе — UPSERT.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_nomenclature_active_price(p_nom integer) RETURNS void AS $$
+        DECLARE
+            now_ts bigint := extract(epoch from now())::bigint;
+            rec record;
+        BEGIN
+            SELECT id, price_type, price, date_from, date_to INTO rec
+            FROM prices
+            WHERE nomenclature = p_nom AND is_deleted IS NOT TRUE
+            ORDER BY (COALESCE(date_from <= now_ts, true) AND COALESCE(now_ts < date_to, true)) DESC,
+                     created_at DESC, id DESC
+            LIMIT 1;
+
+            IF NOT FOUND THEN
+                DELETE FROM nomenclature_active_prices WHERE nomenclature_id = p_nom;
+            ELSE
+                INSERT INTO nomenclature_active_prices
+                    (nomenclature_id, price_id, price_type, price, date_from, date_to, updated_at)
+                VALUES (p_nom, rec.id, rec.price_type, rec.price, rec.date_from, rec.date_to, now())
+                ON CONFLICT (nomenclature_id)
+                DO UPDATE SET price_id = EXCLUDED.price_id,
+                              price_type = EXCLUDED.price_type,
+                              price = EXCLUDED.price,
+                              date_from = EXCLUDED.date_from,
+                              date_to = EXCLUDED.date_to,
+                              updated_at = now();
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Последняя запись остатков: строка проекции удаляется, только если записей
+    # по ключу не осталось; суммарный остаток номенклатуры — UPSERT по PK.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_warehouse_balance_latest(p_org integer, p_wh integer, p_nom integer) RETURNS void AS $$
+        DECLARE
+            rec record;
+        BEGIN
+            IF p_nom IS NULL THEN
+                RETURN;
+            END IF;
+
+            SELECT id, current_amount INTO rec
+            FROM warehouse_balances
+            WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+              AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+              AND nomenclature_id = p_nom
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1;
+
+            IF NOT FOUND THEN
+                DELETE FROM warehouse_balances_latest
+                WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+                  AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+                  AND nomenclature_id = p_nom;
+            ELSE
+                INSERT INTO warehouse_balances_latest
+                    (balance_id, organization_id, warehouse_id, nomenclature_id, current_amount, updated_at)
+                VALUES (rec.id, p_org, p_wh, p_nom, rec.current_amount, now())
+                ON CONFLICT ((COALESCE(organization_id, 0)), (COALESCE(warehouse_id, 0)), nomenclature_id)
+                DO UPDATE SET balance_id = EXCLUDED.balance_id,
+                              current_amount = EXCLUDED.current_amount,
+                              updated_at = now();
+            END IF;
+
+            INSERT INTO nomenclature_marketplace_stats AS s (nomenclature_id, current_amount)
+            VALUES (
+                p_nom,
+                (SELECT COALESCE(sum(greatest(current_amount, 0)), 0)
+                 FROM warehouse_balances_latest
+                 WHERE nomenclature_id = p_nom)
+            )
+            ON CONFLICT (nomenclature_id) DO UPDATE SET current_amount = EXCLUDED.current_amount;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_warehouse_balance_latest(p_org integer, p_wh integer, p_nom integer) RETURNS void AS $$
+        DECLARE
+            rec record;
+        BEGIN
+            IF p_nom IS NULL THEN
+                RETURN;
+            END IF;
+
+            SELECT id, current_amount INTO rec
+            FROM warehouse_balances
+            WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+              AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+              AND nomenclature_id = p_nom
+            ORDER BY created_at DESC, id DESC
+            LIMIT 1;
+
+            IF NOT FOUND THEN
+                DELETE FROM warehouse_balances_latest
+                WHERE COALESCE(organization_id, 0) = COALESCE(p_org, 0)
+                  AND COALESCE(warehouse_id, 0) = COALESCE(p_wh, 0)
+                  AND nomenclature_id = p_nom;
+            ELSE
+                INSERT INTO warehouse_balances_latest
+                    (balance_id, organization_id, warehouse_id, nomenclature_id, current_amount, updated_at)
+                VALUES (rec.id, p_org, p_wh, p_nom, rec.current_amount, now())
+                ON CONFLICT ((COALESCE(organization_id, 0)), (COALESCE(warehouse_id, 0)), nomenclature_id)
+                DO UPDATE SET balance_id = EXCLUDED.balance_id,
+                              current_amount = EXCLUDED.current_amount,
+                              updated_at = now();
+            END IF;
+
+            INSERT INTO nomenclature_marketplace_stats AS s (nomenclature_id, current_amount)
+            SELECT p_nom, COALESCE(sum(greatest(current_amount, 0)), 0)
+            FROM warehouse_balances_latest
+            WHERE nomenclature_id = p_nom
+            ON CONFLICT (nomenclature_id) DO UPDATE SET current_amount = EXCLUDED.current_amount;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION refresh_nomenclature_active_price(p_nom integer) RETURNS void AS $$
+        DECLARE
+            now_ts bigint := extract(epoch from now())::bigint;
+        BEGIN
+            DELETE FROM nomenclature_active_prices WHERE nomenclature_id = p_nom;
+            INSERT INTO nomenclature_active_prices
+                (nomenclature_id, price_id, price_type, price, date_from, date_to, updated_at)
+            SELECT nomenclature, id, price_type, price, date_from, date_to, now()
+            FROM prices
+            WHERE nomenclature = p_nom AND is_deleted IS NOT TRUE
+            ORDER BY (COALESCE(date_from <= now_ts, true) AND COALESCE(now_ts < date_to, true)) DESC,
+                     created_at DESC, id DESC
+            LIMIT 1;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.drop_table('job_cursors')
@@ -0,0 +1,179 @@
+"""balance recalculate lock rows first
+
+Revision ID: c3e8a1f6b924
+Revises: f1a9c3e5d7b2
+Create Date: 2026-10-19 13:05:42.376190
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c3e8a1f6b924'
+down_revision = 'f1a9c3e5d7b2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Сверка считала суммы по снимку начала запроса, а UPDATE ждал блокировку
+    # строки, пока триггер платежа в параллельной транзакции менял баланс:
+    # после ожидания сверка записывала баланс без этого платежа.
+    # Теперь строки блокируются отдельным запросом (в порядке id, чтобы
+    # параллельные сверки не захватили их крест-накрест), а пересчёт идёт
+    # следующим запросом — в VOLATILE-функции он получает новый снимок
+    # и видит все платежи, зафиксированные до получения блокировок.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payboxes_recalculate(p_ids integer[])
+        RETURNS TABLE(paybox_id integer, old_balance double precision, new_balance double precision) AS $$
+            SELECT 1 FROM payboxes WHERE id = ANY(p_ids) ORDER BY id FOR UPDATE;
+
+            WITH moves AS (
+                SELECT p.paybox AS paybox_id, p.date,
+                       CASE WHEN p.type IN ('outgoing', 'transfer') THEN -p.amount ELSE p.amount END AS amount
+                FROM payments p
+                WHERE p.paybox = ANY(p_ids)
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+                UNION ALL
+                SELECT p.paybox_to, p.date, p.amount
+                FROM payments p
+                WHERE p.type = 'transfer' AND p.paybox_to = ANY(p_ids) AND p.paybox IS NOT NULL
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+            ),
+            expected AS (
+                SELECT pb.id, pb.balance AS old_balance,
+                       round((COALESCE(pb.start_balance, 0)
+                           + COALESCE(sum(m.amount) FILTER (WHERE m.date >= pb.balance_date), 0))::numeric, 2
+                       )::double precision AS balance
+                FROM payboxes pb
+                LEFT JOIN moves m ON m.paybox_id = pb.id
+                WHERE pb.id = ANY(p_ids)
+                GROUP BY pb.id
+            )
+            UPDATE payboxes pb
+            SET balance = e.balance,
+                update_start_balance = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pb.id = e.id
+              AND (pb.balance IS NULL OR abs(pb.balance - e.balance) >= 0.01)
+            RETURNING pb.id, e.old_balance, e.balance;
+        $$ LANGUAGE sql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION projects_recalculate(p_ids integer[])
+        RETURNS TABLE(
+            project_id integer,
+            old_incoming double precision, old_outgoing double precision,
+            new_incoming double precision, new_outgoing double precision
+        ) AS $$
+            SELECT 1 FROM projects WHERE id = ANY(p_ids) ORDER BY id FOR UPDATE;
+
+            WITH expected AS (
+                SELECT pr.id, pr.incoming AS old_incoming, pr.outgoing AS old_outgoing,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'incoming'), 0)::numeric, 2)::double precision AS incoming,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'outgoing'), 0)::numeric, 2)::double precision AS outgoing
+                FROM projects pr
+                LEFT JOIN payments p
+                    ON p.project_id = pr.id
+                    AND p.status IS TRUE AND p.is_deleted IS FALSE AND p.paybox IS NOT NULL
+                WHERE pr.id = ANY(p_ids)
+                GROUP BY pr.id
+            )
+            UPDATE projects pr
+            SET incoming = e.incoming,
+                outgoing = e.outgoing,
+                profitability = CASE
+                    WHEN e.outgoing = 0 AND e.incoming <> 0 THEN 100
+                    WHEN e.outgoing = 0 THEN 0
+                    ELSE round(((e.incoming - e.outgoing) / e.outgoing * 100)::numeric, 2)
+                END,
+                updated_at = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pr.id = e.id
+              AND (
+                  pr.incoming IS NULL OR pr.outgoing IS NULL
+                  OR abs(pr.incoming - e.incoming) >= 0.01
+                  OR abs(pr.outgoing - e.outgoing) >= 0.01
+              )
+            RETURNING pr.id, e.old_incoming, e.old_outgoing, e.incoming, e.outgoing;
+        $$ LANGUAGE sql;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION payboxes_recalculate(p_ids integer[])
+        RETURNS TABLE(paybox_id integer, old_balance double precision, new_balance double precision) AS $$
+            WITH moves AS (
+                SELECT p.paybox AS paybox_id, p.date,
+                       CASE WHEN p.type IN ('outgoing', 'transfer') THEN -p.amount ELSE p.amount END AS amount
+                FROM payments p
+                WHERE p.paybox = ANY(p_ids)
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+                UNION ALL
+                SELECT p.paybox_to, p.date, p.amount
+                FROM payments p
+                WHERE p.type = 'transfer' AND p.paybox_to = ANY(p_ids) AND p.paybox IS NOT NULL
+                  AND p.status IS TRUE AND p.is_deleted IS FALSE
+                  AND p.parent_id IS NULL AND p.balance_applied IS TRUE
+            ),
+            expected AS (
+                SELECT pb.id, pb.balance AS old_balance,
+                       round((COALESCE(pb.start_balance, 0)
+                           + COALESCE(sum(m.amount) FILTER (WHERE m.date >= pb.balance_date), 0))::numeric, 2
+                       )::double precision AS balance
+                FROM payboxes pb
+                LEFT JOIN moves m ON m.paybox_id = pb.id
+                WHERE pb.id = ANY(p_ids)
+                GROUP BY pb.id
+            )
+            UPDATE payboxes pb
+            SET balance = e.balance,
+                update_start_balance = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pb.id = e.id
+              AND (pb.balance IS NULL OR abs(pb.balance - e.balance) >= 0.01)
+            RETURNING pb.id, e.old_balance, e.balance;
+        $$ LANGUAGE sql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION projects_recalculate(p_ids integer[])
+        RETURNS TABLE(
+            project_id integer,
+            old_incoming double precision, old_outgoing double precision,
+            new_incoming double precision, new_outgoing double precision
+        ) AS $$
+            WITH expected AS (
+                SELECT pr.id, pr.incoming AS old_incoming, pr.outgoing AS old_outgoing,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'incoming'), 0)::numeric, 2)::double precision AS incoming,
+                       round(COALESCE(sum(p.amount) FILTER (WHERE p.type = 'outgoing'), 0)::numeric, 2)::double precision AS outgoing
+                FROM projects pr
+                LEFT JOIN payments p
+                    ON p.project_id = pr.id
+                    AND p.status IS TRUE AND p.is_deleted IS FALSE AND p.paybox IS NOT NULL
+                WHERE pr.id = ANY(p_ids)
+                GROUP BY pr.id
+            )
+            UPDATE projects pr
+            SET incoming = e.incoming,
+                outgoing = e.outgoing,
+                profitability = CASE
+                    WHEN e.outgoing = 0 AND e.incoming <> 0 THEN 100
+                    WHEN e.outgoing = 0 THEN 0
+                    ELSE round(((e.incoming - e.outgoing) / e.outgoing * 100)::numeric, 2)
+                END,
+                updated_at = extract(epoch FROM now())::integer
+            FROM expected e
+            WHERE pr.id = e.id
+              AND (
+                  pr.incoming IS NULL OR pr.outgoing IS NULL
+                  OR abs(pr.incoming - e.incoming) >= 0.01
+                  OR abs(pr.outgoing - e.outgoing) >= 0.01
+              )
+            RETURNING pr.id, e.old_incoming, e.old_outgoing, e.incoming, e.outgoing;
+        $$ LANGUAGE sql;
+    """)
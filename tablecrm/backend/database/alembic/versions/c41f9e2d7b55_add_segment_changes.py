@@ -0,0 +1,201 @@
+"""add segment changes
+
+Revision ID: c41f9e2d7b55
+Revises: a7d2c5e81f30
+Create Date: 2026-10-18 13:05:12.483920
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'c41f9e2d7b55'
+down_revision = 'a7d2c5e81f30'
+branch_labels = None
+depends_on = None
+
+
+TRIGGERS = (
+    ("trg_docs_sales_segment_changes", "docs_sales", "docs_sales_segment_changes"),
+    ("trg_docs_sales_goods_segment_changes", "docs_sales_goods", "docs_sales_child_segment_changes"),
+    ("trg_docs_sales_tags_segment_changes", "docs_sales_tags", "docs_sales_child_segment_changes"),
+    ("trg_docs_sales_delivery_info_segment_changes", "docs_sales_delivery_info", "docs_sales_child_segment_changes"),
+    ("trg_entity_to_entity_segment_changes", "entity_to_entity", "entity_to_entity_segment_changes"),
+    ("trg_contragents_segment_changes", "contragents", "contragents_segment_changes"),
+    ("trg_contragents_tags_segment_changes", "contragents_tags", "contragents_tags_segment_changes"),
+    ("trg_loyality_cards_segment_changes", "loyality_cards", "loyality_cards_segment_changes"),
+    ("trg_loyality_transactions_segment_changes", "loyality_transactions", "loyality_transactions_segment_changes"),
+)
+
+
+def upgrade() -> None:
+    op.add_column('segments', sa.Column('last_full_recalc_at', sa.DateTime(timezone=True), nullable=True))
+
+    op.create_table('segment_changes',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('cashbox_id', sa.Integer(), nullable=False),
+        sa.Column('object_type', postgresql.ENUM(name='segment_object_type', create_type=False), nullable=False),
+        sa.Column('object_id', sa.BigInteger(), nullable=False),
+        sa.Column('changed_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=False),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index('ix_segment_changes_cashbox_changed_at', 'segment_changes', ['cashbox_id', 'changed_at'], unique=False)
+    op.create_index(op.f('ix_segment_changes_changed_at'), 'segment_changes', ['changed_at'], unique=False)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_change(p_cashbox integer, p_type text, p_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            IF p_cashbox IS NOT NULL AND p_id IS NOT NULL THEN
+                INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+                VALUES (p_cashbox, p_type::segment_object_type, p_id);
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Изменение документа затрагивает и его контрагента: агрегаты покупок считаются по контрагенту
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_docs_sales(p_doc_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox, 'docs_sales'::segment_object_type, id
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL
+            UNION ALL
+            SELECT cashbox, 'contragents'::segment_object_type, contragent
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL AND contragent IS NOT NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION docs_sales_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM segment_mark_change(NEW.cashbox, 'docs_sales', NEW.id);
+                PERFORM segment_mark_change(NEW.cashbox, 'contragents', NEW.contragent);
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                PERFORM segment_mark_change(OLD.cashbox, 'docs_sales', OLD.id);
+            END IF;
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.contragent IS DISTINCT FROM NEW.contragent) THEN
+                PERFORM segment_mark_change(OLD.cashbox, 'contragents', OLD.contragent);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION docs_sales_child_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM segment_mark_docs_sales(OLD.docs_sales_id);
+            END IF;
+            IF TG_OP = 'INSERT' OR (TG_OP = 'UPDATE' AND OLD.docs_sales_id IS DISTINCT FROM NEW.docs_sales_id) THEN
+                PERFORM segment_mark_docs_sales(NEW.docs_sales_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Связи документов продаж (7) с оплатами влияют на критерий is_fully_paid
+    op.execute("""
+        CREATE OR REPLACE FUNCTION entity_to_entity_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') AND OLD.from_entity = 7 THEN
+                PERFORM segment_mark_docs_sales(OLD.from_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') AND NEW.from_entity = 7 THEN
+                PERFORM segment_mark_docs_sales(NEW.from_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION contragents_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM segment_mark_change(OLD.cashbox, 'contragents', OLD.id);
+            ELSE
+                PERFORM segment_mark_change(NEW.cashbox, 'contragents', NEW.id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION contragents_tags_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP IN ('UPDATE', 'DELETE') THEN
+                PERFORM segment_mark_change(OLD.cashbox_id, 'contragents', OLD.contragent_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM segment_mark_change(NEW.cashbox_id, 'contragents', NEW.contragent_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_cards_segment_changes() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' OR (TG_OP = 'UPDATE' AND OLD.contragent_id IS DISTINCT FROM NEW.contragent_id) THEN
+                PERFORM segment_mark_change(OLD.cashbox_id, 'contragents', OLD.contragent_id);
+            END IF;
+            IF TG_OP IN ('INSERT', 'UPDATE') THEN
+                PERFORM segment_mark_change(NEW.cashbox_id, 'contragents', NEW.contragent_id);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Транзакции меняют дату последнего начисления (expires_in_days) по карте контрагента
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_transactions_segment_changes() RETURNS trigger AS $$
+        DECLARE
+            v_card_id integer;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                v_card_id := OLD.loyality_card_id;
+            ELSE
+                v_card_id := NEW.loyality_card_id;
+            END IF;
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox_id, 'contragents'::segment_object_type, contragent_id
+            FROM loyality_cards
+            WHERE id = v_card_id AND cashbox_id IS NOT NULL AND contragent_id IS NOT NULL;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    for trigger_name, table, function in TRIGGERS:
+        op.execute(f"""
+            CREATE TRIGGER {trigger_name}
+            AFTER INSERT OR UPDATE OR DELETE ON {table}
+            FOR EACH ROW
+            EXECUTE FUNCTION {function}();
+        """)
+
+
+def downgrade() -> None:
+    for trigger_name, table, function in TRIGGERS:
+        op.execute(f"DROP TRIGGER IF EXISTS {trigger_name} ON {table}")
+    for function in sorted({function for _, _, function in TRIGGERS}):
+        op.execute(f"DROP FUNCTION IF EXISTS {function}()")
+    op.execute("DROP FUNCTION IF EXISTS segment_mark_docs_sales(bigint)")
+    op.execute("DROP FUNCTION IF EXISTS segment_mark_change(integer, text, bigint)")
+    op.drop_index(op.f('ix_segment_changes_changed_at'), table_name='segment_changes')
+    op.drop_index('ix_segment_changes_cashbox_changed_at', table_name='segment_changes')
+    op.drop_table('segment_changes')
+    op.drop_column('segments', 'last_full_recalc_at')
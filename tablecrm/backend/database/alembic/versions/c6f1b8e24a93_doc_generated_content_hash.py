@@ -0,0 +1,37 @@
+"""doc generated content hash
+
+Revision ID: c6f1b8e24a93
+Revises: a91c4e7b2d56
+Create Date: 2026-10-18 17:03:27.214690
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c6f1b8e24a93'
+down_revision = 'a91c4e7b2d56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('doc_generated', sa.Column('content_hash', sa.String(), nullable=True))
+
+    # поиск уже сгенерированного файла кассы по хэшу содержимого
+    conn = op.get_bind()
+    exists = conn.scalar(sa.text("SELECT to_regclass(:n)"), {"n": "public.idx_doc_generated_content_hash"})
+    if exists is None:
+        with op.get_context().autocommit_block():
+            op.execute("""
+                CREATE INDEX CONCURRENTLY idx_doc_generated_content_hash
+                ON doc_generated (cashbox_id, content_hash)
+                WHERE content_hash IS NOT NULL;
+            """)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_doc_generated_content_hash;")
+    op.drop_column('doc_generated', 'content_hash')
@@ -0,0 +1,58 @@
+"""add search trgm indexes
+
+Revision ID: d38f6a1c9e27
+Revises: b5e0c93d7a41
+Create Date: 2026-10-18 15:41:12.604915
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd38f6a1c9e27'
+down_revision = 'b5e0c93d7a41'
+branch_labels = None
+depends_on = None
+
+
+TRGM_INDEXES = {
+    "idx_nomenclature_name_trgm": "nomenclature USING gin (name gin_trgm_ops)",
+    "idx_nomenclature_barcodes_code_trgm": "nomenclature_barcodes USING gin (code gin_trgm_ops)",
+    "idx_contragents_name_trgm": "contragents USING gin (name gin_trgm_ops)",
+    "idx_contragents_phone_normalized_trgm": (
+        "contragents USING gin ((regexp_replace(phone, '[^0-9]', '', 'g')) gin_trgm_ops)"
+    ),
+    "idx_contragents_inn_trgm": "contragents USING gin (inn gin_trgm_ops)",
+    "idx_contragents_external_id_trgm": "contragents USING gin (external_id gin_trgm_ops)",
+    "idx_chat_contacts_name_trgm": "chat_contacts USING gin (name gin_trgm_ops)",
+    "idx_chat_contacts_phone_normalized_trgm": (
+        "chat_contacts USING gin ((regexp_replace(phone, '[^0-9]', '', 'g')) gin_trgm_ops)"
+    ),
+    "idx_chats_external_chat_id_trgm": "chats USING gin (external_chat_id gin_trgm_ops)",
+    # точный поиск штрихкода на кассе — один проход по btree
+    "idx_nomenclature_barcodes_code_normalized": (
+        "nomenclature_barcodes ((lower(regexp_replace(code, '\\s', '', 'g'))))"
+    ),
+}
+
+# Нормализованные телефон и штрихкод — индексы по выражению, а не генерируемые
+# колонки: ADD COLUMN ... STORED переписывает таблицу под ACCESS EXCLUSIVE.
+# Запросы строят то же выражение (functions/search.py: phone_digits, barcode_code).
+
+
+def upgrade():
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+
+    conn = op.get_bind()
+    for idx_name, definition in TRGM_INDEXES.items():
+        exists = conn.scalar(sa.text("SELECT to_regclass(:n)"), {"n": f"public.{idx_name}"})
+        if exists is None:
+            with op.get_context().autocommit_block():
+                op.execute(f"CREATE INDEX CONCURRENTLY {idx_name} ON {definition};")
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for idx_name in TRGM_INDEXES:
+            op.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {idx_name};")
@@ -0,0 +1,147 @@
+"""chats message counters
+
+Revision ID: d7a3e1f05b92
+Revises: b52e9c7a4f18
+Create Date: 2026-10-18 19:41:27.904215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd7a3e1f05b92'
+down_revision = 'b52e9c7a4f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('chats', sa.Column('unread_count', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('chats', sa.Column('last_message_id', sa.Integer(), nullable=True))
+    op.add_column('chats', sa.Column('last_message_preview', sa.String(length=100), nullable=True))
+
+    # Счётчики ведёт триггер на chat_messages: сообщения пишут и crud, и обработчики
+    # вебхуков, и синхронизация Avito пачками. Непрочитанное — сообщение клиента
+    # со статусом не READ (как раньше в get_chats), последнее — по (created_at, id).
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chat_messages_is_unread(m chat_messages) RETURNS integer AS $$
+            SELECT CASE WHEN m.sender_type = 'CLIENT' AND m.status <> 'READ' THEN 1 ELSE 0 END;
+        $$ LANGUAGE sql IMMUTABLE;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chats_refresh_last_message(p_chat_id integer) RETURNS void AS $$
+            UPDATE chats
+            SET (last_message_id, last_message_preview) = (
+                SELECT id, left(content, 100) FROM chat_messages
+                WHERE chat_id = p_chat_id
+                ORDER BY created_at DESC, id DESC
+                LIMIT 1
+            )
+            WHERE id = p_chat_id;
+        $$ LANGUAGE sql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION chat_messages_counters() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                UPDATE chats c
+                SET unread_count = c.unread_count + chat_messages_is_unread(NEW),
+                    last_message_id = NEW.id,
+                    last_message_preview = left(NEW.content, 100)
+                WHERE c.id = NEW.chat_id
+                  AND NOT EXISTS (
+                      SELECT 1 FROM chat_messages l
+                      WHERE l.id = c.last_message_id AND (l.created_at, l.id) > (NEW.created_at, NEW.id)
+                  );
+                IF NOT FOUND AND chat_messages_is_unread(NEW) = 1 THEN
+                    UPDATE chats SET unread_count = unread_count + 1 WHERE id = NEW.chat_id;
+                END IF;
+
+            ELSIF TG_OP = 'UPDATE' THEN
+                IF NEW.chat_id <> OLD.chat_id THEN
+                    UPDATE chats SET unread_count = greatest(unread_count - chat_messages_is_unread(OLD), 0)
+                    WHERE id = OLD.chat_id;
+                    UPDATE chats SET unread_count = unread_count + chat_messages_is_unread(NEW)
+                    WHERE id = NEW.chat_id;
+                    PERFORM chats_refresh_last_message(OLD.chat_id);
+                    PERFORM chats_refresh_last_message(NEW.chat_id);
+                ELSE
+                    IF chat_messages_is_unread(NEW) <> chat_messages_is_unread(OLD) THEN
+                        UPDATE chats
+                        SET unread_count = greatest(unread_count + chat_messages_is_unread(NEW) - chat_messages_is_unread(OLD), 0)
+                        WHERE id = NEW.chat_id;
+                    END IF;
+                    IF NEW.created_at IS DISTINCT FROM OLD.created_at THEN
+                        PERFORM chats_refresh_last_message(NEW.chat_id);
+                    ELSIF NEW.content IS DISTINCT FROM OLD.content THEN
+                        UPDATE chats SET last_message_preview = left(NEW.content, 100)
+                        WHERE id = NEW.chat_id AND last_message_id = NEW.id;
+                    END IF;
+                END IF;
+
+            ELSE
+                IF chat_messages_is_unread(OLD) = 1 THEN
+                    UPDATE chats SET unread_count = greatest(unread_count - 1, 0) WHERE id = OLD.chat_id;
+                END IF;
+                IF EXISTS (SELECT 1 FROM chats WHERE id = OLD.chat_id AND last_message_id = OLD.id) THEN
+                    PERFORM chats_refresh_last_message(OLD.chat_id);
+                END IF;
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+    # Запись сообщений блокируется до конца миграции, чтобы заполнение
+    # счётчиков и установка триггера видели одни и те же данные
+    op.execute("LOCK TABLE chat_messages IN SHARE ROW EXCLUSIVE MODE")
+    op.execute("""
+        UPDATE chats c
+        SET unread_count = u.cnt
+        FROM (
+            SELECT chat_id, count(*) AS cnt
+            FROM chat_messages
+            WHERE sender_type = 'CLIENT' AND status <> 'READ'
+            GROUP BY chat_id
+        ) u
+        WHERE u.chat_id = c.id
+    """)
+    op.execute("""
+        UPDATE chats c
+        SET last_message_id = m.id,
+            last_message_preview = left(m.content, 100)
+        FROM (
+            SELECT DISTINCT ON (chat_id) chat_id, id, content
+            FROM chat_messages
+            ORDER BY chat_id, created_at DESC, id DESC
+        ) m
+        WHERE m.chat_id = c.id
+    """)
+    op.execute("""
+        CREATE TRIGGER chat_messages_counters
+        AFTER INSERT OR DELETE OR UPDATE OF chat_id, sender_type, status, content, created_at ON chat_messages
+        FOR EACH ROW EXECUTE FUNCTION chat_messages_counters();
+    """)
+
+    # список чатов кассы: keyset-пагинация по (last_message_time, id)
+    conn = op.get_bind()
+    exists = conn.scalar(sa.text("SELECT to_regclass(:n)"), {"n": "public.idx_chats_cashbox_last_message"})
+    if exists is None:
+        with op.get_context().autocommit_block():
+            op.execute("""
+                CREATE INDEX CONCURRENTLY idx_chats_cashbox_last_message
+                ON chats (cashbox_id, last_message_time DESC NULLS LAST, id DESC);
+            """)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_chats_cashbox_last_message;")
+    op.execute("DROP TRIGGER IF EXISTS chat_messages_counters ON chat_messages")
+    op.execute("DROP FUNCTION IF EXISTS chat_messages_counters()")
+    op.execute("DROP FUNCTION IF EXISTS chats_refresh_last_message(integer)")
+    op.execute("DROP FUNCTION IF EXISTS chat_messages_is_unread(chat_messages)")
+    op.drop_column('chats', 'last_message_preview')
+    op.drop_column('chats', 'last_message_id')
+    op.drop_column('chats', 'unread_count')
@@ -0,0 +1,32 @@
+"""apple wallet pass fingerprints
+
+Revision ID: e4a7d2c91b38
+Revises: c6f1b8e24a93
+Create Date: 2026-10-18 17:41:52.903166
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4a7d2c91b38'
+down_revision = 'c6f1b8e24a93'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Отдельная таблица, а не колонка loyality_cards: запись отпечатка
+    # не должна будить триггеры карт (segment_changes, updated_at)
+    op.create_table('apple_wallet_pass_fingerprints',
+        sa.Column('card_id', sa.Integer(), nullable=False),
+        sa.Column('fingerprint', sa.String(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['card_id'], ['loyality_cards.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('card_id')
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('apple_wallet_pass_fingerprints')
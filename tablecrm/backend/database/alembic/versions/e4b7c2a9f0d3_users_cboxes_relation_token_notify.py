@@ -0,0 +1,49 @@
+"""users_cboxes_relation token notify
+
+Revision ID: e4b7c2a9f0d3
+Revises: a91c4e7d2b56
+Create Date: 2026-10-19 10:14:52.307418
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b7c2a9f0d3'
+down_revision = 'a91c4e7d2b56'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Кэш TokenResolver в каждом процессе API сбрасывается по NOTIFY:
+    # токен и статус меняют и API, и бот (отдельный процесс).
+    # Уведомление уходит при фиксации транзакции.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION users_cboxes_relation_token_notify() RETURNS trigger AS $$
+        BEGIN
+            IF OLD.token IS NOT NULL THEN
+                PERFORM pg_notify('token_resolver_invalidate', OLD.token);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE TRIGGER users_cboxes_relation_token_notify_update
+        AFTER UPDATE ON users_cboxes_relation
+        FOR EACH ROW WHEN (OLD.* IS DISTINCT FROM NEW.*)
+        EXECUTE FUNCTION users_cboxes_relation_token_notify();
+    """)
+    op.execute("""
+        CREATE TRIGGER users_cboxes_relation_token_notify_delete
+        AFTER DELETE ON users_cboxes_relation
+        FOR EACH ROW EXECUTE FUNCTION users_cboxes_relation_token_notify();
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS users_cboxes_relation_token_notify_delete ON users_cboxes_relation")
+    op.execute("DROP TRIGGER IF EXISTS users_cboxes_relation_token_notify_update ON users_cboxes_relation")
+    op.execute("DROP FUNCTION IF EXISTS users_cboxes_relation_token_notify()")
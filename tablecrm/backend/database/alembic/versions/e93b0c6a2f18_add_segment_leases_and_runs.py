@@ -0,0 +1,47 @@
+"""add segment leases and runs
+
+Revision ID: e93b0c6a2f18
+Revises: c41f9e2d7b55
+Create Date: 2026-10-18 13:48:27.915306
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e93b0c6a2f18'
+down_revision = 'c41f9e2d7b55'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('segments', sa.Column('lease_owner', sa.String(), nullable=True))
+    op.add_column('segments', sa.Column('lease_until', sa.DateTime(timezone=True), nullable=True))
+
+    op.create_table('segment_runs',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('segment_id', sa.BigInteger(), nullable=False),
+        sa.Column('cashbox_id', sa.Integer(), nullable=True),
+        sa.Column('worker', sa.String(), nullable=True),
+        sa.Column('mode', sa.String(), nullable=False),
+        sa.Column('is_success', sa.Boolean(), nullable=False),
+        sa.Column('started_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('duration_ms', sa.Integer(), nullable=False),
+        sa.Column('docs_sales_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('contragents_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('added_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('removed_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('error', sa.Text(), nullable=True),
+        sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_segment_runs_segment_id'), 'segment_runs', ['segment_id'], unique=False)
+
+
+def downgrade() -> None:
+    op.drop_index(op.f('ix_segment_runs_segment_id'), table_name='segment_runs')
+    op.drop_table('segment_runs')
+    op.drop_column('segments', 'lease_until')
+    op.drop_column('segments', 'lease_owner')
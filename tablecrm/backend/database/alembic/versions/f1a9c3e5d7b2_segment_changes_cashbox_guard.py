@@ -0,0 +1,117 @@
+"""segment changes cashbox guard
+
+Revision ID: f1a9c3e5d7b2
+Revises: b6d2f8e41a07
+Create Date: 2026-10-19 11:48:09.214635
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f1a9c3e5d7b2'
+down_revision = 'b6d2f8e41a07'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    # Журнал пишется только для касс, у которых есть сегменты: у остальных
+    # каждая строка товаров продажи делала лишние вставки в segment_changes.
+    # Первый сегмент кассы всё равно считается полным пересчётом.
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_change(p_cashbox integer, p_type text, p_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            IF p_cashbox IS NOT NULL AND p_id IS NOT NULL
+               AND EXISTS (SELECT 1 FROM segments WHERE cashbox_id = p_cashbox) THEN
+                INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+                VALUES (p_cashbox, p_type::segment_object_type, p_id);
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_docs_sales(p_doc_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM docs_sales d JOIN segments s ON s.cashbox_id = d.cashbox
+                WHERE d.id = p_doc_id
+            ) THEN
+                RETURN;
+            END IF;
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox, 'docs_sales'::segment_object_type, id
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL
+            UNION ALL
+            SELECT cashbox, 'contragents'::segment_object_type, contragent
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL AND contragent IS NOT NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_transactions_segment_changes() RETURNS trigger AS $$
+        DECLARE
+            v_card_id integer;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                v_card_id := OLD.loyality_card_id;
+            ELSE
+                v_card_id := NEW.loyality_card_id;
+            END IF;
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox_id, 'contragents'::segment_object_type, contragent_id
+            FROM loyality_cards
+            WHERE id = v_card_id AND cashbox_id IS NOT NULL AND contragent_id IS NOT NULL
+              AND EXISTS (SELECT 1 FROM segments WHERE segments.cashbox_id = loyality_cards.cashbox_id);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+
+def downgrade() -> None:
+    op.execute("""
+        CREATE OR REPLACE FUNCTION loyality_transactions_segment_changes() RETURNS trigger AS $$
+        DECLARE
+            v_card_id integer;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                v_card_id := OLD.loyality_card_id;
+            ELSE
+                v_card_id := NEW.loyality_card_id;
+            END IF;
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox_id, 'contragents'::segment_object_type, contragent_id
+            FROM loyality_cards
+            WHERE id = v_card_id AND cashbox_id IS NOT NULL AND contragent_id IS NOT NULL;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_docs_sales(p_doc_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+            SELECT cashbox, 'docs_sales'::segment_object_type, id
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL
+            UNION ALL
+            SELECT cashbox, 'contragents'::segment_object_type, contragent
+            FROM docs_sales WHERE id = p_doc_id AND cashbox IS NOT NULL AND contragent IS NOT NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+    op.execute("""
+        CREATE OR REPLACE FUNCTION segment_mark_change(p_cashbox integer, p_type text, p_id bigint)
+        RETURNS void AS $$
+        BEGIN
+            IF p_cashbox IS NOT NULL AND p_id IS NOT NULL THEN
+                INSERT INTO segment_changes (cashbox_id, object_type, object_id)
+                VALUES (p_cashbox, p_type::segment_object_type, p_id);
+            END IF;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
@@ -0,0 +1,48 @@
+"""add segment action runs
+
+Revision ID: f2a8d41c6e07
+Revises: e93b0c6a2f18
+Create Date: 2026-10-18 14:32:09.271554
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8d41c6e07'
+down_revision = 'e93b0c6a2f18'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table('segment_action_runs',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('segment_id', sa.BigInteger(), nullable=False),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('params', sa.JSON(), nullable=False),
+        sa.Column('object_ids', postgresql.ARRAY(sa.BigInteger()), nullable=False),
+        sa.Column('cursor', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('sent_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('failed_count', sa.Integer(), server_default='0', nullable=False),
+        sa.Column('is_finished', sa.Boolean(), server_default='false', nullable=False),
+        sa.Column('lease_owner', sa.String(), nullable=True),
+        sa.Column('lease_until', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('created_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), server_default=sa.text('now()'), nullable=True),
+        sa.ForeignKeyConstraint(['segment_id'], ['segments.id'], ),
+        sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_segment_action_runs_segment_id'), 'segment_action_runs', ['segment_id'], unique=False)
+    op.create_index(
+        'ix_segment_action_runs_unfinished', 'segment_action_runs', ['lease_until'],
+        unique=False, postgresql_where=sa.text('NOT is_finished')
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_segment_action_runs_unfinished', table_name='segment_action_runs')
+    op.drop_index(op.f('ix_segment_action_runs_segment_id'), table_name='segment_action_runs')
+    op.drop_table('segment_action_runs')
@@ -0,0 +1,53 @@
+"""tochka sync cursor
+
+Revision ID: f83b5d1e6c24
+Revises: e4a7d2c91b38
+Create Date: 2026-10-18 18:12:36.448105
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f83b5d1e6c24'
+down_revision = 'e4a7d2c91b38'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('tochka_bank_accounts', sa.Column('sync_cursor_date', sa.String(), nullable=True))
+    op.add_column('tochka_bank_accounts', sa.Column('sync_cursor_payment_id', sa.String(), nullable=True))
+    op.add_column('tochka_bank_accounts', sa.Column('synced_at', sa.DateTime(timezone=True), nullable=True))
+
+    # Уже загруженные счета продолжают с последней сохранённой операции,
+    # а не запрашивают выписку с даты регистрации
+    op.execute("""
+        UPDATE tochka_bank_accounts a
+        SET sync_cursor_date = t.last_date
+        FROM (
+            SELECT "accountId", max("documentProcessDate") AS last_date
+            FROM tochka_bank_payments
+            GROUP BY "accountId"
+        ) t
+        WHERE t."accountId" = a."accountId"
+    """)
+
+    # выборка уже загруженных операций счёта в окне выписки
+    conn = op.get_bind()
+    exists = conn.scalar(sa.text("SELECT to_regclass(:n)"), {"n": "public.idx_tochka_bank_payments_account_payment"})
+    if exists is None:
+        with op.get_context().autocommit_block():
+            op.execute("""
+                CREATE INDEX CONCURRENTLY idx_tochka_bank_payments_account_payment
+                ON tochka_bank_payments ("accountId", payment_id);
+            """)
+
+
+def downgrade() -> None:
+    with op.get_context().autocommit_block():
+        op.execute("DROP INDEX CONCURRENTLY IF EXISTS idx_tochka_bank_payments_account_payment;")
+    op.drop_column('tochka_bank_accounts', 'synced_at')
+    op.drop_column('tochka_bank_accounts', 'sync_cursor_payment_id')
+    op.drop_column('tochka_bank_accounts', 'sync_cursor_date')
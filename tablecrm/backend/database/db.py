@@ -27,7 +27,6 @@ from sqlalchemy import (
 )
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker, declarative_base
-from sqlalchemy.pool import NullPool
 from sqlalchemy.sql import func
 
 from database.enums import (
@@ -549,6 +548,10 @@ tochka_bank_accounts = sqlalchemy.Table(
     ),
     sqlalchemy.Column("is_deleted", Boolean),
     sqlalchemy.Column("is_active", Boolean, default=False),
+    # курсор синхронизации выписок: дата (YYYY-MM-DD) и paymentId последней обработанной операции
+    sqlalchemy.Column("sync_cursor_date", String, nullable=True),
+    sqlalchemy.Column("sync_cursor_payment_id", String, nullable=True),
+    sqlalchemy.Column("synced_at", DateTime(timezone=True), nullable=True),
 )
 
 entity_type = sqlalchemy.Table(
@@ -1261,6 +1264,7 @@ payments = sqlalchemy.Table(
     sqlalchemy.Column("docs_sales_id", Integer, ForeignKey("docs_sales.id")),
     sqlalchemy.Column("contract_id", Integer, ForeignKey("contracts.id")),
     sqlalchemy.Column("docs_purchases_id", Integer, ForeignKey("docs_purchases.id")),
+    sqlalchemy.Column("balance_applied", Boolean, server_default="false", nullable=False),
     sqlalchemy.Column("created_at", Integer),
     sqlalchemy.Column("updated_at", Integer),
 )
@@ -1738,6 +1742,21 @@ docs_warehouse_goods = sqlalchemy.Table(
     ),
 )
 
+# Последний выданный номер документа по организации и типу (functions/doc_numbers.py)
+doc_number_counters = sqlalchemy.Table(
+    "doc_number_counters",
+    metadata,
+    sqlalchemy.Column(
+        "organization_id",
+        Integer,
+        ForeignKey("organizations.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column("doc_type", String(32), primary_key=True),
+    sqlalchemy.Column("last_number", BigInteger, server_default="0", nullable=False),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
+)
+
 warehouse_register_movement = sqlalchemy.Table(
     "warehouse_register_movement",
     metadata,
@@ -1762,6 +1781,45 @@ warehouse_register_movement = sqlalchemy.Table(
     ),
 )
 
+# Проекции warehouse_register_movement, поддерживаются триггером
+# trg_warehouse_register_movement_ledger (миграция 3cd3cfe766f2).
+# organization_id/warehouse_id = 0, если в движении они не заданы.
+warehouse_balance_ledger = sqlalchemy.Table(
+    "warehouse_balance_ledger",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True),
+    sqlalchemy.Column("cashbox_id", Integer, index=True),
+    sqlalchemy.Column("organization_id", Integer, nullable=False),
+    sqlalchemy.Column("warehouse_id", Integer, nullable=False),
+    sqlalchemy.Column("nomenclature_id", Integer, nullable=False),
+    sqlalchemy.Column("incoming_amount", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("outgoing_amount", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("current_amount", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+    sqlalchemy.UniqueConstraint(
+        "organization_id", "warehouse_id", "nomenclature_id", name="uq_warehouse_balance_ledger_key"
+    ),
+    sqlalchemy.Index("ix_warehouse_balance_ledger_warehouse_nomenclature", "warehouse_id", "nomenclature_id"),
+)
+
+# Накопительные итоги прихода/расхода на конец каждого дня, в который было движение.
+# Остаток на дату = incoming_total - outgoing_total последней строки с day <= даты.
+warehouse_balance_daily = sqlalchemy.Table(
+    "warehouse_balance_daily",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True),
+    sqlalchemy.Column("cashbox_id", Integer),
+    sqlalchemy.Column("organization_id", Integer, nullable=False),
+    sqlalchemy.Column("warehouse_id", Integer, nullable=False),
+    sqlalchemy.Column("nomenclature_id", Integer, nullable=False),
+    sqlalchemy.Column("day", Date, nullable=False),
+    sqlalchemy.Column("incoming_total", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("outgoing_total", Float, nullable=False, server_default="0"),
+    sqlalchemy.UniqueConstraint(
+        "organization_id", "warehouse_id", "nomenclature_id", "day", name="uq_warehouse_balance_daily_key"
+    ),
+)
+
 docs_reconciliation = sqlalchemy.Table(
     "docs_reconciliation",
     metadata,
@@ -1977,6 +2035,49 @@ warehouse_balances = sqlalchemy.Table(
     ),
 )
 
+# Проекции для листинга маркетплейса, поддерживаются триггерами
+# на prices, warehouse_balances и docs_sales_goods (миграция 5b0e7a1c94d2).
+nomenclature_active_prices = sqlalchemy.Table(
+    "nomenclature_active_prices",
+    metadata,
+    sqlalchemy.Column("nomenclature_id", Integer, primary_key=True),
+    sqlalchemy.Column("price_id", Integer, nullable=False),
+    sqlalchemy.Column("price_type", Integer, index=True),
+    sqlalchemy.Column("price", Float, nullable=False),
+    sqlalchemy.Column("date_from", Integer),
+    sqlalchemy.Column("date_to", Integer),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+warehouse_balances_latest = sqlalchemy.Table(
+    "warehouse_balances_latest",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True),
+    sqlalchemy.Column("balance_id", Integer, nullable=False),
+    sqlalchemy.Column("organization_id", Integer),
+    sqlalchemy.Column("warehouse_id", Integer),
+    sqlalchemy.Column("nomenclature_id", Integer, nullable=False, index=True),
+    sqlalchemy.Column("current_amount", Float, nullable=False),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
+nomenclature_marketplace_stats = sqlalchemy.Table(
+    "nomenclature_marketplace_stats",
+    metadata,
+    sqlalchemy.Column("nomenclature_id", Integer, primary_key=True),
+    sqlalchemy.Column("current_amount", Float, nullable=False, server_default="0"),
+    sqlalchemy.Column("total_sold", Integer, nullable=False, server_default="0"),
+)
+
+# Курсоры периодических задач: момент, до которого задача уже отработала
+job_cursors = sqlalchemy.Table(
+    "job_cursors",
+    metadata,
+    sqlalchemy.Column("name", String, primary_key=True),
+    sqlalchemy.Column("value", BigInteger, nullable=False),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now()),
+)
+
 messages = sqlalchemy.Table(
     "messages",
     metadata,
@@ -1996,8 +2097,8 @@ loyality_cards = sqlalchemy.Table(
     sqlalchemy.Column("card_number", BigInteger),
     sqlalchemy.Column("tags", String),
     sqlalchemy.Column("balance", Float),
-    sqlalchemy.Column("income", Integer),
-    sqlalchemy.Column("outcome", Integer),
+    sqlalchemy.Column("income", Float),
+    sqlalchemy.Column("outcome", Float),
     sqlalchemy.Column("cashback_percent", Integer),
     sqlalchemy.Column("minimal_checque_amount", Integer),
     sqlalchemy.Column("start_period", DateTime),
@@ -2092,6 +2193,7 @@ doc_generated = sqlalchemy.Table(
     sqlalchemy.Column("entity", String),
     sqlalchemy.Column("entity_id", Integer),
     sqlalchemy.Column("type_doc", String),
+    sqlalchemy.Column("content_hash", String, nullable=True),
     sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
 )
 
@@ -2596,6 +2698,9 @@ segments = sqlalchemy.Table(
     ),
     sqlalchemy.Column("is_archived", Boolean, server_default="false", nullable=False),
     sqlalchemy.Column("is_deleted", Boolean, server_default="false", nullable=False),
+    sqlalchemy.Column("last_full_recalc_at", DateTime(timezone=True), nullable=True),
+    sqlalchemy.Column("lease_owner", String, nullable=True),
+    sqlalchemy.Column("lease_until", DateTime(timezone=True), nullable=True),
 )
 
 
@@ -2642,6 +2747,65 @@ Index(
     "ix_svo_segment_valid_to", segment_objects.c.segment_id, segment_objects.c.valid_to
 )
 
+# Журнал изменённых объектов для инкрементального пересчёта сегментов,
+# заполняется триггерами на docs_sales, контрагентах и картах лояльности
+segment_changes = sqlalchemy.Table(
+    "segment_changes",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True, autoincrement=True),
+    sqlalchemy.Column("cashbox_id", Integer, nullable=False),
+    sqlalchemy.Column(
+        "object_type",
+        Enum(SegmentObjectType, name="segment_object_type"),
+        nullable=False,
+    ),
+    sqlalchemy.Column("object_id", BigInteger, nullable=False),
+    sqlalchemy.Column("changed_at", DateTime(timezone=True), server_default=func.now(), nullable=False, index=True),
+)
+
+Index(
+    "ix_segment_changes_cashbox_changed_at",
+    segment_changes.c.cashbox_id,
+    segment_changes.c.changed_at,
+)
+
+segment_runs = sqlalchemy.Table(
+    "segment_runs",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True, autoincrement=True),
+    sqlalchemy.Column("segment_id", BigInteger, ForeignKey("segments.id"), nullable=False, index=True),
+    sqlalchemy.Column("cashbox_id", Integer, nullable=True),
+    sqlalchemy.Column("worker", String, nullable=True),
+    sqlalchemy.Column("mode", String, nullable=False),
+    sqlalchemy.Column("is_success", Boolean, nullable=False),
+    sqlalchemy.Column("started_at", DateTime(timezone=True), nullable=False),
+    sqlalchemy.Column("duration_ms", Integer, nullable=False),
+    sqlalchemy.Column("docs_sales_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("contragents_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("added_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("removed_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("error", Text, nullable=True),
+)
+
+# Прогресс рассылок действий сегментов (WhatsApp, HTTP) для возобновления после сбоя
+segment_action_runs = sqlalchemy.Table(
+    "segment_action_runs",
+    metadata,
+    sqlalchemy.Column("id", BigInteger, primary_key=True, autoincrement=True),
+    sqlalchemy.Column("segment_id", BigInteger, ForeignKey("segments.id"), nullable=False, index=True),
+    sqlalchemy.Column("action", String, nullable=False),
+    sqlalchemy.Column("params", JSON, nullable=False),
+    sqlalchemy.Column("object_ids", ARRAY(BigInteger), nullable=False),
+    sqlalchemy.Column("cursor", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("sent_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("failed_count", Integer, server_default="0", nullable=False),
+    sqlalchemy.Column("is_finished", Boolean, server_default="false", nullable=False),
+    sqlalchemy.Column("lease_owner", String, nullable=True),
+    sqlalchemy.Column("lease_until", DateTime(timezone=True), nullable=True),
+    sqlalchemy.Column("created_at", DateTime(timezone=True), server_default=func.now()),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
+)
+
 user_permissions = sqlalchemy.Table(
     "user_permissions",
     metadata,
@@ -2824,7 +2988,11 @@ engine = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL)
 engine_job_store = sqlalchemy.create_engine(SQLALCHEMY_DATABASE_URL_JOB_STORE)
 
 async_engine = create_async_engine(
-    SQLALCHEMY_DATABASE_URL_ASYNC, pool_pre_ping=True, poolclass=NullPool
+    SQLALCHEMY_DATABASE_URL_ASYNC,
+    pool_pre_ping=True,
+    pool_size=int(os.environ.get("ASYNC_DB_POOL_SIZE", 5)),
+    max_overflow=int(os.environ.get("ASYNC_DB_MAX_OVERFLOW", 10)),
+    pool_recycle=int(os.environ.get("ASYNC_DB_POOL_RECYCLE", 1800)),
 )
 async_session_maker = sessionmaker(
     async_engine, class_=AsyncSession, expire_on_commit=False
@@ -2969,6 +3137,19 @@ apple_push_tokens = sqlalchemy.Table(
     # sqlalchemy.Column("have_updates", Boolean, nullable=False, default=False, server_default=sqlalchemy.sql.expression.false()),
 )
 
+apple_wallet_pass_fingerprints = sqlalchemy.Table(
+    "apple_wallet_pass_fingerprints",
+    metadata,
+    sqlalchemy.Column(
+        "card_id",
+        sqlalchemy.Integer,
+        sqlalchemy.ForeignKey("loyality_cards.id", ondelete="CASCADE"),
+        primary_key=True,
+    ),
+    sqlalchemy.Column("fingerprint", String, nullable=False),
+    sqlalchemy.Column("updated_at", DateTime(timezone=True), server_default=func.now(), onupdate=func.now()),
+)
+
 apple_wallet_card_settings = sqlalchemy.Table(
     "apple_wallet_card_settings",
     metadata,
@@ -3182,6 +3363,13 @@ chats = sqlalchemy.Table(
     sqlalchemy.Column("last_message_time", DateTime, nullable=True),
     sqlalchemy.Column("last_response_time_seconds", Integer, nullable=True),
     sqlalchemy.Column("metadata", JSON, nullable=True),
+    # последнее загруженное синхронизацией Avito сообщение чата
+    sqlalchemy.Column("sync_cursor_message_id", String(255), nullable=True),
+    sqlalchemy.Column("sync_cursor_message_created", BigInteger, nullable=True),
+    # ведутся триггером chat_messages_counters
+    sqlalchemy.Column("unread_count", Integer, nullable=False, server_default="0"),
+    sqlalchemy.Column("last_message_id", Integer, nullable=True),
+    sqlalchemy.Column("last_message_preview", String(100), nullable=True),
     sqlalchemy.Column(
         "created_at", DateTime, nullable=False, server_default=func.now()
     ),
@@ -3255,6 +3443,9 @@ channel_credentials = sqlalchemy.Table(
     sqlalchemy.Column("last_status_code", Integer, nullable=True),
     sqlalchemy.Column("last_status_check_at", DateTime, nullable=True),
     sqlalchemy.Column("connection_status", String(50), nullable=True),
+    # updated самого свежего чата, обработанного синхронизацией
+    sqlalchemy.Column("sync_cursor_updated", BigInteger, nullable=True),
+    sqlalchemy.Column("synced_at", DateTime, nullable=True),
     sqlalchemy.Column(
         "created_at", DateTime, nullable=False, server_default=func.now()
     ),
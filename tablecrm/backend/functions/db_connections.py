@@ -0,0 +1,15 @@
+import asyncio
+import contextvars
+from typing import Any, Awaitable
+
+
+def in_own_connection(coro: Awaitable[Any]) -> "asyncio.Future[Any]":
+    """
+    Запуск корутины задачей в пустом contextvars-контексте.
+
+    databases хранит соединение в ContextVar, а задача наследует контекст
+    родителя: параллельные задачи, запущенные после запроса родителя, делят
+    его соединение, и их транзакции перемешиваются. В пустом контексте
+    database.connection() берёт из пула своё соединение.
+    """
+    return contextvars.Context().run(asyncio.ensure_future, coro)
@@ -0,0 +1,78 @@
+import os
+from typing import List, Optional
+
+from databases.core import Connection
+
+from database.db import database
+from functions.db_connections import in_own_connection
+
+DOCS_SALES = "docs_sales"
+DOCS_PURCHASES = "docs_purchases"
+DOCS_WAREHOUSE = "docs_warehouse"
+
+_ALLOCATE_QUERY = """
+    INSERT INTO doc_number_counters (organization_id, doc_type, last_number)
+    VALUES (:organization_id, :doc_type, :n)
+    ON CONFLICT (organization_id, doc_type)
+    DO UPDATE SET last_number = doc_number_counters.last_number + EXCLUDED.last_number,
+                  updated_at = now()
+    RETURNING last_number
+"""
+
+
+class DocNumberAllocator:
+    """
+    Номера документов по счётчику doc_number_counters на (организация, тип документа).
+
+    Номер выдаётся одним UPSERT по строке счётчика, без чтения последнего
+    документа, поэтому параллельные создания не получают одинаковых номеров.
+
+    Обычный режим: счётчик увеличивается в отдельном соединении и сразу
+    фиксируется — блокировка строки держится только на время запроса,
+    но если документ потом не создан, номер пропадает (пропуск в нумерации).
+
+    gap_free=True: счётчик увеличивается на переданном connection в его
+    транзакции — при откате номер возвращается, зато создания документов
+    одной организации идут по очереди до фиксации. Вызывающий открывает
+    conn.transaction() и на том же соединении вставляет документ;
+    без connection номер выделяется как в обычном режиме.
+    """
+
+    def __init__(self, gap_free: bool = os.getenv("DOC_NUMBERS_GAP_FREE", "false").lower() == "true"):
+        self.gap_free = gap_free
+
+    async def allocate(
+            self,
+            organization_id: int,
+            doc_type: str,
+            n: int = 1,
+            gap_free: Optional[bool] = None,
+            connection: Optional[Connection] = None,
+    ) -> List[str]:
+        """n подряд идущих номеров для пакетной вставки."""
+        if n <= 0:
+            return []
+        values = {"organization_id": organization_id, "doc_type": doc_type, "n": n}
+        if connection is not None and (self.gap_free if gap_free is None else gap_free):
+            last_number = await connection.fetch_val(_ALLOCATE_QUERY, values)
+        else:
+            # своё соединение из пула: запрос не попадает в транзакцию вызывающего
+            last_number = await in_own_connection(self._allocate_committed(values))
+        return [str(number) for number in range(last_number - n + 1, last_number + 1)]
+
+    @staticmethod
+    async def _allocate_committed(values: dict) -> int:
+        async with database.connection() as connection:
+            return await connection.fetch_val(_ALLOCATE_QUERY, values)
+
+    async def next(
+            self,
+            organization_id: int,
+            doc_type: str,
+            gap_free: Optional[bool] = None,
+            connection: Optional[Connection] = None,
+    ) -> str:
+        return (await self.allocate(organization_id, doc_type, 1, gap_free, connection))[0]
+
+
+doc_numbers = DocNumberAllocator()
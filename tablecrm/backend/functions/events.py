@@ -1,8 +1,19 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import List, Optional
+
 from database.db import database, events
+from functions.token_resolver import token_resolver
 from sqlalchemy import func, select, desc
 
 from ws_manager import manager
 
+logger = logging.getLogger("events")
+
+
 async def get_events(token: str, limit: int, offset: int):
     query_result = (
         events.select().where(events.c.token == token)
@@ -23,5 +34,160 @@ async def write_event(**event):
         events.insert().values(**event)
     )
     if event['token']:
-        await manager.send_message(event['token'], {"action": "create", "target": "events", "result": {**events}})
+        await manager.send_message(event['token'], {"action": "create", "target": "events", "result": {**event, "id": event_id}})
     return event_id
+
+
+def _parse_payload(body: bytes, content_type: Optional[str]):
+    if not body and content_type != "application/json":
+        return {}
+    return json.loads(body)
+
+
+# метка остановки в очереди: всё, что до неё, воркер успевает записать
+_STOP = object()
+
+
+class EventsPipeline:
+    """
+    Фоновая запись событий запросов.
+
+    Middleware только кладёт сырое событие в ограниченную очередь, а воркер
+    пачками резолвит токены и пишет их в events одним multi-row insert'ом
+    каждые flush_interval_ms или по накоплению batch_size событий.
+    При переполнении очереди событие отбрасывается и учитывается в счётчике.
+    Остановка ставит в конец очереди метку: воркер дописывает текущую пачку
+    и всё, что было поставлено до неё, не дольше stop_timeout.
+    """
+
+    def __init__(
+            self,
+            batch_size: int = int(os.getenv("EVENTS_BATCH_SIZE", 500)),
+            flush_interval_ms: int = int(os.getenv("EVENTS_FLUSH_INTERVAL_MS", 1000)),
+            max_queue_size: int = int(os.getenv("EVENTS_QUEUE_SIZE", 20000)),
+            stop_timeout: float = float(os.getenv("EVENTS_STOP_TIMEOUT", 10)),
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self.max_queue_size = max_queue_size
+        self.stop_timeout = stop_timeout
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+
+    @property
+    def is_running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    def stats(self) -> dict:
+        return {
+            "enqueued": self.enqueued,
+            "written": self.written,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "queue_size": self._queue.qsize() if self._queue else 0,
+        }
+
+    async def start(self):
+        if self.is_running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_size)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Останавливает воркер, предварительно дописав всё, что осталось в очереди."""
+        if not self.is_running:
+            return
+        # после этого put() отбрасывает события, и метка остаётся последней в очереди
+        worker, self._worker = self._worker, None
+        try:
+            await asyncio.wait_for(self._drain(worker), timeout=self.stop_timeout)
+        except asyncio.TimeoutError:
+            lost = 0
+            while not self._queue.empty():
+                if self._queue.get_nowait() is not _STOP:
+                    lost += 1
+            self.dropped += lost
+            logger.error(f"Events worker did not finish in {self.stop_timeout}s, {lost} events dropped")
+
+    async def _drain(self, worker: asyncio.Task):
+        await self._queue.put(_STOP)
+        await worker
+
+    def put(self, **event) -> bool:
+        """Неблокирующая постановка события в очередь. Возвращает False, если событие отброшено."""
+        if not self.is_running:
+            self.dropped += 1
+            return False
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+        self.enqueued += 1
+        return True
+
+    async def _run(self):
+        stopping = False
+        while not stopping:
+            event = await self._queue.get()
+            if event is _STOP:
+                return
+            batch = [event]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    event = await asyncio.wait_for(self._queue.get(), timeout=timeout)
+                except asyncio.TimeoutError:
+                    break
+                if event is _STOP:
+                    stopping = True
+                    break
+                batch.append(event)
+            await self._flush(batch)
+
+    async def _resolve_tokens(self, tokens: set) -> dict:
+        relations = await token_resolver.resolve_many(tokens)
+        return {token: (relation.user, relation.cashbox_id) for token, relation in relations.items()}
+
+    def _build_row(self, event: dict, resolved: dict) -> Optional[dict]:
+        try:
+            payload = _parse_payload(event.pop("body"), event.pop("content_type"))
+        except (ValueError, UnicodeDecodeError):
+            payload = {}
+        if event.pop("name_from_payload", False):
+            event["name"] = payload.get("type") if isinstance(payload, dict) else ""
+        user_id, cashbox_id = resolved.get(event["token"], (None, None))
+        return {**event, "payload": payload, "user_id": user_id, "cashbox_id": cashbox_id}
+
+    async def _flush(self, batch: List[dict]):
+        if not batch:
+            return
+        try:
+            resolved = await self._resolve_tokens({e["token"] for e in batch if e.get("token")})
+            rows = [self._build_row(event, resolved) for event in batch]
+            inserted = await database.fetch_all(
+                events.insert().values(rows).returning(events.c.id)
+            )
+            self.written += len(rows)
+        except Exception as e:
+            self.failed += len(batch)
+            logger.error(f"Failed to write {len(batch)} events: {e}")
+            return
+
+        for row, record in zip(rows, inserted):
+            if row["token"]:
+                await manager.send_message(
+                    row["token"], {"action": "create", "target": "events", "result": {**row, "id": record.id}}
+                )
+
+
+events_pipeline = EventsPipeline()
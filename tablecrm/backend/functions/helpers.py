@@ -5,7 +5,6 @@ from datetime import datetime
 from typing import Optional, Union, Any, List
 import json
 
-import aiohttp
 import math
 import pytz
 from databases.backends.postgres import Record
@@ -14,7 +13,10 @@ from sqlalchemy import Table, cast, String, and_, or_, func
 
 from database.db import articles
 
+from common.http_client.registry import http_clients
 from const import PaymentType
+from functions.token_resolver import token_resolver
+from functions.search import phone_digits
 from database.db import (
     users_cboxes_relation,
     database,
@@ -361,9 +363,9 @@ def get_filters_ca(table, filters):
             if value:
                 normalized_search_phone = clear_phone_number(value)
                 if normalized_search_phone:
-                    normalized_phone_in_db = func.regexp_replace(table.c.phone, r'[^\d]', '', 'g')
+                    # то же выражение, что в trgm-индексе по цифрам телефона
                     filters_list.append(
-                        normalized_phone_in_db.ilike(f"%{normalized_search_phone}%")
+                        phone_digits(table.c.phone).ilike(f"%{normalized_search_phone}%")
                     )
                 else:
                     filters_list.append(table.c.phone.ilike(r"%{}%".format(value)))
@@ -563,8 +565,7 @@ def add_status(instance: Optional[Record]) -> Optional[dict]:
 
 
 async def get_user_by_token(token: str) -> Record:
-    query = users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    user = await database.fetch_one(query)
+    user = await token_resolver.resolve(token)
     if not user or not user.status:
         raise_wrong_token()
     return user
@@ -811,7 +812,7 @@ def clear_phone_number(phone_number) -> Union[int, None]:
         return None
 
 async def get_statement(statement_id: str, account_id: str, access_token: str):
-    async with aiohttp.ClientSession() as session:
+    async with http_clients.session("tochka") as session:
         async with session.get(
                 f'https://enter.tochka.com/uapi/open-banking/v1.0/accounts/{account_id}/statements/{statement_id}',
                 headers={'Content-Type': 'application/json', 'Authorization': f'Bearer {access_token}'}) as resp:
@@ -824,7 +825,7 @@ async def get_statement(statement_id: str, account_id: str, access_token: str):
 
 
 async def init_statement(statement_data: dict, access_token: str):
-    async with aiohttp.ClientSession() as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(f'https://enter.tochka.com/uapi/open-banking/v1.0/statements', json={
             'Data': {
                 'Statement': {
@@ -0,0 +1,147 @@
+import os
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy import Table, or_, select
+
+from database.db import (
+    contracts,
+    contragents,
+    database,
+    loyality_cards,
+    nomenclature,
+    organizations,
+    price_types,
+    units,
+    users_cboxes_relation,
+    warehouses,
+)
+
+
+class _Reference:
+    def __init__(
+            self,
+            table: Table,
+            cashbox_column: Optional[str],
+            shared: bool = False,
+            status_code: int = 404,
+            detail: Optional[str] = None,
+    ):
+        self.table = table
+        self.cashbox_column = table.c[cashbox_column] if cashbox_column else None
+        # shared: строки без кассы (cashbox IS NULL) доступны всем кассам
+        self.shared = shared
+        self.status_code = status_code
+        self.detail = detail or f"{table.name.rstrip('s')} не существует!"
+
+    def query(self, cashbox_id: int, ids: Set[int]):
+        query = select(self.table.c.id).where(self.table.c.id.in_(ids))
+        if self.cashbox_column is not None:
+            condition = self.cashbox_column == cashbox_id
+            if self.shared:
+                condition = or_(condition, self.cashbox_column.is_(None))
+            query = query.where(condition)
+        if "is_deleted" in self.table.c:
+            query = query.where(self.table.c.is_deleted.isnot(True))
+        return query
+
+
+REFERENCES = {
+    "contragents": _Reference(
+        contragents, "cashbox", status_code=403,
+        detail="Введенный контрагент не принадлежит вам или не существует!",
+    ),
+    "organizations": _Reference(organizations, "cashbox", shared=True),
+    "contracts": _Reference(contracts, "cashbox", shared=True),
+    "warehouses": _Reference(warehouses, "cashbox"),
+    "price_types": _Reference(price_types, "cashbox", shared=True),
+    "nomenclature": _Reference(nomenclature, "cashbox", shared=True),
+    "loyality_cards": _Reference(loyality_cards, "cashbox_id"),
+    "users": _Reference(users_cboxes_relation, "cashbox_id", detail="Пользователь не существует!"),
+    "units": _Reference(
+        units, None, status_code=403,
+        detail="Единицы измерения с этим id не существует!",
+    ),
+}
+
+
+class ReferenceCache:
+    """
+    Кэш проверок внешних ключей справочников по (касса, справочник, id).
+
+    Запоминаются только найденные id: созданная запись видна сразу,
+    удалённая или изменённая — после invalidate из роутера справочника,
+    в остальных процессах — не позже чем через ttl.
+    Непроверенные id одного вызова проверяются одним запросом IN (...).
+    """
+
+    def __init__(
+            self,
+            ttl: int = int(os.getenv("REFERENCE_CACHE_TTL", 300)),
+            max_size: int = int(os.getenv("REFERENCE_CACHE_SIZE", 50000)),
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple[Optional[int], str, int], float]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict:
+        return {"items": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+    @staticmethod
+    def _key(cashbox_id: Optional[int], entity: str, idx: int) -> Tuple[Optional[int], str, int]:
+        # справочники без кассы (units) общие для всех касс
+        if REFERENCES[entity].cashbox_column is None:
+            cashbox_id = None
+        return cashbox_id, entity, idx
+
+    def _cached(self, key: Tuple[Optional[int], str, int], now: float) -> bool:
+        cached_at = self._entries.get(key)
+        if cached_at is None:
+            return False
+        if now - cached_at >= self.ttl:
+            del self._entries[key]
+            return False
+        self._entries.move_to_end(key)
+        return True
+
+    async def missing(self, cashbox_id: int, entity: str, ids: Iterable[int]) -> Set[int]:
+        """id из ids, которых нет в справочнике кассы (или они удалены)."""
+        now = time.monotonic()
+        unknown = set()
+        for idx in {idx for idx in ids if idx is not None}:
+            if self._cached(self._key(cashbox_id, entity, idx), now):
+                self.hits += 1
+            else:
+                self.misses += 1
+                unknown.add(idx)
+        if not unknown:
+            return set()
+
+        rows = await database.fetch_all(REFERENCES[entity].query(cashbox_id, unknown))
+        found = {row.id for row in rows}
+        for idx in found:
+            self._entries[self._key(cashbox_id, entity, idx)] = now
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return unknown - found
+
+    async def ensure_exist(self, cashbox_id: int, entity: str, ids: Iterable[int]):
+        missing = await self.missing(cashbox_id, entity, ids)
+        if missing:
+            reference = REFERENCES[entity]
+            detail = reference.detail
+            if len(missing) > 1:
+                detail = f"{detail} ({entity}.id: {', '.join(map(str, sorted(missing)))})"
+            raise HTTPException(status_code=reference.status_code, detail=detail)
+
+    def invalidate(self, cashbox_id: Optional[int], entity: str, ids: Iterable[int]):
+        for idx in ids:
+            self._entries.pop(self._key(cashbox_id, entity, idx), None)
+
+
+reference_cache = ReferenceCache()
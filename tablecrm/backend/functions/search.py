@@ -0,0 +1,107 @@
+import re
+from typing import List, Optional
+
+from sqlalchemy import case, func, literal_column, select, and_, or_
+from sqlalchemy.sql import ColumnElement
+
+from database.db import database
+
+# pg_trgm не строит триграммы для строк короче трёх символов:
+# такие запросы ищутся только по префиксу
+TRGM_MIN_LENGTH = 3
+
+
+def escape_like(term: str) -> str:
+    """Экранирование спецсимволов LIKE, чтобы % и _ из запроса искались буквально."""
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def normalize_phone(value) -> str:
+    """Только цифры — как phone_digits в запросе."""
+    return re.sub(r"[^0-9]", "", str(value or ""))
+
+
+def normalize_barcode(value) -> str:
+    """Без пробелов и в нижнем регистре — как barcode_code в запросе."""
+    return re.sub(r"\s", "", str(value or "")).lower()
+
+
+# Телефон и штрихкод индексируются по выражению (миграция d38f6a1c9e27).
+# Планировщик берёт такой индекс, только если выражение в запросе совпадает
+# с индексным, поэтому аргументы regexp_replace — литералы, а не параметры.
+
+def phone_digits(column) -> ColumnElement:
+    """regexp_replace(phone, '[^0-9]', '', 'g') — индексы *_phone_normalized_trgm."""
+    return func.regexp_replace(
+        column, literal_column("'[^0-9]'"), literal_column("''"), literal_column("'g'")
+    )
+
+
+def barcode_code(column) -> ColumnElement:
+    """lower(regexp_replace(code, '\\s', '', 'g')) — индекс idx_nomenclature_barcodes_code_normalized."""
+    return func.lower(
+        func.regexp_replace(column, literal_column("'\\s'"), literal_column("''"), literal_column("'g'"))
+    )
+
+
+def contains(column, term: str) -> ColumnElement:
+    """Подстрока без учёта регистра; использует GIN-индекс gin_trgm_ops по колонке."""
+    return column.ilike(f"%{escape_like(term)}%", escape="\\")
+
+
+def starts_with(column, term: str) -> ColumnElement:
+    return column.ilike(f"{escape_like(term)}%", escape="\\")
+
+
+def match(column, term: str) -> ColumnElement:
+    """Условие поиска: подстрока, для коротких запросов — префикс."""
+    if len(term) < TRGM_MIN_LENGTH:
+        return starts_with(column, term)
+    return contains(column, term)
+
+
+def rank(column, term: str) -> list:
+    """Порядок выдачи: сначала совпадения с начала строки, затем по похожести, затем короче."""
+    return [
+        case((starts_with(column, term), 0), else_=1),
+        func.similarity(column, term).desc(),
+        func.length(column),
+        column,
+    ]
+
+
+def phone_or_text_match(text_column, phone_column, term: str) -> ColumnElement:
+    """Поиск по тексту и, если в запросе есть цифры, по цифрам телефона."""
+    conditions = [match(text_column, term)]
+    digits = normalize_phone(term)
+    if len(digits) >= TRGM_MIN_LENGTH:
+        conditions.append(contains(phone_digits(phone_column), digits))
+    return or_(*conditions)
+
+
+async def suggest(
+        id_column,
+        text_column,
+        term: str,
+        conditions: list,
+        limit: int = 10,
+        select_from=None,
+        match_condition: Optional[ColumnElement] = None,
+) -> List[dict]:
+    """
+    Автоподсказки: id и текст лучших совпадений.
+    conditions — ограничения области поиска (касса, удалённые записи и т.п.).
+    """
+    term = (term or "").strip()
+    if not term:
+        return []
+
+    query = (
+        select(id_column.label("id"), text_column.label("name"))
+        .where(and_(*conditions), match_condition if match_condition is not None else match(text_column, term))
+        .order_by(*rank(text_column, term))
+        .limit(limit)
+    )
+    if select_from is not None:
+        query = query.select_from(select_from)
+    return [dict(row) for row in await database.fetch_all(query)]
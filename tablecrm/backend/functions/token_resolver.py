@@ -0,0 +1,189 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Dict, Iterable, Optional
+
+import asyncpg
+from databases.backends.postgres import Record
+
+from database.db import SQLALCHEMY_DATABASE_URL, database, users_cboxes_relation
+
+logger = logging.getLogger(__name__)
+
+# канал NOTIFY триггера на users_cboxes_relation, payload — прежний токен строки
+INVALIDATE_CHANNEL = "token_resolver_invalidate"
+
+_request_cache: ContextVar[Optional[dict]] = ContextVar("token_resolver_request_cache", default=None)
+
+
+class TokenResolver:
+    """
+    Кэш строк users_cboxes_relation по токену.
+
+    Два уровня: словарь на время одного запроса (один токен резолвится
+    за запрос не более одного раза) и общий TTL+LRU кэш процесса.
+    Кэшируются только найденные токены, поэтому новый токен доступен сразу.
+    При смене токена или статуса нужно вызвать invalidate/invalidate_where;
+    изменения из других процессов (бот, другие воркеры) приходят через
+    LISTEN token_resolver_invalidate — триггер шлёт токен изменённой строки.
+    Пока слушатель не подключён, кэш очищается при каждом переподключении,
+    а записи живут не дольше ttl.
+    """
+
+    def __init__(
+            self,
+            ttl: int = int(os.getenv("TOKEN_CACHE_TTL", 60)),
+            max_size: int = int(os.getenv("TOKEN_CACHE_SIZE", 10000)),
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._cache: "OrderedDict[str, tuple]" = OrderedDict()
+        self._listener: Optional[asyncio.Task] = None
+
+        self.hits = 0
+        self.request_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._cache),
+            "hits": self.hits,
+            "request_hits": self.request_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+    @staticmethod
+    def start_request():
+        """Включает мемоизацию в рамках текущего запроса (вызывается из middleware)."""
+        return _request_cache.set({})
+
+    @staticmethod
+    def end_request(reset_token):
+        _request_cache.reset(reset_token)
+
+    def _get_cached(self, token: str) -> Optional[Record]:
+        request_cache = _request_cache.get()
+        if request_cache is not None and token in request_cache:
+            self.request_hits += 1
+            return request_cache[token]
+
+        item = self._cache.get(token)
+        if item is None:
+            return None
+        expires_at, relation = item
+        if expires_at < time.monotonic():
+            del self._cache[token]
+            return None
+        self._cache.move_to_end(token)
+        self.hits += 1
+        if request_cache is not None:
+            request_cache[token] = relation
+        return relation
+
+    def _store(self, token: str, relation: Record):
+        self._cache[token] = (time.monotonic() + self.ttl, relation)
+        self._cache.move_to_end(token)
+        while len(self._cache) > self.max_size:
+            self._cache.popitem(last=False)
+            self.evictions += 1
+        request_cache = _request_cache.get()
+        if request_cache is not None:
+            request_cache[token] = relation
+
+    async def resolve(self, token: Optional[str]) -> Optional[Record]:
+        if not token:
+            return None
+        relation = self._get_cached(token)
+        if relation is not None:
+            return relation
+
+        self.misses += 1
+        relation = await database.fetch_one(
+            users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
+        )
+        if relation:
+            self._store(token, relation)
+        return relation
+
+    async def resolve_many(self, tokens: Iterable[str]) -> Dict[str, Record]:
+        result = {}
+        missing = set()
+        for token in set(filter(None, tokens)):
+            relation = self._get_cached(token)
+            if relation is not None:
+                result[token] = relation
+            else:
+                missing.add(token)
+
+        if missing:
+            self.misses += len(missing)
+            rows = await database.fetch_all(
+                users_cboxes_relation.select().where(users_cboxes_relation.c.token.in_(missing))
+            )
+            for relation in rows:
+                self._store(relation.token, relation)
+                result[relation.token] = relation
+        return result
+
+    def invalidate(self, token: Optional[str]):
+        if token and self._cache.pop(token, None) is not None:
+            self.invalidations += 1
+        request_cache = _request_cache.get()
+        if request_cache is not None:
+            request_cache.pop(token, None)
+
+    def invalidate_where(self, cashbox_id: Optional[int] = None, user_id: Optional[int] = None):
+        """Сбрасывает записи по кассе и/или пользователю, когда токен неизвестен заранее."""
+        tokens = [
+            token for token, (_, relation) in self._cache.items()
+            if (cashbox_id is None or relation.cashbox_id == cashbox_id)
+            and (user_id is None or relation.user == user_id)
+        ]
+        for token in tokens:
+            self.invalidate(token)
+
+    def clear(self):
+        self._cache.clear()
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.invalidate(payload)
+
+    async def _listen(self, dsn: str, check_interval: float):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(dsn)
+                await connection.add_listener(INVALIDATE_CHANNEL, self._on_notify)
+                # уведомления, пришедшие без слушателя, потеряны
+                self.clear()
+                while True:
+                    await asyncio.sleep(check_interval)
+                    await connection.execute("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Token invalidation listener failed, reconnecting: {e}")
+            finally:
+                if connection is not None and not connection.is_closed():
+                    await connection.close()
+            self.clear()
+            await asyncio.sleep(check_interval)
+
+    def start_listener(self, dsn: str = SQLALCHEMY_DATABASE_URL, check_interval: float = 5):
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen(dsn, check_interval))
+
+    async def stop_listener(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+
+
+token_resolver = TokenResolver()
@@ -1,31 +1,27 @@
 import asyncio
 
-from sqlalchemy import select
+from sqlalchemy import select, func
 
 from ws_manager import manager
 
-from database.db import database, pboxes, users, users_cboxes_relation, projects
+from database.db import database, pboxes, users, projects, payments
+from functions.token_resolver import token_resolver
 
 from datetime import datetime
 import time
 
 
 async def get_user_id_cashbox_id_by_token(token: str):
-    user_cbox = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    )
+    user_cbox = await token_resolver.resolve(token)
 
     if user_cbox:
-        user = await database.fetch_one(users.select().where(users.c.id == user_cbox.user))
-        return user.id, user_cbox.cashbox_id
+        return user_cbox.user, user_cbox.cashbox_id
     else:
         return None, None
 
 
 async def get_user_by_token(token: str):
-    user_cbox = await database.fetch_one(
-        users_cboxes_relation.select().where(users_cboxes_relation.c.token == token)
-    )
+    user_cbox = await token_resolver.resolve(token)
 
     user_dict = None
     if user_cbox:
@@ -44,65 +40,56 @@ async def get_user_by_token(token: str):
 
 
 async def raschet(user, token):
-    update = await database.fetch_all("SELECT * FROM rachet(:token, :today)",
-                                      {"token": token, "today": int(datetime.utcnow().timestamp())})
-
-    payboxes_list_q = select([pboxes.c.id, pboxes.c.start_balance]).where(
-        pboxes.c.cashbox == user.cashbox_id)
-    projects_list_q = select([projects.c.id]).where(
-        projects.c.cashbox == user.cashbox_id)
-
-    payboxes_ids = await database.fetch_all(payboxes_list_q)
-    projects_ids = await database.fetch_all(projects_list_q)
-
-    z_pbs = [dict(pb) for pb in payboxes_ids if pb.id not in [
-        pb.pb_id for pb in update if pb.pb_id]]
-    z_proj = [dict(pr) for pr in projects_ids if pr.id not in [
-        pr.pr_id for pr in update if pr.pr_id]]
-
-    for i in update:
-        if i.pb_id:
-            q = pboxes.select().where(pboxes.c.id == i.pb_id)
-            paybox = await database.fetch_one(q)
-            q = pboxes.update().where(pboxes.c.id == i.pb_id).values(
-                {"balance": round(float(i.balance) + paybox.start_balance, 2),
-                 "update_start_balance": int(datetime.utcnow().timestamp())})
-            await database.execute(q)
-            q = pboxes.select().where(pboxes.c.id == i.pb_id)
-            paybox = await database.fetch_one(q)
-            await manager.send_message(token, {"action": "edit", "target": "payboxes", "result": dict(paybox)})
-        if i.pr_id:
-            update_proj = {"incoming": i.incoming, "outgoing": i.outgoing,
-                           "updated_at": int(datetime.utcnow().timestamp())}
-
-            if update_proj["outgoing"] == 0 and update_proj["incoming"] != 0:
-                update_proj['profitability'] = 100
-            elif update_proj["outgoing"] == 0 and update_proj["incoming"] == 0:
-                update_proj['profitability'] = 0
-            else:
-                update_proj['profitability'] = round(
-                    ((update_proj["incoming"] - update_proj["outgoing"]) / update_proj["outgoing"]) * 100, 2)
-
-            q = projects.update().where(projects.c.id == i.pr_id).values(update_proj)
-            await database.execute(q)
-            q = projects.select().where(projects.c.id == i.pr_id)
-            project = await database.fetch_one(q)
-            await manager.send_message(token, {"action": "edit", "target": "projects", "result": dict(project)})
-
-    for z_paybox in z_pbs:
-        q = pboxes.update().where(pboxes.c.id == z_paybox['id']).values(
-            {"balance": z_paybox['start_balance'], "update_start_balance": int(datetime.utcnow().timestamp())})
-        await database.execute(q)
-        q = pboxes.select().where(pboxes.c.id == z_paybox['id'])
-        paybox = await database.fetch_one(q)
-        await manager.send_message(token, {"action": "edit", "target": "payboxes", "result": dict(paybox)})
-
-    for z_project in z_proj:
-        q = projects.update().where(projects.c.id == z_project['id']).values(
-            {"incoming": 0, "outgoing": 0, 'profitability': 0,
-             "updated_at": int(datetime.utcnow().timestamp())}
+    """
+    Рассылка актуальных балансов счетов и проектов кассы.
+    Сами балансы меняются триггерами на payments в транзакции платежа,
+    здесь пересчёта нет — только два чтения.
+    """
+    payboxes_db = await database.fetch_all(pboxes.select().where(pboxes.c.cashbox == user.cashbox_id))
+    projects_db = await database.fetch_all(projects.select().where(projects.c.cashbox == user.cashbox_id))
+
+    for paybox in payboxes_db:
+        await manager.send_update(token, {"action": "edit", "target": "payboxes", "result": dict(paybox)})
+    for project in projects_db:
+        await manager.send_update(token, {"action": "edit", "target": "projects", "result": dict(project)})
+
+
+async def recalculate_balances(cashbox_id: int) -> dict:
+    """
+    Полный пересчёт балансов счетов и проектов кассы из платежей.
+    Исправляет и возвращает только разошедшиеся записи.
+    """
+    payboxes_ids = [row.id for row in await database.fetch_all(
+        select([pboxes.c.id]).where(pboxes.c.cashbox == cashbox_id))]
+    projects_ids = [row.id for row in await database.fetch_all(
+        select([projects.c.id]).where(projects.c.cashbox == cashbox_id))]
+
+    payboxes_drift = []
+    if payboxes_ids:
+        payboxes_drift = await database.fetch_all(
+            "SELECT * FROM payboxes_recalculate(:ids)", {"ids": payboxes_ids}
         )
-        await database.execute(q)
-        q = projects.select().where(projects.c.id == z_project['id'])
-        project = await database.fetch_one(q)
-        await manager.send_message(token, {"action": "edit", "target": "projects", "result": dict(project)})
+    projects_drift = []
+    if projects_ids:
+        projects_drift = await database.fetch_all(
+            "SELECT * FROM projects_recalculate(:ids)", {"ids": projects_ids}
+        )
+
+    return {
+        "payboxes": [dict(row) for row in payboxes_drift],
+        "projects": [dict(row) for row in projects_drift],
+    }
+
+
+async def apply_matured_payments() -> int:
+    """Платежи, дата которых наступила, включаются в балансы счетов (триггер применит разницу)."""
+    rows = await database.fetch_all(
+        payments.update()
+        .where(
+            payments.c.balance_applied.is_(False),
+            payments.c.date <= func.extract("epoch", func.now()),
+        )
+        .values(balance_applied=True)
+        .returning(payments.c.id)
+    )
+    return len(rows)
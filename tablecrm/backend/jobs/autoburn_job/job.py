@@ -4,7 +4,6 @@ from typing import List, Union, Any, Dict
 from databases.backends.postgres import Record
 from sqlalchemy import select, and_, text
 from database.db import database, loyality_transactions, loyality_cards
-from api.loyality_transactions.routers import raschet_bonuses
 
 
 class AutoBurn:
@@ -145,7 +144,6 @@ async def autoburn():
         try:
             auto_burn = AutoBurn(card=card)
             await auto_burn.start()
-            await raschet_bonuses(card.id)
         except Exception as e:
             print(f"Ошибка при обработке карты {card.id}: {e}")
             # Можно добавить логирование в БД
\ No newline at end of file
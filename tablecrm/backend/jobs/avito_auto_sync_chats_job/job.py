@@ -1,16 +1,27 @@
+import asyncio
 import logging
+import os
 import re
 from datetime import datetime
-from typing import Optional
-from sqlalchemy import select, and_
+from typing import Dict, List, Optional, Set, Tuple
 
-from database.db import database, channel_credentials, channels, chats, chat_messages
+from sqlalchemy import select, and_, func
+from sqlalchemy.dialects.postgresql import insert
+
+from database.db import database, channel_credentials, channels, chats, chat_messages, chat_contacts
 from api.chats.avito.avito_factory import create_avito_client, save_token_callback
 from api.chats.avito.avito_handler import AvitoHandler
 from api.chats import crud
+from functions.db_connections import in_own_connection
 
 logger = logging.getLogger(__name__)
 
+# каналы синхронизируются параллельно, внутри канала — чаты;
+# частоту запросов к Avito дополнительно ограничивает общий http-клиент "avito"
+SYNC_CONCURRENCY = int(os.getenv("AVITO_SYNC_CONCURRENCY", 4))
+CHAT_CONCURRENCY = int(os.getenv("AVITO_SYNC_CHAT_CONCURRENCY", 4))
+CHATS_PAGE_SIZE = 100
+
 
 def extract_phone_from_text(text: str) -> Optional[str]:
     """Извлечь телефон из текста"""
@@ -23,7 +34,7 @@ def extract_phone_from_text(text: str) -> Optional[str]:
         r'\+?7\d{10}',
         r'8\d{10}',
     ]
-    
+
     for pattern in phone_patterns:
         matches = re.findall(pattern, text)
         if matches:
@@ -34,29 +45,465 @@ def extract_phone_from_text(text: str) -> Optional[str]:
                 phone = '+' + phone
             elif len(phone) == 10:
                 phone = '+7' + phone
-            
+
             if phone.startswith('+7') and len(phone) == 12:
                 return phone
             elif len(phone) >= 11:
                 return phone
-    
+
     return None
 
 
+def _is_subscription_error(error: Exception) -> bool:
+    error_str = str(error)
+    return "402" in error_str or "подписку" in error_str.lower() or "subscription" in error_str.lower()
+
+
+def _chat_updated(avito_chat: dict) -> int:
+    last_message = avito_chat.get('last_message') or {}
+    return avito_chat.get('updated') or last_message.get('created') or avito_chat.get('created') or 0
+
+
+def _chat_info(avito_chat: dict, avito_user_id: Optional[int]) -> dict:
+    """Собеседник, метаданные объявления и последнее сообщение чата из списка чатов Avito."""
+    external_chat_id = avito_chat['id']
+    user_name = None
+    user_phone = None
+    user_avatar = None
+    client_user_id = None
+
+    users = avito_chat.get('users', [])
+    if users and avito_user_id:
+        for user in users:
+            user_id_in_chat = user.get('user_id') or user.get('id')
+            if user_id_in_chat and user_id_in_chat != avito_user_id:
+                client_user_id = user_id_in_chat
+                user_name = user.get('name') or user.get('profile_name')
+                user_phone = (
+                    user.get('phone') or
+                    user.get('phone_number') or
+                    user.get('public_user_profile', {}).get('phone') or
+                    user.get('public_user_profile', {}).get('phone_number')
+                )
+                public_profile = user.get('public_user_profile', {})
+                if public_profile:
+                    avatar_data = public_profile.get('avatar', {})
+                    if isinstance(avatar_data, dict):
+                        user_avatar = (
+                            avatar_data.get('default') or
+                            avatar_data.get('images', {}).get('256x256') or
+                            avatar_data.get('images', {}).get('128x128') or
+                            (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
+                        )
+                    elif isinstance(avatar_data, str):
+                        user_avatar = avatar_data
+                if user_name or user_phone:
+                    break
+
+    last_message = avito_chat.get('last_message') or {}
+
+    # Пытаемся извлечь телефон из последнего (системного) сообщения
+    if not user_phone and last_message:
+        message_content = last_message.get('content', {})
+        message_text = None
+        if isinstance(message_content, dict):
+            message_text = message_content.get('text', '')
+        elif isinstance(message_content, str):
+            message_text = message_content
+        if message_text and ('[Системное сообщение]' in message_text or 'системное' in message_text.lower()):
+            user_phone = extract_phone_from_text(message_text)
+
+    context = avito_chat.get('context', {})
+    metadata = {}
+    if isinstance(context, dict):
+        item = context.get('item', {})
+        if isinstance(item, dict):
+            if item.get('title'):
+                metadata['ad_title'] = item.get('title')
+            if item.get('id'):
+                metadata['ad_id'] = item.get('id')
+            if item.get('url'):
+                metadata['ad_url'] = item.get('url')
+    if context:
+        metadata['context'] = context
+
+    return {
+        'external_chat_id': external_chat_id,
+        'client_user_id': str(client_user_id) if client_user_id else None,
+        'name': user_name,
+        'phone': user_phone,
+        'avatar': user_avatar,
+        'fallback_name': user_name or metadata.get('ad_title') or f"Avito Chat {external_chat_id[:8]}",
+        'metadata': metadata or None,
+        'created': datetime.fromtimestamp(avito_chat['created']) if avito_chat.get('created') else None,
+        'last_message_time': datetime.fromtimestamp(last_message['created']) if last_message.get('created') else None,
+        'last_message_id': last_message.get('id'),
+        'last_message_created': last_message.get('created'),
+    }
+
+
+def _message_text(avito_msg: dict) -> str:
+    content = avito_msg.get('content', {})
+    message_type_str = avito_msg.get('type', 'text')
+
+    if isinstance(content, dict):
+        if message_type_str == 'text':
+            message_text = content.get('text', '')
+        elif message_type_str == 'link':
+            link_data = content.get('link', {})
+            message_text = link_data.get('text', link_data.get('url', '[Ссылка]'))
+        elif message_type_str == 'system':
+            message_text = content.get('text', '[Системное сообщение]')
+        elif message_type_str == 'image':
+            message_text = '[Изображение]'
+        elif message_type_str == 'item':
+            item_data = content.get('item', {})
+            message_text = f"Объявление: {item_data.get('title', '[Объявление]')}"
+        elif message_type_str == 'location':
+            loc_data = content.get('location', {})
+            message_text = loc_data.get('text', loc_data.get('title', '[Геолокация]'))
+        elif message_type_str == 'voice':
+            message_text = '[Голосовое сообщение]'
+        else:
+            message_text = f"[{message_type_str}]"
+    else:
+        message_text = str(content) if content else f"[{message_type_str}]"
+
+    return message_text or f"[{message_type_str}]"
+
+
+async def _fetch_changed_chats(client, cursor: Optional[int]) -> List[dict]:
+    """
+    Чаты, изменившиеся с курсора канала. Avito отдаёт чаты от последних
+    обновлённых к старым, поэтому листание останавливается на первой
+    странице, где встретился чат старше курсора.
+    """
+    changed = []
+    offset = 0
+    while True:
+        page = await client.get_chats(limit=CHATS_PAGE_SIZE, offset=offset, unread_only=False)
+        if not page:
+            break
+        fresh = [c for c in page if c.get('id') and (cursor is None or _chat_updated(c) >= cursor)]
+        changed.extend(fresh)
+        if len(page) < CHATS_PAGE_SIZE or len(fresh) < len(page):
+            break
+        offset += CHATS_PAGE_SIZE
+    return changed
+
+
+async def _resolve_contacts(channel_id: int, infos: List[dict], existing_chats: Dict[str, dict]) -> Dict[str, Optional[int]]:
+    """
+    external_chat_id -> chat_contact_id. Контакты уже известных чатов
+    обновляются, для остальных находятся по external_contact_id или
+    создаются одним INSERT.
+    """
+    result: Dict[str, Optional[int]] = {}
+
+    ext_ids = list({info['client_user_id'] for info in infos if info['client_user_id']})
+    by_ext = {}
+    if ext_ids:
+        rows = await database.fetch_all(
+            chat_contacts.select().where(and_(
+                chat_contacts.c.channel_id == channel_id,
+                chat_contacts.c.external_contact_id.in_(ext_ids),
+            ))
+        )
+        by_ext = {row.external_contact_id: dict(row) for row in rows}
+
+    linked_ids = [chat['chat_contact_id'] for chat in existing_chats.values() if chat['chat_contact_id']]
+    linked = {}
+    if linked_ids:
+        rows = await database.fetch_all(chat_contacts.select().where(chat_contacts.c.id.in_(linked_ids)))
+        linked = {row.id: dict(row) for row in rows}
+
+    updates: Dict[int, dict] = {}
+    missing: Dict[str, dict] = {}
+    for info in infos:
+        chat = existing_chats.get(info['external_chat_id'])
+        contact = linked.get(chat['chat_contact_id']) if chat and chat['chat_contact_id'] else None
+        if contact is None and info['client_user_id']:
+            contact = by_ext.get(info['client_user_id'])
+
+        if contact is not None:
+            result[info['external_chat_id']] = contact['id']
+            update = {
+                key: info[key] for key in ('name', 'phone', 'avatar')
+                if info[key] and info[key] != contact.get(key)
+            }
+            # external_contact_id проставляется, только если он не занят другим контактом канала
+            if info['client_user_id'] and contact.get('external_contact_id') != info['client_user_id'] \
+                    and info['client_user_id'] not in by_ext:
+                update['external_contact_id'] = info['client_user_id']
+                by_ext[info['client_user_id']] = contact
+            if update:
+                updates.setdefault(contact['id'], {}).update(update)
+        elif chat is not None and not (info['name'] or info['phone']):
+            # у существующего чата контакт создаётся только при известном имени или телефоне
+            result[info['external_chat_id']] = None
+        elif info['client_user_id']:
+            missing.setdefault(info['client_user_id'], info)
+        else:
+            result[info['external_chat_id']] = await crud.get_or_create_chat_contact(
+                channel_id=channel_id,
+                name=info['name'] if chat is not None else info['fallback_name'],
+                phone=info['phone'],
+                avatar=info['avatar'],
+            )
+
+    for contact_id, update in updates.items():
+        update['updated_at'] = datetime.utcnow()
+        await database.execute(chat_contacts.update().where(chat_contacts.c.id == contact_id).values(**update))
+
+    if missing:
+        now = datetime.utcnow()
+        await database.execute(
+            insert(chat_contacts).values([{
+                'channel_id': channel_id,
+                'external_contact_id': ext_id,
+                'name': info['name'] if info['external_chat_id'] in existing_chats else info['fallback_name'],
+                'phone': info['phone'],
+                'avatar': info['avatar'],
+                'created_at': now,
+                'updated_at': now,
+            } for ext_id, info in missing.items()]).on_conflict_do_nothing(
+                index_elements=['channel_id', 'external_contact_id']
+            )
+        )
+        rows = await database.fetch_all(
+            select(chat_contacts.c.id, chat_contacts.c.external_contact_id).where(and_(
+                chat_contacts.c.channel_id == channel_id,
+                chat_contacts.c.external_contact_id.in_(list(missing)),
+            ))
+        )
+        created = {row.external_contact_id: row.id for row in rows}
+        for info in infos:
+            if info['external_chat_id'] not in result:
+                result[info['external_chat_id']] = created.get(info['client_user_id'])
+
+    return result
+
+
+async def _upsert_chats(channel_id: int, cashbox_id: int, infos: List[dict]) -> Tuple[Dict[str, dict], Set[str]]:
+    """
+    Создаёт новые и обновляет известные чаты канала одним INSERT ... ON CONFLICT.
+    Возвращает сохранённые чаты и external_chat_id уже существовавших.
+    """
+    ext_ids = [info['external_chat_id'] for info in infos]
+    rows = await database.fetch_all(
+        select(chats.c.id, chats.c.external_chat_id, chats.c.chat_contact_id).where(and_(
+            chats.c.channel_id == channel_id,
+            chats.c.cashbox_id == cashbox_id,
+            chats.c.external_chat_id.in_(ext_ids),
+        ))
+    )
+    existing = {row.external_chat_id: dict(row) for row in rows}
+    contact_ids = await _resolve_contacts(channel_id, infos, existing)
+
+    now = datetime.now()
+    query = insert(chats).values([{
+        'channel_id': channel_id,
+        'cashbox_id': cashbox_id,
+        'external_chat_id': info['external_chat_id'],
+        'chat_contact_id': contact_ids.get(info['external_chat_id']),
+        'status': 'ACTIVE',
+        'metadata': info['metadata'],
+        'first_message_time': info['created'],
+        'last_message_time': info['last_message_time'],
+        'updated_at': info['last_message_time'] or now,
+    } for info in infos])
+    query = query.on_conflict_do_update(
+        constraint='uq_chats_channel_external_cashbox',
+        set_={
+            'chat_contact_id': func.coalesce(chats.c.chat_contact_id, query.excluded.chat_contact_id),
+            'metadata': func.coalesce(query.excluded['metadata'], chats.c.metadata),
+            'last_message_time': func.coalesce(query.excluded.last_message_time, chats.c.last_message_time),
+            'updated_at': func.coalesce(query.excluded.last_message_time, chats.c.updated_at),
+        }
+    ).returning(
+        chats.c.id, chats.c.external_chat_id, chats.c.first_message_time, chats.c.first_response_time_seconds,
+        chats.c.sync_cursor_message_id, chats.c.sync_cursor_message_created,
+    )
+    rows = await database.fetch_all(query)
+    return {row.external_chat_id: dict(row) for row in rows}, set(existing)
+
+
+async def _save_messages(chat: dict, avito_messages: List[dict], info: dict) -> int:
+    """
+    Новые сообщения чата одним INSERT, метрики ответа и курсор чата —
+    в транзакции явно взятого соединения: после падения чат дочитывается
+    с того же места.
+    """
+    chat_id = chat['id']
+    async with database.connection() as conn, conn.transaction():
+        ext_ids = [m['id'] for m in avito_messages if m.get('id')]
+        known = set()
+        if ext_ids:
+            rows = await conn.fetch_all(
+                select(chat_messages.c.external_message_id).where(and_(
+                    chat_messages.c.chat_id == chat_id,
+                    chat_messages.c.external_message_id.in_(ext_ids),
+                ))
+            )
+            known = {row.external_message_id for row in rows}
+
+        now = datetime.now()
+        new_messages = []
+        for avito_msg in avito_messages:
+            external_message_id = avito_msg.get('id')
+            if not external_message_id or external_message_id in known:
+                continue
+            known.add(external_message_id)
+            is_read = avito_msg.get('is_read', False) or avito_msg.get('read') is not None
+            new_messages.append({
+                'chat_id': chat_id,
+                'sender_type': "CLIENT" if avito_msg.get('direction', 'in') == "in" else "OPERATOR",
+                'content': _message_text(avito_msg),
+                'message_type': AvitoHandler._map_message_type(avito_msg.get('type', 'text')),
+                'external_message_id': external_message_id,
+                'status': "READ" if is_read else "DELIVERED",
+                'source': "avito",
+                'created_at': datetime.fromtimestamp(avito_msg['created']) if avito_msg.get('created') else now,
+            })
+        new_messages.sort(key=lambda m: m['created_at'])
+
+        chat_updates = {}
+        if new_messages:
+            await conn.execute(chat_messages.insert().values(new_messages))
+
+            # то же, что create_message_and_update_chat для каждого сообщения по порядку
+            last_client_time = await conn.fetch_val(
+                select(func.max(chat_messages.c.created_at)).where(and_(
+                    chat_messages.c.chat_id == chat_id,
+                    chat_messages.c.sender_type == "CLIENT",
+                    chat_messages.c.created_at < new_messages[0]['created_at'],
+                ))
+            )
+            first_message_time = chat['first_message_time']
+            first_response = chat['first_response_time_seconds']
+            for message in new_messages:
+                created_at = message['created_at']
+                if message['sender_type'] == "CLIENT":
+                    if first_message_time is None:
+                        first_message_time = chat_updates['first_message_time'] = created_at
+                    last_client_time = created_at
+                else:
+                    if first_response is None and first_message_time is not None:
+                        first_response = chat_updates['first_response_time_seconds'] = \
+                            int((created_at - first_message_time).total_seconds())
+                    if last_client_time is not None:
+                        chat_updates['last_response_time_seconds'] = int((created_at - last_client_time).total_seconds())
+                chat_updates['last_message_time'] = created_at
+
+        chat_updates['sync_cursor_message_id'] = info['last_message_id']
+        chat_updates['sync_cursor_message_created'] = info['last_message_created']
+        await conn.execute(chats.update().where(chats.c.id == chat_id).values(**chat_updates))
+    return len(new_messages)
+
+
+async def _sync_channel(cred) -> dict:
+    channel_id = cred['channel_id']
+    cashbox_id = cred['cashbox_id']
+    stats = {"chats_created": 0, "chats_updated": 0, "messages_loaded": 0, "errors": 0}
+
+    client = await create_avito_client(
+        channel_id=channel_id,
+        cashbox_id=cashbox_id,
+        on_token_refresh=lambda token_data, ch_id=channel_id, cb_id=cashbox_id: save_token_callback(
+            ch_id,
+            cb_id,
+            token_data
+        )
+    )
+    if not client:
+        logger.warning(f"Could not create Avito client for channel {channel_id}, cashbox {cashbox_id}")
+        stats["errors"] += 1
+        return stats
+
+    cursor = cred['sync_cursor_updated']
+    try:
+        avito_chats = await _fetch_changed_chats(client, cursor)
+    except Exception as e:
+        if _is_subscription_error(e):
+            logger.warning(f"Subscription required for loading chats: {e}")
+        else:
+            logger.error(f"Failed to get chats for channel {channel_id}: {e}")
+            stats["errors"] += 1
+        return stats
+
+    logger.info(f"Retrieved {len(avito_chats)} changed chats from Avito API for channel {channel_id}")
+
+    if avito_chats:
+        infos = {}
+        for avito_chat in avito_chats:
+            infos.setdefault(avito_chat['id'], _chat_info(avito_chat, cred['avito_user_id']))
+        infos = list(infos.values())
+
+        saved, existed = await _upsert_chats(channel_id, cashbox_id, infos)
+        stats["chats_updated"] = len(existed)
+        stats["chats_created"] = len(saved) - len(existed)
+
+        semaphore = asyncio.Semaphore(CHAT_CONCURRENCY)
+
+        async def sync_chat(info: dict):
+            chat = saved.get(info['external_chat_id'])
+            if not chat or not info['last_message_id'] or chat['sync_cursor_message_id'] == info['last_message_id']:
+                return
+            async with semaphore:
+                try:
+                    since = chat['sync_cursor_message_created']
+                    # секундой раньше курсора: сообщения той же секунды отсекаются по external_message_id
+                    avito_messages = await client.sync_messages(
+                        info['external_chat_id'], since_timestamp=since - 1 if since else None
+                    )
+                    loaded = await _save_messages(chat, avito_messages, info)
+                    if loaded:
+                        logger.info(f"Loaded {loaded} messages for chat {chat['id']} (external: {info['external_chat_id']})")
+                    stats["messages_loaded"] += loaded
+                except Exception as e:
+                    if _is_subscription_error(e):
+                        logger.warning(f"Subscription required for loading messages for chat {info['external_chat_id']}")
+                    else:
+                        logger.error(f"Failed to sync messages for chat {chat['id']}: {e}")
+                        stats["errors"] += 1
+
+        # у каждого чата своё соединение: иначе задачи наследуют соединение
+        # канала и транзакции _save_messages перемешиваются на нём
+        await asyncio.gather(*(in_own_connection(sync_chat(info)) for info in infos))
+
+    values = {'synced_at': datetime.utcnow()}
+    # курсор канала сдвигается только после успешной обработки всех чатов;
+    # иначе следующий запуск перечитает список, а готовые чаты пропустит по их курсорам
+    if not stats["errors"] and avito_chats:
+        values['sync_cursor_updated'] = max(_chat_updated(c) for c in avito_chats)
+    await database.execute(channel_credentials.update().where(channel_credentials.c.id == cred['id']).values(**values))
+
+    logger.info(
+        f"Auto-sync completed for channel {channel_id}, cashbox {cashbox_id}: "
+        f"created={stats['chats_created']}, updated={stats['chats_updated']}, messages={stats['messages_loaded']}"
+    )
+    return stats
+
+
 async def sync_avito_chats_and_messages():
     """
     Автоматическая выгрузка новых чатов и сообщений из Avito каждые 5 минут.
     Работает только для аккаунтов с auto_sync_chats_enabled = true.
+
+    Загружаются только чаты, обновлённые после курсора канала, и сообщения
+    новее курсора чата, поэтому цикл для крупных продавцов не растёт с
+    числом чатов.
     """
     try:
         await database.connect()
-        
+
         # Получаем все активные credentials для Avito каналов с включенной автоматической синхронизацией
         query = select([
             channel_credentials.c.id,
             channel_credentials.c.channel_id,
             channel_credentials.c.cashbox_id,
-            channel_credentials.c.avito_user_id
+            channel_credentials.c.avito_user_id,
+            channel_credentials.c.sync_cursor_updated,
         ]).select_from(
             channel_credentials.join(
                 channels,
@@ -70,416 +517,39 @@ async def sync_avito_chats_and_messages():
                 channel_credentials.c.auto_sync_chats_enabled.is_(True)
             )
         )
-        
+
         all_credentials = await database.fetch_all(query)
-        
+
         if not all_credentials:
             logger.info("No Avito credentials with auto_sync_chats_enabled found")
             return
-        
+
         logger.info(f"Starting auto-sync for {len(all_credentials)} Avito accounts")
-        
-        total_chats_created = 0
-        total_chats_updated = 0
-        total_messages_loaded = 0
-        total_errors = 0
-        
-        for cred in all_credentials:
-            try:
-                channel_id = cred['channel_id']
-                cashbox_id = cred['cashbox_id']
-                
-                logger.info(f"Processing auto-sync for channel {channel_id}, cashbox {cashbox_id}")
-                
-                # Создаем клиент
-                client = await create_avito_client(
-                    channel_id=channel_id,
-                    cashbox_id=cashbox_id,
-                    on_token_refresh=lambda token_data, ch_id=channel_id, cb_id=cashbox_id: save_token_callback(
-                        ch_id,
-                        cb_id,
-                        token_data
-                    )
-                )
-                
-                if not client:
-                    logger.warning(f"Could not create Avito client for channel {channel_id}, cashbox {cashbox_id}")
-                    total_errors += 1
-                    continue
-                
-                # Получаем чаты с пагинацией
-                offset = 0
-                limit = 100
-                all_avito_chats = []
-                
-                while True:
-                    try:
-                        avito_chats = await client.get_chats(limit=limit, offset=offset, unread_only=False)
-                        if not avito_chats:
-                            break
-                        
-                        all_avito_chats.extend(avito_chats)
-                        
-                        if len(avito_chats) < limit:
-                            break
-                        
-                        offset += limit
-                    except Exception as e:
-                        error_str = str(e)
-                        if "402" in error_str or "подписку" in error_str.lower() or "subscription" in error_str.lower():
-                            logger.warning(f"Subscription required for loading chats: {e}")
-                            break
-                        logger.error(f"Failed to get chats at offset {offset}: {e}")
-                        total_errors += 1
-                        break
-                
-                logger.info(f"Retrieved {len(all_avito_chats)} chats from Avito API for channel {channel_id}")
-                
-                # Получаем avito_user_id из credentials
-                creds = await database.fetch_one(
-                    channel_credentials.select().where(
-                        (channel_credentials.c.channel_id == channel_id) &
-                        (channel_credentials.c.cashbox_id == cashbox_id) &
-                        (channel_credentials.c.is_active.is_(True))
-                    )
-                )
-                avito_user_id = creds.get('avito_user_id') if creds else None
-                
-                chats_created = 0
-                chats_updated = 0
-                
-                # Обрабатываем каждый чат
-                for avito_chat in all_avito_chats:
-                    try:
-                        external_chat_id = avito_chat.get('id')
-                        if not external_chat_id:
-                            continue
-                        
-                        # Извлекаем информацию о пользователе
-                        users = avito_chat.get('users', [])
-                        user_name = None
-                        user_phone = None
-                        user_avatar = None
-                        client_user_id = None
-                        
-                        if users and avito_user_id:
-                            for user in users:
-                                user_id_in_chat = user.get('user_id') or user.get('id')
-                                if user_id_in_chat and user_id_in_chat != avito_user_id:
-                                    client_user_id = user_id_in_chat
-                                    user_name = user.get('name') or user.get('profile_name')
-                                    user_phone = (
-                                        user.get('phone') or
-                                        user.get('phone_number') or
-                                        user.get('public_user_profile', {}).get('phone') or
-                                        user.get('public_user_profile', {}).get('phone_number')
-                                    )
-                                    public_profile = user.get('public_user_profile', {})
-                                    if public_profile:
-                                        avatar_data = public_profile.get('avatar', {})
-                                        if isinstance(avatar_data, dict):
-                                            user_avatar = (
-                                                avatar_data.get('default') or
-                                                avatar_data.get('images', {}).get('256x256') or
-                                                avatar_data.get('images', {}).get('128x128') or
-                                                (list(avatar_data.get('images', {}).values())[0] if avatar_data.get('images') else None)
-                                            )
-                                        elif isinstance(avatar_data, str):
-                                            user_avatar = avatar_data
-                                    if user_name or user_phone:
-                                        break
-                        
-                        # Пытаемся извлечь телефон из последнего сообщения
-                        if not user_phone:
-                            last_message = avito_chat.get('last_message', {})
-                            if last_message:
-                                message_content = last_message.get('content', {})
-                                message_text = None
-                                if isinstance(message_content, dict):
-                                    message_text = message_content.get('text', '')
-                                elif isinstance(message_content, str):
-                                    message_text = message_content
-                                
-                                if message_text and ('[Системное сообщение]' in message_text or 'системное' in message_text.lower()):
-                                    user_phone = extract_phone_from_text(message_text)
-                        
-                        # Проверяем существующий чат
-                        existing_chat = await database.fetch_one(
-                            chats.select().where(
-                                (chats.c.channel_id == channel_id) &
-                                (chats.c.external_chat_id == external_chat_id) &
-                                (chats.c.cashbox_id == cashbox_id)
-                            )
-                        )
-                        
-                        chat_id = None
-                        
-                        if existing_chat:
-                            chat_id = existing_chat['id']
-                            
-                            context = avito_chat.get('context', {})
-                            ad_title = None
-                            ad_id = None
-                            ad_url = None
-                            if isinstance(context, dict):
-                                item = context.get('item', {})
-                                if isinstance(item, dict):
-                                    ad_title = item.get('title')
-                                    ad_id = item.get('id')
-                                    ad_url = item.get('url')
-                            
-                            metadata = {}
-                            if ad_title:
-                                metadata['ad_title'] = ad_title
-                            if ad_id:
-                                metadata['ad_id'] = ad_id
-                            if ad_url:
-                                metadata['ad_url'] = ad_url
-                            if context:
-                                metadata['context'] = context
-                            
-                            chat_contact_id = existing_chat.get('chat_contact_id')
-                            
-                            if chat_contact_id:
-                                from database.db import chat_contacts
-                                contact_update = {}
-                                
-                                if user_name:
-                                    contact_update['name'] = user_name
-                                if user_phone:
-                                    contact_update['phone'] = user_phone
-                                if user_avatar:
-                                    contact_update['avatar'] = user_avatar
-                                
-                                if client_user_id:
-                                    existing_contact = await database.fetch_one(
-                                        chat_contacts.select().where(chat_contacts.c.id == chat_contact_id)
-                                    )
-                                    if existing_contact and (not existing_contact.get('external_contact_id') or existing_contact.get('external_contact_id') != str(client_user_id)):
-                                        contact_update['external_contact_id'] = str(client_user_id)
-                                
-                                if contact_update:
-                                    await database.execute(
-                                        chat_contacts.update().where(
-                                            chat_contacts.c.id == chat_contact_id
-                                        ).values(**contact_update)
-                                    )
-                            elif (user_name or user_phone) and existing_chat['id']:
-                                from database.db import chat_contacts
-                                contact_data = {
-                                    "channel_id": channel_id,
-                                    "external_contact_id": str(client_user_id) if client_user_id else None,
-                                    "name": user_name,
-                                    "phone": user_phone,
-                                    "avatar": user_avatar
-                                }
-                                contact_result = await database.fetch_one(
-                                    chat_contacts.insert().values(**contact_data).returning(chat_contacts.c.id)
-                                )
-                                if contact_result:
-                                    await database.execute(
-                                        chats.update().where(
-                                            chats.c.id == existing_chat['id']
-                                        ).values(chat_contact_id=contact_result['id'])
-                                    )
-                            
-                            chat_update = {}
-                            if metadata:
-                                chat_update['metadata'] = metadata
-                            
-                            last_message = avito_chat.get('last_message')
-                            if last_message and last_message.get('created'):
-                                last_message_time = datetime.fromtimestamp(last_message['created'])
-                                chat_update['last_message_time'] = last_message_time
-                                chat_update['updated_at'] = last_message_time
-                            
-                            if chat_update:
-                                await database.execute(
-                                    chats.update().where(
-                                        chats.c.id == chat_id
-                                    ).values(**chat_update)
-                                )
-                            
-                            chats_updated += 1
-                            logger.debug(f"Updated chat {chat_id} (external: {external_chat_id})")
-                        else:
-                            context = avito_chat.get('context', {})
-                            ad_title = None
-                            ad_id = None
-                            ad_url = None
-                            if isinstance(context, dict):
-                                item = context.get('item', {})
-                                if isinstance(item, dict):
-                                    ad_title = item.get('title')
-                                    ad_id = item.get('id')
-                                    ad_url = item.get('url')
-                            
-                            metadata = {}
-                            if ad_title:
-                                metadata['ad_title'] = ad_title
-                            if ad_id:
-                                metadata['ad_id'] = ad_id
-                            if ad_url:
-                                metadata['ad_url'] = ad_url
-                            if context:
-                                metadata['context'] = context
-                            
-                            chat_name = user_name or (metadata.get('ad_title') if metadata else None) or f"Avito Chat {external_chat_id[:8]}"
-                            
-                            # Создаем новый чат через crud.create_chat
-                            new_chat = await crud.create_chat(
-                                channel_id=channel_id,
-                                cashbox_id=cashbox_id,
-                                external_chat_id=external_chat_id,
-                                external_chat_id_for_contact=str(client_user_id) if client_user_id else None,
-                                name=chat_name,
-                                phone=user_phone,
-                                avatar=user_avatar,
-                                metadata=metadata if metadata else None
-                            )
-                            
-                            if not new_chat or not new_chat.get('id'):
-                                logger.error(f"Failed to create chat with external_id {external_chat_id}")
-                                continue
-                            
-                            chat_id = new_chat['id']
-                            chats_created += 1
-                            logger.info(f"Created new chat {chat_id} (external: {external_chat_id})")
-                            
-                            if avito_chat.get('created'):
-                                first_message_time = datetime.fromtimestamp(avito_chat['created'])
-                                await database.execute(
-                                    chats.update().where(
-                                        chats.c.id == chat_id
-                                    ).values(first_message_time=first_message_time)
-                                )
-                            
-                            # Обновляем время последнего сообщения
-                            last_message = avito_chat.get('last_message')
-                            if last_message and last_message.get('created'):
-                                last_message_time = datetime.fromtimestamp(last_message['created'])
-                                await database.execute(
-                                    chats.update().where(
-                                        chats.c.id == chat_id
-                                    ).values(
-                                        last_message_time=last_message_time,
-                                        updated_at=last_message_time
-                                    )
-                                )
-                        
-                        # Загружаем сообщения для чата
-                        if chat_id:
-                            try:
-                                avito_messages = await client.sync_messages(external_chat_id)
-                                
-                                messages_loaded = 0
-                                for avito_msg in avito_messages:
-                                    try:
-                                        external_message_id = avito_msg.get('id')
-                                        if not external_message_id:
-                                            continue
-                                        
-                                        # Проверяем существующее сообщение
-                                        existing_message = await database.fetch_one(
-                                            chat_messages.select().where(
-                                                (chat_messages.c.external_message_id == external_message_id) &
-                                                (chat_messages.c.chat_id == chat_id)
-                                            )
-                                        )
-                                        
-                                        if existing_message:
-                                            continue
-                                        
-                                        # Извлекаем текст сообщения
-                                        content = avito_msg.get('content', {})
-                                        message_type_str = avito_msg.get('type', 'text')
-                                        message_text = ""
-                                        
-                                        if isinstance(content, dict):
-                                            if message_type_str == 'text':
-                                                message_text = content.get('text', '')
-                                            elif message_type_str == 'link':
-                                                link_data = content.get('link', {})
-                                                message_text = link_data.get('text', link_data.get('url', '[Ссылка]'))
-                                            elif message_type_str == 'system':
-                                                message_text = content.get('text', '[Системное сообщение]')
-                                            elif message_type_str == 'image':
-                                                message_text = '[Изображение]'
-                                            elif message_type_str == 'item':
-                                                item_data = content.get('item', {})
-                                                message_text = f"Объявление: {item_data.get('title', '[Объявление]')}"
-                                            elif message_type_str == 'location':
-                                                loc_data = content.get('location', {})
-                                                message_text = loc_data.get('text', loc_data.get('title', '[Геолокация]'))
-                                            elif message_type_str == 'voice':
-                                                message_text = '[Голосовое сообщение]'
-                                            else:
-                                                message_text = f"[{message_type_str}]"
-                                        else:
-                                            message_text = str(content) if content else f"[{message_type_str}]"
-                                        
-                                        direction = avito_msg.get('direction', 'in')
-                                        sender_type = "CLIENT" if direction == "in" else "OPERATOR"
-                                        
-                                        is_read = avito_msg.get('is_read', False) or avito_msg.get('read') is not None
-                                        status = "READ" if is_read else "DELIVERED"
-                                        
-                                        created_timestamp = avito_msg.get('created')
-                                        created_at = None
-                                        if created_timestamp:
-                                            created_at = datetime.fromtimestamp(created_timestamp)
-                                        
-                                        await crud.create_message_and_update_chat(
-                                            chat_id=chat_id,
-                                            sender_type=sender_type,
-                                            content=message_text or f"[{message_type_str}]",
-                                            message_type=AvitoHandler._map_message_type(message_type_str),
-                                            external_message_id=external_message_id,
-                                            status=status,
-                                            source="avito",
-                                            created_at=created_at
-                                        )
-                                        messages_loaded += 1
-                                    
-                                    except Exception as e:
-                                        logger.warning(f"Failed to save message {avito_msg.get('id')}: {e}")
-                                        total_errors += 1
-                                
-                                if messages_loaded > 0:
-                                    logger.info(f"Loaded {messages_loaded} messages for chat {chat_id} (external: {external_chat_id})")
-                                    total_messages_loaded += messages_loaded
-                            
-                            except Exception as sync_error:
-                                error_str = str(sync_error)
-                                if "402" in error_str or "подписку" in error_str.lower() or "subscription" in error_str.lower():
-                                    logger.warning(f"Subscription required for loading messages for chat {external_chat_id}")
-                                else:
-                                    logger.error(f"Failed to sync messages for chat {chat_id}: {sync_error}")
-                                    total_errors += 1
-                    
-                    except Exception as e:
-                        logger.warning(f"Failed to process chat {avito_chat.get('id')}: {e}")
-                        total_errors += 1
-                
-                total_chats_created += chats_created
-                total_chats_updated += chats_updated
-                
-                logger.info(
-                    f"Auto-sync completed for channel {channel_id}, cashbox {cashbox_id}: "
-                    f"created={chats_created}, updated={chats_updated}"
-                )
-            
-            except Exception as e:
-                logger.error(f"Error processing auto-sync for credential {cred.get('id')}: {e}", exc_info=True)
-                total_errors += 1
-        
+
+        semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+        async def sync(cred):
+            async with semaphore:
+                try:
+                    return await _sync_channel(cred)
+                except Exception as e:
+                    logger.error(f"Error processing auto-sync for credential {cred.get('id')}: {e}", exc_info=True)
+                    return {"errors": 1}
+
+        results = await asyncio.gather(*(sync(cred) for cred in all_credentials))
+
+        totals = {}
+        for stats in results:
+            for key, value in stats.items():
+                totals[key] = totals.get(key, 0) + value
+
         logger.info(
-            f"Auto-sync job completed: chats_created={total_chats_created}, "
-            f"chats_updated={total_chats_updated}, messages_loaded={total_messages_loaded}, errors={total_errors}"
+            f"Auto-sync job completed: chats_created={totals.get('chats_created', 0)}, "
+            f"chats_updated={totals.get('chats_updated', 0)}, messages_loaded={totals.get('messages_loaded', 0)}, "
+            f"errors={totals.get('errors', 0)}"
         )
-        
+
     except Exception as e:
         logger.error(f"Critical error in avito_auto_sync_chats job: {e}", exc_info=True)
     finally:
         await database.disconnect()
-
@@ -0,0 +1,37 @@
+import logging
+
+from sqlalchemy import select
+
+from database.db import database, cboxes
+from functions.users import apply_matured_payments, recalculate_balances
+
+logger = logging.getLogger(__name__)
+
+
+async def apply_matured_balances():
+    """Включение в балансы счетов платежей, дата которых наступила."""
+    applied = await apply_matured_payments()
+    if applied:
+        logger.info(f"Matured payments applied to payboxes: {applied}")
+
+
+async def reconcile_balances():
+    """
+    Сверка балансов счетов и проектов с платежами.
+    Балансы ведёт триггер на payments, расхождение возможно только после
+    ручных правок в БД — такие записи пересчитываются и логируются.
+    """
+    cashbox_ids = [row.id for row in await database.fetch_all(select(cboxes.c.id).order_by(cboxes.c.id))]
+    for cashbox_id in cashbox_ids:
+        drift = await recalculate_balances(cashbox_id)
+        for paybox in drift["payboxes"]:
+            logger.warning(
+                f"Paybox {paybox['paybox_id']} (cashbox {cashbox_id}) balance drift: "
+                f"{paybox['old_balance']} -> {paybox['new_balance']}"
+            )
+        for project in drift["projects"]:
+            logger.warning(
+                f"Project {project['project_id']} (cashbox {cashbox_id}) drift: "
+                f"incoming {project['old_incoming']} -> {project['new_incoming']}, "
+                f"outgoing {project['old_outgoing']} -> {project['new_outgoing']}"
+            )
@@ -42,10 +42,13 @@ from functions.helpers import init_statement, get_statement
 from functions.payments import clear_repeats, repeat_payment
 from functions.users import raschet
 from jobs.autoburn_job.job import autoburn
+from jobs.balances_job.job import apply_matured_balances, reconcile_balances
+from jobs.loyality_reconcile_job.job import reconcile_loyality_cards
+from jobs.marketplace_prices_job.job import refresh_marketplace_active_prices
 from jobs.module_bank_job.job import module_bank_update_transaction
 from jobs.tochka_bank_job.job import tochka_update_transaction
 from jobs.check_account.job import check_account
-from jobs.segment_jobs.job import segment_update
+from jobs.segment_jobs.job import segment_update, purge_segment_changes
 from jobs.avito_status_check_job.job import check_avito_accounts_status
 from jobs.avito_auto_sync_chats_job.job import sync_avito_chats_and_messages
 
@@ -89,8 +92,13 @@ accountant_interval = int(os.getenv("ACCOUNT_INTERVAL", default=300))
 scheduler.add_job(func=tochka_update_transaction, trigger='interval', minutes=5, id="tochka_update_transaction", max_instances=1, replace_existing=True)
 scheduler.add_job(func=module_bank_update_transaction, trigger='interval', minutes=5, id="module_bank_update_transaction", max_instances=1, replace_existing=True)
 scheduler.add_job(func=autoburn, trigger="interval", seconds=5, id="autoburn", max_instances=1, replace_existing=True)
+scheduler.add_job(func=reconcile_loyality_cards, trigger="cron", hour=3, id="reconcile_loyality_cards", max_instances=1, replace_existing=True)
+scheduler.add_job(func=apply_matured_balances, trigger="interval", minutes=1, id="apply_matured_balances", max_instances=1, replace_existing=True)
+scheduler.add_job(func=reconcile_balances, trigger="cron", hour=3, minute=30, id="reconcile_balances", max_instances=1, replace_existing=True)
 scheduler.add_job(func=check_account, trigger="interval", seconds=accountant_interval, id="check_account", max_instances=1, replace_existing=True)
 scheduler.add_job(func=segment_update, trigger="interval", seconds=60, id="segment_update", max_instances=1, replace_existing=True)
+scheduler.add_job(func=purge_segment_changes, trigger="interval", hours=1, id="purge_segment_changes", max_instances=1, replace_existing=True)
+scheduler.add_job(func=refresh_marketplace_active_prices, trigger="interval", seconds=60, id="marketplace_active_prices", max_instances=1, replace_existing=True)
 
 # Добавляем джоб для обновления времени смен каждую минуту
 scheduler.add_job(func=send_shift_time_updates, trigger="interval", minutes=1, id="shift_time_updates", max_instances=1, replace_existing=True)
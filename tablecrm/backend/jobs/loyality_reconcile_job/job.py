@@ -0,0 +1,32 @@
+import logging
+
+from sqlalchemy import select
+
+from api.loyality_transactions.routers import recalculate_cards
+from database.db import database, loyality_cards
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = 10000
+
+
+async def reconcile_loyality_cards():
+    """
+    Сверка счётчиков income/outcome/balance всех карт с их транзакциями.
+    Счётчики ведёт триггер на loyality_transactions, расхождение возможно
+    только после ручных правок в БД — такие карты пересчитываются и логируются.
+    """
+    last_id, fixed = 0, 0
+    while True:
+        rows = await database.fetch_all(
+            select(loyality_cards.c.id)
+            .where(loyality_cards.c.id > last_id)
+            .order_by(loyality_cards.c.id)
+            .limit(BATCH_SIZE)
+        )
+        if not rows:
+            break
+        last_id = rows[-1].id
+        fixed += await recalculate_cards([row.id for row in rows])
+    if fixed:
+        logger.warning(f"Loyality cards reconciled: {fixed} cards had drifted balances")
@@ -0,0 +1,36 @@
+import time
+
+from sqlalchemy import select
+
+from database.db import database, job_cursors
+
+# Триггер на prices пересчитывает актуальную цену только при записи,
+# поэтому цены, у которых наступил date_from или истёк date_to, добираем здесь.
+FIRST_RUN_LOOKBACK_SECONDS = 24 * 60 * 60
+
+CURSOR_NAME = "marketplace_active_prices"
+
+# Курсор в job_cursors переживает перезапуск процесса задач: окно продолжается
+# с прошлого запуска, а не с now - FIRST_RUN_LOOKBACK_SECONDS.
+_SAVE_CURSOR_QUERY = """
+    INSERT INTO job_cursors (name, value, updated_at)
+    VALUES (:name, :value, now())
+    ON CONFLICT (name) DO UPDATE SET value = EXCLUDED.value, updated_at = now()
+"""
+
+
+async def refresh_marketplace_active_prices():
+    now = int(time.time())
+
+    async with database.connection() as conn, conn.transaction():
+        window_from = await conn.fetch_val(
+            select(job_cursors.c.value).where(job_cursors.c.name == CURSOR_NAME).with_for_update()
+        )
+        if window_from is None:
+            window_from = now - FIRST_RUN_LOOKBACK_SECONDS
+
+        await conn.fetch_one(
+            "SELECT refresh_active_prices_window(:window_from, :window_to) AS refreshed",
+            {"window_from": window_from, "window_to": now},
+        )
+        await conn.execute(_SAVE_CURSOR_QUERY, {"name": CURSOR_NAME, "value": now})
@@ -1,8 +1,8 @@
 import re
-import aiohttp
 
 from datetime import datetime, timedelta
 from sqlalchemy import select, and_
+from common.http_client.registry import http_clients
 from database.db import payments, pboxes, users_cboxes_relation, contragents, docs_sales, async_session_maker, \
     module_bank_operations, module_bank_accounts, module_bank_credentials, integrations_to_cashbox
 from functions.users import raschet
@@ -116,7 +116,7 @@ async def module_bank_update_transaction(
         result = await session.execute(query)
         accounts_credentials = result.fetchall()
         for account in accounts_credentials:
-            async with aiohttp.ClientSession(trust_env=True) as session_http:
+            async with http_clients.session("module_bank") as session_http:
                 async with session_http.post(f'https://api.modulbank.ru/v1/account-info',
                                        headers={
                                            'Authorization': f'Bearer {account.access_token}',
@@ -238,7 +238,7 @@ async def module_bank_update_transaction(
         result = await session.execute(query)
         active_accounts_with_credentials = result.fetchall()
         for account in active_accounts_with_credentials:
-            async with aiohttp.ClientSession(trust_env=True) as http_session:
+            async with http_clients.session("module_bank") as http_session:
                 async with http_session.post(
                         f'https://api.modulbank.ru/v1/account-info/balance/{account.accountId}',
                         headers={
@@ -266,7 +266,7 @@ async def module_bank_update_transaction(
 
             page = 1
             while True:
-                async with aiohttp.ClientSession(trust_env=True) as http_session:
+                async with http_clients.session("module_bank") as http_session:
                     async with http_session.post(
                             f'https://api.modulbank.ru/v1/operation-history/{account.accountId}',
                             headers={
@@ -1,22 +1,34 @@
 import asyncio
+import logging
+import os
 import re
 from datetime import datetime, timedelta
-
-import aiohttp
+from typing import Dict, List, Optional
 
 from sqlalchemy import select, and_
 
+from common.http_client.registry import http_clients
 from database.db import database, payments, tochka_bank_accounts, tochka_bank_credentials, pboxes, \
     users_cboxes_relation, \
     tochka_bank_payments, contragents, docs_sales, integrations_to_cashbox, integrations
+from functions.db_connections import in_own_connection
 from functions.helpers import init_statement, get_statement
 
+logger = logging.getLogger(__name__)
+
+SYNC_CONCURRENCY = int(os.getenv("TOCHKA_SYNC_CONCURRENCY", 5))
+# окно выписки начинается за столько дней до курсора: банк досписывает
+# и переводит в Booked операции задним числом
+SYNC_OVERLAP_DAYS = int(os.getenv("TOCHKA_SYNC_OVERLAP_DAYS", 3))
+STATEMENT_POLL_INTERVAL = 2
+STATEMENT_POLL_ATTEMPTS = int(os.getenv("TOCHKA_STATEMENT_POLL_ATTEMPTS", 60))
+
 async def refresh_token(cred_id: int):
     integration = await database.fetch_one(
         integrations.select().where(integrations.c.id == 1))
     credentials = await database.fetch_one(
         tochka_bank_credentials.select().where(tochka_bank_credentials.c.id == cred_id))
-    async with aiohttp.ClientSession(trust_env = True) as session:
+    async with http_clients.session("tochka") as session:
         async with session.post(f'https://enter.tochka.com/connect/token', data = {
             'client_id': integration.get('client_app_id'),
             'client_secret': integration.get('client_secret'),
@@ -24,7 +36,6 @@ async def refresh_token(cred_id: int):
             'refresh_token': credentials.get('refresh_token'),
         }, headers = {'Content-Type': 'application/x-www-form-urlencoded'}) as resp:
             token_json = await resp.json()
-            print(token_json)
             if token_json.get('access_token') and token_json.get('refresh_token'):
                 await database.execute(tochka_bank_credentials.update().where(tochka_bank_credentials.c.id == cred_id).values({
                     'access_token': token_json.get('access_token'),
@@ -37,7 +48,7 @@ async def extract_number(text):
         return int(match.group(1))
     return None
 
-async def process_payment(contragent_id, description, amount, cashbox_id):
+async def process_payment(contragent_id, description, amount, cashbox_id, conn=database):
     if description:
         number_document = await extract_number(description)
         if number_document:
@@ -50,7 +61,7 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
                     docs_sales.c.is_deleted == False
                 ))
             )
-            docs_sales_info = await database.fetch_one(query)
+            docs_sales_info = await conn.fetch_one(query)
             if docs_sales_info:
                 query = (
                     payments.update()
@@ -61,7 +72,7 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
                         "status": True
                     })
                 )
-                await database.execute(query)
+                await conn.execute(query)
 
                 query = (
                     payments.select()
@@ -69,7 +80,7 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
                         payments.c.docs_sales_id == docs_sales_info.id
                     )
                 )
-                payment_id = await database.fetch_one(query)
+                payment_id = await conn.fetch_one(query)
 
                 if payment_id:
 
@@ -84,7 +95,7 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
             docs_sales.c.is_deleted == False
         ))
     )
-    docs_sales_info = await database.fetch_one(query)
+    docs_sales_info = await conn.fetch_one(query)
     if docs_sales_info:
         query = (
             payments.update()
@@ -95,7 +106,7 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
                 "status": True
             })
         )
-        await database.execute(query)
+        await conn.execute(query)
 
         query = (
             payments.select()
@@ -103,371 +114,352 @@ async def process_payment(contragent_id, description, amount, cashbox_id):
                 payments.c.docs_sales_id == docs_sales_info.id
             )
         )
-        payment_id = await database.fetch_one(query)
+        payment_id = await conn.fetch_one(query)
 
         if payment_id:
             return True, payment_id.id
 
     return False, 0
 
-async def tochka_update_transaction():
-    await database.connect()
-    print("START TOCHKABANK")
-    @database.transaction()
-    async def _tochka_update():
-        active_accounts_with_credentials = await database.fetch_all(
-            select(tochka_bank_accounts.c.accountId,
-                   tochka_bank_accounts.c.registrationDate,
-                   tochka_bank_credentials.c.access_token,
-                   tochka_bank_credentials.c.id.label("cred_id"),
-                   pboxes.c.id.label("pbox_id"),
-                   users_cboxes_relation.c.token,
-                   pboxes.c.cashbox.label("cashbox_id")
-                   ).
-            where(
-                and_(
-                    tochka_bank_accounts.c.is_active == True,
-                    tochka_bank_accounts.c.is_deleted == False
-                )
-            ).
-            select_from(tochka_bank_accounts).
-            join(tochka_bank_credentials,
-                 tochka_bank_credentials.c.id == tochka_bank_accounts.c.tochka_bank_credential_id).
-            join(pboxes, pboxes.c.id == tochka_bank_accounts.c.payboxes_id).
-            join(users_cboxes_relation, users_cboxes_relation.c.id == pboxes.c.cashbox)
-        )
-        if active_accounts_with_credentials:
-            for account in active_accounts_with_credentials:
-                async with aiohttp.ClientSession(trust_env=True) as session:
-                    async with session.get(
-                            f'https://enter.tochka.com/uapi/open-banking/v1.0/accounts/{account.get("accountId")}/balances',
-                            headers={
-                                'Authorization': f'Bearer {account.get("access_token")}',
-                                'Content-type': 'application/json'
-                            }) as resp:
-                        balance_json = await resp.json()
-                    await session.close()
-
-                if not balance_json.get("Data"):
-
-                    await refresh_token(cred_id=account.get('cred_id'))
-
-                    print("проблема с получением баланса (вероятно некорректный access_token), был произведён рефреш")
-
-                    continue
-
-                await database.execute(pboxes.
-                update().
-                where(pboxes.c.id == account.get('pbox_id')).
-                values(
-                    {
-                        'balance': balance_json.get("Data").get("Balance")[0].get("Amount").get("amount"),
-                        'updated_at': int(datetime.utcnow().timestamp()),
-                        'balance_date': int(datetime.utcnow().timestamp())
-                    }
-                ))
+def _transaction_data(payment: dict, statement: dict) -> dict:
+    """Строка tochka_bank_payments по транзакции выписки (без payment_crm_id)."""
+    payment_data = {
+        'accountId': statement.get('accountId'),
+        'statementId': statement.get('statementId'),
+        'statement_creation_datetime': statement.get('creationDateTime'),
+        'transactionTypeCode': payment.get('transactionTypeCode'),
+        'transactionId': payment.get('transactionId'),
+        'status': payment.get('status'),
+        'payment_id': payment.get('paymentId'),
+        'documentProcessDate': payment.get('documentProcessDate'),
+        'documentNumber': payment.get('documentNumber'),
+        'description': payment.get('description'),
+        'creditDebitIndicator': payment.get('creditDebitIndicator'),
+        'amount': payment.get('Amount').get('amount') if payment.get('Amount') else None,
+        'amountNat': payment.get('Amount').get('amountNat') if payment.get('Amount') else None,
+        'currency': payment.get('Amount').get('currency') if payment.get('Amount') else None,
+    }
+    if payment.get('CreditorParty'):
+        payment_data.update({
+            'creditor_party_inn': payment.get('CreditorParty').get('inn'),
+            'creditor_party_name': payment.get('CreditorParty').get('name'),
+            'creditor_party_kpp': payment.get('CreditorParty').get('kpp'),
+            'creditor_account_identification': payment.get('CreditorAccount').get('identification'),
+            'creditor_account_schemeName': payment.get('CreditorAccount').get('schemeName'),
+            'creditor_agent_schemeName': payment.get('CreditorAgent').get('schemeName'),
+            'creditor_agent_name': payment.get('CreditorAgent').get('name'),
+            'creditor_agent_identification': payment.get('CreditorAgent').get('identification'),
+            'creditor_agent_accountIdentification': payment.get('CreditorAgent').get('accountIdentification'),
+        })
+    elif payment.get('DebtorParty'):
+        payment_data.update({
+            'debitor_party_inn': payment.get('DebtorParty').get('inn'),
+            'debitor_party_name': payment.get('DebtorParty').get('name'),
+            'debitor_party_kpp': payment.get('DebtorParty').get('kpp'),
+            'debitor_account_identification': payment.get('DebtorAccount').get('identification'),
+            'debitor_account_schemeName': payment.get('DebtorAccount').get('schemeName'),
+            'debitor_agent_schemeName': payment.get('DebtorAgent').get('schemeName'),
+            'debitor_agent_name': payment.get('DebtorAgent').get('name'),
+            'debitor_agent_identification': payment.get('DebtorAgent').get('identification'),
+            'debitor_agent_accountIdentification': payment.get('DebtorAgent').get('accountIdentification'),
+        })
+    else:
+        raise Exception('не вилидный формат транзакции от Точка банка')
+    return payment_data
+
+
+def _crm_payment_values(payment: dict, account) -> dict:
+    return {
+        'name': payment.get('transactionTypeCode'),
+        'description': payment.get('description'),
+        'type': 'outgoing' if payment.get('creditDebitIndicator') == 'Debit' else 'incoming',
+        'tags': f"TochkaBank,{account.get('accountId')}",
+        'amount': payment.get('Amount').get('amount'),
+        'cashbox': account.get('cashbox_id'),
+        'paybox': account.get('pbox_id'),
+        'date': datetime.strptime(payment.get('documentProcessDate'), "%Y-%m-%d").timestamp(),
+        'updated_at': int(datetime.utcnow().timestamp()),
+        'is_deleted': False,
+        'amount_without_tax': payment.get('Amount').get('amount'),
+        'status': True if payment.get('status') == 'Booked' else False,
+    }
+
+
+def _party(payment: dict) -> dict:
+    return payment.get('CreditorParty') or payment.get('DebtorParty')
+
+
+def _next_cursor(transactions: List[dict], previous_date: Optional[str], previous_payment_id: Optional[str]):
+    """
+    Курсор — дата и paymentId последней обработанной операции.
+    Пока в выписке есть не проведённые (не Booked) операции, курсор не уходит
+    дальше самой ранней из них, чтобы следующий запрос забрал смену её статуса.
+    """
+    if not transactions:
+        return previous_date, previous_payment_id
+
+    pending = sorted(
+        t.get('documentProcessDate') for t in transactions
+        if t.get('status') != 'Booked' and t.get('documentProcessDate')
+    )
+    last = max(transactions, key=lambda t: (t.get('documentProcessDate') or '', t.get('paymentId') or ''))
+    if pending:
+        return pending[0], None
+    if not last.get('documentProcessDate'):
+        return previous_date, previous_payment_id
+    return last.get('documentProcessDate'), last.get('paymentId')
+
+
+async def _fetch_statement(account, start_date: str) -> Optional[dict]:
+    """Запрос выписки и ожидание её готовности — вне транзакции БД."""
+    statement = await init_statement({
+        "accountId": account.get('accountId'),
+        "startDateTime": start_date,
+        "endDateTime": str(datetime.now().date() + timedelta(days=1))
+    }, account.get('access_token'))
+    statement_info = (statement.get('Data') or {}).get('Statement') or {}
+    if not statement_info.get('statementId'):
+        logger.warning(f"Tochka statement for {account.get('accountId')} was not created: {statement}")
+        return None
+
+    for _ in range(STATEMENT_POLL_ATTEMPTS):
+        await asyncio.sleep(STATEMENT_POLL_INTERVAL)
+        info_statement = await get_statement(
+            statement_info.get('statementId'),
+            statement_info.get('accountId'),
+            account.get('access_token'))
+        statements = (info_statement.get('Data') or {}).get('Statement')
+        if isinstance(statements, list) and statements and statements[0].get('status') == 'Ready':
+            return statements[0]
+
+    logger.warning(f"Tochka statement for {account.get('accountId')} is not ready, retry on next run")
+    return None
+
 
-                statement = await init_statement({
-                    "accountId": account.get('accountId'),
-                    "startDateTime": account.get('registrationDate'),
-                    "endDateTime": str(datetime.now().date() + timedelta(days=1))
-                }, account.get('access_token'))
-                status_info = ''
-                info_statement = None
-                while status_info != 'Ready':
-                    await asyncio.sleep(2)
-                    info_statement = await get_statement(
-                        statement.get('Data')['Statement'].get('statementId'),
-                        statement.get('Data')['Statement'].get('accountId'),
-                        account.get('access_token'))
-                    status_info = info_statement.get('Data')['Statement'][0].get('status')
-                tochka_payments_db = await database.fetch_all(
-                    select(*payments.columns, tochka_bank_payments.c.payment_id).
-                    where(and_(payments.c.paybox == account.get('pbox_id'),
-                               payments.c.cashbox == account.get('cashbox_id'))). \
-                    select_from(payments). \
-                    join(tochka_bank_payments, tochka_bank_payments.c.payment_crm_id == payments.c.id))
-
-                if len(tochka_payments_db) < 1:
-                    for payment in info_statement.get('Data')['Statement'][0]['Transaction']:
-
-                        if payment.get('CreditorParty'):
-                            category_payment = 'CreditorParty'
-                        else:
-                            category_payment = 'DebtorParty'
-
-                        contragent_db = await database.fetch_one(
-                            contragents.select().where(and_(
-                                contragents.c.inn == payment.get(category_payment).get('inn')),
-                                contragents.c.cashbox == account.get('cashbox_id')
-                        ))
-
-                        result_process = False
-
-                        if contragent_db:
-                            contragent_id = contragent_db.get('id')
-                            if payment.get('DebtorParty'):
-                                result_process, payment_create_id = await process_payment(
-                                    contragent_id=contragent_db.id,
-                                    description=payment.get('description'),
-                                    amount=payment.get('Amount').get('amount'),
-                                    cashbox_id=account.cashbox_id,
-                                )
-                        else:
-                            contragent_db = await database.execute(contragents.insert().values({
-                                'name': payment.get(category_payment).get('name'),
-                                'inn': payment.get(category_payment).get('inn'),
-                                'cashbox': account.get('cashbox_id'),
-                                'is_deleted': False,
-                                'created_at': int(datetime.utcnow().timestamp()),
-                                'updated_at': int(datetime.utcnow().timestamp()),
-                            }))
-                            contragent_id = contragent_db
-
-                        if not result_process:
-
-                            payment_create_id = await database.execute(payments.insert().values({
-                                'name': payment.get('transactionTypeCode'),
-                                'description': payment.get('description'),
-                                'type': 'outgoing' if payment.get('creditDebitIndicator') == 'Debit' else 'incoming',
-                                'tags': f"TochkaBank,{account.get('accountId')}",
-                                'amount': payment.get('Amount').get('amount'),
-                                'cashbox': account.get('cashbox_id'),
-                                'paybox': account.get('pbox_id'),
-                                'date': datetime.strptime(payment.get('documentProcessDate'), "%Y-%m-%d").timestamp(),
-                                'created_at': int(datetime.utcnow().timestamp()),
-                                'updated_at': int(datetime.utcnow().timestamp()),
-                                'is_deleted': False,
-                                'amount_without_tax': payment.get('Amount').get('amount'),
-                                'status': True if payment.get('status') == 'Booked' else False,
-                                'stopped': True,
-                                'contragent': contragent_id
-                            }))
-
-                        payment_data = {
-                            'accountId': info_statement.get('Data')['Statement'][0].get('accountId'),
-                            'payment_crm_id': payment_create_id,
-                            'statementId': info_statement.get('Data')['Statement'][0].get('statementId'),
-                            'statement_creation_datetime': info_statement.get('Data')['Statement'][0].get(
-                                'creationDateTime'),
-                            'transactionTypeCode': payment.get('transactionTypeCode'),
-                            'transactionId': payment.get('transactionId'),
-                            'status': payment.get('status'),
-                            'payment_id': payment.get('paymentId'),
-                            'documentProcessDate': payment.get('documentProcessDate'),
-                            'documentNumber': payment.get('documentNumber'),
-                            'description': payment.get('description'),
-                            'creditDebitIndicator': payment.get('creditDebitIndicator'),
-                            'amount': payment.get('Amount').get('amount') if payment.get('Amount') else None,
-                            'amountNat': payment.get('Amount').get('amountNat') if payment.get('Amount') else None,
-                            'currency': payment.get('Amount').get('currency') if payment.get('Amount') else None,
-                        }
-                        if payment.get('CreditorParty'):
-                            payment_data.update({
-                                'creditor_party_inn': payment.get('CreditorParty').get('inn'),
-                                'creditor_party_name': payment.get('CreditorParty').get('name'),
-                                'creditor_party_kpp': payment.get('CreditorParty').get('kpp'),
-                                'creditor_account_identification': payment.get('CreditorAccount').get('identification'),
-                                'creditor_account_schemeName': payment.get('CreditorAccount').get('schemeName'),
-                                'creditor_agent_schemeName': payment.get('CreditorAgent').get('schemeName'),
-                                'creditor_agent_name': payment.get('CreditorAgent').get('name'),
-                                'creditor_agent_identification': payment.get('CreditorAgent').get('identification'),
-                                'creditor_agent_accountIdentification': payment.get('CreditorAgent').get(
-                                    'accountIdentification'),
-                            })
-                        elif payment.get('DebtorParty'):
-                            payment_data.update({
-                                'debitor_party_inn': payment.get('DebtorParty').get('inn'),
-                                'debitor_party_name': payment.get('DebtorParty').get('name'),
-                                'debitor_party_kpp': payment.get('DebtorParty').get('kpp'),
-                                'debitor_account_identification': payment.get('DebtorAccount').get('identification'),
-                                'debitor_account_schemeName': payment.get('DebtorAccount').get('schemeName'),
-                                'debitor_agent_schemeName': payment.get('DebtorAgent').get('schemeName'),
-                                'debitor_agent_name': payment.get('DebtorAgent').get('name'),
-                                'debitor_agent_identification': payment.get('DebtorAgent').get('identification'),
-                                'debitor_agent_accountIdentification': payment.get('DebtorAgent').get(
-                                    'accountIdentification'),
-                            }),
-                        else:
-                            raise Exception('не вилидный формат транзакции от Точка банка')
-
-                        await database.execute(tochka_bank_payments.insert().values(payment_data))
-
-                else:
-                    set_tochka_payments_statement = set(
-                        [item.get('paymentId') for item in info_statement.get('Data')['Statement'][0]['Transaction']])
-                    set_tochka_payments_db = set([item.get('payment_id') for item in tochka_payments_db])
-                    new_paymentsId = list(set_tochka_payments_statement - set_tochka_payments_db)
-                    for payment in [item for item in info_statement.get('Data')['Statement'][0]['Transaction'] if
-                                    item.get('paymentId') in new_paymentsId]:
-                        if payment.get('CreditorParty'):
-                            category_payment = 'CreditorParty'
-                        else:
-                            category_payment = 'DebtorParty'
-
-                        contragent_db = await database.fetch_one(
-                            contragents.select().where(and_(
-                                contragents.c.inn == payment.get(category_payment).get('inn')),
-                                contragents.c.cashbox == account.get('cashbox_id')
-                            ))
-
-                        result_process = False
-
-                        if contragent_db:
-                            contragent_id = contragent_db.get('id')
-                            if payment.get('DebtorParty'):
-                                result_process, payment_create_id = await process_payment(
-                                    contragent_id=contragent_db.id,
-                                    description=payment.get('description'),
-                                    amount=payment.get('Amount').get('amount'),
-                                    cashbox_id=account.cashbox_id,
-                                )
-                        else:
-                            contragent_db = await database.execute(contragents.insert().values({
-                                'name': payment.get(category_payment).get('name'),
-                                'inn': payment.get(category_payment).get('inn'),
-                                'cashbox': account.get('cashbox_id'),
-                                'is_deleted': False,
-                                'created_at': int(datetime.utcnow().timestamp()),
-                                'updated_at': int(datetime.utcnow().timestamp()),
-                            }))
-                            contragent_id = contragent_db
-
-                        if not result_process:
-
-                            payment_create_id = await database.execute(payments.insert().values({
-                                'name': payment.get('transactionTypeCode'),
-                                'description': payment.get('description'),
-                                'type': 'outgoing' if payment.get('creditDebitIndicator') == 'Debit' else 'incoming',
-                                'tags': f"TochkaBank,{account.get('accountId')}",
-                                'amount': payment.get('Amount').get('amount'),
-                                'cashbox': account.get('cashbox_id'),
-                                'paybox': account.get('pbox_id'),
-                                'date': datetime.strptime(payment.get('documentProcessDate'), "%Y-%m-%d").timestamp(),
-                                'created_at': int(datetime.utcnow().timestamp()),
-                                'updated_at': int(datetime.utcnow().timestamp()),
-                                'is_deleted': False,
-                                'amount_without_tax': payment.get('Amount').get('amount'),
-                                'status': True if payment.get('status') == 'Booked' else False,
-                                'stopped': True,
-                                'contragent': contragent_id
-                            }))
-
-                        payment_data = {
-                            'accountId': info_statement.get('Data')['Statement'][0].get('accountId'),
-                            'payment_crm_id': payment_create_id,
-                            'statementId': info_statement.get('Data')['Statement'][0].get('statementId'),
-                            'statement_creation_datetime': info_statement.get('Data')['Statement'][0].get(
-                                'creationDateTime'),
-                            'transactionTypeCode': payment.get('transactionTypeCode'),
-                            'transactionId': payment.get('transactionId'),
-                            'status': payment.get('status'),
-                            'payment_id': payment.get('paymentId'),
-                            'documentProcessDate': payment.get('documentProcessDate'),
-                            'documentNumber': payment.get('documentNumber'),
-                            'description': payment.get('description'),
-                            'creditDebitIndicator': payment.get('creditDebitIndicator'),
-                            'amount': payment.get('Amount').get('amount') if payment.get('Amount') else None,
-                            'amountNat': payment.get('Amount').get('amountNat') if payment.get('Amount') else None,
-                            'currency': payment.get('Amount').get('currency') if payment.get('Amount') else None,
-                        }
-                        if payment.get('CreditorParty'):
-                            payment_data.update({
-                                'creditor_party_inn': payment.get('CreditorParty').get('inn'),
-                                'creditor_party_name': payment.get('CreditorParty').get('name'),
-                                'creditor_party_kpp': payment.get('CreditorParty').get('kpp'),
-                                'creditor_account_identification': payment.get('CreditorAccount').get('identification'),
-                                'creditor_account_schemeName': payment.get('CreditorAccount').get('schemeName'),
-                                'creditor_agent_schemeName': payment.get('CreditorAgent').get('schemeName'),
-                                'creditor_agent_name': payment.get('CreditorAgent').get('name'),
-                                'creditor_agent_identification': payment.get('CreditorAgent').get('identification'),
-                                'creditor_agent_accountIdentification': payment.get('CreditorAgent').get(
-                                    'accountIdentification'),
-                            })
-
-                        elif payment.get('DebtorParty'):
-                            payment_data.update({
-                                'debitor_party_inn': payment.get('DebtorParty').get('inn'),
-                                'debitor_party_name': payment.get('DebtorParty').get('name'),
-                                'debitor_party_kpp': payment.get('DebtorParty').get('kpp'),
-                                'debitor_account_identification': payment.get('DebtorAccount').get('identification'),
-                                'debitor_account_schemeName': payment.get('DebtorAccount').get('schemeName'),
-                                'debitor_agent_schemeName': payment.get('DebtorAgent').get('schemeName'),
-                                'debitor_agent_name': payment.get('DebtorAgent').get('name'),
-                                'debitor_agent_identification': payment.get('DebtorAgent').get('identification'),
-                                'debitor_agent_accountIdentification': payment.get('DebtorAgent').get(
-                                    'accountIdentification'),
-                            })
-                        else:
-                            raise Exception('не вилидный формат транзакции от Точка банка')
-
-                        await database.execute(tochka_bank_payments.insert().values(payment_data))
-
-                    for payment in info_statement.get('Data')['Statement'][0]['Transaction']:
-                        payment_data = {
-                            'accountId': info_statement.get('Data')['Statement'][0].get('accountId'),
-                            'statementId': info_statement.get('Data')['Statement'][0].get('statementId'),
-                            'statement_creation_datetime': info_statement.get('Data')['Statement'][0].get(
-                                'creationDateTime'),
-                            'transactionTypeCode': payment.get('transactionTypeCode'),
-                            'transactionId': payment.get('transactionId'),
-                            'status': payment.get('status'),
-                            'payment_id': payment.get('paymentId'),
-                            'documentProcessDate': payment.get('documentProcessDate'),
-                            'documentNumber': payment.get('documentNumber'),
-                            'description': payment.get('description'),
-                            'creditDebitIndicator': payment.get('creditDebitIndicator'),
-                            'amount': payment.get('Amount').get('amount') if payment.get('Amount') else None,
-                            'amountNat': payment.get('Amount').get('amountNat') if payment.get('Amount') else None,
-                            'currency': payment.get('Amount').get('currency') if payment.get('Amount') else None,
-                        }
-                        if payment.get('CreditorParty'):
-                            payment_data.update({
-                                'creditor_party_inn': payment.get('CreditorParty').get('inn'),
-                                'creditor_party_name': payment.get('CreditorParty').get('name'),
-                                'creditor_party_kpp': payment.get('CreditorParty').get('kpp'),
-                                'creditor_account_identification': payment.get('CreditorAccount').get('identification'),
-                                'creditor_account_schemeName': payment.get('CreditorAccount').get('schemeName'),
-                                'creditor_agent_schemeName': payment.get('CreditorAgent').get('schemeName'),
-                                'creditor_agent_name': payment.get('CreditorAgent').get('name'),
-                                'creditor_agent_identification': payment.get('CreditorAgent').get('identification'),
-                                'creditor_agent_accountIdentification': payment.get('CreditorAgent').get(
-                                    'accountIdentification'),
-                            })
-                        elif payment.get('DebtorParty'):
-                            payment_data.update({
-                                'debitor_party_inn': payment.get('DebtorParty').get('inn'),
-                                'debitor_party_name': payment.get('DebtorParty').get('name'),
-                                'debitor_party_kpp': payment.get('DebtorParty').get('kpp'),
-                                'debitor_account_identification': payment.get('DebtorAccount').get('identification'),
-                                'debitor_account_schemeName': payment.get('DebtorAccount').get('schemeName'),
-                                'debitor_agent_schemeName': payment.get('DebtorAgent').get('schemeName'),
-                                'debitor_agent_name': payment.get('DebtorAgent').get('name'),
-                                'debitor_agent_identification': payment.get('DebtorAgent').get('identification'),
-                                'debitor_agent_accountIdentification': payment.get('DebtorAgent').get(
-                                    'accountIdentification'),
-                            }),
-                        else:
-                            raise Exception('не вилидный формат транзакции от Точка банка')
-
-                        await database.execute(tochka_bank_payments.update().where(
-                            tochka_bank_payments.c.payment_id == payment.get('paymentId')).values(payment_data))
-                        payment_update = await database.fetch_one(tochka_bank_payments.select().where(
-                            tochka_bank_payments.c.payment_id == payment.get('paymentId')))
-                        await database.execute(
-                            payments.update().where(payments.c.id == payment_update.get('payment_crm_id')).values({
-                                'name': payment.get('transactionTypeCode'),
-                                'description': payment.get('description'),
-                                'type': 'outgoing' if payment.get('creditDebitIndicator') == 'Debit' else 'incoming',
-                                'tags': f"TochkaBank,{account.get('accountId')}",
-                                'amount': payment.get('Amount').get('amount'),
-                                'cashbox': account.get('cashbox_id'),
-                                'paybox': account.get('pbox_id'),
-                                'date': datetime.strptime(payment.get('documentProcessDate'), "%Y-%m-%d").timestamp(),
-                                'updated_at': int(datetime.utcnow().timestamp()),
-                                'is_deleted': False,
-                                'amount_without_tax': payment.get('Amount').get('amount'),
-                                'status': True if payment.get('status') == 'Booked' else False,
-                            }))
-
-    await _tochka_update()
\ No newline at end of file
+async def _resolve_contragents(conn, transactions: List[dict], cashbox_id: int) -> Dict[Optional[str], int]:
+    """ИНН -> id контрагента кассы; недостающие контрагенты создаются одним INSERT."""
+    parties: Dict[Optional[str], dict] = {}
+    for payment in transactions:
+        party = _party(payment)
+        parties.setdefault(party.get('inn'), party)
+
+    inns = [inn for inn in parties if inn is not None]
+    result: Dict[Optional[str], int] = {}
+    if inns:
+        rows = await conn.fetch_all(
+            select(contragents.c.id, contragents.c.inn)
+            .where(contragents.c.inn.in_(inns), contragents.c.cashbox == cashbox_id)
+            .order_by(contragents.c.id)
+        )
+        for row in rows:
+            result.setdefault(row.inn, row.id)
+    if None in parties:
+        row = await conn.fetch_one(
+            select(contragents.c.id)
+            .where(contragents.c.inn.is_(None), contragents.c.cashbox == cashbox_id)
+            .order_by(contragents.c.id)
+            .limit(1)
+        )
+        if row:
+            result[None] = row.id
+
+    missing = [inn for inn in parties if inn not in result]
+    if missing:
+        now = int(datetime.utcnow().timestamp())
+        created = await conn.fetch_all(
+            contragents.insert().values([{
+                'name': parties[inn].get('name'),
+                'inn': inn,
+                'cashbox': cashbox_id,
+                'is_deleted': False,
+                'created_at': now,
+                'updated_at': now,
+            } for inn in missing]).returning(contragents.c.id, contragents.c.inn)
+        )
+        for row in created:
+            result[row.inn] = row.id
+    return result
+
+
+async def _save_statement(account, statement: dict, balance: float):
+    """
+    Запись выписки счёта — одна короткая транзакция на счёт. Все запросы идут
+    через conn: платёж, строка tochka_bank_payments и курсор фиксируются вместе.
+    """
+    transactions = statement.get('Transaction') or []
+    payment_ids = [t.get('paymentId') for t in transactions]
+
+    async with database.connection() as conn, conn.transaction():
+        await conn.execute(pboxes.update().where(pboxes.c.id == account.get('pbox_id')).values({
+            'balance': balance,
+            'updated_at': int(datetime.utcnow().timestamp()),
+            'balance_date': int(datetime.utcnow().timestamp())
+        }))
+
+        existing = {}
+        if payment_ids:
+            rows = await conn.fetch_all(
+                select(tochka_bank_payments.c.payment_id, tochka_bank_payments.c.payment_crm_id,
+                       tochka_bank_payments.c.status, tochka_bank_payments.c.amount)
+                .where(tochka_bank_payments.c.accountId == account.get('accountId'),
+                       tochka_bank_payments.c.payment_id.in_(payment_ids))
+            )
+            existing = {row.payment_id: row for row in rows}
+
+        new_transactions, seen = [], set()
+        for payment in transactions:
+            if payment.get('paymentId') not in existing and payment.get('paymentId') not in seen:
+                seen.add(payment.get('paymentId'))
+                new_transactions.append(payment)
+
+        if new_transactions:
+            contragent_ids = await _resolve_contragents(conn, new_transactions, account.get('cashbox_id'))
+
+            crm_ids: Dict[str, int] = {}
+            for payment in new_transactions:
+                # входящий платёж от известного контрагента может закрыть оплату документа продажи
+                if payment.get('DebtorParty') and _party(payment).get('inn') in contragent_ids:
+                    result_process, payment_create_id = await process_payment(
+                        contragent_id=contragent_ids[_party(payment).get('inn')],
+                        description=payment.get('description'),
+                        amount=payment.get('Amount').get('amount'),
+                        cashbox_id=account.get('cashbox_id'),
+                        conn=conn,
+                    )
+                    if result_process:
+                        crm_ids[payment.get('paymentId')] = payment_create_id
+
+            to_create = [payment for payment in new_transactions if payment.get('paymentId') not in crm_ids]
+            if to_create:
+                # id заранее из последовательности: так строки tochka_bank_payments
+                # связываются с платежами без расчёта на порядок RETURNING
+                ids = await conn.fetch_all(
+                    "SELECT nextval(pg_get_serial_sequence('payments', 'id')) AS id FROM generate_series(1, :n)",
+                    {"n": len(to_create)},
+                )
+                now = int(datetime.utcnow().timestamp())
+                rows = []
+                for payment, row in zip(to_create, ids):
+                    crm_ids[payment.get('paymentId')] = row.id
+                    rows.append({
+                        **_crm_payment_values(payment, account),
+                        'id': row.id,
+                        'created_at': now,
+                        'stopped': True,
+                        'contragent': contragent_ids.get(_party(payment).get('inn')),
+                    })
+                await conn.execute(payments.insert().values(rows))
+
+            await conn.execute(tochka_bank_payments.insert().values([
+                {**_transaction_data(payment, statement), 'payment_crm_id': crm_ids[payment.get('paymentId')]}
+                for payment in new_transactions
+            ]))
+
+        # уже загруженные операции обновляются, только если банк изменил статус или сумму
+        for payment in transactions:
+            known = existing.get(payment.get('paymentId'))
+            if known is None:
+                continue
+            amount = payment.get('Amount').get('amount') if payment.get('Amount') else None
+            if known.status == payment.get('status') and known.amount == amount:
+                continue
+            await conn.execute(tochka_bank_payments.update().where(
+                tochka_bank_payments.c.accountId == account.get('accountId'),
+                tochka_bank_payments.c.payment_id == payment.get('paymentId')).values(
+                _transaction_data(payment, statement)))
+            if known.payment_crm_id:
+                await conn.execute(
+                    payments.update().where(payments.c.id == known.payment_crm_id).values(
+                        _crm_payment_values(payment, account)))
+
+        cursor_date, cursor_payment_id = _next_cursor(
+            transactions, account.get('sync_cursor_date'), account.get('sync_cursor_payment_id'))
+        await conn.execute(
+            tochka_bank_accounts.update().where(tochka_bank_accounts.c.id == account.get('id')).values({
+                'sync_cursor_date': cursor_date,
+                'sync_cursor_payment_id': cursor_payment_id,
+                'synced_at': datetime.utcnow(),
+            }))
+
+    return len(new_transactions)
+
+
+async def _sync_account(session, account):
+    async with session.get(
+            f'https://enter.tochka.com/uapi/open-banking/v1.0/accounts/{account.get("accountId")}/balances',
+            headers={
+                'Authorization': f'Bearer {account.get("access_token")}',
+                'Content-type': 'application/json'
+            }) as resp:
+        balance_json = await resp.json()
+
+    if not balance_json.get("Data"):
+        await refresh_token(cred_id=account.get('cred_id'))
+        logger.warning(f"Tochka balance for {account.get('accountId')} is unavailable, access token refreshed")
+        return
+
+    balance = balance_json.get("Data").get("Balance")[0].get("Amount").get("amount")
+
+    start_date = account.get('registrationDate')
+    if account.get('sync_cursor_date'):
+        cursor = datetime.strptime(account.get('sync_cursor_date'), "%Y-%m-%d").date()
+        start_date = str(cursor - timedelta(days=SYNC_OVERLAP_DAYS))
+
+    statement = await _fetch_statement(account, start_date)
+    if statement is None:
+        return
+
+    created = await _save_statement(account, statement, balance)
+    if created:
+        logger.info(f"Tochka account {account.get('accountId')}: {created} new transactions since {start_date}")
+
+
+async def tochka_update_transaction(account_id: int = None):
+    """
+    Синхронизация выписок Точки. Каждый счёт запрашивает выписку только от своего
+    курсора (минус SYNC_OVERLAP_DAYS) и пишет её в своей транзакции;
+    счета обрабатываются параллельно, не больше SYNC_CONCURRENCY одновременно.
+    """
+    await database.connect()
+    conditions = [
+        tochka_bank_accounts.c.is_active == True,
+        tochka_bank_accounts.c.is_deleted == False
+    ]
+    if account_id is not None:
+        conditions.append(tochka_bank_accounts.c.id == account_id)
+
+    active_accounts_with_credentials = await database.fetch_all(
+        select(tochka_bank_accounts.c.id,
+               tochka_bank_accounts.c.accountId,
+               tochka_bank_accounts.c.registrationDate,
+               tochka_bank_accounts.c.sync_cursor_date,
+               tochka_bank_accounts.c.sync_cursor_payment_id,
+               tochka_bank_credentials.c.access_token,
+               tochka_bank_credentials.c.id.label("cred_id"),
+               pboxes.c.id.label("pbox_id"),
+               users_cboxes_relation.c.token,
+               pboxes.c.cashbox.label("cashbox_id")
+               ).
+        where(and_(*conditions)).
+        select_from(tochka_bank_accounts).
+        join(tochka_bank_credentials,
+             tochka_bank_credentials.c.id == tochka_bank_accounts.c.tochka_bank_credential_id).
+        join(pboxes, pboxes.c.id == tochka_bank_accounts.c.payboxes_id).
+        join(users_cboxes_relation, users_cboxes_relation.c.id == pboxes.c.cashbox)
+    )
+    if not active_accounts_with_credentials:
+        return
+
+    semaphore = asyncio.Semaphore(SYNC_CONCURRENCY)
+
+    async with http_clients.session("tochka") as session:
+        async def sync(account):
+            async with semaphore:
+                try:
+                    await _sync_account(session, account)
+                except Exception as e:
+                    # ошибка одного счёта не останавливает остальные, его курсор не сдвигается
+                    logger.exception(f"Tochka sync failed for account {account.get('accountId')}: {e}")
+
+        # у каждого счёта своё соединение: транзакции счетов не делят соединение родителя
+        await asyncio.gather(*(in_own_connection(sync(account)) for account in active_accounts_with_credentials))
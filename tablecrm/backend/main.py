@@ -95,8 +95,8 @@ from database.db import database
 from database.fixtures import init_db
 # import sentry_sdk
 
-from functions.users import get_user_id_cashbox_id_by_token
-from functions.events import write_event
+from functions.events import events_pipeline
+from functions.token_resolver import token_resolver
 
 from starlette.types import Message
 
@@ -146,6 +146,11 @@ from api.integrations.routers import router as int_router
 from api.oauth.routes import router as oauth_router
 from api.templates.routers import router as templates_router
 from api.docs_generate.routers import router as doc_generate_router
+from api.docs_generate.render_service import doc_render_service
+from common.http_client.registry import http_clients
+from api.chats.avito.avito_chat_info_cache import avito_chat_info_cache
+from functions.reference_cache import reference_cache
+from ws_manager import hub as ws_hub, ws_bus, ws_updates
 from api.webapp.routers import router as webapp_router
 from apps.tochka_bank.routes import router as tochka_router
 from api.reports.routers import router as reports_router
@@ -293,6 +298,19 @@ async def check_health_app():
     return {"status": "ok"}
 
 
+@app.get("/health/stats", include_in_schema=False)
+async def check_health_stats():
+    return {
+        "events_pipeline": events_pipeline.stats(),
+        "token_resolver": token_resolver.stats(),
+        "http_clients": http_clients.stats(),
+        "avito_chat_info": avito_chat_info_cache.stats(),
+        "reference_cache": reference_cache.stats(),
+        "ws_hub": ws_hub.stats(),
+        "ws_updates": ws_updates.stats(),
+    }
+
+
 @app.post("/api/v1/payments/tinkoff/callback")
 @app.get("/api/v1/payments/tinkoff/callback")
 async def tinkoff_callback_direct(request: Request):
@@ -423,26 +441,20 @@ async def write_event_middleware(request: Request, call_next):
         await set_body(request, body)
         return body
 
-    async def _write_event(request: Request, body: bytes, time_start: float, status_code: int = 500) -> None:
+    def _write_event(request: Request, body: bytes, time_start: float, status_code: int = 500) -> None:
         try:
             if "openapi.json" not in request.url.path:
                 token = request.query_params.get("token")
                 token = token if token else request.path_params.get("token")
 
-                user_id, cashbox_id = await get_user_id_cashbox_id_by_token(token=token)
-                type = "cashevent"
-                payload = {} if not body and request.headers.get("content-type") != "application/json" else json.loads(
-                    body)
-                name = "" if request.scope.get("endpoint") != create_payment else payload.get("type")
-
-                await write_event(
-                    type=type,
-                    name=name,
+                events_pipeline.put(
+                    type="cashevent",
+                    name="",
+                    name_from_payload=request.scope.get("endpoint") == create_payment,
                     method=request.method,
                     url=request.url.__str__(),
-                    payload=payload,
-                    cashbox_id=cashbox_id,
-                    user_id=user_id,
+                    body=body,
+                    content_type=request.headers.get("content-type"),
                     token=token,
                     ip=request.headers.get("X-Forwarded-For"),
                     status_code=status_code,
@@ -454,24 +466,28 @@ async def write_event_middleware(request: Request, call_next):
     time_start = time.time()
     await set_body(request, await request.body())
     body = await get_body(request)
+    resolver_scope = token_resolver.start_request()
     try:
         response = await call_next(request)
-        await _write_event(request=request, body=body, time_start=time_start, status_code=response.status_code)
+        _write_event(request=request, body=body, time_start=time_start, status_code=response.status_code)
         return response
     except Exception as e:
-        await _write_event(request=request, body=body, time_start=time_start)
+        _write_event(request=request, body=body, time_start=time_start)
         raise e
+    finally:
+        token_resolver.end_request(resolver_scope)
 
 
 @app.on_event("startup")
 async def startup():
-    rabbit_factory = RabbitFactory(settings=RabbitMqSettings(
+    rabbit_settings = RabbitMqSettings(
         rabbitmq_host=os.getenv('RABBITMQ_HOST'),
         rabbitmq_user=os.getenv('RABBITMQ_USER'),
         rabbitmq_pass=os.getenv('RABBITMQ_PASS'),
         rabbitmq_port=os.getenv('RABBITMQ_PORT'),
         rabbitmq_vhost=os.getenv('RABBITMQ_VHOST')
-    ))
+    )
+    rabbit_factory = RabbitFactory(settings=rabbit_settings)
 
     s3_factory = S3ServiceFactory(
         s3_settings=S3SettingsModel(
@@ -527,6 +543,8 @@ async def startup():
 
     init_db()
     await database.connect()
+    await events_pipeline.start()
+    token_resolver.start_listener()
 
     if os.getenv("ENABLE_AVITO_ENV_INIT", "false").lower() == "true":
         try:
@@ -535,6 +553,12 @@ async def startup():
         except Exception as e:
             pass
 
+    try:
+        await ws_bus.start(rabbit_settings)
+    except Exception as e:
+        import traceback
+        traceback.print_exc()
+
     try:
         await chat_consumer.start()
     except Exception as e:
@@ -562,7 +586,13 @@ async def startup():
 
 @app.on_event("shutdown")
 async def shutdown():
+    await events_pipeline.stop()
+    await token_resolver.stop_listener()
+    doc_render_service.shutdown()
+    await http_clients.close()
     await database.disconnect()
+    await ws_updates.flush_all()
+    await ws_bus.stop()
     await chat_consumer.stop()
     await avito_consumer.stop()
 
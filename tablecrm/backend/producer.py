@@ -3,6 +3,7 @@ import os
 import uuid
 
 from api.apple_wallet.messages.AppleWalletCardUpdateMessage import AppleWalletCardUpdateMessage
+from api.apple_wallet.messages.AppleWalletCardsBatchUpdateMessage import AppleWalletCardsBatchUpdateMessage
 from common.amqp_messaging.common.core.IRabbitFactory import IRabbitFactory
 from common.amqp_messaging.common.core.IRabbitMessaging import IRabbitMessaging
 from common.utils.ioc.ioc import ioc
@@ -119,3 +120,17 @@ async def publish_apple_wallet_pass_update(card_ids: list[int]):
             ),
             routing_key="teach_card_operation"
         )
+
+
+async def publish_apple_wallet_passes_batch_update(card_ids: list[int], batch_size: int = 100):
+    """Публикация обновления пассов пачками: одно сообщение на batch_size карт."""
+    rabbitmq_messaging: IRabbitMessaging = await ioc.get(IRabbitFactory)()
+
+    for i in range(0, len(card_ids), batch_size):
+        await rabbitmq_messaging.publish(
+            AppleWalletCardsBatchUpdateMessage(
+                message_id=uuid.uuid4(),
+                loyality_card_ids=card_ids[i:i + batch_size],
+            ),
+            routing_key="apple_wallet_card_update"
+        )
@@ -0,0 +1,121 @@
+import argparse
+import asyncio
+import math
+import statistics
+import time
+
+import asyncpg
+
+from database.db import SQLALCHEMY_DATABASE_URL
+
+# Сравнение старой схемы (все склады -> гаверсинус в Python -> сортировка)
+# с фильтром по радиусу через GiST (earth_box) и сортировкой в SQL до LIMIT.
+# Данные создаются во временной таблице и исчезают вместе с соединением.
+
+CENTER_LAT, CENTER_LON = 55.7558, 37.6173
+
+HAVERSINE_SQL = """
+    2 * 6371.0 * asin(sqrt(least(
+        power(sin(radians(latitude - $1) / 2), 2)
+        + cos(radians($1)) * cos(radians(latitude)) * power(sin(radians(longitude - $2) / 2), 2),
+        1.0
+    )))
+"""
+
+
+def haversine(lat1, lon1, lat2, lon2):
+    dlat = math.radians(lat2 - lat1)
+    dlon = math.radians(lon2 - lon1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlon / 2) ** 2
+    return 2 * 6371.0 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+
+
+async def prepare(conn: asyncpg.Connection, size: int):
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS cube")
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS earthdistance")
+    await conn.execute("DROP TABLE IF EXISTS bench_warehouses")
+    await conn.execute("""
+        CREATE TEMP TABLE bench_warehouses (
+            id serial PRIMARY KEY,
+            latitude double precision,
+            longitude double precision,
+            is_public boolean,
+            status boolean,
+            is_deleted boolean
+        )
+    """)
+    # Склады в радиусе ~1000 км от центра, часть без координат и непубличные
+    await conn.execute("""
+        INSERT INTO bench_warehouses (latitude, longitude, is_public, status, is_deleted)
+        SELECT
+            CASE WHEN random() < 0.05 THEN NULL ELSE $1 + (random() - 0.5) * 18 END,
+            $2 + (random() - 0.5) * 30,
+            random() < 0.8, true, random() < 0.02
+        FROM generate_series(1, $3)
+    """, CENTER_LAT, CENTER_LON, size)
+    await conn.execute("""
+        CREATE INDEX ON bench_warehouses USING gist (ll_to_earth(latitude, longitude))
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+        AND is_public IS TRUE AND status IS TRUE AND is_deleted IS NOT TRUE
+    """)
+    await conn.execute("ANALYZE bench_warehouses")
+
+
+async def python_sort(conn: asyncpg.Connection, radius_km: float, limit: int):
+    rows = await conn.fetch("""
+        SELECT id, latitude, longitude FROM bench_warehouses
+        WHERE is_public IS TRUE AND status IS TRUE AND is_deleted IS NOT TRUE
+    """)
+    distances = [
+        (haversine(CENTER_LAT, CENTER_LON, r["latitude"], r["longitude"]), r["id"])
+        for r in rows if r["latitude"] is not None and r["longitude"] is not None
+    ]
+    return sorted(d for d in distances if d[0] <= radius_km)[:limit]
+
+
+async def sql_sort(conn: asyncpg.Connection, radius_km: float, limit: int):
+    return await conn.fetch(f"""
+        SELECT id, {HAVERSINE_SQL} AS distance
+        FROM bench_warehouses
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+          AND is_public IS TRUE AND status IS TRUE AND is_deleted IS NOT TRUE
+          AND earth_box(ll_to_earth($1, $2), $3 * 1000 * 1.01) @> ll_to_earth(latitude, longitude)
+          AND {HAVERSINE_SQL} <= $3
+        ORDER BY distance, id
+        LIMIT $4
+    """, CENTER_LAT, CENTER_LON, radius_km, limit)
+
+
+async def measure(func, *args, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+async def main(sizes, radius_km: float, limit: int, runs: int):
+    conn = await asyncpg.connect(SQLALCHEMY_DATABASE_URL)
+    try:
+        print(f"radius={radius_km} km, limit={limit}, runs={runs}")
+        print(f"{'warehouses':>10} | {'python p50/p95, ms':>20} | {'sql+gist p50/p95, ms':>22}")
+        for size in sizes:
+            await prepare(conn, size)
+            py_p50, py_p95 = await measure(python_sort, conn, radius_km, limit, runs=runs)
+            sql_p50, sql_p95 = await measure(sql_sort, conn, radius_km, limit, runs=runs)
+            print(f"{size:>10} | {py_p50:>9.2f} / {py_p95:<8.2f} | {sql_p50:>10.2f} / {sql_p95:<9.2f}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark distance sorting for marketplace warehouses")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000])
+    parser.add_argument("--radius", type=float, default=50.0, help="Radius in km")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.radius, args.limit, args.runs))
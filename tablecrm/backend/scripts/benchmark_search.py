@@ -0,0 +1,156 @@
+import argparse
+import asyncio
+import statistics
+import time
+
+import asyncpg
+
+from database.db import SQLALCHEMY_DATABASE_URL
+
+# Сравнение поиска ILIKE '%term%' без индекса (как было) с тем же запросом
+# по GIN gin_trgm_ops и ранжированием, плюс поиск штрихкода подстрокой
+# против точного совпадения по btree-индексу на нормализованном коде
+# (то же выражение, что в миграции d38f6a1c9e27).
+# Данные создаются во временных таблицах и исчезают вместе с соединением.
+
+WORDS = [
+    "молоко", "кефир", "сыр", "хлеб", "батон", "масло", "сливочное", "творог", "йогурт", "сметана",
+    "кофе", "чай", "зелёный", "чёрный", "сахар", "соль", "мука", "рис", "гречка", "макароны",
+    "шоколад", "печенье", "вафли", "сок", "яблочный", "апельсиновый", "вода", "газированная", "пиво", "квас",
+]
+
+CASHBOX_ID = 1
+
+
+async def prepare(conn: asyncpg.Connection, size: int, cashboxes: int):
+    await conn.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    await conn.execute("DROP TABLE IF EXISTS bench_nomenclature_barcodes")
+    await conn.execute("DROP TABLE IF EXISTS bench_nomenclature")
+    await conn.execute("""
+        CREATE TEMP TABLE bench_nomenclature (
+            id serial PRIMARY KEY,
+            cashbox integer,
+            name varchar,
+            is_deleted boolean
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO bench_nomenclature (cashbox, name, is_deleted)
+        SELECT
+            1 + (random() * ($2 - 1))::int,
+            ($1::text[])[1 + (random() * (array_length($1::text[], 1) - 1))::int] || ' '
+                || ($1::text[])[1 + (random() * (array_length($1::text[], 1) - 1))::int] || ' '
+                || (random() * 1000)::int,
+            random() < 0.02
+        FROM generate_series(1, $3)
+    """, WORDS, cashboxes, size)
+    await conn.execute("""
+        CREATE TEMP TABLE bench_nomenclature_barcodes (
+            id serial PRIMARY KEY,
+            nomenclature_id integer,
+            code varchar
+        )
+    """)
+    await conn.execute("""
+        INSERT INTO bench_nomenclature_barcodes (nomenclature_id, code)
+        SELECT id, lpad((4600000000000 + id)::text, 13, '0') FROM bench_nomenclature
+    """)
+    await conn.execute("CREATE INDEX ON bench_nomenclature (cashbox)")
+    await conn.execute("CREATE INDEX ON bench_nomenclature_barcodes (nomenclature_id)")
+    await conn.execute("ANALYZE bench_nomenclature")
+    await conn.execute("ANALYZE bench_nomenclature_barcodes")
+
+
+async def create_search_indexes(conn: asyncpg.Connection):
+    await conn.execute("CREATE INDEX ON bench_nomenclature USING gin (name gin_trgm_ops)")
+    await conn.execute("CREATE INDEX ON bench_nomenclature_barcodes USING gin (code gin_trgm_ops)")
+    await conn.execute("CREATE INDEX ON bench_nomenclature_barcodes ((lower(regexp_replace(code, '\\s', '', 'g'))))")
+    await conn.execute("ANALYZE bench_nomenclature")
+    await conn.execute("ANALYZE bench_nomenclature_barcodes")
+
+
+async def name_ilike(conn: asyncpg.Connection, term: str, limit: int):
+    return await conn.fetch("""
+        SELECT id, name FROM bench_nomenclature
+        WHERE cashbox = $1 AND is_deleted IS NOT TRUE AND name ILIKE '%' || $2 || '%'
+        ORDER BY id DESC
+        LIMIT $3
+    """, CASHBOX_ID, term, limit)
+
+
+async def name_ranked(conn: asyncpg.Connection, term: str, limit: int):
+    return await conn.fetch("""
+        SELECT id, name FROM bench_nomenclature
+        WHERE cashbox = $1 AND is_deleted IS NOT TRUE AND name ILIKE '%' || $2 || '%'
+        ORDER BY CASE WHEN name ILIKE $2 || '%' THEN 0 ELSE 1 END,
+                 similarity(name, $2) DESC, length(name), name
+        LIMIT $3
+    """, CASHBOX_ID, term, limit)
+
+
+async def barcode_ilike(conn: asyncpg.Connection, code: str, limit: int):
+    return await conn.fetch("""
+        SELECT n.id FROM bench_nomenclature n
+        WHERE n.id IN (SELECT nomenclature_id FROM bench_nomenclature_barcodes WHERE code ILIKE '%' || $1 || '%')
+        LIMIT $2
+    """, code, limit)
+
+
+async def barcode_exact(conn: asyncpg.Connection, code: str, limit: int):
+    return await conn.fetch("""
+        SELECT n.id FROM bench_nomenclature n
+        WHERE n.id IN (SELECT nomenclature_id FROM bench_nomenclature_barcodes WHERE lower(regexp_replace(code, '\\s', '', 'g')) = $1)
+        LIMIT $2
+    """, code, limit)
+
+
+async def measure(func, *args, runs: int):
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await func(*args)
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[max(0, int(len(timings) * 0.95) - 1)]
+
+
+async def run_cases(conn: asyncpg.Connection, term: str, code: str, limit: int, runs: int):
+    return [
+        ("name ILIKE", await measure(name_ilike, conn, term, limit, runs=runs)),
+        ("name ranked", await measure(name_ranked, conn, term, limit, runs=runs)),
+        ("barcode ILIKE", await measure(barcode_ilike, conn, code, limit, runs=runs)),
+        ("barcode exact", await measure(barcode_exact, conn, code, limit, runs=runs)),
+    ]
+
+
+def lpad_code(nomenclature_id: int) -> str:
+    return str(4600000000000 + nomenclature_id).rjust(13, "0")
+
+
+async def main(sizes, cashboxes: int, term: str, limit: int, runs: int):
+    conn = await asyncpg.connect(SQLALCHEMY_DATABASE_URL)
+    try:
+        print(f"term={term!r}, cashboxes={cashboxes}, limit={limit}, runs={runs}")
+        print(f"{'rows':>10} | {'case':<14} | {'no index p50/p95, ms':>22} | {'trgm/btree p50/p95, ms':>24}")
+        for size in sizes:
+            await prepare(conn, size, cashboxes)
+            code = lpad_code(size // 2)
+            before = await run_cases(conn, term, code, limit, runs)
+            await create_search_indexes(conn)
+            after = await run_cases(conn, term, code, limit, runs)
+            for (case_name, (b50, b95)), (_, (a50, a95)) in zip(before, after):
+                print(f"{size:>10} | {case_name:<14} | {b50:>10.2f} / {b95:<9.2f} | {a50:>11.2f} / {a95:<10.2f}")
+    finally:
+        await conn.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark trigram search over nomenclature catalogues")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100_000, 1_000_000])
+    parser.add_argument("--cashboxes", type=int, default=50)
+    parser.add_argument("--term", default="кефир")
+    parser.add_argument("--limit", type=int, default=20)
+    parser.add_argument("--runs", type=int, default=20)
+    args = parser.parse_args()
+
+    asyncio.run(main(args.sizes, args.cashboxes, args.term, args.limit, args.runs))
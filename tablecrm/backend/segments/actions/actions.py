@@ -1,31 +1,29 @@
-import asyncio
 import json
 import logging
 from datetime import datetime
 from typing import List
 
-from common.apple_wallet_service.impl.WalletNotificationService import WalletNotificationService
-from common.apple_wallet_service.impl.WalletPassService import WalletPassGeneratorService
+from api.apple_wallet.utils import update_apple_wallet_passes
 from database.db import (
     database, segments, tags, contragents_tags, SegmentObjectType, users,
     users_cboxes_relation, docs_sales, docs_sales_tags, employee_shifts,
     contragents, loyality_cards, loyality_transactions
 )
-from sqlalchemy import select, and_, func, literal, or_, update
+from sqlalchemy import select, and_, func, literal, or_, update, exists, values, column, String, BigInteger
 from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.sql import Select
 
 from segments.actions.segment_tg_notification import send_segment_notification
 from segments.masks import replace_masks
 
-from segments.helpers.collect_obj_ids import collect_objects
+from segments.helpers.collect_obj_ids import collect_objects, segment_objects_query
 
 from segments.constants import SegmentChangeType
 
 from segments.helpers.functions import create_replacements
 
-from api.loyality_transactions.routers import raschet_bonuses
 
-from segments.helpers.http_client import HttpClient
+from segments.actions.outbound_campaigns import outbound_campaigns, WA_ACTION, HTTP_ACTION
 
 logger = logging.getLogger(__name__)
 
@@ -36,15 +34,18 @@ class SegmentActions:
         self.ACTIONS = {
             "add_existed_tags": {
                 "obj_type": SegmentObjectType.contragents.value,
-                "method": self.add_existed_tags
+                "method": self.add_existed_tags,
+                "set_based": True,
             },
             "remove_tags": {
                 "obj_type": SegmentObjectType.contragents.value,
-                "method": self.remove_tags
+                "method": self.remove_tags,
+                "set_based": True,
             },
             "client_tags": {
                 "obj_type": SegmentObjectType.contragents.value,
-                "method": self.client_tags
+                "method": self.client_tags,
+                "set_based": True,
             },
             "send_tg_notification": {
                 "obj_type": SegmentObjectType.docs_sales.value,
@@ -52,19 +53,23 @@ class SegmentActions:
             },
             "add_docs_sales_tags": {
                 "obj_type": SegmentObjectType.docs_sales.value,
-                "method": self.add_docs_sales_tags
+                "method": self.add_docs_sales_tags,
+                "set_based": True,
             },
             "remove_docs_sales_tags": {
                 "obj_type": SegmentObjectType.docs_sales.value,
-                "method": self.remove_docs_sales_tags
+                "method": self.remove_docs_sales_tags,
+                "set_based": True,
             },
             "transform_loyality_card": {
                 "obj_type": SegmentObjectType.contragents.value,
-                "method": self.transform_loyality_card
+                "method": self.transform_loyality_card,
+                "set_based": True,
             },
             "add_loyality_transaction": {
                 "obj_type": SegmentObjectType.contragents.value,
-                "method": self.add_loyality_transaction
+                "method": self.add_loyality_transaction,
+                "set_based": True,
             },
             "send_wa_notification": {
                 "obj_type": SegmentObjectType.docs_sales.value,
@@ -80,13 +85,18 @@ class SegmentActions:
         self.segment_obj = await database.fetch_one(
             segments.select().where(segments.c.id == self.segment_obj.id))
 
-    async def run(self, action: str, ids: List[int],
+    async def run(self, action: str, ids,
                   data: dict = None):
         """Метод для выполения action"""
         await self.ACTIONS[action]["method"](ids, data)
 
     async def start_actions(self):
-        """Метод для запуска actions"""
+        """
+        Метод для запуска actions.
+
+        Для set-based действий передаётся не список id, а Select по segment_objects,
+        который подставляется прямо в SQL действия.
+        """
         await self.refresh_segment_obj()
         if self.segment_obj.actions is None:
             return
@@ -98,52 +108,61 @@ class SegmentActions:
                 continue
             if v.get('trigger_on_new'):
                 del v['trigger_on_new']
-                ids = await collect_objects(self.segment_obj.id, self.ACTIONS[k]["obj_type"],
-                                            SegmentChangeType.new.value)
+                mode = SegmentChangeType.new.value
             elif v.get('trigger_on_removed'):
-                ids = await collect_objects(self.segment_obj.id, self.ACTIONS[k]["obj_type"],
-                                            SegmentChangeType.removed.value)
                 del v['trigger_on_removed']
+                mode = SegmentChangeType.removed.value
             else:
-                ids = await collect_objects(
-                    self.segment_obj.id,
-                    self.ACTIONS[k]["obj_type"],
-                    SegmentChangeType.active.value)
+                mode = SegmentChangeType.active.value
+            if self.ACTIONS[k].get("set_based"):
+                await self.run(k, segment_objects_query(self.segment_obj.id, self.ACTIONS[k]["obj_type"], mode), v)
+                continue
+            ids = await collect_objects(self.segment_obj.id, self.ACTIONS[k]["obj_type"], mode)
             if ids:
                 await self.run(k, ids, v)
         return
 
-    async def add_existed_tags(self, contragents_ids: List[int], data: dict):
+    def _object_ids(self, ids) -> Select:
+        """Select id объектов: ids — либо Select по segment_objects, либо список id."""
+        if isinstance(ids, Select):
+            return ids
+        return select(
+            values(column("object_id", BigInteger), name="ids").data([(i,) for i in ids])
+        )
+
+    def _cashbox_tag_ids(self, tag_names: List[str]) -> Select:
+        return select(tags.c.id).where(
+            tags.c.name.in_(tag_names), tags.c.cashbox_id == self.segment_obj.cashbox_id
+        )
+
+    async def add_existed_tags(self, contragents_ids, data: dict):
         tag_names = data.get("name", [])
-        query = select(tags.c.id).where(
-            and_(tags.c.name.in_(tag_names), tags.c.cashbox_id == self.segment_obj.cashbox_id))
-        rows = await database.fetch_all(query)
-        tag_ids = [row.id for row in rows]
-        new_values = []
-        for tag_id in tag_ids:
-            for contragent_id in contragents_ids:
-                new_values.append(
-                    {"contragent_id": contragent_id, "tag_id": tag_id, "cashbox_id": self.segment_obj.cashbox_id})
-        if not new_values:
+        if not tag_names:
             return
-        query = insert(contragents_tags).values(new_values)
-        query = query.on_conflict_do_nothing(
+        object_ids = self._object_ids(contragents_ids).subquery("objects")
+        query = insert(contragents_tags).from_select(
+            ["contragent_id", "tag_id", "cashbox_id"],
+            select(contragents.c.id, tags.c.id, literal(self.segment_obj.cashbox_id))
+            .select_from(object_ids)
+            .join(contragents, contragents.c.id == object_ids.c.object_id)
+            .join(tags, and_(tags.c.name.in_(tag_names), tags.c.cashbox_id == self.segment_obj.cashbox_id))
+        ).on_conflict_do_nothing(
             index_elements=["tag_id", "contragent_id"]  # <- уникальная пара
         )
         await database.execute(query)
 
-    async def remove_tags(self, contragents_ids: List[int], data: dict):
+    async def remove_tags(self, contragents_ids, data: dict):
         tag_names = data.get("name", [])
-        query = select(tags.c.id).where(tags.c.name.in_(tag_names), tags.c.cashbox_id == self.segment_obj.cashbox_id)
-        rows = await database.fetch_all(query)
-        tag_ids = [row.id for row in rows]
         query = (
             contragents_tags.delete()
-            .where(contragents_tags.c.tag_id.in_(tag_ids), contragents_tags.c.contragent_id.in_(contragents_ids))
+            .where(
+                contragents_tags.c.tag_id.in_(self._cashbox_tag_ids(tag_names)),
+                contragents_tags.c.contragent_id.in_(self._object_ids(contragents_ids))
+            )
         )
         await database.execute(query)
 
-    async def client_tags(self, contragents_ids: List[int], data: dict):
+    async def client_tags(self, contragents_ids, data: dict):
         names = []
         prepared_data = []
         tags_data = data.get("tags", [])
@@ -309,26 +328,29 @@ class SegmentActions:
         rows = await database.fetch_all(query)
         return [row.chat_id for row in rows]
 
-    async def add_docs_sales_tags(self, docs_ids: List[int], data: dict):
-
-        tags = data.get("tags")
-        prepared_data = []
-
-        for doc_id in docs_ids:
-            for tag in set(tags):
-                prepared_data.append({
-                    "docs_sales_id": doc_id,
-                    "name": tag
-                })
-
-        if prepared_data:
-            query = insert(docs_sales_tags).values(prepared_data)
-            await database.execute(query)
+    async def add_docs_sales_tags(self, docs_ids, data: dict):
+        tag_names = list(set(data.get("tags") or []))
+        if not tag_names:
+            return
+        object_ids = self._object_ids(docs_ids).subquery("objects")
+        tag_values = values(column("name", String), name="new_tags").data([(name,) for name in tag_names])
+        query = insert(docs_sales_tags).from_select(
+            ["docs_sales_id", "name"],
+            select(docs_sales.c.id, tag_values.c.name)
+            .select_from(object_ids)
+            .join(docs_sales, docs_sales.c.id == object_ids.c.object_id)
+            .join(tag_values, literal(True))
+            .where(~exists().where(
+                docs_sales_tags.c.docs_sales_id == docs_sales.c.id,
+                docs_sales_tags.c.name == tag_values.c.name,
+            ))
+        )
+        await database.execute(query)
 
-    async def remove_docs_sales_tags(self, docs_ids: List[int], data: dict):
+    async def remove_docs_sales_tags(self, docs_ids, data: dict):
         tags = data.get("tags")
         query = docs_sales_tags.delete().where(and_(
-            docs_sales_tags.c.docs_sales_id.in_(docs_ids),
+            docs_sales_tags.c.docs_sales_id.in_(self._object_ids(docs_ids)),
             docs_sales_tags.c.name.in_(tags)
         ))
 
@@ -341,60 +363,15 @@ class SegmentActions:
         if not docs_ids or not all([message, wappi_token, wappi_profile_id]):
             return False
 
-        for idx in docs_ids:
-            query = (
-                select(contragents)
-                .join(docs_sales, docs_sales.c.contragent == contragents.c.id)
-                .where(docs_sales.c.id == idx, contragents.c.phone.isnot(None))
-            )
-            contragent = await database.fetch_one(query)
-            if not contragent:
-                continue
-            replacements = await create_replacements(idx)
-            message_text = replace_masks(message, replacements)
+        await outbound_campaigns.start(self.segment_obj.id, WA_ACTION, docs_ids, data)
 
-            url = f"https://wappi.pro/api/sync/message/send?profile_id={wappi_profile_id}"
-            headers = {"Authorization": f"{wappi_token}"}
-            d = {
-                "body": message_text, "recipient": contragent.phone}
+    async def do_http_request(self, docs_ids: List[int], data: dict):
+        if not docs_ids or not data.get("url") or not data.get("method"):
+            return False
 
-            async with HttpClient() as client:
-                status, response = await client.post(url, headers=headers, data=d)
-                print("Status:", status)
-            await asyncio.sleep(data["sleep"])
+        await outbound_campaigns.start(self.segment_obj.id, HTTP_ACTION, docs_ids, data)
 
-    async def do_http_request(self, docs_ids: List[int], data: dict):
-        for idx in docs_ids:
-            replacements = await create_replacements(idx)
-            data = replace_masks(data, replacements)
-            url = data["url"]
-            if data.get("params"):
-                url = data["url"] + "?" + "&".join([f"{k}={v}" for k, v in data["params"].items()])
-            async with HttpClient() as client:
-                try:
-
-                    method = data["method"].lower()
-
-                    if method == "get":
-                        status, response = await client.get(
-                            url=url,
-                            headers=data.get("headers"),
-                        )
-                    else:
-                        status, response = await getattr(client, method)(
-                            url=url,
-                            headers=data.get("headers"),
-                            data=data.get("body"),
-                        )
-
-                    logger.info(f"Status for contragent {idx}: {status}")
-                    if status not in [200, 201]:
-                        logger.info(f"Response for contragent {idx}: {response}")
-                except Exception as e:
-                    logger.error(e)
-            await asyncio.sleep(data["sleep"])
-
-    async def transform_loyality_card(self, contragents_ids: List[int], data: dict):
+    async def transform_loyality_card(self, contragents_ids, data: dict):
         fields_for_update = {}
         if data.get("cashback_percent"):
             fields_for_update["cashback_percent"] = data.get("cashback_percent")
@@ -406,48 +383,44 @@ class SegmentActions:
             fields_for_update["tags"] = data.get("tag")
         if data.get('apple_wallet_advertisement'):
             fields_for_update["apple_wallet_advertisement"] = data.get("apple_wallet_advertisement")
+        if not fields_for_update:
+            return
 
         query = update(loyality_cards).where(
-            loyality_cards.c.contragent_id.in_(contragents_ids),
-            loyality_cards.c.cashbox_id == self.segment_obj.cashbox_id
-        ).values(**fields_for_update)
-
-        await database.execute(query)
-
-        apple_notification_service = WalletNotificationService()
-        apple_wallet_service = WalletPassGeneratorService()
-
-        loyality_ids_query = select(loyality_cards.c.id).where(
-            loyality_cards.c.contragent_id.in_(contragents_ids),
+            loyality_cards.c.contragent_id.in_(self._object_ids(contragents_ids)),
             loyality_cards.c.cashbox_id == self.segment_obj.cashbox_id
+        ).values(**fields_for_update).returning(loyality_cards.c.id)
+
+        loyality_ids = [row.id for row in await database.fetch_all(query)]
+        await self._update_wallet_passes(loyality_ids)
+
+    async def _update_wallet_passes(self, card_ids: List[int]):
+        """Обновление пассов раздаётся воркеру через RabbitMQ; без брокера — обновляем на месте."""
+        await update_apple_wallet_passes(card_ids)
+
+    async def add_loyality_transaction(self, contragents_ids, data: dict):
+        name = data.get("comment") or "Обновление условий карты лояльности"
+        transactions = (
+            select(
+                literal("accrual" if data.get("direction") == "plus" else "withdraw").label("type"),
+                literal(data.get("amount")).label("amount"),
+                literal(name).label("name"),
+                literal(False).label("is_deleted"),
+                literal(True).label("status"),
+                literal(self.segment_obj.cashbox_id).label("cashbox"),
+                loyality_cards.c.id,
+                loyality_cards.c.card_number,
+            )
+            .where(
+                loyality_cards.c.contragent_id.in_(self._object_ids(contragents_ids)),
+                loyality_cards.c.cashbox_id == self.segment_obj.cashbox_id
+            )
         )
-        loyality_ids = [i.id for i in (await database.fetch_all(loyality_ids_query))]
-        for card_id in loyality_ids:
-            await apple_wallet_service.update_pass(card_id)
-            await apple_notification_service.ask_update_pass(card_id)
-
-
-    async def add_loyality_transaction(self, contragents_ids: List[int], data: dict):
-        insert_data = {}
-        insert_data["amount"] = data.get("amount")
-        insert_data["type"] = "accrual" if data.get("direction") == "plus" else "withdraw"
-        if data.get("comment"):
-            insert_data["name"] = data.get("comment")
-        else:
-            insert_data["name"] = "Обновление условий карты лояльности"
-        insert_data["is_deleted"] = False
-        insert_data["status"] = True
-        insert_data["cashbox"] = self.segment_obj.cashbox_id
-
-        query = select(loyality_cards).where(
-            loyality_cards.c.contragent_id.in_(contragents_ids),
-            loyality_cards.c.cashbox_id == self.segment_obj.cashbox_id
+        query = insert(loyality_transactions).from_select(
+            ["type", "amount", "name", "is_deleted", "status", "cashbox",
+             "loyality_card_id", "loyality_card_number"],
+            transactions
         )
-        cards = await database.fetch_all(query)
-        for card in cards:
-            insert_data["loyality_card_id"] = card.id
-            insert_data["loyality_card_number"] = card.card_number
-            await database.execute(
-                loyality_transactions.insert().values(insert_data)
-            )
-            await asyncio.gather(asyncio.create_task(raschet_bonuses(card.id)))
+
+        # балансы карт обновляет триггер на loyality_transactions в той же транзакции
+        await database.execute(query)
@@ -0,0 +1,188 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+from typing import List, Optional
+
+from sqlalchemy import select, func, or_
+
+from database.db import database, segment_action_runs, docs_sales, contragents
+from functions.db_connections import in_own_connection
+from segments.helpers.functions import create_replacements_many
+from segments.helpers.outbound import OutboundExecutor, outbound_executor
+from segments.logger import logger
+from segments.masks import replace_masks, collect_mask_keys
+
+WA_ACTION = "send_wa_notification"
+HTTP_ACTION = "do_http_request"
+
+
+class OutboundCampaigns:
+    """
+    Фоновые рассылки действий сегментов (WhatsApp, HTTP-запросы).
+
+    Список id снимается в segment_action_runs при запуске, дальше документы
+    обрабатываются пачками: подстановки для пачки загружаются разом, запросы
+    идут параллельно через OutboundExecutor, после каждой пачки сохраняется
+    курсор. Аренда продлевается фоном каждые lease_seconds / 3 в своём
+    соединении, независимо от длины пачки при медленном rate; если её
+    перехватил другой процесс, рассылка останавливается. Если процесс упал,
+    аренда истекает и resume_stale подхватывает рассылку с сохранённого
+    курсора (повторно может уйти не больше одной пачки).
+    """
+
+    def __init__(
+            self,
+            executor: OutboundExecutor = outbound_executor,
+            batch_size: int = int(os.getenv("SEGMENT_OUTBOUND_BATCH_SIZE", 50)),
+            lease_seconds: int = int(os.getenv("SEGMENT_OUTBOUND_LEASE_SECONDS", 600)),
+    ):
+        self.executor = executor
+        self.batch_size = batch_size
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._tasks = set()
+
+    def _lease_until(self):
+        return func.now() + func.make_interval(0, 0, 0, 0, 0, 0, self.lease_seconds)
+
+    def _spawn(self, run_id: int):
+        task = in_own_connection(self.process(run_id))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start(self, segment_id: int, action: str, object_ids: List[int], params: dict) -> int:
+        """Сохраняет рассылку и запускает её в фоне, не блокируя пересчёт сегмента."""
+        run_id = await database.execute(
+            segment_action_runs.insert().values(
+                segment_id=segment_id,
+                action=action,
+                params=params,
+                object_ids=list(object_ids),
+                lease_owner=self.owner,
+                lease_until=self._lease_until(),
+            )
+        )
+        self._spawn(run_id)
+        return run_id
+
+    async def resume_stale(self) -> int:
+        """Забирает незавершённые рассылки с истёкшей арендой."""
+        rows = await database.fetch_all(
+            segment_action_runs.update()
+            .where(
+                segment_action_runs.c.is_finished.is_(False),
+                or_(segment_action_runs.c.lease_until.is_(None), segment_action_runs.c.lease_until < func.now()),
+            )
+            .values(lease_owner=self.owner, lease_until=self._lease_until())
+            .returning(segment_action_runs.c.id)
+        )
+        for row in rows:
+            logger.info(f"Resuming segment action run {row.id}")
+            self._spawn(row.id)
+        return len(rows)
+
+    async def _save(self, run_id: int, **values) -> bool:
+        """Сохраняет прогресс; False — аренду перехватил другой процесс."""
+        row = await database.fetch_one(
+            segment_action_runs.update()
+            .where(segment_action_runs.c.id == run_id, segment_action_runs.c.lease_owner == self.owner)
+            .values(lease_until=self._lease_until(), **values)
+            .returning(segment_action_runs.c.id)
+        )
+        return row is not None
+
+    async def _heartbeat(self, run_id: int, worker: asyncio.Task):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            if not await self._save(run_id):
+                logger.warning(f"Segment action run {run_id} lease lost, stopping")
+                worker.cancel()
+                return
+
+    async def _phones(self, docs_ids: List[int]) -> dict:
+        rows = await database.fetch_all(
+            select(docs_sales.c.id, contragents.c.phone)
+            .join(contragents, docs_sales.c.contragent == contragents.c.id)
+            .where(docs_sales.c.id.in_(docs_ids), contragents.c.phone.isnot(None))
+        )
+        return {row.id: row.phone for row in rows}
+
+    @staticmethod
+    def _rate(params: dict) -> Optional[float]:
+        """rate_per_second из действия; иначе прежний интервал sleep между запросами."""
+        if params.get("rate_per_second"):
+            return float(params["rate_per_second"])
+        if params.get("sleep"):
+            return 1 / float(params["sleep"])
+        return None
+
+    async def _send_wa(self, params: dict, replacements: dict, phone: Optional[str]) -> Optional[bool]:
+        if not phone:
+            return None
+        status, _ = await self.executor.request(
+            "POST",
+            f"https://wappi.pro/api/sync/message/send?profile_id={params['wappi_profile_id']}",
+            headers={"Authorization": f"{params['wappi_token']}"},
+            json={"body": replace_masks(params["message"], replacements), "recipient": phone},
+            rate=self._rate(params),
+            rate_key=params["wappi_profile_id"],
+        )
+        return status is not None and status < 400
+
+    async def _send_http(self, idx: int, params: dict, replacements: dict) -> bool:
+        data = replace_masks(params, replacements)
+        url = data["url"]
+        if data.get("params"):
+            url = data["url"] + "?" + "&".join([f"{k}={v}" for k, v in data["params"].items()])
+        method = data["method"].upper()
+        status, response = await self.executor.request(
+            method,
+            url,
+            headers=data.get("headers"),
+            json=None if method == "GET" else data.get("body"),
+            rate=self._rate(params),
+        )
+        logger.info(f"Status for docs_sales {idx}: {status}")
+        if status not in [200, 201]:
+            logger.info(f"Response for docs_sales {idx}: {response}")
+        return status is not None and status < 400
+
+    async def process(self, run_id: int):
+        run = await database.fetch_one(segment_action_runs.select().where(segment_action_runs.c.id == run_id))
+        if not run or run.is_finished:
+            return
+        params = run.params if isinstance(run.params, dict) else json.loads(run.params)
+        ids = list(run.object_ids)
+        cursor, sent, failed = run.cursor, run.sent_count, run.failed_count
+        is_wa = run.action == WA_ACTION
+        keys = collect_mask_keys(params.get("message") if is_wa else params)
+
+        heartbeat = in_own_connection(self._heartbeat(run_id, asyncio.current_task()))
+        try:
+            while cursor < len(ids):
+                batch = ids[cursor:cursor + self.batch_size]
+                replacements = await create_replacements_many(batch, keys)
+                if is_wa:
+                    phones = await self._phones(batch)
+                    tasks = [self._send_wa(params, replacements.get(idx, {}), phones.get(idx)) for idx in batch]
+                else:
+                    tasks = [self._send_http(idx, params, replacements.get(idx, {})) for idx in batch]
+                results = await asyncio.gather(*tasks)
+                sent += results.count(True)
+                failed += results.count(False)
+                cursor += len(batch)
+                if not await self._save(run_id, cursor=cursor, sent_count=sent, failed_count=failed):
+                    logger.warning(f"Segment action run {run_id} lease lost, stopping")
+                    return
+            await self._save(run_id, is_finished=True, lease_owner=None)
+            logger.info(f"Segment action run {run_id} finished: sent {sent}, failed {failed}")
+        except Exception as e:
+            # аренда истечёт, и рассылку продолжит resume_stale с сохранённого курсора
+            logger.exception(f"Segment action run {run_id} interrupted at {cursor}/{len(ids)}: {e}")
+        finally:
+            heartbeat.cancel()
+
+
+outbound_campaigns = OutboundCampaigns()
@@ -1,7 +1,19 @@
 import enum
+import os
 
 
 class SegmentChangeType(enum.Enum):
     new = "new"
     active = "active"
     removed = "removed"
+
+
+# Полный пересчёт сегмента выполняется не реже этого интервала (сверка инкрементальных дельт)
+SEGMENT_FULL_RECALC_HOURS = int(os.getenv("SEGMENT_FULL_RECALC_HOURS", 24))
+# Сколько хранится журнал segment_changes
+SEGMENT_CHANGES_RETENTION_HOURS = int(os.getenv("SEGMENT_CHANGES_RETENTION_HOURS", 48))
+
+# Параллельный пересчёт сегментов
+SEGMENT_WORKERS = int(os.getenv("SEGMENT_WORKERS", 4))
+SEGMENT_MAX_PER_CASHBOX = int(os.getenv("SEGMENT_MAX_PER_CASHBOX", 1))
+SEGMENT_LEASE_SECONDS = int(os.getenv("SEGMENT_LEASE_SECONDS", 600))
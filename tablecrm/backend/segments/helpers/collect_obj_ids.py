@@ -7,9 +7,10 @@ from database.db import (
 from segments.constants import SegmentChangeType
 
 
-async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
+def segment_objects_query(segment_id, obj_type: SegmentObjectType, mode: str):
     """
-    Получение списка id объектов в сегменте.
+    Select id объектов в сегменте для использования в set-based запросах
+    (INSERT ... SELECT, IN (SELECT ...)) без выгрузки id в Python.
     """
 
     base_condition = [
@@ -33,11 +34,28 @@ async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str):
         base_condition.append(
             segment_objects.c.valid_to >= segments.c.updated_at)
 
-    query = (
+    return (
         select(segment_objects.c.object_id)
         .join(segments, segment_objects.c.segment_id == segments.c.id)
         .where(and_(*base_condition))
     )
-    rows = await database.fetch_all(query)
-    obj_ids = [row["object_id"] for row in rows]
+
+
+async def collect_objects(segment_id, obj_type: SegmentObjectType, mode: str, object_ids=None):
+    """
+    Получение списка id объектов в сегменте.
+    object_ids ограничивает выборку указанными объектами (инкрементальный пересчёт).
+    """
+    query = segment_objects_query(segment_id, obj_type, mode)
+    if object_ids is None:
+        rows = await database.fetch_all(query)
+        return [row["object_id"] for row in rows]
+
+    object_ids = list(object_ids)
+    obj_ids = []
+    for i in range(0, len(object_ids), 30000):
+        rows = await database.fetch_all(
+            query.where(segment_objects.c.object_id.in_(object_ids[i:i + 30000]))
+        )
+        obj_ids.extend(row["object_id"] for row in rows)
     return obj_ids
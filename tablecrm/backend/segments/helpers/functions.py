@@ -1,5 +1,6 @@
 import asyncio
 import json
+from typing import Dict, Iterable, Optional
 
 from api.docs_sales.api.routers import generate_and_save_order_links
 
@@ -11,6 +12,36 @@ from database.db import (
 from sqlalchemy import select, func
 
 
+# Какие маски заполняет каждая группа подстановок
+REPLACEMENT_GROUPS = {
+    "order": {"order_status", "picker_name", "courier_name"},
+    "warehouse": {"warehouse_name", "warehouse_address", "warehouse_phone"},
+    "manager": {"manager_name", "manager_phone"},
+    "goods": {"goods", "goods_count", "order_sum"},
+    "links": {"general", "picker", "courier"},
+    "delivery": {
+        "delivery_address", "delivery_note", "delivery_date",
+        "delivery_recipient_name", "delivery_recipient_phone",
+    },
+    "contragent": {"contragent_name", "contragent_phone", "contragent_inn"},
+    "card": {
+        "card_number", "card_balance", "card_income", "card_outcome", "card_cashback_percent",
+        "card_minimal_checque_amount", "card_max_percentage", "card_max_withdraw_percentage",
+    },
+}
+
+ORDER_STATUSES = {
+    "received": "Получен",
+    "processed": "Обработан",
+    "collecting": "Собирается",
+    "collected": "Собран",
+    "picked": "Назначен доставщик",
+    "delivered": "Доставлен",
+    "closed": "Закрыт",
+    "success": "Успешно"
+}
+
+
 def format_contragent_text_notifications(action: str, segment_name: str, name: str, phone: str):
     if action == "new_contragent":
         header = "Новый пользователь добавлен в сегмент!"
@@ -57,16 +88,7 @@ async def order_info_to_replacements(replacements: dict, order_id: int):
     if not order:
         return
 
-    order_statuses = {
-        "received": "Получен",
-        "processed": "Обработан",
-        "collecting": "Собирается",
-        "collected": "Собран",
-        "picked": "Назначен доставщик",
-        "delivered": "Доставлен",
-        "closed": "Закрыт",
-        "success": "Успешно"
-    }
+    order_statuses = ORDER_STATUSES
     if order.order_status:
         data["order_status"] = order_statuses[order.order_status] if order.order_status in order_statuses else order.status
 
@@ -225,3 +247,155 @@ async def add_loyality_card_info_to_replacements(replacements: dict, contragent_
         data["card_max_percentage"] = card.max_percentage
         data["card_max_withdraw_percentage"] = card.max_withdraw_percentage
     replacements.update(data)
+
+
+def _user_full_name(user) -> str:
+    name = ""
+    if user.first_name:
+        name += f"{user.first_name} "
+    if user.last_name:
+        name += f"{user.last_name}"
+    return name
+
+
+async def create_replacements_many(order_ids: Iterable[int], keys: Optional[set] = None) -> Dict[int, dict]:
+    """
+    Подстановки для пачки заказов: по одному запросу на группу вместо
+    отдельного набора запросов на каждый заказ (см. create_replacements).
+    keys — маски шаблона; группы, чьи маски в шаблоне не встречаются, не загружаются.
+    """
+    order_ids = list(set(order_ids))
+    replacements = {order_id: {} for order_id in order_ids}
+    if not order_ids:
+        return replacements
+
+    def needed(group: str) -> bool:
+        return keys is None or bool(keys & REPLACEMENT_GROUPS[group])
+
+    orders = {
+        row.id: row for row in await database.fetch_all(docs_sales.select().where(docs_sales.c.id.in_(order_ids)))
+    }
+
+    if needed("order"):
+        relation_ids = {o.assigned_picker for o in orders.values()} | {o.assigned_courier for o in orders.values()}
+        relation_ids.discard(None)
+        names = {}
+        if relation_ids:
+            rows = await database.fetch_all(
+                select(users.c.first_name, users.c.last_name, users_cboxes_relation.c.id.label("relation_id"))
+                .join(users_cboxes_relation, users_cboxes_relation.c.user == users.c.id)
+                .where(users_cboxes_relation.c.id.in_(relation_ids))
+            )
+            names = {row.relation_id: _user_full_name(row) for row in rows}
+        for order_id, order in orders.items():
+            data = replacements[order_id]
+            if order.order_status:
+                data["order_status"] = ORDER_STATUSES.get(order.order_status, order.status)
+            if order.assigned_picker in names:
+                data["picker_name"] = names[order.assigned_picker]
+            if order.assigned_courier in names:
+                data["courier_name"] = names[order.assigned_courier]
+
+    if needed("warehouse"):
+        warehouse_ids = {o.warehouse for o in orders.values() if o.warehouse}
+        rows = await database.fetch_all(warehouses.select().where(warehouses.c.id.in_(warehouse_ids))) if warehouse_ids else []
+        by_id = {row.id: row for row in rows}
+        for order_id, order in orders.items():
+            row = by_id.get(order.warehouse)
+            if not row:
+                continue
+            for key, value in (("warehouse_name", row.name), ("warehouse_address", row.address), ("warehouse_phone", row.phone)):
+                if value:
+                    replacements[order_id][key] = value
+
+    if needed("manager"):
+        # тот же запрос, что и в add_manager_info_to_replacements, — от заказа не зависит
+        user = await database.fetch_one(
+            users.select().join(users_cboxes_relation, users_cboxes_relation.c.user == users.c.id)
+        )
+        if user:
+            data = {"manager_name": _user_full_name(user)}
+            if user.phone_number:
+                data["manager_phone"] = user.phone_number
+            for order_id in orders:
+                replacements[order_id].update(data)
+
+    if needed("goods"):
+        rows = await database.fetch_all(
+            select(
+                docs_sales_goods.c.docs_sales_id, nomenclature.c.name, docs_sales_goods.c.price,
+                docs_sales_goods.c.quantity, units.c.convent_national_view
+            )
+            .select_from(docs_sales_goods)
+            .outerjoin(nomenclature, docs_sales_goods.c.nomenclature == nomenclature.c.id)
+            .outerjoin(units, docs_sales_goods.c.unit == units.c.id)
+            .where(docs_sales_goods.c.docs_sales_id.in_(order_ids))
+        )
+        for good in rows:
+            data = replacements[good.docs_sales_id]
+            data.setdefault("goods", "")
+            data["goods"] += (
+                f"{good.name} - {good.quantity} "
+                f"{good.convent_national_view if good.convent_national_view  else ''}"
+                f" x {good.price} р = {good.quantity * good.price} р\n"
+            )
+            data["goods_count"] = data.get("goods_count", 0) + 1
+            data["order_sum"] = data.get("order_sum", 0) + good.quantity * good.price
+
+    if needed("links"):
+        await asyncio.gather(*(link_replacements(replacements[order_id], order_id) for order_id in orders))
+
+    if needed("delivery"):
+        rows = await database.fetch_all(
+            docs_sales_delivery_info.select().where(docs_sales_delivery_info.c.docs_sales_id.in_(order_ids))
+        )
+        for delivery_info in rows:
+            data = replacements[delivery_info.docs_sales_id]
+            if delivery_info.address:
+                data["delivery_address"] = delivery_info.address
+            if delivery_info.note:
+                data["delivery_note"] = delivery_info.note
+            if delivery_info.delivery_date:
+                data["delivery_date"] = delivery_info.delivery_date.strftime('%d.%m.%Y %H:%M')
+            if delivery_info.recipient:
+                recipient_data = json.loads(delivery_info.recipient)
+                if recipient_data:
+                    data["delivery_recipient_name"] = recipient_data.get('name')
+                    data["delivery_recipient_phone"] = recipient_data.get('phone')
+
+    contragent_ids = {o.contragent for o in orders.values() if o.contragent}
+    if contragent_ids and needed("contragent"):
+        rows = await database.fetch_all(contragents.select().where(contragents.c.id.in_(contragent_ids)))
+        by_id = {row.id: row for row in rows}
+        for order_id, order in orders.items():
+            contragent = by_id.get(order.contragent)
+            if contragent:
+                replacements[order_id].update(
+                    contragent_name=contragent.name,
+                    contragent_phone=contragent.phone,
+                    contragent_inn=contragent.inn,
+                )
+
+    if contragent_ids and needed("card"):
+        rows = await database.fetch_all(
+            select(loyality_cards)
+            .distinct(loyality_cards.c.contragent_id)
+            .where(loyality_cards.c.contragent_id.in_(contragent_ids))
+            .order_by(loyality_cards.c.contragent_id, loyality_cards.c.id)
+        )
+        by_contragent = {row.contragent_id: row for row in rows}
+        for order_id, order in orders.items():
+            card = by_contragent.get(order.contragent)
+            if card:
+                replacements[order_id].update(
+                    card_number=card.card_number,
+                    card_balance=card.balance,
+                    card_income=card.income,
+                    card_outcome=card.outcome,
+                    card_cashback_percent=card.cashback_percent,
+                    card_minimal_checque_amount=card.minimal_checque_amount,
+                    card_max_percentage=card.max_percentage,
+                    card_max_withdraw_percentage=card.max_withdraw_percentage,
+                )
+
+    return replacements
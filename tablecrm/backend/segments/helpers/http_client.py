@@ -1,14 +1,14 @@
 import urllib.parse
 
-import aiohttp
+from common.http_client.registry import http_clients
 
 
 class HttpClient:
     """HTTP API клиент."""
 
     def __init__(self):
-        """Инициализирует клиента."""
-        self.session = aiohttp.ClientSession()
+        """Инициализирует клиента на общей сессии интеграции segments."""
+        self.session = http_clients.session("segments")
 
     async def _request(self, method, url, data=None, headers=None):
         """Отправляет запрос к API."""
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import random
+from typing import Any, Dict, Optional, Tuple
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from common.http_client.limits import TokenBucket
+from common.http_client.registry import http_clients
+from segments.logger import logger
+
+
+class OutboundExecutor:
+    """
+    Общий исполнитель исходящих запросов действий сегментов.
+
+    Частота ограничивается token bucket'ом на каждый целевой хост
+    (дополнительно можно разделить хост ключом, например профилем wappi),
+    общее число одновременных запросов — max_concurrency. Сетевые ошибки,
+    429 и 5xx повторяются с экспоненциальной задержкой и случайным jitter.
+    """
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(
+            self,
+            max_concurrency: int = int(os.getenv("SEGMENT_OUTBOUND_CONCURRENCY", 20)),
+            default_rate: float = float(os.getenv("SEGMENT_OUTBOUND_RATE_PER_HOST", 5)),
+            max_retries: int = int(os.getenv("SEGMENT_OUTBOUND_RETRIES", 3)),
+            backoff_base: float = 1.0,
+            backoff_max: float = 30.0,
+            timeout: float = 50,
+    ):
+        self.default_rate = default_rate
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._buckets: Dict[Tuple[str, Optional[str], float], TokenBucket] = {}
+
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "failures": self.failures,
+            "buckets": len(self._buckets),
+        }
+
+    def _bucket(self, url: str, rate: Optional[float], rate_key: Optional[str]) -> TokenBucket:
+        # частота входит в ключ: у bucket'а одна частота, рассылки с разной
+        # частотой на один хост не перезаписывают её друг другу
+        rate = rate or self.default_rate
+        key = (urlsplit(url).netloc, rate_key, rate)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = TokenBucket(rate)
+        return bucket
+
+    def _backoff(self, attempt: int) -> float:
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def request(
+            self,
+            method: str,
+            url: str,
+            headers: Optional[dict] = None,
+            json: Any = None,
+            rate: Optional[float] = None,
+            rate_key: Optional[str] = None,
+    ) -> Tuple[Optional[int], Any]:
+        """Возвращает (status, body); status None — запрос так и не удалось выполнить."""
+        bucket = self._bucket(url, rate, rate_key)
+        status, body = None, None
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt))
+            await bucket.acquire()
+            self.requests += 1
+            try:
+                async with self._semaphore:
+                    async with http_clients.session("segments").request(
+                            method, url, headers=headers or {}, json=json,
+                            timeout=aiohttp.ClientTimeout(total=self.timeout),
+                    ) as response:
+                        status = response.status
+                        try:
+                            body = await response.json(content_type=None)
+                        except Exception:
+                            body = None
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                status, body = None, str(e)
+                logger.warning(f"Outbound {method} {url} failed (attempt {attempt + 1}): {e}")
+            if status is not None and status not in self.RETRY_STATUSES:
+                break
+        if status is None or status >= 400:
+            self.failures += 1
+        return status, body
+
+
+outbound_executor = OutboundExecutor()
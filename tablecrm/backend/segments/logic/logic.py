@@ -21,15 +21,26 @@ class SegmentLogic:
     def __init__(self, segment_obj):
         self.segment_obj = segment_obj
 
-    async def collect_id_changes(self, new_ids: dict):
-        """Сбор всех изменений относительно последнего среза"""
+    async def collect_id_changes(self, new_ids: dict, scope: dict = None):
+        """
+        Сбор всех изменений относительно последнего среза.
+
+        scope — id объектов, пересчитанных инкрементально: сравнение идёт только
+        в их пределах, остальные объекты сегмента не затрагиваются.
+        """
 
         docs_sales_id_to_update = new_ids.get('docs_sales', [])
         contragents_id_to_update = new_ids.get('contragents', [])
 
-        docs_sales_ids = await collect_objects(self.segment_obj.id, SegmentObjectType.docs_sales.value, SegmentChangeType.active.value)
+        docs_sales_ids = await collect_objects(
+            self.segment_obj.id, SegmentObjectType.docs_sales.value, SegmentChangeType.active.value,
+            object_ids=scope[SegmentObjectType.docs_sales.value] if scope is not None else None
+        )
 
-        contragents_ids = await collect_objects(self.segment_obj.id, SegmentObjectType.contragents.value, SegmentChangeType.active.value)
+        contragents_ids = await collect_objects(
+            self.segment_obj.id, SegmentObjectType.contragents.value, SegmentChangeType.active.value,
+            object_ids=scope[SegmentObjectType.contragents.value] if scope is not None else None
+        )
 
         changes = {
             SegmentObjectType.docs_sales.value: {},
@@ -75,6 +86,7 @@ class SegmentLogic:
                     query = (
                         update(segment_objects)
                         .where(and_(
+                            segment_objects.c.segment_id == self.segment_obj.id,
                             segment_objects.c.object_id.in_(chunk),
                             segment_objects.c.object_type == object_type,
                             segment_objects.c.valid_to.is_(None)
@@ -84,9 +96,9 @@ class SegmentLogic:
                     await database.execute(query)
         return
 
-    async def update_segment_data_in_db(self, new_ids: dict):
+    async def update_segment_data_in_db(self, new_ids: dict, scope: dict = None):
         """Обновление в БД. Возвращаем changes чтобы верхний уровень мог использовать diff."""
-        changes = await self.collect_id_changes(new_ids)
+        changes = await self.collect_id_changes(new_ids, scope)
         await self.update_data(changes)
 
         return changes
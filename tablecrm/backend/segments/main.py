@@ -1,7 +1,7 @@
 import json
-from datetime import datetime
+from datetime import datetime, timedelta, timezone
 
-from database.db import segments, database, SegmentStatus, users_cboxes_relation, SegmentObjectType
+from database.db import segments, database, SegmentStatus, users_cboxes_relation, SegmentObjectType, segment_runs
 
 from segments.logic.logic import SegmentLogic
 from segments.query.queries import SegmentCriteriaQuery
@@ -9,16 +9,19 @@ from segments.actions.actions import SegmentActions
 
 from segments.logic.collect_data import ContragentsData
 
+from segments.constants import SEGMENT_FULL_RECALC_HOURS, SEGMENT_CHANGES_RETENTION_HOURS
 from segments.logger import logger
 from segments.websockets import notify
 from segments.query.queries import get_token_by_segment_id, fetch_contragent_by_id
 from segments.helpers.functions import format_contragent_text_notifications
 import asyncio
+import time
 
 
 class Segments:
-    def __init__(self, segment_id: int = None):
+    def __init__(self, segment_id: int = None, worker: str = None):
         self.segment_id = segment_id
+        self.worker = worker
         self.segment_obj = None
         self.logic = None
         self.query = None
@@ -38,16 +41,61 @@ class Segments:
         self.segment_obj = await database.fetch_one(
             segments.select().where(segments.c.id == self.segment_obj.id))
 
-    async def update_segment_datetime(self):
+    async def update_segment_datetime(self, full_recalc: bool = False):
+        values = dict(
+            updated_at=datetime.now(),
+            previous_update_at=self.segment_obj.updated_at,
+        )
+        if full_recalc:
+            values["last_full_recalc_at"] = datetime.now()
         await database.execute(
             segments.update().where(segments.c.id == self.segment_id)
-            .values(
-                updated_at=datetime.now(),
-                previous_update_at=self.segment_obj.updated_at,
-            )
+            .values(**values)
         )
         await self.async_init()
 
+    def can_update_incrementally(self) -> bool:
+        """
+        Инкрементальный пересчёт возможен, если журнал изменений покрывает
+        период с previous_update_at, последний полный пересчёт не старше
+        SEGMENT_FULL_RECALC_HOURS и критерии не зависят от текущего времени.
+        """
+        now = datetime.now(timezone.utc)
+        since = self.segment_obj.previous_update_at
+        last_full = self.segment_obj.last_full_recalc_at
+        if not since or not self.segment_obj.updated_at or not last_full:
+            return False
+        if since < now - timedelta(hours=SEGMENT_CHANGES_RETENTION_HOURS):
+            return False
+        if last_full < now - timedelta(hours=SEGMENT_FULL_RECALC_HOURS):
+            return False
+        return not self.query.is_time_dependent()
+
+    async def collect_incremental_ids(self):
+        """
+        Пересчёт критериев только по объектам, изменённым с previous_update_at.
+        Берётся предыдущий интервал, а не updated_at, чтобы не потерять изменения,
+        закоммиченные во время прошлого расчёта.
+        """
+        changed = await self.query.collect_changed_objects(self.segment_obj.previous_update_at)
+        scope_docs_ids = await self.query.collect_scope_docs_sales_ids(changed)
+        if scope_docs_ids:
+            new_ids = await self.query.collect_ids(scope_docs_ids)
+        else:
+            new_ids = {
+                SegmentObjectType.docs_sales.value: set(),
+                SegmentObjectType.contragents.value: set(),
+            }
+
+        # удалённые документы в scope_docs_ids не попадают, но должны выйти из сегмента
+        scope = {
+            SegmentObjectType.docs_sales.value:
+                set(scope_docs_ids) | changed[SegmentObjectType.docs_sales.value],
+            SegmentObjectType.contragents.value:
+                changed[SegmentObjectType.contragents.value] | new_ids[SegmentObjectType.contragents.value],
+        }
+        return new_ids, scope
+
     async def set_status_in_progress(self):
         await database.execute(
             segments.update().where(segments.c.id == self.segment_id)
@@ -60,14 +108,41 @@ class Segments:
             .values(status=SegmentStatus.calculated.value)
         )
 
-    async def update_segment(self):
+    async def record_run(self, run: dict):
+        """Сохранение метрик прогона сегмента (длительность, объёмы, результат)."""
+        try:
+            await database.execute(
+                segment_runs.insert().values(
+                    segment_id=self.segment_id,
+                    cashbox_id=self.segment_obj.cashbox_id,
+                    worker=self.worker,
+                    **run,
+                )
+            )
+        except Exception as e:
+            logger.error(f"Не удалось сохранить метрики сегмента {self.segment_id}: {e}")
+
+    async def update_segment(self, incremental: bool = False) -> bool:
+        start = datetime.now()
+        started = time.monotonic()
+        run = {"mode": "full", "is_success": False, "started_at": start}
         try:
-            start = datetime.now()
             await self.set_status_in_progress()
-            new_ids = await self.query.collect_ids()
+            incremental = incremental and self.can_update_incrementally()
+            run["mode"] = "incremental" if incremental else "full"
+            if incremental:
+                new_ids, scope = await self.collect_incremental_ids()
+            else:
+                new_ids, scope = await self.query.collect_ids(), None
 
             # теперь update_segment_data_in_db возвращает changes
-            changes = await self.logic.update_segment_data_in_db(new_ids)
+            changes = await self.logic.update_segment_data_in_db(new_ids, scope)
+            run.update(
+                docs_sales_count=len(new_ids.get(SegmentObjectType.docs_sales.value, ())),
+                contragents_count=len(new_ids.get(SegmentObjectType.contragents.value, ())),
+                added_count=sum(len(value.get("new", ())) for value in changes.values()),
+                removed_count=sum(len(value.get("removed", ())) for value in changes.values()),
+            )
             # changes пример:
             # {
             #   "contragents": {"new": [...], "removed": [...], "active": [...]},
@@ -123,11 +198,19 @@ class Segments:
 
             # далее стандартная логика
             await self.actions.start_actions()
-            await self.update_segment_datetime()
+            await self.update_segment_datetime(full_recalc=not incremental)
             await self.set_status_calculated()
-            logger.info(f'Segment {self.segment_id} updated successfully. Start - {start}. Took {datetime.now() - start}')
+            logger.info(
+                f'Segment {self.segment_id} updated successfully ({run["mode"]}). '
+                f'Start - {start}. Took {datetime.now() - start}'
+            )
+            run["is_success"] = True
         except Exception as e:
+            run["error"] = str(e)
             logger.exception(f"Ошибка при обновлении сегмента {self.segment_obj.id}: {e}")
+        run["duration_ms"] = int((time.monotonic() - started) * 1000)
+        await self.record_run(run)
+        return run["is_success"]
 
     async def collect_data(self):
         data_obj = ContragentsData(self.segment_obj)
@@ -135,9 +218,9 @@ class Segments:
         return await data_obj.collect()
 
 
-async def update_segment_task(segment_id: int):
+async def update_segment_task(segment_id: int, incremental: bool = False, worker: str = None):
     token = await get_token_by_segment_id(segment_id)
-    segment = Segments(segment_id)
+    segment = Segments(segment_id, worker=worker)
     logger.info(f"Starting update for segment {segment_id} with token {token}")
 
     await segment.async_init()
@@ -161,7 +244,7 @@ async def update_segment_task(segment_id: int):
     
 
     if segment.segment_obj:
-        await segment.update_segment()
+        await segment.update_segment(incremental=incremental)
         payload = {
             "type": "recalc_finish",
             "segment_name": segment.segment_obj.name,
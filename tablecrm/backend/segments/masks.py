@@ -21,3 +21,17 @@ def replace_masks(message: any, replacements: dict):
     else:
         new_message = message
     return new_message
+
+
+def collect_mask_keys(message: any) -> set:
+    """Имена всех масок {{ key }}, встречающихся в шаблоне (строке, списке или словаре)."""
+    if isinstance(message, str):
+        return {key.strip() for key in re.findall(r"\{\{\s*(.*?)\s*\}\}", message)}
+    if isinstance(message, list):
+        return set().union(*(collect_mask_keys(m) for m in message)) if message else set()
+    if isinstance(message, dict):
+        keys = set()
+        for k, v in message.items():
+            keys |= collect_mask_keys(k) | collect_mask_keys(v)
+        return keys
+    return set()
@@ -1,10 +1,13 @@
 from collections import defaultdict
+from datetime import datetime
+from typing import Optional
 
 from sqlalchemy import select
 
 from database.db import (
     docs_sales, docs_sales_tags, OrderStatus, docs_sales_delivery_info, users_cboxes_relation, segments,
-    database, SegmentObjectType, contragents, contragents_tags, tags, loyality_cards, loyality_transactions
+    database, SegmentObjectType, contragents, contragents_tags, tags, loyality_cards, loyality_transactions,
+    segment_changes
 )
 
 from segments.query import filters as filter_query
@@ -20,6 +23,27 @@ FILTER_PRIORYTY_TAGS = {
     "loyality": 6,
 }
 
+# Критерии, результат которых меняется со временем без изменения данных.
+# Для них инкрементальный пересчёт по журналу изменений невозможен.
+TIME_DEPENDENT_KEYS = {
+    "gte_seconds_ago",
+    "lte_seconds_ago",
+    "last_purchase_days_ago",
+    "expires_in_days",
+    "photos_not_added_minutes",
+}
+
+
+def _has_time_dependent_keys(data) -> bool:
+    if isinstance(data, dict):
+        return any(
+            (key in TIME_DEPENDENT_KEYS and value is not None) or _has_time_dependent_keys(value)
+            for key, value in data.items()
+        )
+    if isinstance(data, list):
+        return any(_has_time_dependent_keys(item) for item in data)
+    return False
+
 
 def chunk_list(lst, chunk_size=30000):
     """Разбивает список на части заданного размера"""
@@ -135,10 +159,57 @@ class SegmentCriteriaQuery:
         elif join_type == "join":
             return query.join(table_obj, condition)
 
-    async def calculate(self):
-        """Собираем Id документов продаж"""
-        docs_sales_rows = await database.fetch_all(select(docs_sales.c.id).where(docs_sales.c.cashbox == self.cashbox_id, docs_sales.c.is_deleted == False))
-        self.docs_sales_ids = [row.id for row in docs_sales_rows]
+    def is_time_dependent(self) -> bool:
+        return _has_time_dependent_keys(self.criteria_data)
+
+    async def collect_changed_objects(self, since: datetime) -> dict:
+        """Id документов продаж и контрагентов кассы, изменённых начиная с since."""
+        rows = await database.fetch_all(
+            select(segment_changes.c.object_type, segment_changes.c.object_id)
+            .distinct()
+            .where(
+                segment_changes.c.cashbox_id == self.cashbox_id,
+                segment_changes.c.changed_at >= since,
+            )
+        )
+        changed = {
+            SegmentObjectType.docs_sales.value: set(),
+            SegmentObjectType.contragents.value: set(),
+        }
+        for row in rows:
+            object_type = getattr(row.object_type, "value", row.object_type)
+            if object_type in changed:
+                changed[object_type].add(row.object_id)
+        return changed
+
+    async def collect_scope_docs_sales_ids(self, changed: dict) -> list:
+        """
+        Документы, членство которых могло измениться: изменённые документы
+        и все документы изменённых контрагентов (агрегаты покупок считаются по контрагенту).
+        """
+        changed_docs = list(changed.get(SegmentObjectType.docs_sales.value, ()))
+        changed_contragents = list(changed.get(SegmentObjectType.contragents.value, ()))
+
+        scope = set()
+        for ids, column in ((changed_docs, docs_sales.c.id), (changed_contragents, docs_sales.c.contragent)):
+            for chunk_ids in chunk_list(ids, 30000):
+                rows = await database.fetch_all(
+                    select(docs_sales.c.id).where(
+                        docs_sales.c.cashbox == self.cashbox_id,
+                        docs_sales.c.is_deleted == False,
+                        column.in_(chunk_ids),
+                    )
+                )
+                scope.update(row.id for row in rows)
+        return list(scope)
+
+    async def calculate(self, docs_sales_ids: Optional[list] = None):
+        """Собираем Id документов продаж. docs_sales_ids ограничивает пересчёт этими документами."""
+        if docs_sales_ids is None:
+            docs_sales_rows = await database.fetch_all(select(docs_sales.c.id).where(docs_sales.c.cashbox == self.cashbox_id, docs_sales.c.is_deleted == False))
+            self.docs_sales_ids = [row.id for row in docs_sales_rows]
+        else:
+            self.docs_sales_ids = list(docs_sales_ids)
         groups = self.group_criteria_by_priority()
         for group in groups:
             if not self.docs_sales_ids:
@@ -183,8 +254,8 @@ class SegmentCriteriaQuery:
 
         return self.docs_sales_ids
 
-    async def collect_ids(self):
-        docs_sales_ids = await self.calculate()
+    async def collect_ids(self, docs_sales_ids: Optional[list] = None):
+        docs_sales_ids = await self.calculate(docs_sales_ids)
 
         data = {
             SegmentObjectType.docs_sales.value: set(),
@@ -0,0 +1,189 @@
+import asyncio
+import os
+import socket
+import uuid
+from collections import OrderedDict, defaultdict, deque
+from typing import Dict, List, Optional
+
+from sqlalchemy import and_, or_, func, cast, Integer, select, text
+from sqlalchemy.dialects.postgresql import JSONB
+
+from database.db import database, segments
+from functions.db_connections import in_own_connection
+from segments.constants import SEGMENT_WORKERS, SEGMENT_MAX_PER_CASHBOX, SEGMENT_LEASE_SECONDS
+from segments.logger import logger
+from segments.main import update_segment_task
+
+
+def _due_conditions():
+    """Условия «сегмент пора пересчитать» (cron и истёк interval_minutes)."""
+    interval_minutes = cast(
+        func.jsonb_extract_path_text(cast(segments.c.update_settings, JSONB), 'interval_minutes'),
+        Integer
+    )
+    next_run_at = segments.c.updated_at + func.make_interval(0, 0, 0, 0, 0, interval_minutes)
+    conditions = and_(
+        segments.c.type_of_update == 'cron',
+        segments.c.is_archived.isnot(True),
+        segments.c.is_deleted.isnot(True),
+        segments.c.update_settings['interval_minutes'].isnot(None),
+        or_(segments.c.updated_at.is_(None), next_run_at <= func.now()),
+    )
+    return conditions, next_run_at
+
+
+def _lease_free():
+    return or_(segments.c.lease_until.is_(None), segments.c.lease_until < func.now())
+
+
+class SegmentScheduler:
+    """
+    Параллельный пересчёт сегментов по расписанию.
+
+    Просроченные сегменты выбираются по убыванию просрочки и раздаются
+    пулу из max_workers задач по кругу между кассами, так что одна касса
+    с большим числом сегментов не занимает все слоты (не более
+    max_per_cashbox одновременно). Перед расчётом сегмент захватывается
+    арендой (lease_owner/lease_until в segments), которая продлевается во
+    время расчёта, поэтому несколько процессов с джобами делят работу
+    без двойного пересчёта. Ручной пересчёт из API (refresh) берёт ту же
+    аренду. Метрики прогонов пишутся в segment_runs.
+    """
+
+    def __init__(
+            self,
+            max_workers: int = SEGMENT_WORKERS,
+            max_per_cashbox: int = SEGMENT_MAX_PER_CASHBOX,
+            lease_seconds: int = SEGMENT_LEASE_SECONDS,
+    ):
+        self.max_workers = max(1, max_workers)
+        self.max_per_cashbox = max(1, max_per_cashbox)
+        self.lease_seconds = lease_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+    async def get_due_segments(self) -> List:
+        conditions, next_run_at = _due_conditions()
+        overdue = func.coalesce(
+            func.extract("epoch", func.now() - next_run_at),
+            # ни разу не считавшиеся сегменты — в начало очереди
+            func.extract("epoch", func.now() - func.coalesce(segments.c.created_at, func.now())) + 10 ** 9,
+        ).label("overdue_seconds")
+        query = (
+            select(segments.c.id, segments.c.cashbox_id, overdue)
+            .where(conditions, _lease_free())
+            .order_by(text("overdue_seconds DESC"), segments.c.id)
+        )
+        return await database.fetch_all(query)
+
+    def build_queue(self, rows) -> deque:
+        """Чередование касс: самый просроченный сегмент каждой кассы, затем следующий и т.д."""
+        by_cashbox: "OrderedDict[int, deque]" = OrderedDict()
+        for row in rows:
+            by_cashbox.setdefault(row.cashbox_id, deque()).append(row)
+        queue = deque()
+        while by_cashbox:
+            for cashbox_id in list(by_cashbox):
+                queue.append(by_cashbox[cashbox_id].popleft())
+                if not by_cashbox[cashbox_id]:
+                    del by_cashbox[cashbox_id]
+        return queue
+
+    async def acquire(self, segment_id: int, due: bool = True) -> bool:
+        """Захват аренды; due=False — без проверки расписания (ручной пересчёт)."""
+        conditions = [segments.c.id == segment_id, _lease_free()]
+        if due:
+            conditions.append(_due_conditions()[0])
+        query = (
+            segments.update()
+            .where(*conditions)
+            .values(
+                lease_owner=self.owner,
+                lease_until=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, self.lease_seconds),
+            )
+            .returning(segments.c.id)
+        )
+        return await database.fetch_one(query) is not None
+
+    async def extend(self, segment_id: int):
+        await database.execute(
+            segments.update()
+            .where(segments.c.id == segment_id, segments.c.lease_owner == self.owner)
+            .values(lease_until=func.now() + func.make_interval(0, 0, 0, 0, 0, 0, self.lease_seconds))
+        )
+
+    async def release(self, segment_id: int):
+        await database.execute(
+            segments.update()
+            .where(segments.c.id == segment_id, segments.c.lease_owner == self.owner)
+            .values(lease_owner=None, lease_until=None)
+        )
+
+    async def _heartbeat(self, segment_id: int):
+        while True:
+            await asyncio.sleep(max(1, self.lease_seconds // 3))
+            try:
+                await self.extend(segment_id)
+            except Exception as e:
+                logger.error(f"Не удалось продлить аренду сегмента {segment_id}: {e}")
+
+    async def run_segment(self, segment_id: int):
+        if not await self.acquire(segment_id):
+            # сегмент уже взял другой процесс или он перестал быть просроченным
+            return
+        await self._run_leased(segment_id, incremental=True)
+
+    async def refresh(self, segment_id: int) -> bool:
+        """
+        Полный пересчёт по запросу (создание, изменение, кнопка «обновить») в фоне.
+        False — сегмент сейчас пересчитывает другой процесс или задача.
+        """
+        if not await self.acquire(segment_id, due=False):
+            return False
+        self.start(segment_id)
+        return True
+
+    def start(self, segment_id: int):
+        """Полный пересчёт в фоне по уже захваченной аренде."""
+        # своё соединение: расчёт переживает запрос, который его запустил
+        in_own_connection(self._run_leased(segment_id, incremental=False))
+
+    async def _run_leased(self, segment_id: int, incremental: bool):
+        # продление аренды — на своём соединении, не между запросами расчёта
+        heartbeat = in_own_connection(self._heartbeat(segment_id))
+        try:
+            await update_segment_task(segment_id, incremental=incremental, worker=self.owner)
+        except Exception as e:
+            logger.exception(f"Ошибка при пересчёте сегмента {segment_id}: {e}")
+        finally:
+            heartbeat.cancel()
+            await self.release(segment_id)
+
+    async def run(self) -> int:
+        """Один проход: пересчитывает все просроченные сегменты, возвращает их число."""
+        queue = self.build_queue(await self.get_due_segments())
+        total = len(queue)
+        running: Dict[asyncio.Task, Optional[int]] = {}
+        per_cashbox = defaultdict(int)
+
+        while queue or running:
+            # запускаем первые по очереди сегменты, чья касса не упёрлась в лимит
+            skipped = deque()
+            while queue and len(running) < self.max_workers:
+                row = queue.popleft()
+                if per_cashbox[row.cashbox_id] >= self.max_per_cashbox:
+                    skipped.append(row)
+                    continue
+                per_cashbox[row.cashbox_id] += 1
+                running[in_own_connection(self.run_segment(row.id))] = row.cashbox_id
+            skipped.extend(queue)
+            queue = skipped
+
+            if not running:
+                break
+            done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                per_cashbox[running.pop(task)] -= 1
+        return total
+
+
+segment_scheduler = SegmentScheduler()
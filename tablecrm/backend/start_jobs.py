@@ -1,14 +1,50 @@
 import asyncio
 import atexit
+import os
+import traceback
 
+from common.amqp_messaging.common.core.IRabbitFactory import IRabbitFactory
+from common.amqp_messaging.common.impl.RabbitFactory import RabbitFactory
+from common.amqp_messaging.models.RabbitMqSettings import RabbitMqSettings
+from common.utils.ioc.ioc import ioc
 from jobs.jobs import scheduler
+from ws_manager import ws_bus, ws_updates
 
 IS_RUN_STATE = True
 
 def my_any_func():
     scheduler.shutdown()
+    # дописать в шину обновления, накопленные задачами (смены, балансы)
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(ws_updates.flush_all())
+        loop.run_until_complete(ws_bus.stop())
+    except Exception:
+        traceback.print_exc()
+
+
+async def startup():
+    rabbit_settings = RabbitMqSettings(
+        rabbitmq_host=os.getenv('RABBITMQ_HOST'),
+        rabbitmq_user=os.getenv('RABBITMQ_USER'),
+        rabbitmq_pass=os.getenv('RABBITMQ_PASS'),
+        rabbitmq_port=os.getenv('RABBITMQ_PORT'),
+        rabbitmq_vhost=os.getenv('RABBITMQ_VHOST')
+    )
+    # задачи публикуют в очереди (пересборка пассов Apple Wallet и т.п.)
+    # через IRabbitFactory, как и API; без регистрации продюсеры падают
+    # и задачи откатываются на синхронную обработку
+    ioc.set(IRabbitFactory, await RabbitFactory(settings=rabbit_settings)())
+
+    # сокетов в этом процессе нет: шина только публикует сообщения задач
+    # процессам API, где подключены клиенты
+    try:
+        await ws_bus.start(rabbit_settings, consume=False)
+    except Exception:
+        traceback.print_exc()
 
 if __name__ == "__main__":
     atexit.register(my_any_func)
+    asyncio.get_event_loop().run_until_complete(startup())
     scheduler.start()
-    asyncio.get_event_loop().run_forever()
\ No newline at end of file
+    asyncio.get_event_loop().run_forever()
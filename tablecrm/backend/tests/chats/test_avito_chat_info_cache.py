@@ -0,0 +1,152 @@
+import asyncio
+
+import pytest
+
+import api.chats.avito.avito_chat_info_cache as cache_module
+from api.chats.avito.avito_chat_info_cache import AvitoChatInfoCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeClient:
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+        self.release = asyncio.Event()
+        self.release.set()
+
+    async def get_chat_info(self, chat_id):
+        self.calls.append(chat_id)
+        await self.release.wait()
+        if self.fail:
+            raise RuntimeError("avito is down")
+        return {"id": chat_id, "version": len(self.calls)}
+
+
+class FakeDatabase:
+    def __init__(self, creds):
+        self.creds = creds
+        self.queries = 0
+
+    async def fetch_one(self, query):
+        self.queries += 1
+        return self.creds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def avito(monkeypatch):
+    """Подменяет чтение credentials и создание клиента Avito."""
+    client = FakeClient()
+    db = FakeDatabase({"avito_user_id": 42})
+    created = []
+
+    async def create_avito_client(**kwargs):
+        created.append(kwargs)
+        return client
+
+    monkeypatch.setattr(cache_module, "database", db)
+    monkeypatch.setattr(cache_module, "create_avito_client", create_avito_client)
+    client.db = db
+    client.created = created
+    return client
+
+
+class TestAvitoChatInfoCache:
+    @pytest.mark.asyncio
+    async def test_miss_without_wait_loads_in_background(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60)
+
+        assert await cache.get(1, 10, "chat") is None
+        await asyncio.gather(*cache._refreshing.values())
+
+        entry = await cache.get(1, 10, "chat")
+        assert entry == {"info": {"id": "chat", "version": 1}, "avito_user_id": 42}
+        assert cache.stats()["misses"] == 1 and cache.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrent_misses_share_one_request(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60)
+        avito.release.clear()
+
+        waiting = [asyncio.ensure_future(cache.get(1, 10, "chat", wait=True)) for _ in range(3)]
+        await asyncio.sleep(0)
+        avito.release.set()
+        entries = await asyncio.gather(*waiting)
+
+        assert avito.calls == ["chat"]
+        assert entries[0] is entries[1] is entries[2]
+
+    @pytest.mark.asyncio
+    async def test_stale_entry_is_served_and_refreshed(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60, client_ttl=600)
+        await cache.get(1, 10, "chat", wait=True)
+        clock.now += 60
+
+        entry = await cache.get(1, 10, "chat")
+        assert entry["info"]["version"] == 1
+        await asyncio.gather(*cache._refreshing.values())
+
+        assert (await cache.get(1, 10, "chat"))["info"]["version"] == 2
+        assert cache.stats()["stale"] == 1
+        # клиент канала переиспользуется в пределах client_ttl
+        assert len(avito.created) == 1 and avito.db.queries == 1
+
+    @pytest.mark.asyncio
+    async def test_invalidate_forces_background_refresh(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60)
+        await cache.get(1, 10, "chat", wait=True)
+
+        cache.invalidate(10, "chat")
+        cache.invalidate(10, "unknown")
+
+        assert (await cache.get(1, 10, "chat"))["info"]["version"] == 1
+        await asyncio.gather(*cache._refreshing.values())
+        assert (await cache.get(1, 10, "chat"))["info"]["version"] == 2
+        assert cache.stats()["items"] == 1
+
+    @pytest.mark.asyncio
+    async def test_lru_eviction(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60, max_size=2)
+        for chat in ("a", "b"):
+            await cache.get(1, 10, chat, wait=True)
+        await cache.get(1, 10, "a")
+        await cache.get(1, 10, "c", wait=True)
+
+        assert list(cache._entries) == [(10, "a"), (10, "c")]
+
+    @pytest.mark.asyncio
+    async def test_failed_fetch_keeps_old_entry(self, clock, avito):
+        cache = AvitoChatInfoCache(ttl=60)
+        await cache.get(1, 10, "chat", wait=True)
+        avito.fail = True
+        clock.now += 60
+
+        assert (await cache.get(1, 10, "chat"))["info"]["version"] == 1
+        await asyncio.gather(*cache._refreshing.values())
+
+        assert (await cache.get(1, 10, "chat"))["info"]["version"] == 1
+        assert cache.stats()["errors"] == 1
+
+    @pytest.mark.asyncio
+    async def test_missing_credentials_are_remembered(self, clock, avito):
+        avito.db.creds = None
+        cache = AvitoChatInfoCache(ttl=60)
+
+        assert await cache.get(1, 10, "a", wait=True) is None
+        assert await cache.get(1, 10, "b", wait=True) is None
+
+        assert avito.db.queries == 1
+        assert avito.created == [] and avito.calls == []
@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+
+import common.http_client.limits as limits_module
+from common.http_client.limits import CircuitBreaker, CircuitOpenError, TokenBucket
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(limits_module.time, "monotonic", clock)
+    return clock
+
+
+class TestTokenBucket:
+    @pytest.mark.asyncio
+    async def test_burst_up_to_capacity_then_rate(self):
+        bucket = TokenBucket(rate=20, capacity=3)
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        for _ in range(3):
+            await bucket.acquire()
+        burst = loop.time() - started
+        for _ in range(2):
+            await bucket.acquire()
+        total = loop.time() - started
+
+        assert burst < 0.02
+        # два запроса сверх ёмкости — по 1/20 с каждый
+        assert 0.09 <= total < 0.3
+
+    @pytest.mark.asyncio
+    async def test_concurrent_waiters_share_the_rate(self):
+        bucket = TokenBucket(rate=50)
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+
+        assert loop.time() - started >= 0.09
+
+    def test_capacity_is_at_least_one(self):
+        assert TokenBucket(rate=1, capacity=0).capacity == 1
+
+
+class TestCircuitBreaker:
+    def test_opens_after_threshold_and_rejects(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+        breaker.before_request()
+        breaker.record_failure()
+        breaker.before_request()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+        assert breaker.stats() == {"state": "open", "failures": 2, "rejected": 1}
+
+    def test_success_resets_failure_count(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=30)
+        breaker.record_failure()
+        breaker.record_success()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.CLOSED
+
+    def test_half_open_lets_one_probe_through(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        clock.now += 30
+
+        breaker.before_request()
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+        breaker.record_success()
+        assert breaker.state == CircuitBreaker.CLOSED
+        breaker.before_request()
+
+    def test_failed_probe_reopens(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=30)
+        for _ in range(3):
+            breaker.record_failure()
+        clock.now += 31
+        breaker.before_request()
+        breaker.record_failure()
+
+        assert breaker.state == CircuitBreaker.OPEN
+        with pytest.raises(CircuitOpenError):
+            breaker.before_request()
+
+    def test_cancelled_probe_frees_the_slot(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=30)
+        breaker.record_failure()
+        clock.now += 30
+        breaker.before_request()
+        breaker.cancel_probe()
+
+        breaker.before_request()
+
+    def test_zero_threshold_only_counts(self, clock):
+        breaker = CircuitBreaker("test", failure_threshold=0)
+        for _ in range(10):
+            breaker.record_failure()
+
+        breaker.before_request()
+        assert breaker.stats()["failures"] == 10
+
+    def test_open_error_is_a_client_error(self):
+        import aiohttp
+
+        assert issubclass(CircuitOpenError, aiohttp.ClientError)
@@ -0,0 +1,102 @@
+import asyncio
+
+import aiohttp
+import pytest
+
+from common.http_client.limits import CircuitOpenError
+from common.http_client.registry import DEFAULTS, HttpClientRegistry, IntegrationClient
+
+
+class FakeResponse:
+    def __init__(self, status):
+        self.status = status
+        self.released = False
+
+    def release(self):
+        self.released = True
+
+
+class FakeSession:
+    """Вместо aiohttp.ClientSession: отвечает статусами по очереди, запоминает запросы."""
+
+    closed = False
+
+    def __init__(self, *statuses):
+        self.statuses = list(statuses)
+        self.requests = []
+
+    async def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs))
+        status = self.statuses.pop(0) if len(self.statuses) > 1 else self.statuses[0]
+        if isinstance(status, Exception):
+            raise status
+        return FakeResponse(status)
+
+
+def client(session: FakeSession, **config) -> IntegrationClient:
+    client = IntegrationClient("test", {**DEFAULTS, **config})
+    client._session = session
+    client._loop = asyncio.get_running_loop()
+    return client
+
+
+class TestIntegrationClient:
+    @pytest.mark.asyncio
+    async def test_buckets_are_per_host_and_rate_key(self):
+        integration = client(FakeSession(200), rate=10, capacity=1)
+
+        first = integration.bucket("https://api.avito.ru/messenger", "client-1")
+
+        assert integration.bucket("https://api.avito.ru/token", "client-1") is first
+        assert integration.bucket("https://api.avito.ru/messenger", "client-2") is not first
+        assert integration.bucket("https://other.example/messenger", "client-1") is not first
+        assert integration.stats()["rate_limited_hosts"] == 2
+        assert integration.stats()["rate_buckets"] == 3
+
+    @pytest.mark.asyncio
+    async def test_no_rate_means_no_bucket(self):
+        integration = client(FakeSession(200), rate=None)
+
+        assert integration.bucket("https://api.example/x", "key") is None
+
+    @pytest.mark.asyncio
+    async def test_session_headers_and_rate_key_reach_request(self):
+        session = FakeSession(200)
+        integration = client(session, rate=1000, capacity=1)
+        registry = HttpClientRegistry()
+        registry._clients["test"] = integration
+
+        async with registry.session("test", headers={"Authorization": "Bearer x"}, rate_key="client-1") as http:
+            async with http.get("https://api.example/x", headers={"X-Extra": "1"}) as response:
+                assert response.status == 200
+
+        method, url, kwargs = session.requests[0]
+        assert kwargs["headers"] == {"Authorization": "Bearer x", "X-Extra": "1"}
+        assert "rate_key" not in kwargs
+        assert list(integration._buckets) == [("api.example", "client-1")]
+        assert response.released
+
+    @pytest.mark.asyncio
+    async def test_server_errors_open_the_host_circuit(self):
+        session = FakeSession(503)
+        integration = client(session, failure_threshold=2, reset_timeout=30)
+
+        for _ in range(2):
+            assert (await integration.get("https://down.example/x")).status == 503
+        with pytest.raises(CircuitOpenError):
+            await integration.get("https://down.example/x")
+
+        session.statuses = [200]
+        assert (await integration.get("https://up.example/x")).status == 200
+        assert len(session.requests) == 3
+
+    @pytest.mark.asyncio
+    async def test_network_errors_count_as_failures(self):
+        session = FakeSession(aiohttp.ClientConnectionError("refused"))
+        integration = client(session, failure_threshold=1, reset_timeout=30)
+
+        with pytest.raises(aiohttp.ClientConnectionError):
+            await integration.get("https://down.example/x")
+
+        assert integration.breaker("https://down.example/x").state == "open"
+        assert integration.stats()["endpoints"]
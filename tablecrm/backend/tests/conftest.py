@@ -0,0 +1,43 @@
+import asyncpg
+import pytest
+import pytest_asyncio
+
+from database.db import database
+
+
+async def _connect():
+    try:
+        await database.connect()
+    except (OSError, asyncpg.PostgresError) as e:
+        pytest.skip(f"База недоступна: {e}")
+
+
+@pytest_asyncio.fixture
+async def db_connection():
+    """
+    Соединение с базой из POSTGRES_* (как у tests/api) внутри транзакции,
+    которая откатывается после теста. Без базы тест пропускается.
+    """
+    await _connect()
+    try:
+        async with database.connection() as connection:
+            transaction = await connection.transaction()
+            try:
+                yield connection
+            finally:
+                await transaction.rollback()
+    finally:
+        await database.disconnect()
+
+
+@pytest_asyncio.fixture
+async def db_pool():
+    """
+    Пул соединений без общей транзакции — для проверок параллельных
+    транзакций; созданные строки тест удаляет сам.
+    """
+    await _connect()
+    try:
+        yield database
+    finally:
+        await database.disconnect()
@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from api.loyality_transactions.routers import recalculate_cards
+from database.db import loyality_cards, loyality_transactions
+from functions.db_connections import in_own_connection
+
+
+async def create_card(connection, income: float = 0) -> int:
+    return await connection.execute(
+        loyality_cards.insert().values(
+            card_number=900000001, income=income, outcome=0, balance=income, is_deleted=False,
+            apple_wallet_advertisement="TableCRM",
+        )
+    )
+
+
+async def add_transaction(connection, card_id: int, type: str, amount: float) -> int:
+    return await connection.execute(
+        loyality_transactions.insert().values(
+            loyality_card_id=card_id, type=type, amount=amount, status=True, is_deleted=False,
+        )
+    )
+
+
+async def card_totals(connection, card_id: int):
+    row = await connection.fetch_one(
+        select(loyality_cards.c.income, loyality_cards.c.outcome, loyality_cards.c.balance)
+        .where(loyality_cards.c.id == card_id)
+    )
+    return row.income, row.outcome, row.balance
+
+
+class TestLoyalityBalanceTrigger:
+    @pytest.mark.asyncio
+    async def test_transactions_update_card_counters(self, db_connection):
+        card_id = await create_card(db_connection)
+        accrual_id = await add_transaction(db_connection, card_id, "accrual", 100.5)
+        await add_transaction(db_connection, card_id, "withdraw", 30)
+
+        assert await card_totals(db_connection, card_id) == (100.5, 30, 70.5)
+
+        await db_connection.execute(
+            loyality_transactions.update()
+            .where(loyality_transactions.c.id == accrual_id)
+            .values(is_deleted=True)
+        )
+        # баланс не уходит в минус, как и в recalculate_cards
+        assert await card_totals(db_connection, card_id) == (0, 30, 0)
+
+    @pytest.mark.asyncio
+    async def test_amount_change_applies_difference(self, db_connection):
+        card_id = await create_card(db_connection)
+        accrual_id = await add_transaction(db_connection, card_id, "accrual", 50)
+
+        await db_connection.execute(
+            loyality_transactions.update()
+            .where(loyality_transactions.c.id == accrual_id)
+            .values(amount=80)
+        )
+
+        assert await card_totals(db_connection, card_id) == (80, 0, 80)
+
+    @pytest.mark.asyncio
+    async def test_recalculate_fixes_only_drifted_cards(self, db_connection):
+        drifted = await create_card(db_connection)
+        correct = await create_card(db_connection)
+        await add_transaction(db_connection, drifted, "accrual", 40)
+        await add_transaction(db_connection, correct, "accrual", 10)
+        await db_connection.execute(
+            loyality_cards.update().where(loyality_cards.c.id == drifted).values(income=999, balance=999)
+        )
+
+        assert await recalculate_cards([drifted, correct, drifted]) == 1
+        assert await card_totals(db_connection, drifted) == (40, 0, 40)
+        assert await recalculate_cards([drifted, correct]) == 0
+
+    @pytest.mark.asyncio
+    async def test_recalculate_keeps_concurrent_transaction(self, db_pool):
+        # карта с расхождением; пока сверка ждёт блокировку карты, параллельная
+        # транзакция начисляет 100 — после сверки они не должны потеряться
+        card_id = await create_card(db_pool, income=999)
+        inserted, release = asyncio.Event(), asyncio.Event()
+
+        async def concurrent_accrual():
+            async with db_pool.connection() as connection, connection.transaction():
+                await add_transaction(connection, card_id, "accrual", 100)
+                inserted.set()
+                await release.wait()
+
+        try:
+            holder = in_own_connection(concurrent_accrual())
+            await inserted.wait()
+            recalculation = in_own_connection(recalculate_cards([card_id]))
+            await asyncio.sleep(0.2)
+            assert not recalculation.done()
+            release.set()
+            await holder
+
+            assert await recalculation == 1
+            assert await card_totals(db_pool, card_id) == (100, 0, 100)
+        finally:
+            release.set()
+            await db_pool.execute(
+                loyality_transactions.delete().where(loyality_transactions.c.loyality_card_id == card_id)
+            )
+            await db_pool.execute(loyality_cards.delete().where(loyality_cards.c.id == card_id))
@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import pytest
+from sqlalchemy import select, text
+
+from database.db import payments, pboxes as payboxes, projects
+from functions.db_connections import in_own_connection
+
+PAST = 1_600_000_000
+
+
+async def create_paybox(connection, balance: float = 0) -> int:
+    return await connection.execute(
+        payboxes.insert().values(name="test", start_balance=0, balance=balance, balance_date=0)
+    )
+
+
+async def create_project(connection) -> int:
+    return await connection.execute(projects.insert().values(name="test", incoming=0, outgoing=0))
+
+
+async def add_payment(connection, paybox_id: int, type: str, amount: float, **values) -> int:
+    values = {"date": PAST, "status": True, "is_deleted": False, **values}
+    return await connection.execute(
+        payments.insert().values(paybox=paybox_id, type=type, amount=amount, **values)
+    )
+
+
+async def balance(connection, paybox_id: int) -> float:
+    return await connection.fetch_val(select(payboxes.c.balance).where(payboxes.c.id == paybox_id))
+
+
+class TestPaymentsBalanceTriggers:
+    @pytest.mark.asyncio
+    async def test_payments_move_paybox_balance(self, db_connection):
+        paybox_id = await create_paybox(db_connection)
+        await add_payment(db_connection, paybox_id, "incoming", 150.25)
+        outgoing_id = await add_payment(db_connection, paybox_id, "outgoing", 50)
+        await add_payment(db_connection, paybox_id, "incoming", 1000, status=False)
+
+        assert await balance(db_connection, paybox_id) == 100.25
+
+        await db_connection.execute(payments.update().where(payments.c.id == outgoing_id).values(is_deleted=True))
+        assert await balance(db_connection, paybox_id) == 150.25
+
+        await db_connection.execute(payments.delete().where(payments.c.id == outgoing_id))
+        assert await balance(db_connection, paybox_id) == 150.25
+
+    @pytest.mark.asyncio
+    async def test_transfer_moves_between_payboxes(self, db_connection):
+        source = await create_paybox(db_connection, balance=0)
+        target = await create_paybox(db_connection, balance=0)
+        await add_payment(db_connection, source, "transfer", 40, paybox_to=target)
+
+        assert (await balance(db_connection, source), await balance(db_connection, target)) == (-40, 40)
+
+    @pytest.mark.asyncio
+    async def test_future_payment_applies_when_matured(self, db_connection):
+        paybox_id = await create_paybox(db_connection)
+        payment_id = await add_payment(db_connection, paybox_id, "incoming", 70, date=int(time.time()) + 86400)
+
+        assert await balance(db_connection, paybox_id) == 0
+
+        # дата платежа уже прошла: BEFORE-триггер включает его в баланс счёта
+        await db_connection.execute(payments.update().where(payments.c.id == payment_id).values(date=PAST))
+        assert await balance(db_connection, paybox_id) == 70
+
+    @pytest.mark.asyncio
+    async def test_project_totals_and_profitability(self, db_connection):
+        paybox_id = await create_paybox(db_connection)
+        project_id = await create_project(db_connection)
+        await add_payment(db_connection, paybox_id, "incoming", 300, project_id=project_id)
+        await add_payment(db_connection, paybox_id, "outgoing", 200, project_id=project_id)
+
+        row = await db_connection.fetch_one(
+            select(projects.c.incoming, projects.c.outgoing, projects.c.profitability)
+            .where(projects.c.id == project_id)
+        )
+        assert (row.incoming, row.outgoing, row.profitability) == (300, 200, 50)
+
+    @pytest.mark.asyncio
+    async def test_recalculate_returns_only_drifted_rows(self, db_connection):
+        drifted = await create_paybox(db_connection)
+        correct = await create_paybox(db_connection)
+        project_id = await create_project(db_connection)
+        await add_payment(db_connection, drifted, "incoming", 10, project_id=project_id)
+        await add_payment(db_connection, correct, "incoming", 20)
+        await db_connection.execute(payboxes.update().where(payboxes.c.id == drifted).values(balance=999))
+        await db_connection.execute(projects.update().where(projects.c.id == project_id).values(incoming=5))
+
+        rows = await db_connection.fetch_all(
+            text("SELECT * FROM payboxes_recalculate(:ids)").bindparams(ids=[drifted, correct])
+        )
+        assert [(r.paybox_id, r.old_balance, r.new_balance) for r in rows] == [(drifted, 999, 10)]
+
+        rows = await db_connection.fetch_all(
+            text("SELECT * FROM projects_recalculate(:ids)").bindparams(ids=[project_id])
+        )
+        assert [(r.project_id, r.old_incoming, r.new_incoming) for r in rows] == [(project_id, 5, 10)]
+
+    @pytest.mark.asyncio
+    async def test_recalculate_keeps_concurrent_payment(self, db_pool):
+        # счёт с расхождением; пока сверка ждёт блокировку счёта, параллельная
+        # транзакция проводит платёж — сверка должна его учесть, а не затереть
+        paybox_id = await create_paybox(db_pool, balance=999)
+        inserted, release = asyncio.Event(), asyncio.Event()
+
+        async def concurrent_payment():
+            async with db_pool.connection() as connection, connection.transaction():
+                await add_payment(connection, paybox_id, "incoming", 50)
+                inserted.set()
+                await release.wait()
+
+        async def recalculate():
+            return await db_pool.fetch_all(
+                text("SELECT * FROM payboxes_recalculate(:ids)").bindparams(ids=[paybox_id])
+            )
+
+        try:
+            holder = in_own_connection(concurrent_payment())
+            await inserted.wait()
+            recalculation = in_own_connection(recalculate())
+            await asyncio.sleep(0.2)
+            assert not recalculation.done()
+            release.set()
+            await holder
+
+            assert [r.new_balance for r in await recalculation] == [50]
+            assert await balance(db_pool, paybox_id) == 50
+        finally:
+            release.set()
+            await db_pool.execute(payments.delete().where(payments.c.paybox == paybox_id))
+            await db_pool.execute(payboxes.delete().where(payboxes.c.id == paybox_id))
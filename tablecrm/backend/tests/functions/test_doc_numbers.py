@@ -0,0 +1,80 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+from database.db import organizations, users_cboxes_relation
+from functions.doc_numbers import DOCS_PURCHASES, DOCS_SALES, DocNumberAllocator
+
+
+async def create_organization(connection) -> int:
+    owner_id = await connection.execute(users_cboxes_relation.insert().values(token="doc-numbers-test"))
+    return await connection.execute(
+        organizations.insert().values(type="test", short_name="test", owner=owner_id)
+    )
+
+
+async def delete_organization(connection, organization_id: int):
+    # счётчики удаляются каскадом
+    owner_id = await connection.fetch_val(
+        select(organizations.c.owner).where(organizations.c.id == organization_id)
+    )
+    await connection.execute(organizations.delete().where(organizations.c.id == organization_id))
+    await connection.execute(users_cboxes_relation.delete().where(users_cboxes_relation.c.id == owner_id))
+
+
+class TestDocNumberAllocator:
+    @pytest.mark.asyncio
+    async def test_empty_batch_does_not_touch_counter(self):
+        assert await DocNumberAllocator().allocate(1, DOCS_SALES, 0) == []
+
+    @pytest.mark.asyncio
+    async def test_numbers_are_sequential_per_doc_type(self, db_connection):
+        allocator = DocNumberAllocator(gap_free=True)
+        organization_id = await create_organization(db_connection)
+
+        assert await allocator.next(organization_id, DOCS_SALES, connection=db_connection) == "1"
+        assert await allocator.allocate(organization_id, DOCS_SALES, 3, connection=db_connection) == ["2", "3", "4"]
+        assert await allocator.next(organization_id, DOCS_PURCHASES, connection=db_connection) == "1"
+
+    @pytest.mark.asyncio
+    async def test_gap_free_number_returns_on_rollback(self, db_connection):
+        allocator = DocNumberAllocator(gap_free=True)
+        organization_id = await create_organization(db_connection)
+        await allocator.next(organization_id, DOCS_SALES, connection=db_connection)
+
+        transaction = await db_connection.transaction()
+        assert await allocator.next(organization_id, DOCS_SALES, connection=db_connection) == "2"
+        await transaction.rollback()
+
+        assert await allocator.next(organization_id, DOCS_SALES, connection=db_connection) == "2"
+
+    @pytest.mark.asyncio
+    async def test_committed_number_survives_caller_rollback(self, db_pool):
+        allocator = DocNumberAllocator(gap_free=False)
+        organization_id = await create_organization(db_pool)
+        try:
+            async with db_pool.connection() as connection:
+                transaction = await connection.transaction()
+                # connection передан, но без gap_free номер выделяется в своём соединении
+                assert await allocator.next(organization_id, DOCS_SALES, connection=connection) == "1"
+                await transaction.rollback()
+
+            assert await allocator.next(organization_id, DOCS_SALES) == "2"
+        finally:
+            await delete_organization(db_pool, organization_id)
+
+    @pytest.mark.asyncio
+    async def test_concurrent_allocations_do_not_collide(self, db_pool):
+        allocator = DocNumberAllocator(gap_free=False)
+        organization_id = await create_organization(db_pool)
+        try:
+            batches = await asyncio.gather(
+                *(allocator.allocate(organization_id, DOCS_SALES, 2) for _ in range(10))
+            )
+
+            numbers = sorted(int(number) for batch in batches for number in batch)
+            assert numbers == list(range(1, 21))
+            assert all(int(batch[1]) == int(batch[0]) + 1 for batch in batches)
+        finally:
+            await delete_organization(db_pool, organization_id)
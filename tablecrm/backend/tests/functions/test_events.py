@@ -0,0 +1,153 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import functions.events as events_module
+from functions.events import EventsPipeline
+
+
+class FakeDatabase:
+    """Запоминает пачки insert'ов в events; blocked — запись зависает."""
+
+    def __init__(self, fail: bool = False, blocked: bool = False):
+        self.fail = fail
+        self.blocked = blocked
+        self.batches = []
+
+    async def fetch_all(self, query):
+        if self.blocked:
+            await asyncio.Event().wait()
+        if self.fail:
+            raise ConnectionError("database is down")
+        # по параметру token на строку multi-row insert'а: token_m0, token_m1, ...
+        count = len([key for key in query.compile().params if key.split("_m")[0] == "token"])
+        self.batches.append(count)
+        first = sum(self.batches[:-1]) + 1
+        return [SimpleNamespace(id=first + i) for i in range(count)]
+
+
+class FakeResolver:
+    def __init__(self, relations: dict):
+        self.relations = relations
+        self.calls = []
+
+    async def resolve_many(self, tokens):
+        self.calls.append(set(tokens))
+        return {token: self.relations[token] for token in tokens if token in self.relations}
+
+
+class FakeManager:
+    def __init__(self):
+        self.messages = []
+
+    async def send_message(self, token, message):
+        self.messages.append((token, message))
+
+
+def event(token="t1", body=b"", content_type=None, **extra):
+    return dict(
+        type="cashevent", name="", method="GET", url="http://localhost/x", body=body,
+        content_type=content_type, token=token, ip=None, status_code=200, request_time=0.01, **extra,
+    )
+
+
+@pytest.fixture
+def fakes(monkeypatch):
+    database = FakeDatabase()
+    resolver = FakeResolver({"t1": SimpleNamespace(user=10, cashbox_id=1)})
+    manager = FakeManager()
+    monkeypatch.setattr(events_module, "database", database)
+    monkeypatch.setattr(events_module, "token_resolver", resolver)
+    monkeypatch.setattr(events_module, "manager", manager)
+    return SimpleNamespace(database=database, resolver=resolver, manager=manager)
+
+
+class TestEventsPipeline:
+    @pytest.mark.asyncio
+    async def test_put_before_start_is_dropped(self, fakes):
+        pipeline = EventsPipeline()
+
+        assert pipeline.put(**event()) is False
+        assert pipeline.stats()["dropped"] == 1
+
+    @pytest.mark.asyncio
+    async def test_writes_in_batches_of_batch_size(self, fakes):
+        pipeline = EventsPipeline(batch_size=3, flush_interval_ms=10_000)
+        await pipeline.start()
+        for _ in range(7):
+            assert pipeline.put(**event())
+        await pipeline.stop()
+
+        assert fakes.database.batches == [3, 3, 1]
+        assert pipeline.stats()["written"] == 7
+
+    @pytest.mark.asyncio
+    async def test_flushes_partial_batch_after_interval(self, fakes):
+        pipeline = EventsPipeline(batch_size=100, flush_interval_ms=20)
+        await pipeline.start()
+        pipeline.put(**event())
+        pipeline.put(**event())
+        await asyncio.sleep(0.1)
+
+        assert fakes.database.batches == [2]
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_full_queue_drops_events(self, fakes):
+        fakes.database.blocked = True
+        pipeline = EventsPipeline(batch_size=1, max_queue_size=2, stop_timeout=0.05)
+        await pipeline.start()
+        pipeline.put(**event())
+        await asyncio.sleep(0.01)  # воркер забрал первое событие и завис на записи
+
+        results = [pipeline.put(**event()) for _ in range(3)]
+
+        assert results == [True, True, False]
+        assert pipeline.stats()["dropped"] == 1
+        await pipeline.stop()
+
+    @pytest.mark.asyncio
+    async def test_stop_timeout_counts_lost_events(self, fakes):
+        fakes.database.blocked = True
+        pipeline = EventsPipeline(batch_size=1, stop_timeout=0.05)
+        await pipeline.start()
+        for _ in range(3):
+            pipeline.put(**event())
+        await pipeline.stop()
+
+        assert pipeline.is_running is False
+        # первое событие зависло в записи, два остались в очереди
+        assert pipeline.stats()["dropped"] == 2
+        assert pipeline.put(**event()) is False
+
+    @pytest.mark.asyncio
+    async def test_rows_are_resolved_and_announced(self, fakes):
+        pipeline = EventsPipeline(batch_size=10, flush_interval_ms=10_000)
+        await pipeline.start()
+        pipeline.put(**event(body=b'{"type": "incoming"}', content_type="application/json", name_from_payload=True))
+        pipeline.put(**event(token=None, body=b"not json", content_type="application/json"))
+        await pipeline.stop()
+
+        assert fakes.resolver.calls == [{"t1"}]
+        assert len(fakes.manager.messages) == 1
+        token, message = fakes.manager.messages[0]
+        assert token == "t1"
+        assert message["target"] == "events"
+        assert message["result"]["name"] == "incoming"
+        assert message["result"]["payload"] == {"type": "incoming"}
+        assert (message["result"]["user_id"], message["result"]["cashbox_id"]) == (10, 1)
+        assert message["result"]["id"] == 1
+
+    @pytest.mark.asyncio
+    async def test_failed_write_is_counted(self, fakes):
+        fakes.database.fail = True
+        pipeline = EventsPipeline(batch_size=10, flush_interval_ms=10_000)
+        await pipeline.start()
+        pipeline.put(**event())
+        pipeline.put(**event())
+        await pipeline.stop()
+
+        assert pipeline.stats()["failed"] == 2
+        assert pipeline.stats()["written"] == 0
+        assert fakes.manager.messages == []
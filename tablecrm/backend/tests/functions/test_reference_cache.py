@@ -0,0 +1,124 @@
+from types import SimpleNamespace
+
+import pytest
+from fastapi import HTTPException
+
+import functions.reference_cache as reference_cache_module
+from functions.reference_cache import ReferenceCache
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class FakeDatabase:
+    """Отвечает строками для существующих id; запоминает, какие id запрашивались."""
+
+    def __init__(self, existing):
+        self.existing = set(existing)
+        self.queries = []
+
+    async def fetch_all(self, query):
+        ids = next(value for value in query.compile().params.values() if isinstance(value, (list, tuple, set)))
+        self.queries.append(sorted(ids))
+        return [SimpleNamespace(id=idx) for idx in ids if idx in self.existing]
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(reference_cache_module.time, "monotonic", clock)
+    return clock
+
+
+@pytest.fixture
+def db(monkeypatch):
+    db = FakeDatabase({1, 2, 3, 4})
+    monkeypatch.setattr(reference_cache_module, "database", db)
+    return db
+
+
+class TestReferenceCache:
+    @pytest.mark.asyncio
+    async def test_unknown_ids_checked_in_one_query(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+
+        assert await cache.missing(7, "warehouses", [1, 2, 9, None, 2]) == {9}
+        assert await cache.missing(7, "warehouses", [1, 2, 3]) == set()
+
+        assert db.queries == [[1, 2, 9], [3]]
+        assert cache.stats() == {"items": 3, "hits": 2, "misses": 4}
+
+    @pytest.mark.asyncio
+    async def test_missing_ids_are_not_cached(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+        await cache.missing(7, "warehouses", [9])
+        db.existing.add(9)
+
+        # созданная запись видна сразу
+        assert await cache.missing(7, "warehouses", [9]) == set()
+
+    @pytest.mark.asyncio
+    async def test_entries_expire_after_ttl(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+        await cache.missing(7, "warehouses", [1])
+        clock.now += 59
+        await cache.missing(7, "warehouses", [1])
+        clock.now += 1
+
+        db.existing.discard(1)
+        assert await cache.missing(7, "warehouses", [1]) == {1}
+        assert db.queries == [[1], [1]]
+
+    @pytest.mark.asyncio
+    async def test_lru_evicts_least_recently_checked(self, clock, db):
+        cache = ReferenceCache(ttl=60, max_size=2)
+        await cache.missing(7, "warehouses", [1])
+        await cache.missing(7, "warehouses", [2])
+        await cache.missing(7, "warehouses", [1])
+        await cache.missing(7, "warehouses", [3])
+
+        assert list(cache._entries) == [(7, "warehouses", 1), (7, "warehouses", 3)]
+
+    @pytest.mark.asyncio
+    async def test_invalidate_drops_entry(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+        await cache.missing(7, "warehouses", [1, 2])
+        db.existing.discard(1)
+
+        cache.invalidate(7, "warehouses", [1])
+
+        assert await cache.missing(7, "warehouses", [1, 2]) == {1}
+        assert db.queries[-1] == [1]
+
+    @pytest.mark.asyncio
+    async def test_entries_are_per_cashbox_except_units(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+        await cache.missing(7, "warehouses", [1])
+        await cache.missing(8, "warehouses", [1])
+        await cache.missing(7, "units", [1])
+        await cache.missing(8, "units", [1])
+
+        assert db.queries == [[1], [1], [1]]
+
+        cache.invalidate(None, "units", [1])
+        assert cache.stats()["items"] == 2
+
+    @pytest.mark.asyncio
+    async def test_ensure_exist_raises_reference_error(self, clock, db):
+        cache = ReferenceCache(ttl=60)
+        await cache.ensure_exist(7, "contragents", [1, 2])
+
+        with pytest.raises(HTTPException) as error:
+            await cache.ensure_exist(7, "contragents", [1, 9])
+        assert error.value.status_code == 403
+        assert error.value.detail == "Введенный контрагент не принадлежит вам или не существует!"
+
+        with pytest.raises(HTTPException) as error:
+            await cache.ensure_exist(7, "warehouses", [8, 9])
+        assert error.value.status_code == 404
+        assert error.value.detail == "warehouse не существует! (warehouses.id: 8, 9)"
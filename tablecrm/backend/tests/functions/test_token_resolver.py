@@ -0,0 +1,135 @@
+from types import SimpleNamespace
+
+import pytest
+
+import functions.token_resolver as token_resolver_module
+from functions.token_resolver import TokenResolver
+
+
+def relation(token, user=1, cashbox_id=1):
+    return SimpleNamespace(token=token, user=user, cashbox_id=cashbox_id)
+
+
+class FakeDatabase:
+    """users_cboxes_relation в памяти; считает запросы к базе."""
+
+    def __init__(self, *rows):
+        self.rows = {row.token: row for row in rows}
+        self.queries = 0
+
+    def _tokens(self, query):
+        tokens = set()
+        for value in query.compile().params.values():
+            tokens.update(value if isinstance(value, (list, tuple, set)) else [value])
+        return tokens
+
+    async def fetch_one(self, query):
+        self.queries += 1
+        return next((self.rows[t] for t in self._tokens(query) if t in self.rows), None)
+
+    async def fetch_all(self, query):
+        self.queries += 1
+        return [self.rows[t] for t in self._tokens(query) if t in self.rows]
+
+
+@pytest.fixture
+def database(monkeypatch):
+    database = FakeDatabase(relation("a", user=1, cashbox_id=1), relation("b", user=2, cashbox_id=1),
+                            relation("c", user=3, cashbox_id=2))
+    monkeypatch.setattr(token_resolver_module, "database", database)
+    return database
+
+
+class TestTokenResolver:
+    @pytest.mark.asyncio
+    async def test_found_token_is_cached(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+
+        assert (await resolver.resolve("a")).user == 1
+        assert (await resolver.resolve("a")).user == 1
+        assert database.queries == 1
+        assert resolver.stats()["hits"] == 1
+
+    @pytest.mark.asyncio
+    async def test_unknown_token_is_not_cached(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+
+        assert await resolver.resolve("new") is None
+        database.rows["new"] = relation("new", user=9)
+
+        assert (await resolver.resolve("new")).user == 9
+        assert await resolver.resolve(None) is None
+        assert database.queries == 2
+
+    @pytest.mark.asyncio
+    async def test_expired_entry_is_reloaded(self, database, monkeypatch):
+        now = [1000.0]
+        monkeypatch.setattr(token_resolver_module.time, "monotonic", lambda: now[0])
+        resolver = TokenResolver(ttl=60, max_size=10)
+
+        await resolver.resolve("a")
+        now[0] += 61
+        await resolver.resolve("a")
+
+        assert database.queries == 2
+
+    @pytest.mark.asyncio
+    async def test_least_recently_used_is_evicted(self, database):
+        resolver = TokenResolver(ttl=60, max_size=2)
+
+        await resolver.resolve("a")
+        await resolver.resolve("b")
+        await resolver.resolve("a")
+        await resolver.resolve("c")
+
+        assert resolver.stats()["evictions"] == 1
+        assert set(resolver._cache) == {"a", "c"}
+
+    @pytest.mark.asyncio
+    async def test_resolve_many_queries_only_missing(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+        await resolver.resolve("a")
+
+        result = await resolver.resolve_many(["a", "b", "b", "unknown", None])
+
+        assert {token: row.user for token, row in result.items()} == {"a": 1, "b": 2}
+        assert database.queries == 2
+        assert resolver.stats()["misses"] == 3
+
+    @pytest.mark.asyncio
+    async def test_request_scope_memoizes_until_end(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+        scope = resolver.start_request()
+        try:
+            await resolver.resolve("a")
+            resolver.clear()
+            await resolver.resolve("a")
+        finally:
+            resolver.end_request(scope)
+
+        assert database.queries == 1
+        assert resolver.stats()["request_hits"] == 1
+        await resolver.resolve("a")
+        assert database.queries == 2
+
+    @pytest.mark.asyncio
+    async def test_invalidate_where_drops_matching_entries(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+        await resolver.resolve_many(["a", "b", "c"])
+
+        resolver.invalidate_where(cashbox_id=1)
+        assert set(resolver._cache) == {"c"}
+
+        resolver.invalidate_where(user_id=3)
+        assert resolver.stats()["size"] == 0
+        assert resolver.stats()["invalidations"] == 3
+
+    @pytest.mark.asyncio
+    async def test_notify_payload_invalidates_token(self, database):
+        resolver = TokenResolver(ttl=60, max_size=10)
+        await resolver.resolve("a")
+
+        resolver._on_notify(None, 1, token_resolver_module.INVALIDATE_CHANNEL, "a")
+        await resolver.resolve("a")
+
+        assert database.queries == 2
@@ -0,0 +1,166 @@
+import asyncio
+import contextvars
+
+import aiohttp
+import pytest
+
+import segments.helpers.outbound as outbound_module
+from segments.actions.outbound_campaigns import OutboundCampaigns
+from segments.helpers.outbound import OutboundExecutor
+
+marker = contextvars.ContextVar("marker", default=None)
+
+
+class FakeResponse:
+    def __init__(self, status, body=None):
+        self.status = status
+        self.body = body
+
+    async def json(self, content_type=None):
+        return self.body
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        pass
+
+
+class FakeSession:
+    """Отвечает по сценарию: статус, тело или исключение на каждую попытку."""
+
+    def __init__(self, script, delay=0.0):
+        self.script = list(script)
+        self.delay = delay
+        self.calls = []
+        self.active = 0
+        self.max_active = 0
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url))
+        return self._respond()
+
+    def _respond(self):
+        session = self
+
+        class _Context:
+            async def __aenter__(self):
+                session.active += 1
+                session.max_active = max(session.max_active, session.active)
+                try:
+                    await asyncio.sleep(session.delay)
+                finally:
+                    session.active -= 1
+                step = session.script.pop(0) if len(session.script) > 1 else session.script[0]
+                if isinstance(step, Exception):
+                    raise step
+                return FakeResponse(*step)
+
+            async def __aexit__(self, exc_type, exc_val, exc_tb):
+                pass
+
+        return _Context()
+
+
+class FakeClients:
+    def __init__(self, session):
+        self._session = session
+
+    def session(self, name):
+        return self._session
+
+
+@pytest.fixture
+def http(monkeypatch):
+    def install(script, delay=0.0):
+        session = FakeSession(script, delay)
+        monkeypatch.setattr(outbound_module, "http_clients", FakeClients(session))
+        return session
+    return install
+
+
+def executor(**kwargs):
+    kwargs.setdefault("default_rate", 1000)
+    return OutboundExecutor(backoff_base=0, **kwargs)
+
+
+class TestOutboundExecutor:
+    @pytest.mark.asyncio
+    async def test_retries_server_errors_until_success(self, http):
+        session = http([(503, None), (429, None), (200, {"ok": True})])
+        outbound = executor(max_retries=3)
+
+        assert await outbound.request("POST", "https://hook.example/x") == (200, {"ok": True})
+        assert len(session.calls) == 3
+        assert outbound.stats()["retries"] == 2
+        assert outbound.stats()["failures"] == 0
+
+    @pytest.mark.asyncio
+    async def test_client_error_is_not_retried(self, http):
+        session = http([(400, {"error": "bad"})])
+        outbound = executor(max_retries=3)
+
+        assert await outbound.request("POST", "https://hook.example/x") == (400, {"error": "bad"})
+        assert len(session.calls) == 1
+        assert outbound.stats()["failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_gives_up_after_max_retries(self, http):
+        session = http([aiohttp.ClientConnectionError("refused")])
+        outbound = executor(max_retries=2)
+
+        status, body = await outbound.request("GET", "https://hook.example/x")
+
+        assert status is None
+        assert "refused" in body
+        assert len(session.calls) == 3
+        assert outbound.stats()["failures"] == 1
+
+    @pytest.mark.asyncio
+    async def test_concurrency_is_limited(self, http):
+        session = http([(200, None)], delay=0.01)
+        outbound = executor(max_concurrency=3)
+
+        await asyncio.gather(*(outbound.request("POST", f"https://h{i % 2}.example/x") for i in range(10)))
+
+        assert session.max_active == 3
+
+    def test_buckets_are_per_host_key_and_rate(self):
+        outbound = executor()
+
+        first = outbound._bucket("https://api.example/a", None, "profile-1")
+        assert outbound._bucket("https://api.example/b", None, "profile-1") is first
+        assert outbound._bucket("https://api.example/a", None, "profile-2") is not first
+        assert outbound._bucket("https://other.example/a", None, "profile-1") is not first
+        assert outbound._bucket("https://api.example/a", 2, "profile-1") is not first
+        assert outbound.stats()["buckets"] == 4
+
+    @pytest.mark.asyncio
+    async def test_rate_limits_requests_to_one_host(self, http):
+        http([(200, None)])
+        outbound = executor()
+        loop = asyncio.get_running_loop()
+
+        started = loop.time()
+        for _ in range(3):
+            await outbound.request("POST", "https://slow.example/x", rate=20)
+
+        # ёмкость bucket'а — 1: второй и третий запрос ждут по 1/20 с
+        assert loop.time() - started >= 0.09
+
+
+class TestOutboundCampaigns:
+    @pytest.mark.asyncio
+    async def test_spawned_run_does_not_inherit_caller_context(self):
+        campaigns = OutboundCampaigns(executor())
+        seen = []
+
+        async def process(run_id):
+            seen.append((run_id, marker.get()))
+
+        campaigns.process = process
+        marker.set("caller connection")
+        campaigns._spawn(5)
+        await asyncio.gather(*campaigns._tasks)
+
+        assert seen == [(5, None)]
@@ -0,0 +1,127 @@
+import asyncio
+import contextvars
+from collections import defaultdict
+from types import SimpleNamespace
+
+import pytest
+
+import segments.scheduler as scheduler_module
+from segments.scheduler import SegmentScheduler
+
+marker = contextvars.ContextVar("marker", default=None)
+
+
+def row(segment_id, cashbox_id):
+    return SimpleNamespace(id=segment_id, cashbox_id=cashbox_id)
+
+
+class FakeWorkload:
+    """run_segment без базы: считает одновременные расчёты всего и по кассам."""
+
+    def __init__(self, rows, duration=0.01):
+        self.rows = rows
+        self.cashbox = {r.id: r.cashbox_id for r in rows}
+        self.duration = duration
+        self.running = 0
+        self.per_cashbox = defaultdict(int)
+        self.max_running = 0
+        self.max_per_cashbox = 0
+        self.order = []
+        self.inherited = []
+
+    async def get_due_segments(self):
+        return self.rows
+
+    async def run_segment(self, segment_id):
+        cashbox_id = self.cashbox[segment_id]
+        self.order.append(segment_id)
+        self.inherited.append(marker.get())
+        self.running += 1
+        self.per_cashbox[cashbox_id] += 1
+        self.max_running = max(self.max_running, self.running)
+        self.max_per_cashbox = max(self.max_per_cashbox, self.per_cashbox[cashbox_id])
+        await asyncio.sleep(self.duration)
+        self.running -= 1
+        self.per_cashbox[cashbox_id] -= 1
+
+
+def scheduler_for(workload, **kwargs):
+    scheduler = SegmentScheduler(lease_seconds=30, **kwargs)
+    scheduler.get_due_segments = workload.get_due_segments
+    scheduler.run_segment = workload.run_segment
+    return scheduler
+
+
+class TestSegmentScheduler:
+    def test_build_queue_interleaves_cashboxes(self):
+        rows = [row(1, 10), row(2, 10), row(3, 10), row(4, 20), row(5, 30), row(6, 20)]
+
+        queue = SegmentScheduler().build_queue(rows)
+
+        assert [r.id for r in queue] == [1, 4, 5, 2, 6, 3]
+
+    @pytest.mark.asyncio
+    async def test_run_respects_worker_and_cashbox_limits(self):
+        rows = [row(i, 1) for i in range(1, 7)] + [row(i, 2) for i in range(7, 10)] + [row(10, 3)]
+        workload = FakeWorkload(rows)
+
+        total = await scheduler_for(workload, max_workers=4, max_per_cashbox=2).run()
+
+        assert total == 10
+        assert sorted(workload.order) == list(range(1, 11))
+        assert workload.max_running == 4
+        assert workload.max_per_cashbox == 2
+        # первыми стартуют сегменты всех трёх касс, а не шесть подряд первой
+        assert {workload.cashbox[i] for i in workload.order[:3]} == {1, 2, 3}
+
+    @pytest.mark.asyncio
+    async def test_workers_do_not_inherit_caller_context(self):
+        # databases держит соединение в contextvars: воркер не должен получить соединение вызывающего
+        workload = FakeWorkload([row(1, 1), row(2, 2)])
+        marker.set("caller connection")
+
+        await scheduler_for(workload, max_workers=2, max_per_cashbox=1).run()
+
+        assert workload.inherited == [None, None]
+
+    @pytest.mark.asyncio
+    async def test_run_segment_skips_segment_leased_elsewhere(self, monkeypatch):
+        scheduler = SegmentScheduler(lease_seconds=30)
+        calls = []
+
+        async def acquire(segment_id, due=True):
+            return False
+
+        async def update_segment_task(segment_id, **kwargs):
+            calls.append(segment_id)
+
+        scheduler.acquire = acquire
+        monkeypatch.setattr(scheduler_module, "update_segment_task", update_segment_task)
+
+        await scheduler.run_segment(1)
+
+        assert calls == []
+
+    @pytest.mark.asyncio
+    async def test_lease_is_released_when_recalculation_fails(self, monkeypatch):
+        scheduler = SegmentScheduler(lease_seconds=30)
+        released = []
+
+        async def acquire(segment_id, due=True):
+            return True
+
+        async def release(segment_id):
+            released.append(segment_id)
+
+        async def update_segment_task(segment_id, incremental, worker):
+            assert incremental is True
+            assert worker == scheduler.owner
+            raise RuntimeError("boom")
+
+        scheduler.acquire = acquire
+        scheduler.release = release
+        monkeypatch.setattr(scheduler_module, "update_segment_task", update_segment_task)
+
+        await scheduler.run_segment(7)
+
+        assert released == [7]
@@ -0,0 +1,270 @@
+import asyncio
+import json
+
+import pytest
+
+from ws_manager import WS_CLOSE_SLOW_CONSUMER, ConnectionManager, UpdateCoalescer, WebSocketBus, WebSocketHub
+
+
+class FakeSocket:
+    """Сокет в памяти: запоминает отправленные кадры; stuck — не отвечает вовсе."""
+
+    def __init__(self, stuck: bool = False):
+        self.stuck = stuck
+        self.sent = []
+        self.closed_code = None
+
+    async def send_text(self, text: str):
+        if self.stuck:
+            await asyncio.Event().wait()
+        self.sent.append(json.loads(text))
+
+    async def close(self, code: int = 1000):
+        self.closed_code = code
+
+
+class FakeMessage:
+    def __init__(self, body: str, **headers):
+        self.body = body.encode("utf-8")
+        self.headers = headers
+
+
+async def drain(hub: WebSocketHub):
+    while any(subscriber.queue.qsize() for subscriber in hub._subscribers.values()):
+        await asyncio.sleep(0.001)
+    await asyncio.sleep(0.001)
+
+
+class TestWebSocketHub:
+    @pytest.mark.asyncio
+    async def test_publish_reaches_only_sockets_of_key(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        first, second, other = FakeSocket(), FakeSocket(), FakeSocket()
+        hub.add(first, ["token:a", "cashbox:1"])
+        hub.add(second, ["token:b", "cashbox:1"])
+        hub.add(other, ["token:c", "cashbox:2"])
+
+        await hub.publish("token:a", {"n": 1})
+        await hub.publish("cashbox:1", {"n": 2})
+        await drain(hub)
+
+        assert first.sent == [{"n": 1}, {"n": 2}]
+        assert second.sent == [{"n": 2}]
+        assert other.sent == []
+        assert [s.websocket for s in hub.subscribers("cashbox:1")] == [first, second]
+
+    @pytest.mark.asyncio
+    async def test_remove_drops_empty_keys(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        socket = FakeSocket()
+        hub.add(socket, ["token:a", "cashbox:1"])
+
+        assert hub.remove(socket).keys == ["token:a", "cashbox:1"]
+        assert hub.remove(socket) is None
+        assert hub.stats()["keys"] == 0
+        assert hub.subscribers("token:a") == []
+
+    @pytest.mark.asyncio
+    async def test_add_again_replaces_keys(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        socket = FakeSocket()
+        hub.add(socket, ["token:a"])
+        hub.add(socket, ["token:b"])
+
+        assert hub.subscribers("token:a") == []
+        assert hub.get(socket).keys == ["token:b"]
+        hub.remove(socket)
+
+    @pytest.mark.asyncio
+    async def test_overflow_evicts_slow_socket(self):
+        hub = WebSocketHub(queue_size=2, send_timeout=10)
+        slow, fast = FakeSocket(stuck=True), FakeSocket()
+        hub.add(slow, ["cashbox:1"])
+        hub.add(fast, ["cashbox:1"])
+
+        for i in range(4):
+            await hub.publish("cashbox:1", {"n": i})
+            await asyncio.sleep(0.001)
+        await drain(hub)
+
+        assert hub.get(slow) is None
+        assert slow.closed_code == WS_CLOSE_SLOW_CONSUMER
+        assert hub.get(fast) is not None
+        assert [frame["n"] for frame in fast.sent] == [0, 1, 2, 3]
+        assert hub.stats()["evicted"] == 1
+        hub.remove(fast)
+
+    @pytest.mark.asyncio
+    async def test_send_timeout_evicts_socket(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=0.01)
+        stuck = FakeSocket(stuck=True)
+        hub.add(stuck, ["token:a"])
+
+        await hub.publish("token:a", {"n": 1})
+        await asyncio.sleep(0.05)
+
+        assert hub.get(stuck) is None
+        assert stuck.closed_code == WS_CLOSE_SLOW_CONSUMER
+        assert hub.stats()["evicted"] == 1
+
+    @pytest.mark.asyncio
+    async def test_send_goes_through_socket_queue(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        socket = FakeSocket()
+        hub.add(socket, ["chats_cashbox:1"])
+
+        assert hub.send(socket, {"type": "connected"})
+        await hub.publish("chats_cashbox:1", {"type": "message"})
+        await drain(hub)
+
+        assert socket.sent == [{"type": "connected"}, {"type": "message"}]
+        assert hub.send(FakeSocket(), {"type": "connected"}) is False
+        hub.remove(socket)
+
+    @pytest.mark.asyncio
+    async def test_unserializable_message_is_skipped(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        socket = FakeSocket()
+        hub.add(socket, ["token:a"])
+
+        await hub.publish("token:a", {"value": object()})
+        await drain(hub)
+
+        assert socket.sent == []
+        assert hub.stats()["errors"] == 1
+        hub.remove(socket)
+
+
+class TestWebSocketBus:
+    @pytest.mark.asyncio
+    async def test_skips_own_messages(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        bus = WebSocketBus(hub)
+        socket = FakeSocket()
+        hub.add(socket, ["token:a"])
+
+        await bus._on_message(FakeMessage('{"n":1}', origin=bus.origin, key="token:a", kind="message"))
+        await bus._on_message(FakeMessage('{"n":2}', origin="other", key=b"token:a", kind=b"message"))
+        await drain(hub)
+
+        assert socket.sent == [{"n": 2}]
+        assert bus.stats()["received"] == 1
+        hub.remove(socket)
+
+    @pytest.mark.asyncio
+    async def test_remote_connect_notifies_listeners_without_republishing(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        bus = WebSocketBus(hub, buffer_size=8)
+        bus._buffer = asyncio.Queue(maxsize=8)
+        hub.bus = bus
+        connected = []
+        hub.connect_listeners.append(connected.append)
+
+        await bus._on_message(FakeMessage('["token:a"]', origin="other", kind="connected"))
+
+        assert connected == [["token:a"]]
+        assert bus.stats()["buffered"] == 0
+
+    @pytest.mark.asyncio
+    async def test_publish_buffers_for_other_processes(self):
+        hub = WebSocketHub(queue_size=8, send_timeout=1)
+        bus = WebSocketBus(hub, buffer_size=1)
+        bus._buffer = asyncio.Queue(maxsize=1)
+        hub.bus = bus
+
+        await hub.publish("token:a", {"n": 1})
+        await hub.publish("token:a", {"n": 2})
+
+        assert bus._buffer.get_nowait() == ("token:a", '{"n":1}', "message")
+        assert bus.stats()["dropped"] == 1
+
+
+def coalescer(window: float = 60):
+    hub = WebSocketHub(queue_size=64, send_timeout=1)
+    socket = FakeSocket()
+    hub.add(socket, ["token:a"])
+    return UpdateCoalescer(hub, window=window), socket
+
+
+class TestUpdateCoalescer:
+    @pytest.mark.asyncio
+    async def test_window_keeps_last_update_per_row(self):
+        updates, socket = coalescer(window=0.05)
+        for balance in (1, 2, 3):
+            await updates.send("token:a", {"action": "edit", "target": "payboxes", "result": {"id": 1, "balance": balance}})
+        await updates.send("token:a", {"action": "edit", "target": "payboxes", "result": {"id": 2, "balance": 9}})
+
+        await asyncio.sleep(0.1)
+        await drain(updates.hub)
+
+        assert socket.sent == [{
+            "action": "edit", "target": "payboxes",
+            "result": [{"id": 1, "balance": 3}, {"id": 2, "balance": 9}],
+        }]
+        assert updates.stats()["coalesced"] == 2 and updates.stats()["pending"] == 0
+
+    @pytest.mark.asyncio
+    async def test_single_row_keeps_callers_shape(self):
+        updates, socket = coalescer()
+        await updates.send("token:a", {"action": "edit", "target": "payboxes", "result": {"id": 1}})
+        await updates.send("token:a", {"action": "create", "target": "docs_sales", "result": [{"id": 5}]})
+        await updates.flush("token:a")
+        await drain(updates.hub)
+
+        assert socket.sent == [
+            {"action": "edit", "target": "payboxes", "result": {"id": 1}},
+            {"action": "create", "target": "docs_sales", "result": [{"id": 5}]},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_rows_without_id_go_out_after_pending(self):
+        updates, socket = coalescer()
+        await updates.send("token:a", {"action": "edit", "target": "payboxes", "result": {"id": 1}})
+        await updates.send("token:a", {"action": "delete", "target": "payboxes", "result": [1, 2]})
+        await drain(updates.hub)
+
+        assert [message["action"] for message in socket.sent] == ["edit", "delete"]
+        assert not updates.has_pending("token:a")
+
+    @pytest.mark.asyncio
+    async def test_patch_sends_only_changed_fields(self):
+        updates, socket = coalescer()
+        message = {"action": "edit", "target": "projects"}
+        await updates.send("token:a", {**message, "result": {"id": 1, "name": "x", "incoming": 10}}, patch=True)
+        await updates.flush("token:a")
+        await updates.send("token:a", {**message, "result": {"id": 1, "name": "x", "incoming": 15}}, patch=True)
+        await updates.flush("token:a")
+        await updates.send("token:a", {**message, "result": {"id": 1, "name": "x", "incoming": 15}}, patch=True)
+        await updates.flush("token:a")
+        await drain(updates.hub)
+
+        assert socket.sent == [
+            {**message, "result": {"id": 1, "name": "x", "incoming": 10}},
+            {**message, "result": {"incoming": 15, "id": 1}, "patch": True},
+        ]
+
+    @pytest.mark.asyncio
+    async def test_new_socket_resets_snapshots(self):
+        updates, socket = coalescer()
+        row = {"action": "edit", "target": "projects", "result": {"id": 1, "incoming": 10}}
+        await updates.send("token:a", row, patch=True)
+        await updates.flush("token:a")
+
+        reconnected = FakeSocket()
+        updates.hub.add(reconnected, ["token:a"])
+        await updates.send("token:a", row, patch=True)
+        await updates.flush("token:a")
+        await drain(updates.hub)
+
+        assert reconnected.sent == [row]
+        assert updates.stats()["snapshots"] == 1
+
+    @pytest.mark.asyncio
+    async def test_send_message_flushes_pending_first(self):
+        updates, socket = coalescer()
+        manager = ConnectionManager(updates.hub, updates)
+        await manager.send_update("a", {"action": "edit", "target": "payboxes", "result": {"id": 1}})
+        await manager.send_message("a", {"action": "notify"})
+        await drain(updates.hub)
+
+        assert [message["action"] for message in socket.sent] == ["edit", "notify"]
@@ -4,7 +4,9 @@ import os
 import databases
 
 from api.apple_wallet.handlers.AppleWalletCardUpdateHandler import AppleWalletCardUpdateHandler
+from api.apple_wallet.handlers.AppleWalletCardsBatchUpdateHandler import AppleWalletCardsBatchUpdateHandler
 from api.apple_wallet.messages.AppleWalletCardUpdateMessage import AppleWalletCardUpdateMessage
+from api.apple_wallet.messages.AppleWalletCardsBatchUpdateMessage import AppleWalletCardsBatchUpdateMessage
 from api.docs_sales.handlers.RecalculateFinancialsHandler import RecalculateFinancialsHandler
 from api.docs_sales.handlers.RecalculateLoyaltyPointsHandler import RecalculateLoyaltyPointsHandler
 from api.docs_sales.messages.RecalculateFinancialsMessageModel import RecalculateFinancialsMessageModel
@@ -22,6 +24,7 @@ from common.amqp_messaging.common.core.IRabbitMessaging import IRabbitMessaging
 from common.amqp_messaging.common.impl.RabbitFactory import RabbitFactory
 from common.amqp_messaging.common.impl.models.QueueSettingsModel import QueueSettingsModel
 from common.amqp_messaging.models.RabbitMqSettings import RabbitMqSettings
+from common.http_client.registry import http_clients
 from database.db import database
 
 
@@ -49,6 +52,7 @@ async def startup():
     ))
     await rabbitmq_messaging.subscribe(TechCardWarehouseOperationMessage, TechCardWarehouseOperationHandler())
     await rabbitmq_messaging.subscribe(AppleWalletCardUpdateMessage, AppleWalletCardUpdateHandler())
+    await rabbitmq_messaging.subscribe(AppleWalletCardsBatchUpdateMessage, AppleWalletCardsBatchUpdateHandler())
     await rabbitmq_messaging.subscribe(CreateMarketplaceOrderMessage, CreateMarketplaceOrderHandler())
 
     await rabbitmq_messaging.install([
@@ -81,9 +85,11 @@ async def startup():
             prefetch_count=1
         )
     ])
-    await asyncio.Future()
-
-    await database.disconnect()
+    try:
+        await asyncio.Future()
+    finally:
+        await http_clients.close()
+        await database.disconnect()
 
 if __name__ == "__main__":
     loop = asyncio.new_event_loop()
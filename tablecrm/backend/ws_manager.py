@@ -1,28 +1,511 @@
-from typing import List, Dict
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set, Tuple
 
+import aio_pika
+from aio_pika.abc import AbstractIncomingMessage
 from fastapi import WebSocket
 
+from common.amqp_messaging.amqp_connection.impl.AmqpConnection import AmqpConnection
+from common.amqp_messaging.models.RabbitMqSettings import RabbitMqSettings
+
+logger = logging.getLogger(__name__)
+
+# закрытие медленного клиента: "Try Again Later"
+WS_CLOSE_SLOW_CONSUMER = 1013
+
+
+class Subscriber:
+    """Сокет в хабе: ключи индекса, данные менеджера и очередь исходящих сообщений."""
+
+    __slots__ = ("websocket", "keys", "info", "queue", "task")
+
+    def __init__(self, websocket: WebSocket, keys: List[str], info: Any, queue_size: int):
+        self.websocket = websocket
+        self.keys = keys
+        self.info = info
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.task: Optional[asyncio.Task] = None
+
+
+class WebSocketHub:
+    """
+    Сокеты процесса с индексом ключ -> сокеты (ключи вида "token:...", "chat:...").
+
+    Сообщение сериализуется один раз и кладётся в ограниченную очередь каждого
+    сокета ключа; отправляет его задача сокета, поэтому рассылка не ждёт
+    медленных клиентов. Переполненная очередь или отправка дольше send_timeout —
+    медленный клиент: сокет закрывается и уходит из индекса.
+    Если запущена шина (WebSocketBus), сообщение доставляется и сокетам
+    других процессов.
+    """
+
+    def __init__(
+            self,
+            queue_size: int = int(os.getenv("WS_SEND_QUEUE_SIZE", 256)),
+            send_timeout: float = float(os.getenv("WS_SEND_TIMEOUT", 10)),
+    ):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self._index: Dict[str, Dict[WebSocket, Subscriber]] = {}
+        self._subscribers: Dict[WebSocket, Subscriber] = {}
+        self.bus: Optional["WebSocketBus"] = None
+        # вызываются с ключами нового сокета, в том числе подключённого к другому процессу
+        self.connect_listeners: List[Callable[[List[str]], None]] = []
+
+        self.sent = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "sockets": len(self._subscribers),
+            "keys": len(self._index),
+            "queued": sum(subscriber.queue.qsize() for subscriber in self._subscribers.values()),
+            "sent": self.sent,
+            "evicted": self.evicted,
+            "errors": self.errors,
+            "bus": self.bus.stats() if self.bus is not None else None,
+        }
+
+    def add(self, websocket: WebSocket, keys: Iterable[str], info: Any = None) -> Subscriber:
+        """Сокет уже принят (accept); повторное добавление заменяет ключи и info."""
+        self.remove(websocket)
+        subscriber = Subscriber(websocket, list(keys), info, self.queue_size)
+        self._subscribers[websocket] = subscriber
+        for key in subscriber.keys:
+            self._index.setdefault(key, {})[websocket] = subscriber
+        subscriber.task = asyncio.create_task(self._sender(subscriber))
+        self.connected(subscriber.keys)
+        return subscriber
+
+    def connected(self, keys: List[str], remote: bool = False):
+        for listener in self.connect_listeners:
+            listener(keys)
+        if not remote and self.bus is not None:
+            self.bus.publish_connected(keys)
+
+    def remove(self, websocket: WebSocket) -> Optional[Subscriber]:
+        subscriber = self._subscribers.pop(websocket, None)
+        if subscriber is None:
+            return None
+        for key in subscriber.keys:
+            sockets = self._index.get(key)
+            if sockets is not None:
+                sockets.pop(websocket, None)
+                if not sockets:
+                    del self._index[key]
+        if subscriber.task is not None and subscriber.task is not asyncio.current_task():
+            subscriber.task.cancel()
+        return subscriber
+
+    def get(self, websocket: WebSocket) -> Optional[Subscriber]:
+        return self._subscribers.get(websocket)
+
+    def subscribers(self, key: str) -> List[Subscriber]:
+        """Сокеты ключа в этом процессе."""
+        return list(self._index.get(key, {}).values())
+
+    async def _close(self, websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    async def _sender(self, subscriber: Subscriber):
+        try:
+            while True:
+                text = await subscriber.queue.get()
+                await asyncio.wait_for(subscriber.websocket.send_text(text), self.send_timeout)
+                self.sent += 1
+        except asyncio.CancelledError:
+            raise
+        except asyncio.TimeoutError:
+            self.evicted += 1
+            self.remove(subscriber.websocket)
+            await self._close(subscriber.websocket, WS_CLOSE_SLOW_CONSUMER)
+        except Exception:
+            # клиент отключился: endpoint ещё вызовет disconnect, remove идемпотентен
+            self.errors += 1
+            self.remove(subscriber.websocket)
+
+    def _evict(self, subscriber: Subscriber):
+        self.evicted += 1
+        self.remove(subscriber.websocket)
+        asyncio.create_task(self._close(subscriber.websocket, WS_CLOSE_SLOW_CONSUMER))
+
+    def _dumps(self, key: str, message: dict) -> Optional[str]:
+        try:
+            # как WebSocket.send_json
+            return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            self.errors += 1
+            logger.warning(f"WebSocket message for {key} is not serializable: {e}")
+            return None
+
+    def deliver(self, key: str, text: str) -> int:
+        """Положить готовый JSON в очереди сокетов ключа этого процесса."""
+        sockets = self._index.get(key)
+        if not sockets:
+            return 0
+        slow = []
+        for subscriber in sockets.values():
+            try:
+                subscriber.queue.put_nowait(text)
+            except asyncio.QueueFull:
+                slow.append(subscriber)
+        delivered = len(sockets) - len(slow)
+        for subscriber in slow:
+            self._evict(subscriber)
+        return delivered
+
+    def send(self, websocket: WebSocket, message: dict) -> bool:
+        """
+        Сообщение одному сокету хаба (ответ endpoint'а) через его очередь:
+        после add() в сокет пишет только задача отправки, прямой send_json
+        из endpoint'а перемешал бы кадры с рассылками.
+        """
+        subscriber = self._subscribers.get(websocket)
+        if subscriber is None:
+            return False
+        text = self._dumps(f"socket {id(websocket)}", message)
+        if text is None:
+            return False
+        try:
+            subscriber.queue.put_nowait(text)
+        except asyncio.QueueFull:
+            self._evict(subscriber)
+            return False
+        return True
+
+    async def publish(self, key: str, message: dict):
+        text = self._dumps(key, message)
+        if text is None:
+            return
+        self.deliver(key, text)
+        if self.bus is not None:
+            self.bus.publish(key, text)
+
+
+class WebSocketBus:
+    """
+    Доставка сообщений хаба сокетам других процессов (воркеры uvicorn)
+    через fanout-обменник RabbitMQ.
+
+    Каждый процесс читает свою эксклюзивную очередь, привязанную к обменнику,
+    и пропускает свои же сообщения — локальным сокетам они уже доставлены.
+    Публикация не ждёт брокера: сообщения копятся в ограниченном буфере
+    и отправляются фоновой задачей; при переполнении буфера сообщение
+    теряется (как и при отправке в закрытый сокет). В очереди процесса
+    сообщения живут не дольше message_ttl секунд. При остановке буфер
+    дописывается в обменник не дольше drain_timeout секунд.
+
+    consume=False — только публикация: для процессов без сокетов
+    (задачи планировщика), которым некому доставлять чужие сообщения.
+    """
+
+    def __init__(
+            self,
+            hub: WebSocketHub,
+            exchange_name: str = os.getenv("WS_FANOUT_EXCHANGE", "ws.fanout"),
+            buffer_size: int = int(os.getenv("WS_FANOUT_BUFFER_SIZE", 10000)),
+            message_ttl: int = 30,
+            drain_timeout: float = 5,
+    ):
+        self.hub = hub
+        self.exchange_name = exchange_name
+        self.message_ttl = message_ttl
+        self.drain_timeout = drain_timeout
+        self.buffer_size = buffer_size
+        self.origin = uuid.uuid4().hex
+        self._buffer: Optional[asyncio.Queue] = None
+        self._connection: Optional[AmqpConnection] = None
+        self._exchange: Optional[aio_pika.abc.AbstractExchange] = None
+        self._publisher: Optional[asyncio.Task] = None
+
+        self.published = 0
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+
+    def stats(self) -> dict:
+        return {
+            "buffered": self._buffer.qsize() if self._buffer is not None else 0,
+            "published": self.published,
+            "received": self.received,
+            "dropped": self.dropped,
+            "errors": self.errors,
+        }
+
+    async def start(self, settings: RabbitMqSettings, consume: bool = True):
+        if self._publisher is not None:
+            return
+        self._connection = AmqpConnection(settings=settings)
+        await self._connection.install()
+
+        channel = await self._connection.get_channel()
+        self._exchange = await channel.declare_exchange(
+            self.exchange_name, aio_pika.ExchangeType.FANOUT, durable=False,
+        )
+        if consume:
+            queue = await channel.declare_queue(
+                exclusive=True,
+                auto_delete=True,
+                arguments={"x-message-ttl": self.message_ttl * 1000},
+            )
+            await queue.bind(self._exchange)
+            await queue.consume(self._on_message, no_ack=True)
+
+        self._buffer = asyncio.Queue(maxsize=self.buffer_size)
+        self._publisher = asyncio.create_task(self._publish_loop())
+        self.hub.bus = self
+
+    async def stop(self):
+        if self.hub.bus is self:
+            self.hub.bus = None
+        if self._publisher is None:
+            return
+        try:
+            await asyncio.wait_for(self._buffer.join(), timeout=self.drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"WebSocket bus stopped with {self._buffer.qsize()} unpublished messages")
+        self._publisher.cancel()
+        self._publisher = None
+
+    def _put(self, key: str, text: str, kind: str):
+        try:
+            self._buffer.put_nowait((key, text, kind))
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def publish(self, key: str, text: str):
+        self._put(key, text, "message")
+
+    def publish_connected(self, keys: List[str]):
+        self._put("", json.dumps(keys), "connected")
+
+    async def _publish_loop(self):
+        while True:
+            key, text, kind = await self._buffer.get()
+            try:
+                await self._exchange.publish(
+                    aio_pika.Message(
+                        body=text.encode("utf-8"),
+                        content_type="application/json",
+                        content_encoding="utf-8",
+                        headers={"origin": self.origin, "key": key, "kind": kind},
+                        delivery_mode=aio_pika.DeliveryMode.NOT_PERSISTENT,
+                        expiration=self.message_ttl,
+                    ),
+                    routing_key="",
+                )
+                self.published += 1
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.errors += 1
+                logger.warning(f"Failed to publish WebSocket message for {key}: {e}")
+            finally:
+                self._buffer.task_done()
+
+    async def _on_message(self, message: AbstractIncomingMessage):
+        headers = message.headers or {}
+        if headers.get("origin") == self.origin:
+            return
+        key, kind = headers.get("key"), headers.get("kind") or "message"
+        if isinstance(key, bytes):
+            key = key.decode("utf-8")
+        if isinstance(kind, bytes):
+            kind = kind.decode("utf-8")
+        self.received += 1
+        if kind == "connected":
+            self.hub.connected(json.loads(message.body.decode("utf-8")), remote=True)
+        elif key:
+            self.hub.deliver(key, message.body.decode("utf-8"))
+
+
+class UpdateCoalescer:
+    """
+    Объединение частых обновлений строк (балансы счетов и проектов, цены,
+    документы, смены) в пределах окна window секунд.
+
+    По (ключ хаба, action, target, id строки) остаётся последнее обновление;
+    когда окно ключа истекает, обновления уходят одним сообщением на
+    (action, target): списком в "result", если вызывающий передал список
+    (как пакетные "create"/"edit") или строк несколько, иначе одной строкой,
+    как раньше. Порядок относительно прочих сообщений
+    сохраняет ConnectionManager: send_message сначала отправляет накопленное.
+
+    patch=True: отправляются только поля, изменившиеся с прошлой отправки
+    строки в этот ключ (плюс поле id), с "patch": true; неизменившаяся строка
+    не отправляется вовсе. Снимки отправленного хранятся в процессе не дольше
+    snapshot_ttl — без снимка строка уходит целиком. Новый сокет ключа
+    (в любом процессе, через шину) сбрасывает снимки ключа, поэтому
+    переподключившийся клиент сначала получает строки целиком.
+    """
+
+    def __init__(
+            self,
+            hub: WebSocketHub,
+            window: float = float(os.getenv("WS_COALESCE_WINDOW", 0.2)),
+            snapshot_ttl: float = float(os.getenv("WS_PATCH_SNAPSHOT_TTL", 300)),
+            snapshot_size: int = int(os.getenv("WS_PATCH_SNAPSHOT_SIZE", 50000)),
+    ):
+        self.hub = hub
+        self.window = window
+        self.snapshot_ttl = snapshot_ttl
+        self.snapshot_size = snapshot_size
+        # ключ хаба -> (action, target, id) -> (сообщение с одной строкой, id_field, patch, списком)
+        self._pending: Dict[str, "OrderedDict[Tuple[Any, Any, Any], Tuple[dict, str, bool, bool]]"] = {}
+        self._flushers: Dict[str, asyncio.Task] = {}
+        self._snapshots: "OrderedDict[Tuple[str, Any, Any], Tuple[float, dict]]" = OrderedDict()
+        self._snapshot_keys: Dict[str, Set[Tuple[str, Any, Any]]] = {}
+        hub.connect_listeners.append(self.reset)
+
+        self.received = 0
+        self.coalesced = 0
+        self.flushed = 0
+
+    def stats(self) -> dict:
+        return {
+            "pending": sum(len(pending) for pending in self._pending.values()),
+            "snapshots": len(self._snapshots),
+            "received": self.received,
+            "coalesced": self.coalesced,
+            "flushed": self.flushed,
+        }
+
+    def reset(self, keys: List[str]):
+        """Забыть отправленные ключам строки: следующие patch уйдут целиком."""
+        for key in keys:
+            for snapshot_key in self._snapshot_keys.pop(key, ()):
+                self._snapshots.pop(snapshot_key, None)
+
+    def has_pending(self, key: str) -> bool:
+        return key in self._pending
+
+    async def send(self, key: str, message: dict, id_field: str = "id", patch: bool = False):
+        """message["result"] — строка или список строк с полем id_field."""
+        result = message.get("result")
+        as_list = isinstance(result, list)
+        rows = result if as_list else [result]
+        if not rows or not all(isinstance(row, dict) and row.get(id_field) is not None for row in rows):
+            await self.flush(key)
+            await self.hub.publish(key, message)
+            return
+
+        pending = self._pending.setdefault(key, OrderedDict())
+        for row in rows:
+            self.received += 1
+            item_key = (message.get("action"), message.get("target"), row[id_field])
+            if item_key in pending:
+                self.coalesced += 1
+            pending[item_key] = ({**message, "result": row}, id_field, patch, as_list)
+
+        if key not in self._flushers:
+            self._flushers[key] = asyncio.create_task(self._flush_later(key))
+
+    async def _flush_later(self, key: str):
+        await asyncio.sleep(self.window)
+        self._flushers.pop(key, None)
+        await self.flush(key)
+
+    def _diff(self, key: str, target: Any, row_id: Any, row: dict, id_field: str) -> Optional[dict]:
+        now = time.monotonic()
+        snapshot_key = (key, target, row_id)
+        cached = self._snapshots.pop(snapshot_key, None)
+        self._snapshots[snapshot_key] = (now, dict(row))
+        self._snapshot_keys.setdefault(key, set()).add(snapshot_key)
+        while len(self._snapshots) > self.snapshot_size:
+            evicted_key, _ = self._snapshots.popitem(last=False)
+            keys = self._snapshot_keys.get(evicted_key[0])
+            if keys is not None:
+                keys.discard(evicted_key)
+                if not keys:
+                    del self._snapshot_keys[evicted_key[0]]
+
+        if cached is None or now - cached[0] >= self.snapshot_ttl:
+            return row
+        previous = cached[1]
+        changed = {field: value for field, value in row.items() if field not in previous or previous[field] != value}
+        if not changed:
+            return None
+        changed[id_field] = row_id
+        return changed
+
+    async def flush(self, key: str):
+        pending = self._pending.pop(key, None)
+        flusher = self._flushers.pop(key, None)
+        if flusher is not None and flusher is not asyncio.current_task():
+            flusher.cancel()
+        if not pending:
+            return
+
+        # (action, target, patch) -> (последнее сообщение группы, строки, списком)
+        groups: "OrderedDict[Tuple[Any, Any, bool], Tuple[dict, List[dict], bool]]" = OrderedDict()
+        for (action, target, row_id), (message, id_field, patch, as_list) in pending.items():
+            row = message["result"]
+            is_patch = False
+            if patch:
+                row = self._diff(key, target, row_id, row, id_field)
+                if row is None:
+                    continue
+                is_patch = row is not message["result"]
+            group_key = (action, target, is_patch)
+            rows, group_as_list = groups[group_key][1:] if group_key in groups else ([], False)
+            groups[group_key] = (message, rows, group_as_list or as_list)
+            rows.append(row)
+
+        for (action, target, is_patch), (message, rows, as_list) in groups.items():
+            batch = {**message, "result": rows if as_list or len(rows) > 1 else rows[0]}
+            if is_patch:
+                batch["patch"] = True
+            self.flushed += 1
+            await self.hub.publish(key, batch)
+
+    async def flush_all(self):
+        for key in list(self._pending):
+            await self.flush(key)
+
 
 class ConnectionManager:
-    def __init__(self):
-        self.active_connections: List[Dict] = []
+    """Сокеты /ws/{token}/: сообщения по токену пользователя или всей кассе."""
 
-    async def connect(self, token: str, websocket: WebSocket):
+    def __init__(self, hub: WebSocketHub, updates: UpdateCoalescer):
+        self.hub = hub
+        self.updates = updates
+
+    async def connect(self, token: str, websocket: WebSocket, cashbox_id: Optional[int] = None):
         await websocket.accept()
-        self.active_connections.append({"token": token, "socket": websocket})
+        keys = [f"token:{token}"]
+        if cashbox_id is not None:
+            keys.append(f"cashbox:{cashbox_id}")
+        self.hub.add(websocket, keys)
 
     async def disconnect(self, token: str, ws: WebSocket):
         # await ws.close()
-        self.active_connections.remove({"token": token, "socket": ws})
+        self.hub.remove(ws)
 
     async def send_message(self, token: str, message: dict):
-        try:
-            matches = [
-                x for x in self.active_connections if x["token"] == token]
-            for ws in matches:
-                await ws['socket'].send_json(message)
-        except Exception as e:
-            print(e)
+        key = f"token:{token}"
+        if self.updates.has_pending(key):
+            await self.updates.flush(key)
+        await self.hub.publish(key, message)
+
+    async def send_update(self, token: str, message: dict, id_field: str = "id", patch: bool = False):
+        """Обновление строк через UpdateCoalescer: доставляется не позже чем через окно."""
+        await self.updates.send(f"token:{token}", message, id_field, patch)
+
+    async def send_to_cashbox(self, cashbox_id: int, message: dict):
+        await self.hub.publish(f"cashbox:{cashbox_id}", message)
 
 
-manager = ConnectionManager()
+hub = WebSocketHub()
+ws_bus = WebSocketBus(hub)
+ws_updates = UpdateCoalescer(hub)
+manager = ConnectionManager(hub, ws_updates)